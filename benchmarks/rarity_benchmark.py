@@ -0,0 +1,62 @@
+"""
+Benchmark the rarity engine against a synthetic collection. Run from the repo root:
+
+    python -m benchmarks.rarity_benchmark [TOKEN_COUNT] [TRAIT_COUNT]
+"""
+import random
+import sys
+import time
+
+from util import output
+from util.token import count_trait_codes
+from util.token import get_code_rarities
+from util.token import set_token_rarities_and_ranks_from_codes
+from util.token import Token
+from util.traits import encode_tokens
+
+
+def make_collection(token_count: int, trait_count: int) -> dict:
+    """Make a fake collection with a skewed spread of values for each trait type
+
+    :param token_count: How many tokens to create
+    :param trait_count: How many trait types each token can have
+    :return: dict of token ID to Token
+    """
+    rng = random.Random(0)
+    all_tokens = {}
+    for i in range(token_count):
+        traits = {}
+        for t in range(trait_count):
+            if rng.random() < 0.9:
+                traits[f"Trait{t}"] = f"Value{int(rng.expovariate(0.3))}"
+        all_tokens[f"token_{i}"] = Token(token=f"token_{i}", traits=traits)
+    return all_tokens
+
+
+def main(token_count: int, trait_count: int) -> None:
+    all_tokens = make_collection(token_count, trait_count)
+
+    timings = {}
+    start_time = time.perf_counter()
+    vocabulary = encode_tokens(output.get_trait_map(all_tokens), all_tokens)
+    timings["encode"] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    total, code_counts = count_trait_codes(vocabulary, all_tokens)
+    code_rarities = get_code_rarities(total, code_counts)
+    timings["count"] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    set_token_rarities_and_ranks_from_codes(code_rarities, all_tokens)
+    timings["score and rank"] = time.perf_counter() - start_time
+
+    print(f"{token_count} tokens, {trait_count} trait types")
+    for stage, seconds in timings.items():
+        print(f"{stage}: {seconds:.3f}s")
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 100_000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 20,
+    )
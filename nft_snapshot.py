@@ -1,368 +1,2026 @@
-"""
-Script to fetch data about an NFT mint on the Solana network. Capabilities include:
-- Fetching mint token list from a CandyMachine ID
-- Printing an ordered list of how many NFTs each wallet is holding
-- Printing a rarity assessment of the different traits from metadata
-- Outputting a CSV snapshotting token info and current holders
-
-Originally based on https://github.com/GMnky/Python-Solana-NFT-Snapshot but significantly overhauled since
-"""
-import asyncio
-import logging
-import time
-from argparse import ArgumentParser
-from typing import Callable
-
-import aiohttp
-import tqdm
-from aiolimiter import AsyncLimiter
-
-from util import http_helpers as hh
-from util import output
-from util import solana_helpers as sh
-from util.cache import read_token_list
-from util.cache import token_cache
-from util.cache import write_token_list
-from util.token import get_attribute_counts
-from util.token import Token
-
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="%(asctime)s %(name)-12s %(levelname)-8s %(message)s",
-    filename="app.log",
-)
-ch = logging.StreamHandler()
-ch.setLevel(logging.INFO)
-ch.setFormatter(logging.Formatter("%(message)s"))
-logging.getLogger("").addHandler(ch)
-
-logger = logging.getLogger("nft_snapshot")
-
-
-def main(
-    get_token_list: bool,
-    get_holder_counts: bool,
-    get_attribute_distribution: bool,
-    get_holder_snapshot: bool,
-    get_rarity: bool,
-    candymachine_id: str,
-    token_id: str,
-    cmv2: bool,
-    outfile_name: str,
-    token_file_name: str,
-    bust_cache: bool,
-) -> None:
-    """Central piece of the script: run the specified pieces of functionality specified from the options passed in.
-    Will fetch needed data, if required (although fetched data is cached to disk so analysis can be run multiple
-    times from those snapshots).
-
-    :param get_token_list: Whether to fetch the token list for the given CM ID (requires candymachine_id)
-    :param get_holder_counts: Whether to print the number of NFTs held per wallet
-    :param get_attribute_distribution: Whether to print the rarity of all attributes found in the metadata
-    :param get_holder_snapshot: Whether to output a CSV snapshot of information for each token
-    :param get_rarity: Whether to display rarity information for the given token
-    :param candymachine_id: The Candy Machine ID to fetch tokens for
-    :param token_id: The token to fetch rarity information for
-    :param cmv2: Whether the specified candymachine_id uses v2 or not
-    :param outfile_name: Name to output the CSV snapshot to
-    :param token_file_name: Name to output the token list to
-    :param bust_cache: Whether to clear out the cache prior to running so you get fresh data
-    :return:
-    """
-    token_list = []
-    all_tokens = {}
-
-    # If required, bust cache. otherwise, load it
-    token_cache.initialize(token_file_name.split(".")[0])
-    if bust_cache:
-        # all_tokens is empty, so we can just overwrite the cache with it
-        token_cache.save(all_tokens)
-    else:
-        all_tokens = token_cache.load()
-
-    if get_token_list:
-        if candymachine_id:
-            token_list = sh.get_token_list_from_candymachine_id(candymachine_id, cmv2)
-        else:
-            print("ERROR: You asked for the token list but didn't give CM ID to look up by")
-            exit(1)
-
-        # Write the token file (note that this will blow away whatever is there now)
-        write_token_list(token_file_name, token_list)
-
-    # If we're looking up based on an existing token list from disk, read it in
-    if not token_list:
-        token_list = read_token_list(token_file_name)
-
-    for token in token_list:
-        if token not in all_tokens:
-            all_tokens[token] = Token(token)
-
-    holders_populated = False
-    accounts_populated = False
-
-    if get_holder_counts:
-        if not holders_populated:
-            populate_holders_details_async(all_tokens)
-            holders_populated = True
-        print(holder_counts(all_tokens))
-
-    if get_attribute_distribution:
-        if not accounts_populated:
-            populate_account_details_async(all_tokens)
-            accounts_populated = True
-        print(attribute_distribution(all_tokens))
-
-    if get_holder_snapshot:
-        if not holders_populated:
-            populate_holders_details_async(all_tokens)
-            holders_populated = True
-        if not accounts_populated:
-            populate_account_details_async(all_tokens)
-            accounts_populated = True
-        output.holder_snapshot(all_tokens, outfile_name)
-
-    if get_rarity:
-        if not token_id:
-            raise ValueError("No tokenid supplied")
-        if not holders_populated:
-            populate_holders_details_async(all_tokens)
-            holders_populated = True
-        if not accounts_populated:
-            populate_account_details_async(all_tokens)
-            accounts_populated = True
-        print(output.format_token_rarity(token_id, all_tokens))
-
-
-def populate_holders_details_async(all_tokens: dict) -> dict:
-    """Fetch data about which wallets own the NFTs specified by the given token IDs. Fetched data is cached at the end.
-
-    :param all_tokens: A dict of all the token data being operated upon
-    :return: The all_tokens dict populated for each token
-    """
-    start_time = time.time()
-    logging.info("\nPopulating token account details...")
-    asyncio.run(
-        fetch_token_data_from_network_async(
-            sh.create_solana_client,
-            all_tokens,
-            "token_account",
-            sh.get_token_account_from_solana_async,
-        )
-    )
-    token_cache.save(all_tokens)
-    logging.info("--- %s seconds ---", (time.time() - start_time))
-
-    start_time = time.time()
-    logging.info("\nPopulating holders details...")
-    result = sh.get_holder_account_info_from_solana(all_tokens)
-    token_cache.save(all_tokens)
-    logging.info("--- %s seconds ---", (time.time() - start_time))
-    return result
-
-
-def populate_account_details_async(all_tokens: dict) -> dict:
-    """Fetch metadata about the given token IDs, including attributes. Fetched data is cached at the end.
-
-    :param all_tokens: A dict of all the token data being operated upon
-    :return: The all_tokens dict populated for each token
-    """
-    start_time = time.time()
-    logging.info("\nPopulating account details...")
-    asyncio.run(
-        fetch_token_data_from_network_async(
-            sh.create_solana_client,
-            all_tokens,
-            "name",
-            sh.get_account_info_from_solana_async,
-        )
-    )
-    token_cache.save(all_tokens)
-    logging.info("--- %s seconds ---", (time.time() - start_time))
-
-    start_time = time.time()
-    logging.info("\nPopulating token metadata details...")
-    result = asyncio.run(
-        fetch_token_data_from_network_async(
-            hh.create_http_client, all_tokens, "image", get_arweave_metadata
-        )
-    )
-    token_cache.save(all_tokens)
-    logging.info("--- %s seconds ---", (time.time() - start_time))
-
-    return result
-
-
-async def fetch_token_data_from_network_async(
-    create_client_fn: Callable, all_tokens: dict, key: str, get_data_fn: Callable
-) -> dict:
-    """Method to abstract the async client and task management for data fetching. Creates a task for each token
-
-    :param create_client_fn: Function that creates and returns the async network client used to fetch data
-    :param all_tokens: A dict of all the token data being operated upon
-    :param key: The key in token_data to save the fetched data to
-    :param get_data_fn: The function to call in order to fetch the data
-    :return: The all_tokens dict populated for each token
-    """
-    limiter = AsyncLimiter(100, 1)
-    cache_task = asyncio.create_task(token_cache.periodic_cache_task(all_tokens))
-    async with create_client_fn() as client:
-        tasks = []
-        for token in all_tokens.keys():
-            if getattr(all_tokens[token], key) is None:
-                tasks.append(asyncio.create_task(get_data_fn(client, all_tokens[token], limiter)))
-        [await f for f in tqdm.tqdm(asyncio.as_completed(tasks), total=len(tasks))]
-    try:
-        cache_task.cancel()
-    except asyncio.CancelledError:
-        pass
-    return all_tokens
-
-
-async def get_arweave_metadata(
-    http_client: aiohttp.ClientSession, token: Token, limiter: AsyncLimiter
-) -> Token:
-    """Fetches token metadata for a particular token (primarily used for traits) from Arweave if a URL is present.
-
-    :param http_client: The aiohttp client used to make requests
-    :param token: The Token instance for the single desired token
-    :param limiter: An AsyncLimiter used to prevent hitting request limits, and generally be a good citizen.
-    :return: The data dict with the "arweave" key populated with response data (if applicable)
-    """
-    if token.data_uri:
-        async with limiter:
-            response = await hh.async_http_request(http_client, token.data_uri)
-            token.image = response.get("image")
-            attributes = response.get("attributes")
-            if attributes:
-                token.traits = {}
-                for attribute in attributes:
-                    trait_type = attribute["trait_type"]
-                    value = attribute["value"] if attribute["value"] is not None else ""
-                    token.traits[trait_type] = value
-    else:
-        token.image = ""
-        token.traits = {}
-
-    return token
-
-
-def holder_counts(all_tokens: dict) -> str:
-    """Analyze the token data to determine how many NFTs are in each wallet, and print it out.
-
-    :param all_tokens: The preassembled data dict for all tokens
-    :return: A string containing the formatted output
-    """
-    counts = {}
-    for token in all_tokens.values():
-        if not counts.get(token.holder_address):
-            counts[token.holder_address] = 0
-        counts[token.holder_address] += 1
-
-    return output.format_biggest_holders(len(all_tokens), counts)
-
-
-def attribute_distribution(all_tokens: dict) -> str:
-    """Analyze the token data to determine the statistical rarity of the possible NFT traits, and print it out.
-
-    :param all_tokens: The preassembled data dict for all tokens
-    :return: A string containing the formatted output
-    """
-    trait_map = output.get_trait_map(all_tokens)
-    token_with_attr_count, attribute_counts = get_attribute_counts(trait_map, all_tokens)
-    return output.format_trait_frequency(token_with_attr_count, attribute_counts)
-
-
-if __name__ == "__main__":
-    parser = ArgumentParser()
-    parser.add_argument(
-        "token_file",
-        metavar="TOKEN_FILE",
-        type=str,
-        help="file to read token IDs from (and write them to, if applicable)",
-    )
-    parser.add_argument(
-        "-t",
-        dest="token_list",
-        action="store_true",
-        default=False,
-        help="get the token list for the given CM ID (requires passing --cmid)",
-    )
-    parser.add_argument(
-        "-o",
-        dest="holder_counts",
-        action="store_true",
-        default=False,
-        help="get and print the overall holder counts",
-    )
-    parser.add_argument(
-        "-a",
-        dest="attributes",
-        action="store_true",
-        default=False,
-        help="get and print the overall metadata attribute distribution",
-    )
-    parser.add_argument(
-        "-s",
-        dest="snapshot",
-        action="store_true",
-        default=False,
-        help="get and output the snapshot file to the outfile name from -f",
-    )
-    parser.add_argument(
-        "-r",
-        dest="rarity",
-        action="store_true",
-        default=False,
-        help="get and output the rarity of the given token ID (requires passing --tokenid)",
-    )
-    parser.add_argument(
-        "-f",
-        "--file",
-        dest="outfile_name",
-        default="snapshot.csv",
-        help="write snapshot to FILE (defaults to snapshot.csv)",
-        metavar="SNAP_FILE",
-    )
-    parser.add_argument(
-        "--cmid",
-        dest="candymachine_id",
-        help="use CANDYMACHINE_ID to fetch tokens",
-        metavar="CANDYMACHINE_ID",
-    )
-    parser.add_argument(
-        "--tokenid",
-        dest="token_id",
-        help="the token ID to fetch rarity information for",
-        metavar="TOKEN_ID",
-    )
-    parser.add_argument(
-        "--cmv2",
-        dest="cm_v2",
-        action="store_true",
-        default=False,
-        help="use Candy Machine v2 method to fetch tokens from CM ID",
-    )
-    parser.add_argument(
-        "--bust-cache",
-        dest="bust_cache",
-        action="store_true",
-        default=False,
-        help="clear out any existing cache data for this token file",
-    )
-
-    args = parser.parse_args()
-
-    main(
-        args.token_list,
-        args.holder_counts,
-        args.attributes,
-        args.snapshot,
-        args.rarity,
-        args.candymachine_id,
-        args.token_id,
-        args.cm_v2,
-        args.outfile_name,
-        args.token_file,
-        args.bust_cache,
-    )
+"""
+Script to fetch data about an NFT mint on the Solana network. Capabilities include:
+- Fetching mint token list from a CandyMachine ID
+- Printing an ordered list of how many NFTs each wallet is holding
+- Printing a rarity assessment of the different traits from metadata
+- Outputting a CSV snapshotting token info and current holders
+- Diffing snapshots to get a feed of transfers, new and burned tokens, and metadata changes
+
+Originally based on https://github.com/GMnky/Python-Solana-NFT-Snapshot but significantly overhauled since
+"""
+import asyncio
+import contextlib
+import datetime
+import functools
+import logging
+import signal
+import sys
+import time
+from argparse import ArgumentParser
+from argparse import ArgumentTypeError
+from pathlib import Path
+
+import aiohttp
+from aiolimiter import AsyncLimiter
+
+from util import http_helpers as hh
+from util import output
+from util import solana_helpers as sh
+from util.batch import CollectionJob
+from util.batch import DEFAULT_CONCURRENCY
+from util.batch import DEFAULT_REQUESTS_PER_SECOND
+from util.batch import FairScheduler
+from util.batch import load_manifest
+from util.cache import read_token_list
+from util.cache import TokenCache
+from util.cache import write_token_list
+from util.daemon import DaemonCollection
+from util.daemon import DaemonState
+from util.daemon import DEFAULT_INTERVALS
+from util.daemon import MAX_SLEEP
+from util.daemon import timestamped_name
+from util.deadline import Deadline
+from util.deadline import fill_from_stale
+from util.diff import DIFF_FORMATS
+from util.diff import diff_snapshots
+from util.diff import read_snapshot
+from util.diff import token_snapshot
+from util.diff import write_changes
+from util.distribution import holder_distribution
+from util.freshness import data_as_of
+from util.freshness import REVALIDATE_MODES
+from util.freshness import Revalidation
+from util.freshness import stamp_fetched
+from util.history import HolderHistory
+from util.offload import CpuPool
+from util.planner import fields_for
+from util.planner import format_plan
+from util.planner import plan_fetches
+from util.planner import REPORT_FIELDS
+from util.planner import STAGES
+from util.rarity import RARITY_MODELS
+from util.rarity_index import build_rarity_index
+from util.rarity_index import rarity_fingerprint
+from util.rarity_index import RarityIndex
+from util.rarity_state import RarityState
+from util.render import JsonRenderer
+from util.render import make_renderer
+from util.render import Renderer
+from util.render import RENDER_FORMATS
+from util.shard import merge_shard_caches
+from util.shard import shard_cache_key
+from util.shard import shard_tokens
+from util.server import DEFAULT_HOST
+from util.server import QueryService
+from util.server import run_server
+from util.token import EDITION_FILTERS
+from util.token import filter_editions
+from util.token import get_attribute_counts
+from util.token import Token
+from util.trait_index import holders_for
+from util.trait_index import TraitIndex
+from util.wallet_index import WalletIndex
+
+logger = logging.getLogger("nft_snapshot")
+
+HOLDER_STATS_FORMATS = ("text", "json")
+
+
+async def main(
+    session: "SnapshotSession",
+    get_token_list: bool,
+    get_holder_counts: bool,
+    get_attribute_distribution: bool,
+    get_holder_snapshot: bool,
+    get_rarity: bool,
+    token_id: str = None,
+    outfile_name: str = None,
+    rarity_models: list = (),
+    rank_range: tuple = None,
+    trait_query: str = None,
+    wallet: str = None,
+    diff: list = None,
+    diff_format: str = "csv",
+    diff_file: str = "-",
+    holder_history: str = None,
+    history_at: datetime.datetime = None,
+    holding_time: str = None,
+    holder_stats: str = None,
+    report_format: str = "text",
+    top: int = None,
+    explain: bool = False,
+    revalidate: str = None,
+) -> None:
+    """Central piece of the script: run the specified pieces of functionality specified from the options passed in.
+    Will fetch needed data through the session, if required (although fetched data is cached to disk so analysis can
+    be run multiple times from those snapshots).
+
+    :param session: The SnapshotSession for the collection, set up with the fetch options (discovery sources,
+        deadline, cache busting, shard merging, editions and workers); entered here
+    :param get_token_list: Whether to look up the token list from the session's discovery sources
+    :param get_holder_counts: Whether to print the number of NFTs held per wallet
+    :param get_attribute_distribution: Whether to print the rarity of all attributes found in the metadata
+    :param get_holder_snapshot: Whether to output a CSV snapshot of information for each token
+    :param get_rarity: Whether to display rarity information for the given token
+    :param token_id: The token to fetch rarity information for
+    :param outfile_name: Name to output the CSV snapshot to
+    :param rarity_models: Names of extra rarity models to include in the snapshot and rarity output
+    :param rank_range: (start, end) ranks to list the tokens for, if desired
+    :param trait_query: Trait query (e.g. "Background=Gold AND Eyes=Laser") to list the matching holders for
+    :param wallet: Wallet address to list the held tokens for, if desired
+    :param diff: One or two snapshot files to diff: old and new, or just old to diff against the current data
+    :param diff_format: Format to write the diff in ("csv" or "json")
+    :param diff_file: Name to output the diff to ("-" for stdout)
+    :param holder_history: Token ID to print the recorded holder history of, if desired
+    :param history_at: Point in time to show the holder of holder_history at, if desired
+    :param holding_time: Wallet address to print how long it has held each of its tokens, if desired
+    :param holder_stats: "text" or "json" to print holder distribution stats with -o instead of every wallet
+    :param report_format: Format to print the reports in (one of render.RENDER_FORMATS)
+    :param top: Only print this many of the biggest holders with -o, or rarest values of each trait with -a
+    :param explain: Print the fetch stages and request counts the requested reports need, instead of running them
+    :param revalidate: Print the -o, -a and -r reports from the cached data straight away, annotated with its age,
+        while refreshing it in the background; then when the refresh is done, just update the cache ("cache"), print
+        the reports again ("rerender") or write a snapshot ("snapshot")
+    :return:
+    """
+    async with session:
+        await session.discover(refresh=get_token_list)
+
+        if explain:
+            reports = requested_reports(
+                holder_counts=get_holder_counts,
+                attributes=get_attribute_distribution,
+                snapshot=get_holder_snapshot,
+                rarity=get_rarity,
+                rank_range=rank_range,
+                trait_query=trait_query,
+                wallet=wallet,
+                diff=diff and len(diff) == 1,
+            )
+            print(session.explain(*reports))
+            return
+
+        renderer = make_renderer(report_format, sys.stdout)
+        if revalidate:
+            await stale_while_revalidate(
+                session,
+                renderer,
+                revalidate,
+                outfile_name,
+                get_holder_counts=get_holder_counts,
+                get_attribute_distribution=get_attribute_distribution,
+                get_rarity=get_rarity,
+                token_id=token_id,
+                rarity_models=rarity_models,
+                holder_stats=holder_stats,
+                top=top,
+            )
+            return
+
+        if get_holder_counts:
+            await session.populate("holder_counts")
+            holder_counts(
+                session.report_tokens, session.wallet_index(), holder_stats, renderer, top
+            )
+
+        if get_attribute_distribution:
+            await session.populate("attributes")
+            attribute_distribution(session.report_tokens, renderer, top)
+
+        if get_holder_snapshot:
+            await session.snapshot(outfile_name, rarity_models)
+
+        if get_rarity:
+            if not token_id:
+                raise ValueError("No tokenid supplied")
+            await session.populate("rarity")
+            rarity_index = session.rarity_index(rarity_models)
+            output.write_token_rarity(
+                renderer, token_id, session.report_tokens, rarity_models, rarity_index
+            )
+
+        if rank_range:
+            await session.populate("rank_range")
+            output.write_rank_range(renderer, session.rarity_index(rarity_models), *rank_range)
+
+        if trait_query:
+            await session.populate("trait_query")
+            trait_query_holders(session.report_tokens, trait_query, renderer)
+
+        if wallet:
+            await session.populate("wallet")
+            held = session.wallet_index().tokens_for(wallet)
+            output.write_wallet_holdings(renderer, wallet, held, session.report_tokens)
+
+        if diff:
+            await session.diff(diff[0], diff_file, diff_format, *diff[1:])
+
+        if holder_history or holding_time:
+            history_report(
+                session.report_tokens,
+                session.history(),
+                holder_history,
+                history_at,
+                holding_time,
+                renderer,
+            )
+
+        output.write_data_status(renderer, session.report_tokens)
+
+
+def write_snapshot(
+    all_tokens: dict,
+    outfile_name: str,
+    rarity_models: list,
+    collection: str,
+    cache: TokenCache,
+    report_tokens: dict = None,
+) -> None:
+    """Write a snapshot of the collection, recording its holders in the holder history
+
+    :param all_tokens: A dict of all the token data being operated upon
+    :param outfile_name: Name to output the snapshot to
+    :param rarity_models: Names of extra rarity models to include in the snapshot
+    :param collection: Name of the collection, for the snapshot metadata
+    :param cache: The collection's TokenCache, for the rarity state and holder history
+    :param report_tokens: The tokens to write to the snapshot and rank, if only some of all_tokens (see
+        SnapshotSession.select_editions()). The holder history still records the whole collection.
+    """
+    report_tokens = report_tokens if report_tokens is not None else all_tokens
+    rarity_state = report_rarity_state(all_tokens, report_tokens, cache)
+    metadata = output.snapshot_metadata(report_tokens, collection)
+    history = load_history(cache)
+    output.holder_snapshot(
+        report_tokens, outfile_name, rarity_models, rarity_state, metadata, history, all_tokens
+    )
+    cache.save_extra("history", history)
+
+
+async def stale_while_revalidate(
+    session: "SnapshotSession",
+    renderer: Renderer,
+    revalidate: str,
+    outfile_name: str,
+    **report_options,
+) -> None:
+    """Print the requested reports from the cached data straight away, each annotated with how old its data is,
+    while the data they use is refreshed in the background. Once the refresh is done the fresh data is cached, and
+    depending on revalidate the reports are printed again or a snapshot is written from it.
+
+    :param session: The SnapshotSession for the collection, already entered
+    :param renderer: The Renderer to print the reports with
+    :param revalidate: What to do once the refresh is done (one of freshness.REVALIDATE_MODES)
+    :param outfile_name: Name to output the snapshot to, with revalidate "snapshot"
+    :param report_options: Which reports to print and their options (see write_reports())
+    """
+    reports = requested_reports(
+        holder_counts=report_options.get("get_holder_counts"),
+        attributes=report_options.get("get_attribute_distribution"),
+        rarity=report_options.get("get_rarity"),
+        snapshot=revalidate == "snapshot",
+    )
+    # Has to be checked before the refreshed data is saved
+    cached_at = session.cache.saved_at()
+    revalidation = Revalidation(session.all_tokens, fields_for(reports), session.fetch_stages)
+    revalidation.start()
+    session.select_editions()
+    write_reports(session, renderer, cached_at, **report_options)
+
+    await revalidation.wait()
+    session.cache.save(session.all_tokens)
+    session.select_editions()
+    if revalidate == "rerender":
+        write_reports(session, renderer, **report_options)
+    elif revalidate == "snapshot":
+        await session.snapshot(outfile_name, report_options.get("rarity_models", ()))
+
+
+def write_reports(
+    session: "SnapshotSession",
+    renderer: Renderer,
+    cached_at: float = None,
+    get_holder_counts: bool = False,
+    get_attribute_distribution: bool = False,
+    get_rarity: bool = False,
+    token_id: str = None,
+    rarity_models: list = (),
+    holder_stats: str = None,
+    top: int = None,
+) -> None:
+    """Print the -o, -a and -r reports from the data at hand, without fetching anything, each followed by how old
+    its data is
+
+    :param session: The SnapshotSession for the collection, already entered
+    :param renderer: The Renderer to print the reports with
+    :param cached_at: When the cache was written, taken as the fetch time of data without one recorded
+    :param get_holder_counts: Whether to print the number of NFTs held per wallet
+    :param get_attribute_distribution: Whether to print the rarity of all attributes found in the metadata
+    :param get_rarity: Whether to display rarity information for token_id
+    :param token_id: The token to display rarity information for
+    :param rarity_models: Names of extra rarity models to include in the rarity output
+    :param holder_stats: "text" or "json" to print holder distribution stats with -o instead of every wallet
+    :param top: Only print this many of the biggest holders with -o, or rarest values of each trait with -a
+    """
+    report_tokens = session.report_tokens
+    if get_holder_counts:
+        holder_counts(report_tokens, session.wallet_index(), holder_stats, renderer, top)
+        as_of = data_as_of(report_tokens, REPORT_FIELDS["holder_counts"], cached_at)
+        output.write_data_age(renderer, "holder_counts", as_of)
+
+    if get_attribute_distribution:
+        attribute_distribution(report_tokens, renderer, top)
+        as_of = data_as_of(report_tokens, REPORT_FIELDS["attributes"], cached_at)
+        output.write_data_age(renderer, "attributes", as_of)
+
+    if get_rarity:
+        if not token_id:
+            raise ValueError("No tokenid supplied")
+        rarity_index = session.rarity_index(rarity_models)
+        output.write_token_rarity(renderer, token_id, report_tokens, rarity_models, rarity_index)
+        as_of = data_as_of(report_tokens, REPORT_FIELDS["rarity"], cached_at)
+        output.write_data_age(renderer, "rarity", as_of)
+
+
+def load_cache(
+    cache: TokenCache, bust_cache: bool, keep_stale: bool = False, merge_shards: int = None
+) -> (dict, dict):
+    """Load the cached token data, or clear the cache out if busting it
+
+    :param cache: The collection's TokenCache
+    :param bust_cache: Whether to clear out the cache so everything is fetched fresh
+    :param keep_stale: Whether to hang on to the cleared-out data to fall back on if there isn't time to fetch it all
+        again (see SnapshotSession's deadline)
+    :param merge_shards: Number of shards (see run_shard()) to merge the cached data of into the cache, if any
+    :return: The all_tokens dict to operate on; the stale token data (empty unless busting with keep_stale)
+    """
+    if not bust_cache:
+        all_tokens, stale_tokens = cache.load(), {}
+    else:
+        stale_tokens = cache.load() if keep_stale else {}
+        # all_tokens is empty, so we can just overwrite the cache with it
+        all_tokens = {}
+        cache.save(all_tokens)
+    if merge_shards:
+        merge_shard_caches(all_tokens, cache.key, merge_shards)
+        cache.save(all_tokens)
+    return all_tokens, stale_tokens
+
+
+def discovery_sources(
+    candymachine_id: str = None, cmv2: bool = False, collections: list = (), creators: list = ()
+) -> list:
+    """Get the sources to fetch a token list from (see solana_helpers.get_token_list_from_sources())
+
+    :param candymachine_id: The Candy Machine ID to fetch tokens for, if any
+    :param cmv2: Whether the candymachine_id uses v2 or not
+    :param collections: Verified collection mints to fetch tokens for
+    :param creators: Verified first creator addresses to fetch tokens for
+    :return: list of (kind, address) pairs
+    """
+    sources = [("cmv2" if cmv2 else "cmid", candymachine_id)] if candymachine_id else []
+    sources.extend(("collection", collection) for collection in collections or ())
+    sources.extend(("creator", creator) for creator in creators or ())
+    return sources
+
+
+def requested_reports(**requested) -> list:
+    """Get the names of the reports that were asked for
+
+    :param requested: Report name (a key of planner.REPORT_FIELDS) to whether it was asked for
+    :return: list of report names
+    """
+    return [report for report, wanted in requested.items() if wanted]
+
+
+async def get_arweave_metadata(
+    http_client: aiohttp.ClientSession, token: Token, limiter: AsyncLimiter
+) -> Token:
+    """Fetches token metadata for a particular token (primarily used for traits) from Arweave if a URL is present.
+
+    :param http_client: The aiohttp client used to make requests
+    :param token: The Token instance for the single desired token
+    :param limiter: An AsyncLimiter used to prevent hitting request limits, and generally be a good citizen.
+    :return: The data dict with the "arweave" key populated with response data (if applicable)
+    """
+    if token.data_uri:
+        async with limiter:
+            response = await hh.async_http_request(http_client, token.data_uri)
+            token.image = response.get("image")
+            attributes = response.get("attributes")
+            if attributes:
+                token.traits = {}
+                for attribute in attributes:
+                    trait_type = attribute["trait_type"]
+                    value = attribute["value"] if attribute["value"] is not None else ""
+                    token.traits[trait_type] = value
+    else:
+        token.image = ""
+        token.traits = {}
+
+    return token
+
+
+class SnapshotSession:
+    """Async API for working with a collection from other code, e.g. a bot or web service. A session owns its
+    collection's cache, network clients, rate limiters and request scheduler, so several sessions can run at once in
+    one process. Each report method fetches whatever its data needs first (see planner.REPORT_FIELDS) and returns the
+    report's data rather than printing it. The command line, batch mode and the daemon all fetch through sessions too.
+
+        async with SnapshotSession("tokenlist_mf.txt", candymachine_id=MF_CMID) as session:
+            await session.discover()
+            biggest = await session.holder_counts(top=10)
+            rarity = await session.token_rarity(token_id)
+
+    Collections can share clients, limiters and a scheduler (as batch mode does) by passing them in, in which case
+    the session leaves closing them to the caller.
+    """
+
+    def __init__(
+        self,
+        token_file_name: str,
+        candymachine_id: str = None,
+        cmv2: bool = False,
+        name: str = None,
+        requests_per_second: int = DEFAULT_REQUESTS_PER_SECOND,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        clients: dict = None,
+        limiters: dict = None,
+        scheduler: FairScheduler = None,
+        shard: tuple = None,
+        workers: int = None,
+        collections: list = (),
+        creators: list = (),
+        bust_cache: bool = False,
+        deadline: float = None,
+        merge_shards: int = None,
+        editions: list = None,
+    ):
+        """
+        :param token_file_name: File to read the collection's token IDs from (and write them to, if discovered)
+        :param candymachine_id: The Candy Machine ID to discover the collection's tokens from, if any
+        :param cmv2: Whether the candymachine_id uses v2 or not
+        :param name: The collection's name, for logs and snapshot metadata (defaults to the CM ID or token file)
+        :param requests_per_second: Requests per second allowed to each provider, if the session makes its limiters
+        :param concurrency: Requests in flight at once, if the session makes its scheduler
+        :param clients: Network clients to use ("solana" and "http"), rather than opening its own
+        :param limiters: AsyncLimiters to use for each provider ("solana" and "http"), rather than making its own
+        :param scheduler: A running FairScheduler to make requests through, rather than starting its own
+        :param shard: (index, count) to work on just one shard of the collection, with a cache of its own
+        :param workers: Number of worker processes to derive and decode the metadata accounts in, if the clients
+            passed in don't come with a CpuPool ("cpu") already (inline if None)
+        :param collections: Verified collection mints to discover the collection's tokens by, as well as
+            candymachine_id
+        :param creators: Verified first creator addresses to discover the collection's tokens by, as well as
+            candymachine_id
+        :param bust_cache: Whether to clear out the cache when the session starts, so everything is fetched fresh
+        :param deadline: Seconds the session has to fetch data in, from when it starts. Once they're up no more
+            requests are made, gaps are filled from the previously cached data where possible, and tokens with stale
+            or missing data are flagged.
+        :param merge_shards: Number of shards (see run_shard()) to merge the cached data of into the cache when the
+            session starts
+        :param editions: Edition kinds ("master", "print" and/or "none") to restrict the reports to, if desired. The
+            edition accounts are fetched along with each report's data, but the tokens left out are still kept up to
+            date in the cache, the holder history and the saved indexes.
+        """
+        cache_key = token_file_name.split(".")[0]
+        if shard is not None:
+            cache_key = shard_cache_key(cache_key, *shard)
+        self.token_file_name = token_file_name
+        self.candymachine_id = candymachine_id
+        self.cmv2 = cmv2
+        self.collections = collections or ()
+        self.creators = creators or ()
+        self.name = name or candymachine_id or Path(token_file_name).stem
+        self.shard = shard
+        self.workers = workers
+        self.concurrency = concurrency
+        self.bust_cache = bust_cache
+        self.deadline_seconds = deadline
+        self.merge_shards = merge_shards
+        self.editions = editions
+        self.cache = TokenCache()
+        self.cache.initialize(cache_key)
+        self.clients = clients
+        self.limiters = limiters or {
+            "solana": AsyncLimiter(requests_per_second, 1),
+            "http": AsyncLimiter(requests_per_second, 1),
+        }
+        self.scheduler = scheduler
+        self.all_tokens = {}
+        # The tokens the reports cover: all of them, or just those of the edition kinds asked for
+        self.report_tokens = self.all_tokens
+        # Fetch stages already run this session, so tokens that failed aren't retried by every report
+        self.populated = set()
+        self.deadline = None
+        self._exit_stack = None
+
+    async def __aenter__(self) -> "SnapshotSession":
+        self._exit_stack = contextlib.AsyncExitStack()
+        if self.clients is None:
+            self.clients = {
+                "solana": await self._exit_stack.enter_async_context(sh.create_solana_client()),
+                "http": await self._exit_stack.enter_async_context(hh.create_http_client()),
+            }
+        if self.workers and "cpu" not in self.clients:
+            pool = self._exit_stack.enter_context(CpuPool(self.workers))
+            self.clients = {**self.clients, "cpu": pool}
+        if self.scheduler is None:
+            self.scheduler = await self._exit_stack.enter_async_context(
+                FairScheduler(self.concurrency)
+            )
+        keep_stale = self.deadline_seconds is not None
+        self.all_tokens, stale_tokens = await asyncio.to_thread(
+            load_cache, self.cache, self.bust_cache, keep_stale, self.merge_shards
+        )
+        self.report_tokens = self.all_tokens
+        if self.deadline_seconds is not None:
+            self.deadline = Deadline(self.deadline_seconds, stale_tokens)
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self._exit_stack.aclose()
+
+    async def discover(self, refresh: bool = False) -> list:
+        """Get the collection's token list, from the token file or, if there isn't one yet (or refresh is set), from
+        the Candy Machine ID, collections and creators, writing it to the token file for next time
+
+        :param refresh: Whether to look the tokens up even if there is a token file
+        :return: list of token IDs (just the shard's, for a shard session)
+        """
+        if refresh or not Path(self.token_file_name).exists():
+            if self.shard is not None:
+                # Every shard would run the whole discovery, in the same checkpoints and writing the same token file
+                raise ValueError(
+                    f"No token file {self.token_file_name} for the shard: write it with -t before sharding"
+                )
+            sources = discovery_sources(
+                self.candymachine_id, self.cmv2, self.collections, self.creators
+            )
+            if not sources:
+                raise ValueError(
+                    f"No token file {self.token_file_name} and no CM ID, collection or creator to look one up by"
+                )
+            token_list = await asyncio.to_thread(
+                sh.get_token_list_from_sources, sources, self.clients.get("cpu")
+            )
+            write_token_list(self.token_file_name, token_list)
+        else:
+            token_list = read_token_list(self.token_file_name)
+        if self.shard is not None:
+            token_list = shard_tokens(token_list, *self.shard)
+        for token in token_list:
+            if token not in self.all_tokens:
+                self.all_tokens[token] = Token(token)
+            # Stale/missing flags only describe the run that set them
+            self.all_tokens[token].data_status = None
+        self.report_tokens = self.all_tokens
+        return token_list
+
+    def explain(self, *reports: str) -> str:
+        """Describe the fetch stages and requests the given reports need, without fetching anything
+
+        :param reports: Names of reports (keys of planner.REPORT_FIELDS)
+        :return: The plan, formatted by planner.format_plan()
+        """
+        plan = plan_fetches(self.all_tokens, self._fields(reports), self.populated)
+        return format_plan(plan, len(self.all_tokens))
+
+    async def populate(self, *reports: str) -> int:
+        """Fetch the data the given reports need for tokens that don't have it yet, saving it to the cache. With
+        editions, each token's edition is fetched too, and report_tokens narrowed down to the kinds asked for. With a
+        deadline, whatever couldn't be fetched in time is filled in from stale data where possible, and flagged.
+
+        :param reports: Names of reports (keys of planner.REPORT_FIELDS)
+        :return: The number of failed requests
+        """
+        fields = self._fields(reports)
+        plan = plan_fetches(self.all_tokens, fields, self.populated)
+        stage_names = [stage.name for stage in plan.stages]
+        failures = await self.fetch_stages(stage_names, save=True)
+        self.populated.update(stage_names)
+        if self.deadline is not None:
+            fill_from_stale(self.all_tokens, fields, self.deadline.stale_tokens)
+        if self.editions and (stage_names or self.report_tokens is self.all_tokens):
+            self.select_editions()
+        return failures
+
+    async def fetch_stages(
+        self, stage_names: list, all_tokens: dict = None, save: bool = False
+    ) -> int:
+        """Run fetch stages, in order, for the tokens missing their data. With a deadline, each stage gets an even
+        share of the time left and stages are skipped once it is up.
+
+        :param stage_names: The stages to run (keys of planner.STAGES)
+        :param all_tokens: The tokens to fetch for (the session's own if None)
+        :param save: Whether to save all_tokens to the cache as the data comes in. Tokens that are only partly
+            filled in, like a background refresh's copy (see freshness.Revalidation) or tokens with fields cleared to
+            fetch them again, mustn't be saved.
+        :return: The number of failed requests
+        """
+        all_tokens = self.all_tokens if all_tokens is None else all_tokens
+        if save:
+            cache_task = asyncio.create_task(self.cache.periodic_cache_task(all_tokens))
+        failures = 0
+        try:
+            for i, stage_name in enumerate(stage_names):
+                timeout = None
+                if self.deadline is not None:
+                    if self.deadline.expired():
+                        logger.warning("Out of time, skipping fetching %s", stage_name)
+                        continue
+                    timeout = self.deadline.stage_budget(len(stage_names) - i)
+                failures += await fetch_stage_async(
+                    self.name,
+                    all_tokens,
+                    stage_name,
+                    self.scheduler,
+                    self.clients,
+                    self.limiters,
+                    timeout,
+                )
+                if save:
+                    self.cache.save(all_tokens)
+        finally:
+            if save:
+                cache_task.cancel()
+        return failures
+
+    def select_editions(self) -> dict:
+        """Pick out the tokens the reports cover from the data at hand: all of them, or if the session has edition
+        kinds, the tokens of those kinds
+
+        :return: dict of the tokens to report on (also kept as report_tokens)
+        """
+        self.report_tokens = filter_editions(self.all_tokens, self.editions)
+        if self.report_tokens is not self.all_tokens:
+            logger.info(
+                "Reporting on %d of %d tokens", len(self.report_tokens), len(self.all_tokens)
+            )
+        return self.report_tokens
+
+    def _fields(self, reports: tuple) -> set:
+        return fields_for([*reports, "editions"] if self.editions else reports)
+
+    def wallet_index(self) -> WalletIndex:
+        """Get the WalletIndex of the holders of the tokens being reported on (see report_wallet_index())
+
+        :return: The up-to-date WalletIndex
+        """
+        return report_wallet_index(self.all_tokens, self.report_tokens, self.cache)
+
+    def rarity_index(self, rarity_models: list = ()) -> RarityIndex:
+        """Get the RarityIndex of the tokens being reported on (see report_rarity_index())
+
+        :param rarity_models: Names of extra rarity models the index needs to include
+        :return: The up-to-date RarityIndex
+        """
+        return report_rarity_index(self.all_tokens, self.report_tokens, self.cache, rarity_models)
+
+    def history(self) -> HolderHistory:
+        """Get the collection's recorded holder history (see load_history())
+
+        :return: The HolderHistory
+        """
+        return load_history(self.cache)
+
+    async def holder_counts(self, top: int = None) -> list:
+        """Get how many tokens each wallet holds
+
+        :param top: Only include this many of the biggest holders, if given
+        :return: list of (holder address, count) tuples, biggest holders first
+        """
+        await self.populate("holder_counts")
+        return self.wallet_index().top(top)
+
+    async def holder_stats(self) -> dict:
+        """Get the holder distribution stats (see distribution.holder_distribution())
+
+        :return: dict of the stats
+        """
+        await self.populate("holder_counts")
+        counts = self.wallet_index().counts()
+        return holder_distribution(len(self.report_tokens), counts, output.MARKETPLACE_WALLETS)
+
+    async def attribute_distribution(self) -> (int, dict):
+        """Get how often each trait value occurs
+
+        :return: int: count of tokens with traits; dict: counts of all values for all traits
+        """
+        await self.populate("attributes")
+        return get_attribute_counts(output.get_trait_map(self.report_tokens), self.report_tokens)
+
+    async def token_rarity(self, token_id: str, rarity_models: list = ()) -> dict:
+        """Get a token's rarity (see RarityIndex.lookup())
+
+        :param token_id: The token ID
+        :param rarity_models: Names of extra rarity models to include
+        :return: dict of the token's rarity info
+        """
+        await self.populate("rarity")
+        return self.rarity_index(rarity_models).lookup(token_id)
+
+    async def rank_range(self, start: int, end: int, rarity_models: list = ()) -> list:
+        """Get the tokens ranked from start to end (inclusive) by rarity
+
+        :param start: The first rank to include (1 is rarest)
+        :param end: The last rank to include
+        :param rarity_models: Names of extra rarity models to include in the index
+        :return: list of token summary dicts, in rank order
+        """
+        await self.populate("rank_range")
+        return self.rarity_index(rarity_models).rank_range(start, end)
+
+    async def trait_query(self, trait_query: str) -> dict:
+        """Find the tokens matching a trait query (see TraitIndex.query()) and who holds them
+
+        :param trait_query: The trait query, e.g. "Background=Gold AND NOT Eyes=Laser"
+        :return: dict mapping holder address to a list of the matching token IDs it holds
+        """
+        await self.populate("trait_query")
+        trait_index = TraitIndex(self.report_tokens, output.get_trait_map(self.report_tokens))
+        return holders_for(self.report_tokens, trait_index.query(trait_query))
+
+    async def wallet(self, holder_address: str) -> list:
+        """Get the tokens a wallet holds
+
+        :param holder_address: The wallet's address
+        :return: list of token IDs
+        """
+        await self.populate("wallet")
+        return self.wallet_index().tokens_for(holder_address)
+
+    async def snapshot(self, outfile_name: str, rarity_models: list = ()) -> None:
+        """Write a snapshot of the collection, recording its holders in the holder history
+
+        :param outfile_name: Name to output the snapshot to
+        :param rarity_models: Names of extra rarity models to include in the snapshot
+        """
+        await self.populate("snapshot")
+        write_snapshot(
+            self.all_tokens, outfile_name, rarity_models, self.name, self.cache, self.report_tokens
+        )
+
+    async def diff(
+        self,
+        old_snapshot: str,
+        diff_file: str = "-",
+        diff_format: str = "csv",
+        new_snapshot: str = None,
+    ) -> int:
+        """Write out the changes between two snapshots, or between a snapshot and the current data for the
+        collection
+
+        :param old_snapshot: The snapshot file name to diff against
+        :param diff_file: Name to output the diff to ("-" for stdout)
+        :param diff_format: Format to write the diff in ("csv" or "json")
+        :param new_snapshot: The snapshot file name to diff old_snapshot with (the current data if None)
+        :return: The number of changes written
+        """
+        if new_snapshot is not None:
+            new_rows = read_snapshot(new_snapshot)
+        else:
+            await self.populate("diff")
+            rarity_state = report_rarity_state(self.all_tokens, self.report_tokens, self.cache)
+            new_rows = token_snapshot(self.report_tokens, rarity_state=rarity_state)
+        count = write_changes(
+            diff_snapshots(read_snapshot(old_snapshot), new_rows), diff_file, diff_format
+        )
+        logger.info("%d changes since %s", count, old_snapshot)
+        return count
+
+
+def run_shard(
+    token_file_name: str,
+    shard: tuple,
+    candymachine_id: str = None,
+    cmv2: bool = False,
+    reports: list = (),
+    workers: int = None,
+) -> int:
+    """Fetch the data for one shard of a collection into the shard's own cache, as an independent worker. The shards
+    split the token list deterministically, so they can run as separate processes on one machine or on several
+    machines sharing the cache directory; once they're all done, --merge-shards combines their caches.
+
+    :param token_file_name: File to read the collection's token IDs from
+    :param shard: (index, count) of the shard to run
+    :param candymachine_id: The collection's Candy Machine ID, if any, to name it by (the token file has to have
+        been written already: shards don't look the tokens up themselves)
+    :param cmv2: Whether the candymachine_id uses v2 or not
+    :param reports: Names of the reports to fetch the data for (keys of planner.REPORT_FIELDS; all the snapshot's
+        data if none are given)
+    :param workers: Number of worker processes to derive and decode the metadata accounts in (inline if None)
+    :return: The number of failed requests
+    """
+    return asyncio.run(
+        run_shard_async(token_file_name, shard, candymachine_id, cmv2, reports, workers)
+    )
+
+
+async def run_shard_async(
+    token_file_name: str,
+    shard: tuple,
+    candymachine_id: str = None,
+    cmv2: bool = False,
+    reports: list = (),
+    workers: int = None,
+) -> int:
+    """Fetch the data for one shard of a collection (see run_shard())
+
+    :param token_file_name: File to read the collection's token IDs from
+    :param shard: (index, count) of the shard to run
+    :param candymachine_id: The collection's Candy Machine ID, if any, to name it by (the token file has to have
+        been written already: shards don't look the tokens up themselves)
+    :param cmv2: Whether the candymachine_id uses v2 or not
+    :param reports: Names of the reports to fetch the data for (all the snapshot's data if none are given)
+    :param workers: Number of worker processes to derive and decode the metadata accounts in (inline if None)
+    :return: The number of failed requests
+    """
+    session = SnapshotSession(token_file_name, candymachine_id, cmv2, shard=shard, workers=workers)
+    async with session:
+        token_list = await session.discover()
+        logger.info("Shard %d of %d: %d tokens", shard[0], shard[1], len(token_list))
+        return await session.populate(*(reports or ["snapshot"]))
+
+
+def run_batch(manifest_name: str, report_format: str = "text", workers: int = None) -> None:
+    """Process every collection in a batch manifest (see batch.load_manifest()) concurrently in one process. The
+    collections share the network clients, a rate limit per provider and a cap on requests in flight, with the
+    requests scheduled fairly between them.
+
+    :param manifest_name: Name of the manifest file
+    :param report_format: Format to print the -o and -a reports in (one of render.RENDER_FORMATS)
+    :param workers: Number of worker processes to derive and decode the metadata accounts in (inline if None)
+    """
+    jobs, settings = load_manifest(manifest_name)
+    renderer = make_renderer(report_format, sys.stdout)
+    asyncio.run(run_batch_async(jobs, renderer, workers=workers, **settings))
+
+
+async def run_batch_async(
+    jobs: list,
+    renderer: Renderer,
+    requests_per_second: int = DEFAULT_REQUESTS_PER_SECOND,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    workers: int = None,
+) -> list:
+    """Fetch the data for and produce the reports of a batch of collections concurrently
+
+    :param jobs: list of CollectionJobs
+    :param renderer: The Renderer to print the reports with
+    :param requests_per_second: Requests per second allowed to each provider, across the whole batch
+    :param concurrency: Requests in flight at once, across the whole batch
+    :param workers: Number of worker processes, shared by the batch, to derive and decode the metadata accounts in
+        (inline if None)
+    :return: list of the names of the collections that failed
+    """
+    limiters = {
+        "solana": AsyncLimiter(requests_per_second, 1),
+        "http": AsyncLimiter(requests_per_second, 1),
+    }
+    async with sh.create_solana_client() as solana_client, hh.create_http_client() as http_client:
+        with CpuPool(workers) as pool:
+            clients = {"solana": solana_client, "http": http_client, "cpu": pool}
+            async with FairScheduler(concurrency) as scheduler:
+                results = await asyncio.gather(
+                    *(
+                        batch_collection_async(job, scheduler, clients, limiters, renderer)
+                        for job in jobs
+                    ),
+                    return_exceptions=True,
+                )
+    failed = []
+    for job, result in zip(jobs, results):
+        if isinstance(result, Exception):
+            logger.error("Failed to process %s: %s", job.name, result)
+            failed.append(job.name)
+    return failed
+
+
+async def batch_collection_async(
+    job: CollectionJob, scheduler: FairScheduler, clients: dict, limiters: dict, renderer: Renderer
+) -> dict:
+    """Fetch the data a batch collection's reports need through the shared scheduler, then produce the reports
+
+    :param job: The CollectionJob
+    :param scheduler: The FairScheduler shared by the batch
+    :param clients: The shared network clients ("solana" and "http")
+    :param limiters: The shared AsyncLimiters for each provider ("solana" and "http")
+    :param renderer: The Renderer to print the reports with
+    :return: The collection's all_tokens dict
+    """
+    session = batch_session(job, scheduler, clients, limiters)
+    async with session:
+        await session.discover()
+        await session.populate(*job.reports)
+        write_batch_reports(job, session, renderer)
+    return session.all_tokens
+
+
+def batch_session(
+    job: CollectionJob, scheduler: FairScheduler, clients: dict, limiters: dict
+) -> SnapshotSession:
+    """Make the SnapshotSession for a batch (or daemon) collection, sharing the batch's clients, limiters and
+    scheduler
+
+    :param job: The CollectionJob
+    :param scheduler: The FairScheduler shared by the batch
+    :param clients: The shared network clients ("solana" and "http")
+    :param limiters: The shared AsyncLimiters for each provider ("solana" and "http")
+    :return: The SnapshotSession, not yet entered
+    """
+    return SnapshotSession(
+        job.token_file,
+        job.candymachine_id,
+        job.cmv2,
+        job.name,
+        clients=clients,
+        limiters=limiters,
+        scheduler=scheduler,
+    )
+
+
+async def fetch_stage_async(
+    name: str,
+    all_tokens: dict,
+    stage_name: str,
+    scheduler: FairScheduler,
+    clients: dict,
+    limiters: dict,
+    timeout: float = None,
+) -> int:
+    """Run a fetch stage for a collection's tokens that are missing its data, through the shared scheduler. Failed
+    requests are logged and leave their tokens unpopulated.
+
+    :param name: The collection's name
+    :param all_tokens: The collection's token data
+    :param stage_name: The stage (a key of planner.STAGES)
+    :param scheduler: The shared FairScheduler
+    :param clients: The shared network clients ("solana" and "http")
+    :param limiters: The shared AsyncLimiters for each provider ("solana" and "http")
+    :param timeout: Seconds to stop fetching after, if any. Requests that haven't finished by then are cancelled,
+        leaving their tokens unpopulated.
+    :return: The number of failed requests
+    """
+    key = STAGES[stage_name].key
+    fetching = [token for token in all_tokens.values() if getattr(token, key) is None]
+    logger.info("%s: fetching %s for %d tokens", name, stage_name, len(fetching))
+    work = stage_work(stage_name, all_tokens, clients, limiters)
+    results = await scheduler.run(name, work, timeout)
+    unfinished = [result for result in results if isinstance(result, asyncio.TimeoutError)]
+    if unfinished:
+        logger.warning(
+            "%s: out of time with %d of %d %s requests unfinished",
+            name,
+            len(unfinished),
+            len(results),
+            stage_name,
+        )
+    failures = [result for result in results if isinstance(result, Exception)]
+    if len(failures) > len(unfinished):
+        logger.warning(
+            "%s: %d %s requests failed", name, len(failures) - len(unfinished), stage_name
+        )
+    stamp_fetched(fetching, stage_name)
+    return len(failures)
+
+
+def stage_work(stage_name: str, all_tokens: dict, clients: dict, limiters: dict) -> list:
+    """Get the requests a fetch stage needs to make for the tokens missing its data, for the FairScheduler
+
+    :param stage_name: The stage (a key of planner.STAGES)
+    :param all_tokens: A dict of all the token data being operated upon
+    :param clients: The network clients ("solana" and "http"), and optionally a CpuPool ("cpu") to derive and
+        decode the metadata accounts in
+    :param limiters: The AsyncLimiters for each provider ("solana" and "http")
+    :return: list of functions taking no arguments that return the awaitable for each request
+    """
+    solana_client, solana_limiter = clients["solana"], limiters["solana"]
+    if stage_name == "holders":
+        owner_accounts = sh.group_by_token_account(all_tokens)
+        return [
+            functools.partial(
+                sh.get_holder_chunk_from_solana_async,
+                solana_client,
+                all_tokens,
+                owner_accounts,
+                chunk,
+                solana_limiter,
+            )
+            for chunk in sh.holder_chunks(owner_accounts)
+        ]
+    if stage_name == "editions":
+        return [
+            functools.partial(
+                sh.get_edition_chunk_from_solana_async,
+                solana_client,
+                all_tokens,
+                chunk,
+                solana_limiter,
+                pool=clients.get("cpu"),
+            )
+            for chunk in sh.edition_chunks(all_tokens)
+        ]
+
+    get_data_fns = {
+        "token_accounts": (sh.get_token_account_from_solana_async, "solana"),
+        "accounts": (
+            functools.partial(sh.get_account_info_from_solana_async, pool=clients.get("cpu")),
+            "solana",
+        ),
+        "metadata": (get_arweave_metadata, "http"),
+    }
+    get_data_fn, provider = get_data_fns[stage_name]
+    key = STAGES[stage_name].key
+    return [
+        functools.partial(get_data_fn, clients[provider], token, limiters[provider])
+        for token in all_tokens.values()
+        if getattr(token, key) is None
+    ]
+
+
+def write_batch_reports(job: CollectionJob, session: SnapshotSession, renderer: Renderer) -> None:
+    """Produce the reports asked for for a batch collection
+
+    :param job: The CollectionJob
+    :param session: The collection's SnapshotSession, with the reports' data fetched
+    :param renderer: The Renderer to print the reports with
+    """
+    if "holder_counts" in job.reports or "attributes" in job.reports:
+        renderer.begin(f"Collection {job.name}", "collection")
+        renderer.field("collection", job.name, None)
+        renderer.end()
+    if "holder_counts" in job.reports:
+        wallet_index = session.wallet_index()
+        holder_counts(session.report_tokens, wallet_index, renderer=renderer, top=job.top)
+    if "attributes" in job.reports:
+        attribute_distribution(session.report_tokens, renderer, job.top)
+    if "snapshot" in job.reports:
+        write_snapshot(
+            session.all_tokens,
+            job.outfile_name,
+            job.rarity_models,
+            job.name,
+            session.cache,
+            session.report_tokens,
+        )
+        logger.info("%s: wrote snapshot to %s", job.name, job.outfile_name)
+
+
+def run_daemon(manifest_name: str, workers: int = None) -> None:
+    """Keep every collection in a batch manifest up to date, refreshing holders and metadata and writing snapshots
+    on schedule until stopped (see run_daemon_async())
+
+    :param manifest_name: Name of the manifest file
+    :param workers: Number of worker processes to derive and decode the metadata accounts in (inline if None)
+    """
+    jobs, settings = load_manifest(manifest_name)
+    asyncio.run(run_daemon_async(jobs, workers=workers, **settings))
+
+
+async def run_daemon_async(
+    jobs: list,
+    requests_per_second: int = DEFAULT_REQUESTS_PER_SECOND,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    cycles: int = None,
+    workers: int = None,
+) -> list:
+    """Run the daemon: keep the collections' token data in memory, and whenever one of their tasks (see
+    daemon.DEFAULT_INTERVALS) is due, run it, sharing the network clients, rate limits and scheduler as in batch
+    mode. Each collection's state is saved alongside its cache after every cycle, so a restarted daemon carries on
+    where it left off. Stops on SIGINT/SIGTERM once the current cycle is done.
+
+    :param jobs: list of CollectionJobs
+    :param requests_per_second: Requests per second allowed to each provider, across all collections
+    :param concurrency: Requests in flight at once, across all collections
+    :param cycles: Stop after this many cycles (for testing; runs until stopped if None)
+    :param workers: Number of worker processes, shared by all collections, to derive and decode the metadata
+        accounts in (inline if None)
+    :return: list of the DaemonCollections
+    """
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            # Not available on this platform, or not running in the main thread
+            pass
+
+    limiters = {
+        "solana": AsyncLimiter(requests_per_second, 1),
+        "http": AsyncLimiter(requests_per_second, 1),
+    }
+    async with sh.create_solana_client() as solana_client, hh.create_http_client() as http_client:
+        with CpuPool(workers) as pool:
+            clients = {"solana": solana_client, "http": http_client, "cpu": pool}
+            async with FairScheduler(
+                concurrency
+            ) as scheduler, contextlib.AsyncExitStack() as stack:
+                daemon_collections = []
+                for job in jobs:
+                    session = await stack.enter_async_context(
+                        batch_session(job, scheduler, clients, limiters)
+                    )
+                    daemon_collections.append(await load_daemon_collection(job, session))
+                cycle = 0
+                while not stop.is_set():
+                    now = time.time()
+                    results = await asyncio.gather(
+                        *(daemon_cycle_async(collection, now) for collection in daemon_collections),
+                        return_exceptions=True,
+                    )
+                    for collection, result in zip(daemon_collections, results):
+                        if isinstance(result, Exception):
+                            logger.error("%s: daemon cycle failed: %s", collection.job.name, result)
+                    cycle += 1
+                    if cycles is not None and cycle >= cycles:
+                        break
+                    try:
+                        await asyncio.wait_for(stop.wait(), daemon_sleep(daemon_collections))
+                    except asyncio.TimeoutError:
+                        pass
+    logger.info("Daemon stopped")
+    return daemon_collections
+
+
+async def load_daemon_collection(job: CollectionJob, session: SnapshotSession) -> DaemonCollection:
+    """Get a collection's token list and daemon state, for the daemon to keep in memory
+
+    :param job: The CollectionJob
+    :param session: The collection's SnapshotSession, already entered (so its cached token data is loaded)
+    :return: The DaemonCollection
+    """
+    await session.discover()
+    state = session.cache.load_extra("daemon") or DaemonState()
+    return DaemonCollection(job, session, state)
+
+
+def daemon_intervals(job: CollectionJob) -> dict:
+    """Get how often to run each daemon task for a collection
+
+    :param job: The CollectionJob
+    :return: dict of task name to interval in seconds (None for tasks that don't run)
+    """
+    intervals = {**DEFAULT_INTERVALS, **(job.intervals or {})}
+    if "snapshot" not in job.reports:
+        intervals["snapshot"] = None
+    return intervals
+
+
+def daemon_sleep(daemon_collections: list) -> float:
+    """Get how long the daemon can sleep before the next task is due
+
+    :param daemon_collections: list of DaemonCollections
+    :return: Seconds to sleep, at most daemon.MAX_SLEEP
+    """
+    next_due = [
+        collection.state.next_due(daemon_intervals(collection.job))
+        for collection in daemon_collections
+    ]
+    next_due = [due for due in next_due if due is not None]
+    if not next_due:
+        return MAX_SLEEP
+    return min(max(min(next_due) - time.time(), 0), MAX_SLEEP)
+
+
+async def daemon_cycle_async(collection: DaemonCollection, now: float) -> list:
+    """Run whichever of a collection's daemon tasks are due, then fetch anything its reports still need that
+    hasn't been fetched yet (new tokens, or requests that failed last time)
+
+    :param collection: The DaemonCollection
+    :param now: The Unix time of the cycle
+    :return: list of the tasks that ran
+    """
+    job, session, state = collection
+    due = state.due(daemon_intervals(job), now)
+    if "holders" in due:
+        await refresh_holders_async(session)
+    if "metadata" in due:
+        await refresh_stages_async(session, ["accounts", "metadata"])
+    if {"holders", "metadata"} & set(due):
+        session.cache.save(session.all_tokens)
+    # Every cycle retries whatever failed in the last one
+    session.populated.clear()
+    await session.populate(*job.reports)
+
+    if "snapshot" in due:
+        daemon_snapshot(collection, now)
+    for task in due:
+        state.mark(task, now)
+    session.cache.save_extra("daemon", state)
+    return due
+
+
+async def refresh_holders_async(session: SnapshotSession) -> None:
+    """Refresh the holders of every token with a known token account. Holders are rechecked in batches against the
+    token accounts already known; only tokens whose account turns out to be empty (the token moved to another
+    account) have their token account looked up again.
+
+    :param session: The collection's SnapshotSession
+    """
+    known = [token for token in session.all_tokens.values() if token.token_account]
+    await refresh_stages_async(session, ["holders"], tokens=known)
+    moved = [token for token in known if not token.holder_address or str(token.amount) == "0"]
+    if moved:
+        logger.info("%s: %d tokens have moved token account", session.name, len(moved))
+        await refresh_stages_async(session, ["token_accounts", "holders"], tokens=moved)
+
+
+async def refresh_stages_async(
+    session: SnapshotSession, stage_names: list, tokens: list = None
+) -> None:
+    """Fetch the given stages' data again for some or all of a collection's tokens. Tokens that can't be fetched
+    keep the data they had.
+
+    :param session: The collection's SnapshotSession
+    :param stage_names: The stages to refresh (keys of planner.STAGES), in the order to run them
+    :param tokens: The Tokens to refresh (all of them if None)
+    """
+    tokens = list(session.all_tokens.values()) if tokens is None else tokens
+    fields = [field for stage_name in stage_names for field in STAGES[stage_name].fields]
+    previous = {token.token: {field: getattr(token, field) for field in fields} for token in tokens}
+    for token in tokens:
+        for field in fields:
+            setattr(token, field, None)
+        if "metadata" in stage_names:
+            # Metadata fetching only sets traits for tokens that have some
+            token.traits = {}
+
+    # The cleared tokens mustn't be saved until whatever couldn't be fetched has its old data back
+    await session.fetch_stages(stage_names)
+
+    for token in tokens:
+        for stage_name in stage_names:
+            stage = STAGES[stage_name]
+            if getattr(token, stage.key) is None:
+                for field in stage.fields:
+                    setattr(token, field, previous[token.token][field])
+
+
+def daemon_snapshot(collection: DaemonCollection, now: float) -> str:
+    """Write a scheduled snapshot of a collection to a file of its own, and if asked for, the changes since the
+    previous one
+
+    :param collection: The DaemonCollection
+    :param now: The Unix time of the snapshot
+    :return: The name of the snapshot file
+    """
+    job, session, state = collection
+    snapshot_name = timestamped_name(job.outfile_name, now)
+    write_snapshot(
+        session.all_tokens,
+        snapshot_name,
+        job.rarity_models,
+        job.name,
+        session.cache,
+        session.report_tokens,
+    )
+    logger.info("%s: wrote snapshot to %s", job.name, snapshot_name)
+
+    if job.diff and state.last_snapshot and Path(state.last_snapshot).exists():
+        diff_name = timestamped_name(f"{job.name}_diff.csv", now)
+        changes = diff_snapshots(read_snapshot(state.last_snapshot), read_snapshot(snapshot_name))
+        count = write_changes(changes, diff_name)
+        logger.info(
+            "%s: wrote %d changes since %s to %s", job.name, count, state.last_snapshot, diff_name
+        )
+    state.last_snapshot = snapshot_name
+    return snapshot_name
+
+
+def serve_collections(jobs: list, host: str = DEFAULT_HOST, port: int = None) -> None:
+    """Serve the collections' cached data over HTTP as JSON (see server.make_app()) until interrupted, reloading
+    each collection whenever its cache is written to. Nothing is fetched: keep the caches up to date with --daemon
+    or regular runs.
+
+    :param jobs: list of CollectionJobs to serve
+    :param host: Interface to listen on
+    :param port: Port to listen on
+    """
+    caches = {}
+    for job in jobs:
+        cache = TokenCache()
+        cache.initialize(job.cache_key)
+        caches[job.name] = cache
+    service = QueryService(caches, {job.name: job.rarity_models for job in jobs})
+    run_server(service, host, port)
+
+
+def update_rarity_state(all_tokens: dict, cache: TokenCache) -> RarityState:
+    """Load the persisted rarity state for the collection and bring it up to date with the current token data,
+    so only tokens affected by new or changed traits get rescored. The state is saved back if anything changed.
+
+    :param all_tokens: A dict of all the token data being operated upon
+    :param cache: The collection's TokenCache
+    :return: The up-to-date RarityState
+    """
+    rarity_state = cache.load_extra("rarity") or RarityState()
+    changed = rarity_state.sync(all_tokens)
+    if changed:
+        logger.info("Updated rarity for %d changed tokens", len(changed))
+        cache.save_extra("rarity", rarity_state)
+    return rarity_state
+
+
+def update_rarity_index(
+    all_tokens: dict, cache: TokenCache, rarity_models: list = ()
+) -> RarityIndex:
+    """Load the persisted rarity index for the collection. An index built from the cache as it was last saved is
+    used as it is; otherwise it is checked against the rarity state and token names (see
+    rarity_index.rarity_fingerprint()) and rebuilt (and saved) if they have changed since it was built or it is
+    missing any of the requested rarity models.
+
+    :param all_tokens: A dict of all the token data being operated upon
+    :param cache: The collection's TokenCache
+    :param rarity_models: Names of extra rarity models the index needs to include
+    :return: The up-to-date RarityIndex
+    """
+    cached_at = cache.saved_at()
+    rarity_index = cache.load_extra("rarity_index")
+    has_models = rarity_index is not None and set(rarity_models) <= set(rarity_index.models)
+    # Indexes saved by older versions have no cached_at or fingerprint, so are always rebuilt
+    built_at = getattr(rarity_index, "cached_at", None)
+    if has_models and cached_at is not None and built_at == cached_at:
+        return rarity_index
+
+    rarity_state = update_rarity_state(all_tokens, cache)
+    fingerprint = rarity_fingerprint(rarity_state, all_tokens)
+    if not has_models or getattr(rarity_index, "fingerprint", None) != fingerprint:
+        rarity_index = build_rarity_index(rarity_state, all_tokens, rarity_models, cached_at)
+    elif built_at != cached_at:
+        # Still up to date with a newer save of the cache, so it only needs stamping with it
+        rarity_index.cached_at = cached_at
+    else:
+        return rarity_index
+    cache.save_extra("rarity_index", rarity_index)
+    return rarity_index
+
+
+def update_wallet_index(all_tokens: dict, cache: TokenCache) -> WalletIndex:
+    """Load the persisted wallet index for the collection and bring it up to date with the current holders. The
+    index is saved back if anything changed.
+
+    :param all_tokens: A dict of all the token data being operated upon
+    :param cache: The collection's TokenCache
+    :return: The up-to-date WalletIndex
+    """
+    wallet_index = cache.load_extra("wallets") or WalletIndex()
+    if wallet_index.sync(all_tokens):
+        cache.save_extra("wallets", wallet_index)
+    return wallet_index
+
+
+def report_rarity_state(all_tokens: dict, report_tokens: dict, cache: TokenCache) -> RarityState:
+    """Get the RarityState to rank the tokens being reported on with. The saved state is kept up to date with the
+    whole collection either way; if the reports only cover some of it (see SnapshotSession.select_editions()), a
+    throwaway state ranking just those tokens is returned instead.
+
+    :param all_tokens: A dict of all the token data being operated upon
+    :param report_tokens: The tokens being reported on (all_tokens itself if there's no filtering)
+    :param cache: The collection's TokenCache
+    :return: The RarityState
+    """
+    rarity_state = update_rarity_state(all_tokens, cache)
+    if report_tokens is all_tokens:
+        return rarity_state
+    report_state = RarityState()
+    report_state.sync(report_tokens)
+    return report_state
+
+
+def report_rarity_index(
+    all_tokens: dict, report_tokens: dict, cache: TokenCache, rarity_models: list = ()
+) -> RarityIndex:
+    """Get the RarityIndex of the tokens being reported on: the saved index, or if the reports only cover some of
+    the collection, a throwaway index of just those tokens (see report_rarity_state())
+
+    :param all_tokens: A dict of all the token data being operated upon
+    :param report_tokens: The tokens being reported on (all_tokens itself if there's no filtering)
+    :param cache: The collection's TokenCache
+    :param rarity_models: Names of extra rarity models the index needs to include
+    :return: The RarityIndex
+    """
+    if report_tokens is all_tokens:
+        return update_rarity_index(all_tokens, cache, rarity_models)
+    rarity_state = report_rarity_state(all_tokens, report_tokens, cache)
+    return build_rarity_index(rarity_state, report_tokens, rarity_models)
+
+
+def report_wallet_index(all_tokens: dict, report_tokens: dict, cache: TokenCache) -> WalletIndex:
+    """Get the WalletIndex of the holders of the tokens being reported on. The saved index is kept up to date with
+    the whole collection either way; if the reports only cover some of it, a throwaway index of just those tokens'
+    holders is returned instead.
+
+    :param all_tokens: A dict of all the token data being operated upon
+    :param report_tokens: The tokens being reported on (all_tokens itself if there's no filtering)
+    :param cache: The collection's TokenCache
+    :return: The WalletIndex
+    """
+    wallet_index = update_wallet_index(all_tokens, cache)
+    if report_tokens is all_tokens:
+        return wallet_index
+    report_index = WalletIndex()
+    report_index.sync(report_tokens)
+    return report_index
+
+
+def load_history(cache: TokenCache) -> HolderHistory:
+    """Load the persisted holder history for the collection, which every snapshot taken with -s is recorded in
+
+    :param cache: The collection's TokenCache
+    :return: The HolderHistory (empty if no snapshots have been taken yet)
+    """
+    return cache.load_extra("history") or HolderHistory()
+
+
+def history_report(
+    all_tokens: dict,
+    history: HolderHistory,
+    holder_history: str = None,
+    history_at: datetime.datetime = None,
+    holding_time: str = None,
+    renderer: Renderer = None,
+) -> str:
+    """Report on the recorded holder history: a token's holders over time, and/or how long a wallet has held its
+    tokens
+
+    :param all_tokens: A dict of all the token data being operated upon
+    :param history: The collection's HolderHistory (see load_history())
+    :param holder_history: Token ID to report the holder history of, if desired
+    :param history_at: Point in time to show the holder of holder_history at, if desired
+    :param holding_time: Wallet address to report holding times for, if desired
+    :param renderer: Renderer to stream the output to as it is produced, rather than returning it
+    :return: A str containing the formatted output (None if it was written to renderer)
+    """
+    result_str = ""
+    if holder_history:
+        changes = history.history(holder_history)
+        holder_at = (
+            history.holder_at(holder_history, history_at.timestamp()) if history_at else None
+        )
+        if renderer is None:
+            result_str += output.format_holder_history(
+                holder_history, changes, history_at, holder_at
+            )
+        else:
+            output.write_holder_history(renderer, holder_history, changes, history_at, holder_at)
+    if holding_time:
+        durations = history.holding_durations(holding_time)
+        if renderer is None:
+            result_str += output.format_holding_durations(holding_time, durations, all_tokens)
+        else:
+            output.write_holding_durations(renderer, holding_time, durations, all_tokens)
+    return result_str if renderer is None else None
+
+
+def holder_counts(
+    all_tokens: dict,
+    wallet_index: WalletIndex = None,
+    holder_stats: str = None,
+    renderer: Renderer = None,
+    top: int = None,
+) -> str:
+    """Analyze the token data to determine how many NFTs are in each wallet, and print it out.
+
+    :param all_tokens: The preassembled data dict for all tokens
+    :param wallet_index: Up-to-date WalletIndex to read the holders from (one is built from all_tokens if None)
+    :param holder_stats: "text" or "json" to output holder distribution stats instead of the full list of wallets
+    :param renderer: Renderer to stream the output to as it is produced, rather than returning it
+    :param top: Only include this many of the biggest holders, if given
+    :return: A string containing the formatted output (None if it was written to renderer)
+    """
+    if wallet_index is None:
+        wallet_index = WalletIndex()
+        wallet_index.sync(all_tokens)
+
+    if holder_stats:
+        distribution = holder_distribution(
+            len(all_tokens), wallet_index.counts(), output.MARKETPLACE_WALLETS
+        )
+        if renderer is None:
+            return output.format_holder_distribution(distribution, holder_stats)
+        if holder_stats == "json" and not isinstance(renderer, JsonRenderer):
+            # --holder-stats json asks for the stats as JSON whatever --format is
+            renderer = JsonRenderer(renderer.stream)
+        output.write_holder_distribution(renderer, distribution)
+    elif renderer is None:
+        return output.format_biggest_holders(len(all_tokens), wallet_index, top)
+    else:
+        output.write_biggest_holders(renderer, len(all_tokens), wallet_index, top)
+
+
+def attribute_distribution(all_tokens: dict, renderer: Renderer = None, top: int = None) -> str:
+    """Analyze the token data to determine the statistical rarity of the possible NFT traits, and print it out.
+
+    :param all_tokens: The preassembled data dict for all tokens
+    :param renderer: Renderer to stream the output to as it is produced, rather than returning it
+    :param top: Only include this many of the rarest values of each trait, if given
+    :return: A string containing the formatted output (None if it was written to renderer)
+    """
+    trait_map = output.get_trait_map(all_tokens)
+    token_with_attr_count, attribute_counts = get_attribute_counts(trait_map, all_tokens)
+    if renderer is None:
+        return output.format_trait_frequency(token_with_attr_count, attribute_counts, top)
+    output.write_trait_frequency(renderer, token_with_attr_count, attribute_counts, top)
+
+
+def parse_rarity_models(models_str: str) -> list:
+    """Parse a comma-separated list of rarity model names from the command line
+
+    :param models_str: The comma-separated model names
+    :return: list of model names, in the order given
+    """
+    models = [model.strip() for model in models_str.split(",") if model.strip()]
+    for model in models:
+        if model not in RARITY_MODELS:
+            raise ArgumentTypeError(f"unknown rarity model {model}")
+    return models
+
+
+def parse_editions(editions_str: str) -> list:
+    """Parse a comma-separated list of edition kinds from the command line
+
+    :param editions_str: The comma-separated edition kinds
+    :return: list of edition kinds
+    """
+    editions = [edition.strip() for edition in editions_str.split(",") if edition.strip()]
+    for edition in editions:
+        if edition not in EDITION_FILTERS:
+            raise ArgumentTypeError(f"unknown edition kind {edition}")
+    return editions
+
+
+def parse_shard(shard_str: str) -> tuple:
+    """Parse an INDEX/COUNT shard from the command line
+
+    :param shard_str: The shard, e.g. "0/4" for the first of four
+    :return: tuple of (index, count) ints
+    """
+    try:
+        index, count = (int(part) for part in shard_str.split("/"))
+    except ValueError:
+        raise ArgumentTypeError(f"invalid shard {shard_str}, expected INDEX/COUNT")
+    if count < 1 or not 0 <= index < count:
+        raise ArgumentTypeError(f"invalid shard {shard_str}, expected 0 <= INDEX < COUNT")
+    return index, count
+
+
+def parse_positive_int(value_str: str) -> int:
+    """Parse a count from the command line that has to be at least 1
+
+    :param value_str: The count, e.g. "10"
+    :return: The count as an int
+    """
+    try:
+        value = int(value_str)
+    except ValueError:
+        raise ArgumentTypeError(f"invalid count {value_str}, expected a whole number")
+    if value < 1:
+        raise ArgumentTypeError(f"invalid count {value_str}, expected at least 1")
+    return value
+
+
+def parse_rank_range(range_str: str) -> tuple:
+    """Parse a START:END rank range from the command line
+
+    :param range_str: The range, e.g. "1:10"
+    :return: tuple of (start, end) ints
+    """
+    try:
+        start, end = (int(rank) for rank in range_str.split(":"))
+    except ValueError:
+        raise ArgumentTypeError(f"invalid rank range {range_str}, expected START:END")
+    if start < 1 or end < start:
+        raise ArgumentTypeError(f"invalid rank range {range_str}, expected 1 <= START <= END")
+    return start, end
+
+
+def parse_history_time(time_str: str) -> datetime.datetime:
+    """Parse the --at option: an ISO 8601 date or date and time, taken to be UTC if it has no time zone
+
+    :param time_str: The option's value
+    :return: The point in time, as a timezone-aware datetime
+    """
+    try:
+        at = datetime.datetime.fromisoformat(time_str)
+    except ValueError:
+        raise ArgumentTypeError(f"Expected an ISO 8601 date or time, got {time_str}")
+    return at if at.tzinfo else at.replace(tzinfo=datetime.timezone.utc)
+
+
+def trait_query_holders(all_tokens: dict, trait_query: str, renderer: Renderer = None) -> str:
+    """Find the tokens matching a trait query and who holds them, and print it out.
+
+    :param all_tokens: The preassembled data dict for all tokens
+    :param trait_query: The trait query, e.g. "Background=Gold AND (Eyes=Laser OR NOT Hat=)"
+    :param renderer: Renderer to stream the output to as it is produced, rather than returning it
+    :return: A string containing the formatted output (None if it was written to renderer)
+    """
+    trait_index = TraitIndex(all_tokens, output.get_trait_map(all_tokens))
+    holders = holders_for(all_tokens, trait_index.query(trait_query))
+    if renderer is None:
+        return output.format_trait_query(trait_query, holders)
+    output.write_trait_query(renderer, trait_query, holders)
+
+
+def configure_logging() -> None:
+    """Set up logging for the command line: everything to app.log, and info and up to the console. Code using
+    SnapshotSession as a library is left to configure logging itself.
+    """
+    logging.basicConfig(
+        level=logging.DEBUG,
+        format="%(asctime)s %(name)-12s %(levelname)-8s %(message)s",
+        filename="app.log",
+    )
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.INFO)
+    ch.setFormatter(logging.Formatter("%(message)s"))
+    logging.getLogger("").addHandler(ch)
+
+
+def build_parser() -> ArgumentParser:
+    """Build the command line's argument parser
+
+    :return: The ArgumentParser
+    """
+    parser = ArgumentParser()
+    parser.add_argument(
+        "token_file",
+        metavar="TOKEN_FILE",
+        type=str,
+        nargs="?",
+        help="file to read token IDs from (and write them to, if applicable)",
+    )
+    parser.add_argument(
+        "-t",
+        dest="token_list",
+        action="store_true",
+        default=False,
+        help="get the token list for the given CM ID, collections and/or creators (requires passing --cmid, "
+        "--collection or --creator)",
+    )
+    parser.add_argument(
+        "-o",
+        dest="holder_counts",
+        action="store_true",
+        default=False,
+        help="get and print the overall holder counts",
+    )
+    parser.add_argument(
+        "-a",
+        dest="attributes",
+        action="store_true",
+        default=False,
+        help="get and print the overall metadata attribute distribution",
+    )
+    parser.add_argument(
+        "-s",
+        dest="snapshot",
+        action="store_true",
+        default=False,
+        help="get and output the snapshot file to the outfile name from -f",
+    )
+    parser.add_argument(
+        "-r",
+        dest="rarity",
+        action="store_true",
+        default=False,
+        help="get and output the rarity of the given token ID (requires passing --tokenid)",
+    )
+    parser.add_argument(
+        "-f",
+        "--file",
+        dest="outfile_name",
+        default="snapshot.csv",
+        help="write snapshot to FILE (defaults to snapshot.csv; .gz/.zst compresses, - writes to stdout, "
+        ".parquet/.arrow writes a typed columnar file, which needs pyarrow)",
+        metavar="SNAP_FILE",
+    )
+    parser.add_argument(
+        "--cmid",
+        dest="candymachine_id",
+        help="use CANDYMACHINE_ID to fetch tokens",
+        metavar="CANDYMACHINE_ID",
+    )
+    parser.add_argument(
+        "--collection",
+        dest="collections",
+        action="append",
+        default=[],
+        help="with -t, also fetch the tokens in the verified collection COLLECTION_MINT (can be given more than "
+        "once)",
+        metavar="COLLECTION_MINT",
+    )
+    parser.add_argument(
+        "--creator",
+        dest="creators",
+        action="append",
+        default=[],
+        help="with -t, also fetch the tokens whose verified first creator is CREATOR (can be given more than "
+        "once)",
+        metavar="CREATOR",
+    )
+    parser.add_argument(
+        "--tokenid",
+        dest="token_id",
+        help="the token ID to fetch rarity information for",
+        metavar="TOKEN_ID",
+    )
+    parser.add_argument(
+        "--cmv2",
+        dest="cm_v2",
+        action="store_true",
+        default=False,
+        help="use Candy Machine v2 method to fetch tokens from CM ID",
+    )
+    parser.add_argument(
+        "--bust-cache",
+        dest="bust_cache",
+        action="store_true",
+        default=False,
+        help="clear out any existing cache data for this token file",
+    )
+    parser.add_argument(
+        "--rarity-models",
+        dest="rarity_models",
+        type=parse_rarity_models,
+        default=[],
+        help="comma-separated extra rarity models to include with -s and -r (any of: {})".format(
+            ", ".join(RARITY_MODELS)
+        ),
+        metavar="MODELS",
+    )
+    parser.add_argument(
+        "--rank-range",
+        dest="rank_range",
+        type=parse_rank_range,
+        help="list the tokens ranked START to END by rarity (e.g. 1:10 for the ten rarest)",
+        metavar="START:END",
+    )
+    parser.add_argument(
+        "--where",
+        dest="trait_query",
+        help="list the holders of tokens matching QUERY, e.g. 'Background=Gold AND NOT Eyes=Laser' "
+        "(supports AND, OR, NOT and parentheses)",
+        metavar="QUERY",
+    )
+    parser.add_argument(
+        "--wallet",
+        dest="wallet",
+        help="list the tokens held by WALLET",
+        metavar="WALLET",
+    )
+
+    parser.add_argument(
+        "--diff",
+        dest="diff",
+        nargs="+",
+        help="write the changes (transfers, new and burned tokens, trait and metadata changes) from the "
+        "first SNAP_FILE to the second, or to the current data if only one is given",
+        metavar="SNAP_FILE",
+    )
+    parser.add_argument(
+        "--diff-format",
+        dest="diff_format",
+        choices=DIFF_FORMATS,
+        default="csv",
+        help="format to write the diff in (defaults to csv)",
+    )
+    parser.add_argument(
+        "--diff-file",
+        dest="diff_file",
+        default="-",
+        help="write the diff to FILE (defaults to stdout)",
+        metavar="DIFF_FILE",
+    )
+
+    parser.add_argument(
+        "--holder-history",
+        dest="holder_history",
+        help="print who has held TOKEN_ID over time, as recorded by -s snapshots",
+        metavar="TOKEN_ID",
+    )
+    parser.add_argument(
+        "--at",
+        dest="history_at",
+        type=parse_history_time,
+        help="with --holder-history, also print who held the token at TIME (ISO 8601, UTC by default)",
+        metavar="TIME",
+    )
+    parser.add_argument(
+        "--holding-time",
+        dest="holding_time",
+        help="print how long WALLET has held each of its tokens, as recorded by -s snapshots",
+        metavar="WALLET",
+    )
+
+    parser.add_argument(
+        "--holder-stats",
+        dest="holder_stats",
+        choices=HOLDER_STATS_FORMATS,
+        help="with -o, print holder distribution stats (histogram, Gini coefficient, concentration, "
+        "marketplace share) as text or JSON instead of every wallet",
+    )
+
+    parser.add_argument(
+        "--format",
+        dest="report_format",
+        choices=RENDER_FORMATS,
+        default="text",
+        help="format to print the reports in (defaults to text); json prints each report as a JSON object on a "
+        "line of its own",
+    )
+    parser.add_argument(
+        "--top",
+        dest="top",
+        type=parse_positive_int,
+        help="only print the N biggest holders with -o, or the N rarest values of each trait with -a",
+        metavar="N",
+    )
+
+    parser.add_argument(
+        "--explain",
+        dest="explain",
+        action="store_true",
+        default=False,
+        help="print the fetch stages and request counts the requested outputs need given what is cached, "
+        "without fetching anything or producing the outputs",
+    )
+    parser.add_argument(
+        "--deadline",
+        dest="deadline",
+        type=float,
+        help="stop fetching data after SECONDS, filling in gaps from stale cached data where possible and "
+        "flagging tokens with stale or missing data in the outputs",
+        metavar="SECONDS",
+    )
+    parser.add_argument(
+        "--batch",
+        dest="batch",
+        help="process every collection in the JSON manifest MANIFEST concurrently, sharing network clients and "
+        "rate limits, instead of a single TOKEN_FILE",
+        metavar="MANIFEST",
+    )
+    parser.add_argument(
+        "--daemon",
+        dest="daemon",
+        action="store_true",
+        default=False,
+        help="with --batch, keep running, refreshing holders and metadata and writing snapshots on the intervals "
+        "in the manifest",
+    )
+    parser.add_argument(
+        "--serve",
+        dest="serve",
+        type=int,
+        help="serve token rarity, wallet holdings, holder counts and trait distribution as JSON over HTTP on "
+        "PORT from the cached data (of TOKEN_FILE, or every collection with --batch), reloading when the cache "
+        "changes",
+        metavar="PORT",
+    )
+    parser.add_argument(
+        "--host",
+        dest="host",
+        default=DEFAULT_HOST,
+        help=f"with --serve, the interface to listen on (defaults to {DEFAULT_HOST})",
+        metavar="HOST",
+    )
+    parser.add_argument(
+        "--shard",
+        dest="shard",
+        type=parse_shard,
+        help="fetch the data for shard INDEX of COUNT (e.g. 0/4) of the token list into a cache of its own, as one "
+        "of several workers on this or other machines sharing the cache directory; fetches the data the "
+        "requested outputs need (the snapshot's if none), without producing them",
+        metavar="INDEX/COUNT",
+    )
+    parser.add_argument(
+        "--merge-shards",
+        dest="merge_shards",
+        type=int,
+        help="merge the caches of COUNT --shard workers into this token file's cache before producing the "
+        "outputs",
+        metavar="COUNT",
+    )
+    parser.add_argument(
+        "--editions",
+        dest="editions",
+        type=parse_editions,
+        help="comma-separated edition kinds to restrict the outputs to (any of: {}), e.g. master,none to leave "
+        "print editions out of holder counts and rarity; edition accounts are fetched in batches of 100".format(
+            ", ".join(EDITION_FILTERS)
+        ),
+        metavar="KINDS",
+    )
+    parser.add_argument(
+        "--workers",
+        dest="workers",
+        type=int,
+        help="derive and decode the on-chain metadata accounts in N worker processes, leaving the main process "
+        "free to keep the requests going (worth it for collections of thousands of tokens)",
+        metavar="N",
+    )
+    parser.add_argument(
+        "--revalidate",
+        dest="revalidate",
+        choices=REVALIDATE_MODES,
+        help="print the -o, -a and -r outputs from cached data straight away, noting how old it is, while "
+        "refreshing it in the background; then just cache the fresh data, print the outputs again "
+        "(rerender), or write a snapshot to SNAP_FILE (snapshot)",
+    )
+
+    return parser
+
+
+def cli(argv: list = None) -> None:
+    """Run the command line
+
+    :param argv: The command line arguments (sys.argv's if None)
+    """
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    configure_logging()
+    if args.diff and len(args.diff) > 2:
+        parser.error("--diff takes one or two snapshot files")
+    if args.daemon and not args.batch:
+        parser.error("--daemon needs a --batch manifest")
+    if args.daemon and args.serve is not None:
+        parser.error("run --serve in a separate process alongside --daemon")
+    if args.serve is not None and args.batch:
+        serve_collections(load_manifest(args.batch)[0], args.host, args.serve)
+        return
+    if args.serve is not None and args.token_file:
+        collection = args.candymachine_id or args.token_file.split(".")[0]
+        job = CollectionJob(collection, args.token_file, rarity_models=tuple(args.rarity_models))
+        serve_collections([job], args.host, args.serve)
+        return
+    if args.daemon:
+        run_daemon(args.batch, args.workers)
+        return
+    if args.batch:
+        run_batch(args.batch, args.report_format, args.workers)
+        return
+    if not args.token_file:
+        parser.error("TOKEN_FILE is required unless using --batch")
+    if args.shard:
+        if args.token_list or not Path(args.token_file).exists():
+            parser.error("--shard needs the token file written by a run with -t first")
+        reports = requested_reports(
+            holder_counts=args.holder_counts,
+            attributes=args.attributes,
+            snapshot=args.snapshot,
+            rarity=args.rarity,
+        )
+        run_shard(
+            args.token_file, args.shard, args.candymachine_id, args.cm_v2, reports, args.workers
+        )
+        return
+
+    if args.token_list and not discovery_sources(
+        args.candymachine_id, args.cm_v2, args.collections, args.creators
+    ):
+        parser.error("-t needs a CM ID, --collection or --creator to look the tokens up by")
+
+    session = SnapshotSession(
+        args.token_file,
+        args.candymachine_id,
+        args.cm_v2,
+        workers=args.workers,
+        collections=args.collections,
+        creators=args.creators,
+        bust_cache=args.bust_cache,
+        deadline=args.deadline,
+        merge_shards=args.merge_shards,
+        editions=args.editions,
+    )
+    asyncio.run(
+        main(
+            session,
+            args.token_list,
+            args.holder_counts,
+            args.attributes,
+            args.snapshot,
+            args.rarity,
+            args.token_id,
+            args.outfile_name,
+            args.rarity_models,
+            args.rank_range,
+            args.trait_query,
+            args.wallet,
+            args.diff,
+            args.diff_format,
+            args.diff_file,
+            args.holder_history,
+            args.history_at,
+            args.holding_time,
+            args.holder_stats,
+            args.report_format,
+            args.top,
+            args.explain,
+            args.revalidate,
+        )
+    )
+
+
+if __name__ == "__main__":
+    cli()
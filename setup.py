@@ -13,6 +13,7 @@ setuptools.setup(
     long_description_content_type="text/markdown",
     url="https://github.com/bill-hewitt/python_solana_nft_snapshot",
     packages=setuptools.find_packages(),
+    py_modules=["nft_snapshot"],
     include_package_data=True,
     classifiers=["Programming Language :: Python :: 3", "Operating System :: OS Independent"],
     use_scm_version=True,
@@ -23,9 +24,10 @@ setuptools.setup(
         "aiolimiter",
         "asyncio",
         "base58",
-        "pandas",
+        "numpy",
         "retry",
         "solana",
+        "sortedcontainers",
         "tqdm",
     ],
     tests_require=["mock", "pytest", "pytest-mock"],
@@ -0,0 +1,120 @@
+import asyncio
+import json
+
+import pytest
+
+from util import batch
+
+
+class TestBatch:
+    def test_load_manifest(self, tmp_path):
+        manifest = tmp_path / "manifest.json"
+        manifest.write_text(
+            json.dumps(
+                {
+                    "requests_per_second": 40,
+                    "collections": [
+                        {"token_file": "tokenlist_mf.txt", "reports": ["holder_counts"]},
+                        {
+                            "name": "trash",
+                            "cmid": "test_cm",
+                            "cmv2": True,
+                            "reports": ["snapshot"],
+                            "snapshot_file": "trash.parquet",
+                            "top": 5,
+                        },
+                    ],
+                }
+            )
+        )
+        jobs, settings = batch.load_manifest(str(manifest))
+        assert jobs == [
+            batch.CollectionJob(
+                name="tokenlist_mf",
+                token_file="tokenlist_mf.txt",
+                reports=("holder_counts",),
+                outfile_name="tokenlist_mf_snapshot.csv",
+            ),
+            batch.CollectionJob(
+                name="trash",
+                token_file="tokenlist_trash.txt",
+                candymachine_id="test_cm",
+                cmv2=True,
+                reports=("snapshot",),
+                outfile_name="trash.parquet",
+                top=5,
+            ),
+        ]
+        assert jobs[1].cache_key == "tokenlist_trash"
+        assert settings == {"requests_per_second": 40, "concurrency": batch.DEFAULT_CONCURRENCY}
+
+    @pytest.mark.parametrize(
+        "collections",
+        [
+            [{"reports": ["snapshot"]}],
+            [{"token_file": "a.txt", "reports": ["rarity"]}],
+            [{"token_file": "a.txt"}, {"token_file": "a.txt"}],
+            [{"token_file": "a.txt", "intervals": {"rarity": 60}}],
+            [{"token_file": "a.txt", "top": 0}],
+            [{"token_file": "a.txt", "top": "5"}],
+        ],
+    )
+    def test_load_manifest_invalid(self, tmp_path, collections):
+        manifest = tmp_path / "manifest.json"
+        manifest.write_text(json.dumps({"collections": collections}))
+        with pytest.raises(ValueError):
+            batch.load_manifest(str(manifest))
+
+    @pytest.mark.asyncio
+    async def test_fair_scheduler_takes_turns(self):
+        order = []
+
+        def request(name):
+            async def fn():
+                order.append(name)
+                await asyncio.sleep(0)
+                return name
+
+            return fn
+
+        async with batch.FairScheduler(concurrency=1) as scheduler:
+            results = await asyncio.gather(
+                scheduler.run("big", [request(f"big_{i}") for i in range(3)]),
+                scheduler.run("small", [request("small_0")]),
+                scheduler.run("empty", []),
+            )
+        assert order == ["big_0", "small_0", "big_1", "big_2"]
+        assert results == [["big_0", "big_1", "big_2"], ["small_0"], []]
+
+    @pytest.mark.asyncio
+    async def test_fair_scheduler_returns_errors(self):
+        async def fail():
+            raise ValueError("bad request")
+
+        async def succeed():
+            return 1
+
+        async with batch.FairScheduler(concurrency=2) as scheduler:
+            results = await scheduler.run("test", [fail, succeed])
+        assert isinstance(results[0], ValueError)
+        assert results[1] == 1
+
+    @pytest.mark.asyncio
+    async def test_fair_scheduler_timeout(self):
+        started = []
+
+        def request(delay):
+            async def fn():
+                started.append(delay)
+                await asyncio.sleep(delay)
+                return delay
+
+            return fn
+
+        async with batch.FairScheduler(concurrency=1) as scheduler:
+            results = await scheduler.run("test", [request(0), request(10), request(0)], 0.1)
+            # The request in flight is cancelled, and the one still queued never starts
+            assert await scheduler.run("test", [request(0)]) == [0]
+        assert started == [0, 10, 0]
+        assert results[0] == 0
+        assert all(isinstance(result, asyncio.TimeoutError) for result in results[1:])
@@ -1,6 +1,7 @@
 import pickle
 
 import mock
+import pytest
 
 from util import cache
 
@@ -27,8 +28,9 @@ class TestCache:
 
         file_mock = mock.mock_open(read_data=pickle.dumps(test_cache_data))
         with mock.patch("pathlib.Path.open", file_mock) as path_mock:
-            cache.token_cache.initialize("test")
-            config = cache.token_cache.load()
+            token_cache = cache.TokenCache()
+            token_cache.initialize("test")
+            config = token_cache.load()
             path_mock.assert_called_once()
             pickle_mock.assert_called_once_with(file_mock())
         assert config == test_cache_data
@@ -39,7 +41,60 @@ class TestCache:
 
         file_mock = mock.mock_open(read_data=pickle.dumps(test_cache_data))
         with mock.patch("pathlib.Path.open", file_mock) as path_mock:
-            cache.token_cache.initialize("test")
-            cache.token_cache.save(test_cache_data)
+            token_cache = cache.TokenCache()
+            token_cache.initialize("test")
+            token_cache.save(test_cache_data)
             path_mock.assert_called_once()
         pickle_mock.assert_called_once_with(test_cache_data, file_mock())
+
+    def test_save_is_atomic(self, mocker, monkeypatch, tmp_path):
+        monkeypatch.setattr(cache, "CACHE_DIR", str(tmp_path))
+        token_cache = cache.TokenCache()
+        token_cache.initialize("test")
+        token_cache.save({"1": "old"})
+
+        # A write that fails part way through leaves the old cache in place, and no temporary file behind
+        mocker.patch("pickle.dump", side_effect=OSError("disk full"))
+        token_cache.save({"1": "new"})
+        assert token_cache.load() == {"1": "old"}
+        assert [path.name for path in tmp_path.iterdir()] == ["test_cache.p"]
+        with pytest.raises(OSError):
+            cache.dump_atomic({}, token_cache.extra_path("wallets"))
+        assert not token_cache.extra_path("wallets").exists()
+
+    def test_read_raises(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(cache, "CACHE_DIR", str(tmp_path))
+        token_cache = cache.TokenCache()
+        token_cache.initialize("test")
+        with pytest.raises(OSError):
+            token_cache.read()
+        token_cache.path.write_bytes(pickle.dumps({"1": "one"})[:5])
+        with pytest.raises(Exception):
+            token_cache.read()
+        assert token_cache.load() == {}
+
+    def test_saved_at(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(cache, "CACHE_DIR", str(tmp_path))
+        token_cache = cache.TokenCache()
+        token_cache.initialize("test")
+        assert token_cache.saved_at() is None
+        token_cache.save({})
+        assert token_cache.saved_at() == (tmp_path / "test_cache.p").stat().st_mtime
+
+    def test_discovery_checkpoint(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(cache, "CACHE_DIR", str(tmp_path))
+        checkpoint = cache.DiscoveryCheckpoint("cm_test")
+        assert checkpoint.load() == {}
+        checkpoint.save(b"\x00", ["mint_1", "mint_2"])
+        checkpoint.save(b"\xff", [])
+
+        # A write that was cut off isn't taken as a finished partition
+        (tmp_path / "cm_test_discovery" / "01.tmp").write_bytes(b"partial")
+        assert cache.DiscoveryCheckpoint("cm_test").load() == {
+            b"\x00": ["mint_1", "mint_2"],
+            b"\xff": [],
+        }
+        checkpoint.clear()
+        assert not (tmp_path / "cm_test_discovery").exists()
+        # Clearing again (e.g. by another process) isn't an error
+        checkpoint.clear()
@@ -0,0 +1,41 @@
+import pytest
+
+from util import columnar
+from util import output
+from util.token import Token
+
+
+class TestColumnar:
+    def test_is_columnar(self):
+        assert columnar.is_columnar("snapshot.parquet")
+        assert columnar.is_columnar("snapshot.arrow")
+        assert not columnar.is_columnar("snapshot.csv")
+        assert not columnar.is_columnar("snapshot.csv.gz")
+
+    def test_write_columnar_snapshot_row_groups(self, tmp_path):
+        ipc = pytest.importorskip("pyarrow.ipc")
+        input_dict = {
+            f"token_addr_{i}": Token(token=f"token_addr_{i}", traits={"Trait1": f"Value{i % 3}"})
+            for i in range(5)
+        }
+        vocabulary = output.rank_collection(input_dict)
+        test_outfile = tmp_path / "outfile.arrow"
+        columnar.write_columnar_snapshot(
+            str(test_outfile), input_dict, vocabulary, row_group_size=2
+        )
+        with ipc.open_file(test_outfile) as reader:
+            assert reader.num_record_batches == 3
+            table = reader.read_all()
+        assert table.column("Trait1").to_pylist() == [f"Value{i % 3}" for i in range(5)]
+
+    def test_snapshot_schema(self):
+        pytest.importorskip("pyarrow")
+        input_dict = {"token_1": Token(token="token_1", traits={"Trait1": "Value1"})}
+        vocabulary = output.rank_collection(input_dict, ["trait_count"])
+        schema = columnar.snapshot_schema(vocabulary, ["trait_count"], {"slot": None})
+        assert schema.names[-3:] == ["TraitCount", "TraitCountRank", "Trait1"]
+        assert (
+            str(schema.field("Trait1").type)
+            == "dictionary<values=string, indices=int32, ordered=0>"
+        )
+        assert schema.metadata == {b"slot": b"null"}
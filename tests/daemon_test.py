@@ -0,0 +1,33 @@
+import pickle
+
+from util import daemon
+
+
+class TestDaemon:
+    def test_daemon_state(self):
+        intervals = {"holders": 60, "metadata": 3600, "snapshot": None}
+        state = daemon.DaemonState()
+        # Everything is due the first time
+        assert state.due(intervals, 10000) == ["holders", "metadata"]
+        assert state.next_due(intervals) == 60
+
+        state.mark("holders", 10000)
+        state.mark("metadata", 10000)
+        assert state.due(intervals, 10030) == []
+        assert state.due(intervals, 10060) == ["holders"]
+        assert state.next_due(intervals) == 10060
+        assert state.next_due({"snapshot": None}) is None
+
+    def test_daemon_state_persists(self):
+        state = daemon.DaemonState()
+        state.mark("holders", 1000)
+        state.last_snapshot = "snapshot.csv"
+        loaded = pickle.loads(pickle.dumps(state))
+        assert loaded.last_run == {"holders": 1000}
+        assert loaded.last_snapshot == "snapshot.csv"
+
+    def test_timestamped_name(self):
+        assert daemon.timestamped_name("mf_snapshot.csv", 0) == "mf_snapshot_19700101T000000Z.csv"
+        assert daemon.timestamped_name("out/mf.csv.gz", 3600) == "out/mf_19700101T010000Z.csv.gz"
+        assert daemon.timestamped_name("mf_{timestamp}.parquet", 0) == "mf_19700101T000000Z.parquet"
+        assert daemon.timestamped_name("snapshot", 0) == "snapshot_19700101T000000Z"
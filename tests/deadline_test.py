@@ -0,0 +1,58 @@
+from util import deadline
+from util.token import Token
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestDeadline:
+    def test_deadline(self):
+        clock = FakeClock()
+        run_deadline = deadline.Deadline(60, clock=clock)
+        assert run_deadline.remaining() == 60
+        assert run_deadline.stage_budget(3) == 20
+        assert not run_deadline.expired()
+
+        clock.now += 45
+        assert run_deadline.stage_budget(1) == 15
+        clock.now += 30
+        assert run_deadline.remaining() == 0
+        assert run_deadline.expired()
+
+    def test_fill_from_stale(self):
+        input_dict = {
+            "1": Token(token="1", name="One", holder_address="wallet_1"),
+            "2": Token(token="2", name="Two"),
+            "3": Token(token="3"),
+            "4": Token(token="4"),
+        }
+        stale_tokens = {
+            "2": Token(token="2", name="Old Two", holder_address="wallet_2", amount=1),
+            "3": Token(token="3", holder_address="wallet_3"),
+        }
+        stale_tokens["2"].holder_slot = 5
+
+        result = deadline.fill_from_stale(input_dict, {"name", "holder_address"}, stale_tokens)
+        assert result == (1, 2)
+        assert input_dict["1"].data_status is None
+        # Only the fields that were missing are filled in
+        assert input_dict["2"].name == "Two"
+        assert input_dict["2"].holder_address == "wallet_2"
+        assert input_dict["2"].amount == 1
+        assert input_dict["2"].holder_slot == 5
+        assert input_dict["2"].data_status == deadline.STALE
+        # Token 3 has a stale holder but no name to fall back on
+        assert input_dict["3"].holder_address == "wallet_3"
+        assert input_dict["3"].data_status == deadline.MISSING
+        assert input_dict["4"].data_status == deadline.MISSING
+
+    def test_fill_from_stale_keeps_missing(self):
+        input_dict = {"1": Token(token="1")}
+        deadline.fill_from_stale(input_dict, {"holder_address"})
+        deadline.fill_from_stale(input_dict, {"name"}, {"1": Token(token="1", name="One")})
+        assert input_dict["1"].data_status == deadline.MISSING
@@ -0,0 +1,114 @@
+import csv
+import gzip
+import json
+
+import pytest
+
+from util import diff
+from util import output
+from util.token import Token
+
+
+def make_row(token, holder, **traits):
+    row = {
+        "Number": token[-1],
+        "TokenName": f"Token #{token[-1]}",
+        "Token": token,
+        "HolderAddress": holder,
+        "TotalHeld": "1",
+        "Image": "",
+        "Rank": "1",
+        "Rarity": "50.00000000000000000000%",
+    }
+    row.update(traits)
+    return row
+
+
+class TestDiff:
+    def test_diff_snapshots(self):
+        old_rows = [
+            make_row("token_1", "wallet_1", Hat="Cap"),
+            make_row("token_2", "wallet_2", Hat="Crown"),
+            make_row("token_3", "wallet_3", Hat="Cap"),
+        ]
+        new_rows = [
+            dict(make_row("token_1", "wallet_2", Hat="Cap"), Rank="2"),
+            make_row("token_2", "wallet_2", Hat="Beanie"),
+            make_row("token_4", "wallet_4", Hat="Cap"),
+        ]
+        changes = list(diff.diff_snapshots(old_rows, new_rows))
+        assert [(c["change"], c["token"], c["field"], c["old"], c["new"]) for c in changes] == [
+            ("transfer", "token_1", "HolderAddress", "wallet_1", "wallet_2"),
+            ("trait", "token_2", "Hat", "Crown", "Beanie"),
+            ("new", "token_4", "", "", "wallet_4"),
+            ("burned", "token_3", "", "wallet_3", ""),
+        ]
+
+    def test_diff_snapshots_ignores_derived_columns(self):
+        old_rows = [dict(make_row("token_1", "wallet_1"), RarityScore="2.0", RarityScoreRank="1")]
+        new_rows = [dict(make_row("token_1", "wallet_1"), Rank="5", Rarity="10.0%")]
+        assert list(diff.diff_snapshots(old_rows, new_rows)) == []
+
+    def test_diff_snapshots_new_trait_type(self):
+        old_rows = [make_row("token_1", "wallet_1", Hat="Cap")]
+        new_rows = [dict(make_row("token_1", "wallet_1", Hat="Cap"), Eyes="Laser", TokenName="x")]
+        changes = list(diff.diff_snapshots(old_rows, new_rows))
+        assert [(c["change"], c["field"], c["old"], c["new"]) for c in changes] == [
+            ("metadata", "TokenName", "Token #1", "x"),
+            ("trait", "Eyes", "", "Laser"),
+        ]
+
+    def test_read_snapshot_round_trip(self, tmp_path):
+        input_dict = {
+            "token_addr_1": Token(token="token_addr_1", holder_address="owner_1", amount=1),
+            "token_addr_2": Token(token="token_addr_2", traits={"Trait1": "Value1"}),
+        }
+        test_snapshot = tmp_path / "snapshot.csv.gz"
+        output.holder_snapshot(input_dict, str(test_snapshot))
+        rows = list(diff.read_snapshot(str(test_snapshot)))
+        assert rows == list(diff.token_snapshot(input_dict))
+        assert rows[0]["HolderAddress"] == "owner_1"
+        assert rows[1]["Trait1"] == "Value1"
+        assert "" not in rows[0]
+
+    def test_read_snapshot_parquet(self, tmp_path):
+        pytest.importorskip("pyarrow")
+        input_dict = {
+            "token_addr_1": Token(token="token_addr_1", amount="1", traits={"Trait1": "Value1"}),
+            "token_addr_2": Token(token="token_addr_2", amount="1", traits={"Trait1": "Value2"}),
+        }
+        csv_snapshot = tmp_path / "snapshot.csv"
+        parquet_snapshot = tmp_path / "snapshot.parquet"
+        output.holder_snapshot(input_dict, str(csv_snapshot))
+        output.holder_snapshot(input_dict, str(parquet_snapshot))
+        changes = diff.diff_snapshots(
+            diff.read_snapshot(str(csv_snapshot)), diff.read_snapshot(str(parquet_snapshot))
+        )
+        assert list(changes) == []
+
+    def test_write_changes_csv(self, tmp_path):
+        changes = diff.diff_snapshots([], [make_row("token_1", "wallet_1")])
+        test_outfile = tmp_path / "changes.csv"
+        assert diff.write_changes(changes, str(test_outfile)) == 1
+        rows = list(csv.reader(test_outfile.open()))
+        assert rows == [diff.DIFF_COLUMNS, ["new", "token_1", "Token #1", "", "", "wallet_1"]]
+
+    def test_write_changes_json(self, tmp_path):
+        changes = diff.diff_snapshots([make_row("token_1", "wallet_1")], [])
+        test_outfile = tmp_path / "changes.json.gz"
+        assert diff.write_changes(changes, str(test_outfile), "json") == 1
+        with gzip.open(test_outfile, "rt") as infile:
+            assert json.load(infile) == [
+                {
+                    "change": "burned",
+                    "token": "token_1",
+                    "name": "Token #1",
+                    "field": "",
+                    "old": "wallet_1",
+                    "new": "",
+                }
+            ]
+
+    def test_write_changes_unknown_format(self):
+        with pytest.raises(ValueError):
+            diff.write_changes([], "-", "xml")
@@ -0,0 +1,41 @@
+import numpy
+import pytest
+
+from util import distribution
+
+
+class TestDistribution:
+    def test_holder_distribution(self):
+        counts = {"wallet_1": 1, "wallet_2": 2, "wallet_3": 7, "market": 10, "": 5, None: 1}
+        result = distribution.holder_distribution(26, counts, {"market": "MagicEden"})
+        assert result["tokens"] == 26
+        assert result["holders"] == 4
+        assert result["tokens_held"] == 20
+        assert result["unique_holder_ratio"] == pytest.approx(4 / 26)
+        assert result["mean"] == 5.0
+        assert result["median"] == 4.5
+        assert result["max"] == 10
+        assert result["concentration"] == {"top_1": 0.5, "top_10": 1.0, "top_100": 1.0}
+        assert result["marketplaces"] == {"listed": {"MagicEden": 10}, "listed_share": 10 / 26}
+        assert result["histogram"] == [
+            {"bucket": "1", "wallets": 1, "tokens": 1},
+            {"bucket": "2", "wallets": 1, "tokens": 2},
+            {"bucket": "3-5", "wallets": 0, "tokens": 0},
+            {"bucket": "6-10", "wallets": 2, "tokens": 17},
+            {"bucket": "11-25", "wallets": 0, "tokens": 0},
+            {"bucket": "26-50", "wallets": 0, "tokens": 0},
+            {"bucket": "51-100", "wallets": 0, "tokens": 0},
+            {"bucket": "101+", "wallets": 0, "tokens": 0},
+        ]
+
+    def test_holder_distribution_empty(self):
+        result = distribution.holder_distribution(0, {})
+        assert result["holders"] == 0
+        assert result["gini"] == 0.0
+        assert result["concentration"]["top_1"] == 0.0
+        assert result["marketplaces"]["listed_share"] == 0.0
+
+    def test_gini(self):
+        assert distribution.gini(numpy.array([5, 5, 5, 5])) == 0.0
+        assert distribution.gini(numpy.array([0, 0, 0, 10])) == pytest.approx(0.75)
+        assert distribution.gini(numpy.array([1, 2, 3])) == pytest.approx(2 / 9)
@@ -0,0 +1,72 @@
+import pytest
+
+from util import freshness
+from util.token import Token
+
+
+class TestFreshness:
+    def test_stamp_fetched(self):
+        tokens = [Token(token="1", name="One"), Token(token="2")]
+        freshness.stamp_fetched(tokens, "accounts", 1000)
+        assert tokens[0].fetched_at == {"accounts": 1000}
+        assert tokens[1].fetched_at == {}
+
+    def test_data_as_of(self):
+        input_dict = {
+            "1": Token(token="1", name="One", holder_address="wallet_1"),
+            "2": Token(token="2", name="Two"),
+            "3": Token(token="3"),
+        }
+        input_dict["1"].fetched_at = {"accounts": 2000, "holders": 3000}
+        assert freshness.data_as_of(input_dict, {"holder_address"}) == 3000
+        assert freshness.data_as_of(input_dict, {"holder_address", "name"}) == 2000
+        # Token 2's name was cached before fetch times were recorded
+        assert freshness.data_as_of(input_dict, {"name"}, default=500) == 500
+        assert freshness.data_as_of(input_dict, {"traits"}) is None
+
+    def test_format_data_age(self):
+        assert freshness.format_data_age(0, now=5400) == "1970-01-01T00:00:00+00:00 (1:30:00 old)"
+        assert freshness.format_data_age(None) == "unknown"
+
+    @pytest.mark.asyncio
+    async def test_revalidation(self):
+        input_dict = {
+            "1": Token(token="1", token_account="account_1", holder_address="old_1", name="One"),
+            "2": Token(token="2", token_account="account_2", holder_address="old_2", name="Two"),
+        }
+        calls = []
+
+        async def fetch_stages(stage_names, all_tokens):
+            calls.append((stage_names, set(all_tokens)))
+            # The stages being refreshed start out empty; the rest are left as they were
+            assert all_tokens["1"].token_account is None
+            assert all_tokens["1"].holder_address is None
+            assert all_tokens["1"].name == "One"
+            all_tokens["1"].token_account = "account_3"
+            all_tokens["1"].holder_address = "new_1"
+            freshness.stamp_fetched([all_tokens["1"]], "token_accounts", 1000)
+            freshness.stamp_fetched([all_tokens["1"]], "holders", 1000)
+
+        revalidation = freshness.Revalidation(input_dict, {"holder_address"}, fetch_stages)
+        assert revalidation.stage_names == ["token_accounts", "holders"]
+        revalidation.start()
+        assert await revalidation.wait() == 1
+        assert calls == [(["token_accounts", "holders"], {"1", "2"})]
+        assert input_dict["1"].token_account == "account_3"
+        assert input_dict["1"].holder_address == "new_1"
+        assert input_dict["1"].fetched_at == {"token_accounts": 1000, "holders": 1000}
+        # Token 2 couldn't be refreshed, so keeps its cached data
+        assert input_dict["2"].holder_address == "old_2"
+        assert input_dict["2"].fetched_at == {}
+
+    @pytest.mark.asyncio
+    async def test_revalidation_error_keeps_cached_data(self):
+        input_dict = {"1": Token(token="1", name="One", image="image_1")}
+
+        async def fetch_stages(stage_names, all_tokens):
+            raise ValueError("network down")
+
+        revalidation = freshness.Revalidation(input_dict, {"traits"}, fetch_stages).start()
+        assert await revalidation.wait() == 0
+        assert isinstance(revalidation.error, ValueError)
+        assert input_dict["1"].image == "image_1"
@@ -0,0 +1,80 @@
+import pytest
+
+from util.deadline import MISSING
+from util.deadline import STALE
+from util.history import HolderHistory
+from util.token import Token
+
+
+def holders(**holder_addresses):
+    return {
+        mint: Token(token=mint, holder_address=holder_address)
+        for mint, holder_address in holder_addresses.items()
+    }
+
+
+class TestHolderHistory:
+    def test_record_stores_only_changes(self):
+        history = HolderHistory()
+        assert history.record(holders(a="wallet_1", b="wallet_2"), 100, slot=1) == 2
+        assert history.record(holders(a="wallet_1", b="wallet_2"), 200, slot=2) == 0
+        assert history.record(holders(a="wallet_2", b="wallet_2"), 300, slot=3) == 1
+        assert len(history) == 3
+        assert history.snapshots == [(100, 1), (200, 2), (300, 3)]
+        assert history.history("a") == [(100, "wallet_1"), (300, "wallet_2")]
+        assert history.history("b") == [(100, "wallet_2")]
+        assert history.wallets == ["wallet_1", "wallet_2"]
+
+    def test_record_burned(self):
+        history = HolderHistory()
+        history.record(holders(a="wallet_1", b="wallet_2"), 100)
+        assert history.record(holders(a="wallet_1"), 200) == 1
+        assert history.history("b") == [(100, "wallet_2"), (200, None)]
+        assert history.holding_durations("wallet_2") == {}
+        # A token that never had a holder isn't stored at all
+        assert history.record(holders(a="wallet_1", c=""), 300) == 0
+        assert "c" not in history.times
+
+    def test_record_skips_flagged_tokens(self):
+        history = HolderHistory()
+        history.record(holders(a="wallet_1", b="wallet_2"), 100)
+        partial = holders(a="", b="wallet_3")
+        partial["a"].data_status = MISSING
+        partial["b"].data_status = STALE
+        assert history.record(partial, 200) == 0
+        assert history.history("a") == [(100, "wallet_1")]
+        assert history.history("b") == [(100, "wallet_2")]
+
+    def test_record_out_of_order(self):
+        history = HolderHistory()
+        history.record(holders(a="wallet_1"), 200)
+        with pytest.raises(ValueError):
+            history.record(holders(a="wallet_1"), 100)
+
+    def test_holder_at(self):
+        history = HolderHistory()
+        history.record(holders(a="wallet_1"), 100)
+        history.record(holders(a="wallet_2"), 200)
+        assert history.holder_at("a", 50) is None
+        assert history.holder_at("a", 100) == "wallet_1"
+        assert history.holder_at("a", 199) == "wallet_1"
+        assert history.holder_at("a", 500) == "wallet_2"
+        assert history.holder_at("missing", 500) is None
+
+    def test_holders_at(self):
+        history = HolderHistory()
+        history.record(holders(a="wallet_1", b="wallet_1"), 100)
+        history.record(holders(a="wallet_2"), 200)
+        assert history.holders_at(150) == {"a": "wallet_1", "b": "wallet_1"}
+        assert history.holders_at(250) == {"a": "wallet_2"}
+
+    def test_holding_durations(self):
+        history = HolderHistory()
+        history.record(holders(a="wallet_1"), 100)
+        history.record(holders(a="wallet_1", b="wallet_1"), 200)
+        history.record(holders(a="wallet_1", b="wallet_2"), 300)
+        history.record(holders(a="wallet_1", b="wallet_2"), 400)
+        assert history.holding_durations("wallet_1") == {"a": 300}
+        assert history.holding_durations("wallet_2") == {"b": 100}
+        assert history.holding_durations("wallet_2", 1000) == {"b": 700}
+        assert history.holding_durations("unknown") == {}
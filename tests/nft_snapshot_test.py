@@ -1,203 +1,625 @@
+import datetime
+import json
+import sys
+from argparse import ArgumentTypeError
+from pathlib import Path
+
 import mock
 import pytest
 from aiolimiter import AsyncLimiter
 
 import nft_snapshot
-from util import http_helpers as hh
+from util import cache
 from util import solana_helpers as sh
+from util.daemon import DaemonState
+from util.history import HolderHistory
+from util.render import TextRenderer
 from util.token import Token
 
 
-class TestNftSnapshot:
-    def test_main_token_list(self, mocker):
-        input_dict = {"1": Token(token="1"), "2": Token(token="2"), "3": Token(token="3")}
-        tc_mock = mocker.patch.object(nft_snapshot, "token_cache")
-        tc_mock.load.return_value = input_dict
-        wtl_mock = mocker.patch.object(nft_snapshot, "write_token_list")
+@pytest.fixture
+def session_args(monkeypatch, tmp_path):
+    monkeypatch.setattr(cache, "CACHE_DIR", str(tmp_path / "cache"))
+    token_file = tmp_path / "tokens.txt"
+    token_file.write_text("1\n2\n3")
+    return str(token_file), {"solana": None, "http": None}
+
+
+@pytest.fixture
+def fake_fetches(mocker):
+    async def fetch_account(client, token, limiter, pool=None):
+        token.name = f"#{token.token}"
+        token.data_uri = "uri"
+
+    async def fetch_token_account(client, token, limiter):
+        token.token_account = f"account_{token.token}"
+
+    async def fetch_holders(client, all_tokens, owner_accounts, chunk, limiter):
+        for account in chunk:
+            for mint in owner_accounts[account]:
+                all_tokens[mint].holder_address = "wallet_2" if mint == "3" else "wallet_1"
+                all_tokens[mint].amount = "1"
+
+    mocker.patch.object(nft_snapshot.sh, "get_token_account_from_solana_async", fetch_token_account)
+    mocker.patch.object(nft_snapshot.sh, "get_holder_chunk_from_solana_async", fetch_holders)
+    mocker.patch.object(nft_snapshot.sh, "get_account_info_from_solana_async", fetch_account)
 
-        sh_mock = mocker.patch.object(nft_snapshot, "sh")
-        sh_mock.get_token_list_from_candymachine_id.return_value = ["12345"]
 
-        nft_snapshot.main(
-            True, False, False, False, False, "test_cm", "", False, "outfile", "tokenfile", False
+class TestNftSnapshot:
+    @pytest.mark.asyncio
+    async def test_main_token_list(self, mocker, session_args):
+        token_file, clients = session_args
+        sources_mock = mocker.patch.object(nft_snapshot.sh, "get_token_list_from_sources")
+        sources_mock.return_value = ["12345"]
+        session = nft_snapshot.SnapshotSession(
+            token_file, "test_cm", clients=clients, collections=["mint_1"]
         )
-        sh_mock.get_token_list_from_candymachine_id.assert_called_once_with("test_cm", False)
-        wtl_mock.assert_called_once_with("tokenfile", ["12345"])
 
-    def test_main_holder_list(self, mocker):
-        input_dict = {"1": Token(token="1"), "2": Token(token="2"), "3": Token(token="3")}
-        tc_mock = mocker.patch.object(nft_snapshot.token_cache, "load")
-        tc_mock.return_value = input_dict
-        rtl_mock = mocker.patch.object(nft_snapshot, "read_token_list")
-        rtl_mock.return_value = ["1", "2", "3"]
+        await nft_snapshot.main(session, True, False, False, False, False)
+        sources_mock.assert_called_once_with([("cmid", "test_cm"), ("collection", "mint_1")], None)
+        assert nft_snapshot.read_token_list(token_file) == ["12345"]
+        assert set(session.all_tokens) == {"12345"}
+
+    @pytest.mark.asyncio
+    async def test_main_editions(self, mocker, session_args, fake_fetches):
+        token_file, clients = session_args
+        holder_counts_mock = mocker.patch.object(nft_snapshot, "holder_counts")
+
+        async def fetch_editions(client, all_tokens, chunk, limiter, pool=None):
+            for mint in chunk:
+                all_tokens[mint].edition = "print" if mint == "3" else "master"
+
+        mocker.patch.object(nft_snapshot.sh, "get_edition_chunk_from_solana_async", fetch_editions)
+        session = nft_snapshot.SnapshotSession(token_file, clients=clients, editions=["master"])
+
+        await nft_snapshot.main(session, False, True, False, False, False)
+        assert session.populated == {"token_accounts", "holders", "editions"}
+        report_tokens, report_index = holder_counts_mock.call_args[0][:2]
+        assert set(report_tokens) == {"1", "2"}
+        assert report_index.top() == [("wallet_1", 2)]
+        # The saved index still covers every token
+        assert session.cache.load_extra("wallets").top() == [("wallet_1", 2), ("wallet_2", 1)]
 
-        pop_holders_mock = mocker.patch.object(nft_snapshot, "populate_holders_details_async")
+    def test_discovery_sources(self):
+        assert nft_snapshot.discovery_sources("test_cm", True) == [("cmv2", "test_cm")]
+        assert nft_snapshot.discovery_sources(None, False, ["mint_1"], ["creator_1"]) == [
+            ("collection", "mint_1"),
+            ("creator", "creator_1"),
+        ]
+        assert nft_snapshot.discovery_sources() == []
+
+    @pytest.mark.asyncio
+    async def test_main_holder_list(self, mocker, session_args, fake_fetches):
+        token_file, clients = session_args
         holders_mock = mocker.patch.object(nft_snapshot, "holder_counts")
+        session = nft_snapshot.SnapshotSession(token_file, clients=clients)
 
-        nft_snapshot.main(
-            False, True, False, False, False, "test_cm", "", False, "outfile", "tokenfile", False
-        )
-        rtl_mock.assert_called_once_with("tokenfile")
-        pop_holders_mock.assert_called_once_with(input_dict)
-        holders_mock.assert_called_once_with(input_dict)
-
-    def test_main_attributes(self, mocker):
-        input_dict = {"1": Token(token="1"), "2": Token(token="2"), "3": Token(token="3")}
-        tc_mock = mocker.patch.object(nft_snapshot.token_cache, "load")
-        tc_mock.return_value = input_dict
-        rtl_mock = mocker.patch.object(nft_snapshot, "read_token_list")
-        rtl_mock.return_value = ["1", "2", "3"]
-
-        pop_accts_mock = mocker.patch.object(nft_snapshot, "populate_account_details_async")
+        await nft_snapshot.main(session, False, True, False, False, False)
+        assert session.populated == {"token_accounts", "holders"}
+        holders_mock.assert_called_once_with(session.all_tokens, mock.ANY, None, mock.ANY, None)
+        wallet_index, _, renderer = holders_mock.call_args[0][1:4]
+        assert wallet_index.top() == [("wallet_1", 2), ("wallet_2", 1)]
+        assert isinstance(renderer, TextRenderer)
+        # The fetched data was saved to the session's cache
+        assert session.cache.load()["3"].holder_address == "wallet_2"
+
+    @pytest.mark.asyncio
+    async def test_main_attributes(self, mocker, session_args):
+        token_file, clients = session_args
         attrs_mock = mocker.patch.object(nft_snapshot, "attribute_distribution")
+        session = nft_snapshot.SnapshotSession(token_file, clients=clients)
+        populate_mock = mocker.patch.object(session, "populate")
 
-        nft_snapshot.main(
-            False, False, True, False, False, "test_cm", "", False, "outfile", "tokenfile", False
-        )
-        rtl_mock.assert_called_once_with("tokenfile")
-        pop_accts_mock.assert_called_once_with(input_dict)
-        attrs_mock.assert_called_once_with(input_dict)
-
-    def test_main_snapshot(self, mocker):
-        input_dict = {"1": Token(token="1"), "2": Token(token="2"), "3": Token(token="3")}
-        tc_mock = mocker.patch.object(nft_snapshot.token_cache, "load")
-        tc_mock.return_value = input_dict
-        rtl_mock = mocker.patch.object(nft_snapshot, "read_token_list")
-        rtl_mock.return_value = ["1", "2", "3"]
-
-        pop_holders_mock = mocker.patch.object(nft_snapshot, "populate_holders_details_async")
-        pop_accts_mock = mocker.patch.object(nft_snapshot, "populate_account_details_async")
-        snap_mock = mocker.patch.object(nft_snapshot.output, "holder_snapshot")
-
-        nft_snapshot.main(
-            False, False, False, True, False, "test_cm", "", False, "outfile", "tokenfile", False
+        await nft_snapshot.main(session, False, False, True, False, False)
+        populate_mock.assert_awaited_once_with("attributes")
+        attrs_mock.assert_called_once_with(session.all_tokens, mock.ANY, None)
+
+    @pytest.mark.asyncio
+    async def test_main_snapshot(self, mocker, session_args):
+        token_file, clients = session_args
+        snapshot_mock = mocker.patch.object(nft_snapshot, "write_snapshot")
+        session = nft_snapshot.SnapshotSession(token_file, "test_cm", clients=clients)
+        populate_mock = mocker.patch.object(session, "populate")
+
+        await nft_snapshot.main(session, False, False, False, True, False, None, "outfile")
+        populate_mock.assert_awaited_once_with("snapshot")
+        snapshot_mock.assert_called_once_with(
+            session.all_tokens, "outfile", (), "test_cm", session.cache, session.all_tokens
         )
-        rtl_mock.assert_called_once_with("tokenfile")
-        pop_holders_mock.assert_called_once_with(input_dict)
-        pop_accts_mock.assert_called_once_with(input_dict)
-        snap_mock.assert_called_once_with(input_dict, "outfile")
-
-    def test_main_rarity(self, mocker):
-        input_dict = {"1": Token(token="1"), "2": Token(token="2"), "3": Token(token="3")}
-        tc_mock = mocker.patch.object(nft_snapshot.token_cache, "load")
-        tc_mock.return_value = input_dict
-        rtl_mock = mocker.patch.object(nft_snapshot, "read_token_list")
-        rtl_mock.return_value = ["1", "2", "3"]
-
-        pop_holders_mock = mocker.patch.object(nft_snapshot, "populate_holders_details_async")
-        pop_accts_mock = mocker.patch.object(nft_snapshot, "populate_account_details_async")
-        rarity_mock = mocker.patch.object(nft_snapshot.output, "format_token_rarity")
-
-        nft_snapshot.main(
-            False,
-            False,
-            False,
-            False,
-            True,
-            "test_cm",
-            "token_val",
-            False,
-            "outfile",
-            "tokenfile",
-            False,
+
+    @pytest.mark.asyncio
+    async def test_main_rarity(self, mocker, session_args):
+        token_file, clients = session_args
+        rarity_mock = mocker.patch.object(nft_snapshot.output, "write_token_rarity")
+        index_mock = mocker.patch.object(nft_snapshot, "update_rarity_index")
+        session = nft_snapshot.SnapshotSession(token_file, clients=clients)
+        populate_mock = mocker.patch.object(session, "populate")
+
+        await nft_snapshot.main(session, False, False, False, False, True, "token_val")
+        populate_mock.assert_awaited_once_with("rarity")
+        index_mock.assert_called_once_with(session.all_tokens, session.cache, ())
+        rarity_mock.assert_called_once_with(
+            mock.ANY, "token_val", session.all_tokens, (), index_mock.return_value
         )
-        rtl_mock.assert_called_once_with("tokenfile")
-        pop_holders_mock.assert_called_once_with(input_dict)
-        pop_accts_mock.assert_called_once_with(input_dict)
-        rarity_mock.assert_called_once_with("token_val", input_dict)
-
-    def test_main_rarity_no_token_raises(self, mocker):
-        input_dict = {"1": Token(token="1"), "2": Token(token="2"), "3": Token(token="3")}
-        tc_mock = mocker.patch.object(nft_snapshot.token_cache, "load")
-        tc_mock.return_value = input_dict
-        rtl_mock = mocker.patch.object(nft_snapshot, "read_token_list")
-        rtl_mock.return_value = ["1", "2", "3"]
+
+    @pytest.mark.asyncio
+    async def test_main_rarity_no_token_raises(self, mocker, session_args):
+        token_file, clients = session_args
+        session = nft_snapshot.SnapshotSession(token_file, clients=clients)
+        mocker.patch.object(session, "populate")
 
         with pytest.raises(ValueError):
-            nft_snapshot.main(
-                False,
-                False,
-                False,
-                False,
-                True,
-                "test_cm",
-                "",
-                False,
-                "outfile",
-                "tokenfile",
-                False,
+            await nft_snapshot.main(session, False, False, False, False, True, "")
+
+    @pytest.mark.asyncio
+    async def test_main_bust_cache(self, session_args):
+        token_file, clients = session_args
+        session = nft_snapshot.SnapshotSession(token_file, clients=clients, bust_cache=True)
+        session.cache.save({"1": Token(token="1", holder_address="wallet_1")})
+
+        await nft_snapshot.main(session, False, False, False, False, False)
+        assert session.cache.load() == {}
+        assert session.all_tokens["1"].holder_address is None
+
+    @pytest.mark.asyncio
+    async def test_main_explain(self, mocker, session_args, capsys):
+        token_file, clients = session_args
+        Path(token_file).write_text("1\n2")
+        session = nft_snapshot.SnapshotSession(token_file, clients=clients)
+        session.cache.save({"1": Token(token="1", holder_address="wallet_1")})
+        populate_mock = mocker.patch.object(session, "populate")
+
+        await nft_snapshot.main(session, False, True, False, False, False, explain=True)
+        populate_mock.assert_not_called()
+        result = capsys.readouterr().out
+        assert "Fields needed: holder_address\n" in result
+        assert "token_accounts: 2 tokens, 2 requests" in result
+        assert "holders: 1 tokens, 1 requests" in result
+        assert "Total requests: 3\n" in result
+
+    @pytest.mark.asyncio
+    async def test_populate(self, mocker, session_args):
+        token_file, clients = session_args
+        Path(token_file).write_text("1\n2")
+        session = nft_snapshot.SnapshotSession(token_file, clients=clients)
+        session.cache.save(
+            {
+                "1": Token(token="1", token_account="account_1"),
+                "2": Token(token="2", name="Two"),
+            }
+        )
+        stage_mock = mocker.patch.object(nft_snapshot, "fetch_stage_async", return_value=0)
+        save_spy = mocker.spy(session.cache, "save")
+
+        async with session:
+            await session.discover()
+            assert await session.populate("holder_counts", "wallet") == 0
+            stage_names = [call[0][2] for call in stage_mock.call_args_list]
+            assert stage_names == ["token_accounts", "holders", "accounts"]
+            assert session.populated == {"token_accounts", "holders", "accounts"}
+            # The cache is saved after each stage
+            assert save_spy.call_count == 3
+
+            # Stages that already ran aren't run again
+            await session.populate("holder_counts")
+            assert stage_mock.call_count == 3
+
+    @pytest.mark.asyncio
+    async def test_populate_with_deadline(self, mocker, session_args):
+        token_file, clients = session_args
+        Path(token_file).write_text("1\n2")
+        session = nft_snapshot.SnapshotSession(
+            token_file, clients=clients, bust_cache=True, deadline=30
+        )
+        session.cache.save({"1": Token(token="1", token_account="account_1", holder_address="old")})
+        clock = mock.Mock(return_value=0.0)
+
+        async def fetch_stage(name, all_tokens, stage_name, *args):
+            # The first stage uses up all the time
+            clock.return_value = 30.0
+            all_tokens["2"].token_account = "account_2"
+            return 0
+
+        stage_mock = mocker.patch.object(nft_snapshot, "fetch_stage_async", side_effect=fetch_stage)
+
+        async with session:
+            # The busted cache's data is kept to fall back on
+            assert session.all_tokens == {}
+            session.deadline = nft_snapshot.Deadline(30, session.deadline.stale_tokens, clock=clock)
+            await session.discover()
+            await session.populate("holder_counts")
+        # Two stages were planned, so the first gets half the time
+        stage_mock.assert_called_once_with(
+            "tokens",
+            session.all_tokens,
+            "token_accounts",
+            session.scheduler,
+            clients,
+            session.limiters,
+            15.0,
+        )
+        assert session.populated == {"token_accounts", "holders"}
+        assert session.all_tokens["1"].holder_address == "old"
+        assert session.all_tokens["1"].data_status == "stale"
+        assert session.all_tokens["2"].data_status == "missing"
+
+    @pytest.mark.asyncio
+    async def test_stale_while_revalidate(self, mocker, session_args, capsys):
+        token_file, clients = session_args
+        Path(token_file).write_text("1\n2")
+        input_dict = {
+            "1": Token(token="1", token_account="account_1", holder_address="wallet_1"),
+            "2": Token(token="2", token_account="account_2", holder_address="wallet_1"),
+        }
+        input_dict["1"].fetched_at = {"token_accounts": 0, "holders": 0}
+        session = nft_snapshot.SnapshotSession(token_file, clients=clients)
+        session.cache.save(input_dict)
+        mocker.patch.object(session.cache, "saved_at").return_value = 3600
+        save_mock = mocker.patch.object(session.cache, "save")
+
+        async def refresh(stage_names, all_tokens=None, save=False):
+            # The refresh works on a copy of the tokens, so mustn't save it over the cache
+            assert stage_names == ["token_accounts", "holders"] and not save
+            assert all_tokens is not session.all_tokens
+            for mint, token in all_tokens.items():
+                token.token_account = f"account_{mint}"
+                token.holder_address = "wallet_2"
+                token.fetched_at = {"token_accounts": 7200, "holders": 7200}
+            return 0
+
+        mocker.patch.object(session, "fetch_stages", side_effect=refresh)
+
+        async with session:
+            await session.discover()
+            await nft_snapshot.stale_while_revalidate(
+                session, TextRenderer(sys.stdout), "rerender", "outfile", get_holder_counts=True
             )
+        out = capsys.readouterr().out
+        cached, fresh = out.split("holder_counts data as of 1970-01-01T00:00:00+00:00")
+        assert "wallet_1: 2" in cached
+        assert "wallet_2: 2" in fresh
+        assert "holder_counts data as of 1970-01-01T02:00:00+00:00" in fresh
+        save_mock.assert_called_once_with(session.all_tokens)
+        assert session.all_tokens["2"].holder_address == "wallet_2"
 
-    def test_main_bust_cache(self, mocker):
-        cache_mock = mocker.patch.object(nft_snapshot.token_cache, "save")
-        rtl_mock = mocker.patch.object(nft_snapshot, "read_token_list")
-        rtl_mock.return_value = []
+    @pytest.mark.asyncio
+    async def test_main_revalidate(self, mocker, session_args):
+        token_file, clients = session_args
+        revalidate_mock = mocker.patch.object(nft_snapshot, "stale_while_revalidate")
+        session = nft_snapshot.SnapshotSession(token_file, clients=clients)
+        populate_mock = mocker.patch.object(session, "populate")
 
-        nft_snapshot.main(
-            False, False, False, False, False, "test_cm", "", False, "outfile", "tokenfile", True
+        await nft_snapshot.main(
+            session, False, True, False, False, False, "", "outfile", top=5, revalidate="snapshot"
+        )
+        populate_mock.assert_not_called()
+        revalidate_mock.assert_awaited_once_with(
+            session,
+            mock.ANY,
+            "snapshot",
+            "outfile",
+            get_holder_counts=True,
+            get_attribute_distribution=False,
+            get_rarity=False,
+            token_id="",
+            rarity_models=(),
+            holder_stats=None,
+            top=5,
         )
-        cache_mock.assert_called_once_with({})
 
-    def test_populate_holders_details_async(self, mocker):
-        cache_mock = mocker.patch.object(nft_snapshot.token_cache, "save")
-        fetch_mock = mocker.patch.object(nft_snapshot, "fetch_token_data_from_network_async")
-        holder_mock = mocker.patch.object(nft_snapshot.sh, "get_holder_account_info_from_solana")
+    def test_stage_work(self):
         input_dict = {
-            "token_1": Token(token="token_1"),
-            "token_2": Token(token="token_2"),
-            "token_3": Token(token="token_3"),
+            "1": Token(token="1", token_account="account_1"),
+            "2": Token(token="2", token_account="account_1", name="Two"),
+            "3": Token(token="3", token_account=""),
         }
-        fetch_mock.return_value = input_dict
-        holder_mock.return_value = input_dict
-
-        result = nft_snapshot.populate_holders_details_async(input_dict)
-        fetch_mock.assert_called_once_with(
-            sh.create_solana_client,
-            input_dict,
-            "token_account",
-            sh.get_token_account_from_solana_async,
+        clients = {"solana": mock.Mock(), "http": mock.Mock()}
+        limiters = {"solana": mock.Mock(), "http": mock.Mock()}
+
+        holder_work = nft_snapshot.stage_work("holders", input_dict, clients, limiters)
+        # Tokens sharing a token account share a request
+        assert len(holder_work) == 1
+        assert holder_work[0].func == sh.get_holder_chunk_from_solana_async
+        assert holder_work[0].args[3] == ["account_1"]
+
+        account_work = nft_snapshot.stage_work("accounts", input_dict, clients, limiters)
+        assert [work.args for work in account_work] == [
+            (clients["solana"], input_dict["1"], limiters["solana"]),
+            (clients["solana"], input_dict["3"], limiters["solana"]),
+        ]
+        edition_work = nft_snapshot.stage_work("editions", input_dict, clients, limiters)
+        assert edition_work[0].func == sh.get_edition_chunk_from_solana_async
+        assert edition_work[0].args[2] == ["1", "2", "3"]
+        metadata_work = nft_snapshot.stage_work("metadata", input_dict, clients, limiters)
+        assert metadata_work[0].func == nft_snapshot.get_arweave_metadata
+        assert metadata_work[0].args[0] == clients["http"]
+
+    @pytest.mark.asyncio
+    async def test_batch_collection_async(self, mocker, session_args, fake_fetches):
+        token_file, _ = session_args
+        Path(token_file).write_text("1\n2")
+        token_cache = cache.TokenCache()
+        token_cache.initialize(token_file.split(".")[0])
+        token_cache.save({"1": Token(token="1", token_account="account_1")})
+        save_spy = mocker.spy(nft_snapshot.TokenCache, "save")
+        reports_mock = mocker.patch.object(nft_snapshot, "write_batch_reports")
+        job = nft_snapshot.CollectionJob("test", token_file, reports=("holder_counts",))
+        renderer = mock.Mock()
+
+        async with nft_snapshot.FairScheduler(concurrency=2) as scheduler:
+            result = await nft_snapshot.batch_collection_async(
+                job, scheduler, {"solana": None, "http": None}, {"solana": None}, renderer
+            )
+        assert result["2"].token_account == "account_2"
+        assert {token.holder_address for token in result.values()} == {"wallet_1"}
+        assert set(result["2"].fetched_at) == {"token_accounts", "holders"}
+        assert save_spy.call_count == 2
+        reports_mock.assert_called_once_with(job, mock.ANY, renderer)
+        session = reports_mock.call_args[0][1]
+        assert session.all_tokens is result and session.name == "test"
+
+    def test_write_batch_reports(self, mocker):
+        holder_counts_mock = mocker.patch.object(nft_snapshot, "holder_counts")
+        attributes_mock = mocker.patch.object(nft_snapshot, "attribute_distribution")
+        snapshot_mock = mocker.patch.object(nft_snapshot, "write_snapshot")
+        input_dict = {"1": Token(token="1")}
+        job = nft_snapshot.CollectionJob(
+            "test", "tokens.txt", reports=("holder_counts", "snapshot"), outfile_name="test.csv"
         )
-        holder_mock.assert_called_once_with(input_dict)
-        assert cache_mock.call_count == 2
-        assert result == input_dict
+        renderer = mock.Mock()
+        session = mock.Mock(all_tokens=input_dict, report_tokens=input_dict)
 
-    def test_populate_account_details_async(self, mocker):
-        cache_mock = mocker.patch.object(nft_snapshot.token_cache, "save")
-        fetch_mock = mocker.patch.object(nft_snapshot, "fetch_token_data_from_network_async")
+        nft_snapshot.write_batch_reports(job, session, renderer)
+        holder_counts_mock.assert_called_once_with(
+            input_dict, session.wallet_index.return_value, renderer=renderer, top=None
+        )
+        attributes_mock.assert_not_called()
+        snapshot_mock.assert_called_once_with(
+            input_dict, "test.csv", (), "test", session.cache, input_dict
+        )
+
+    @pytest.mark.asyncio
+    async def test_refresh_holders_async(self, mocker, session_args):
+        token_file, _ = session_args
         input_dict = {
-            "token_1": Token(token="token_1"),
-            "token_2": Token(token="token_2"),
-            "token_3": Token(token="token_3"),
+            "1": Token(token="1", token_account="account_1", holder_address="wallet_1", amount="1"),
+            "2": Token(token="2", token_account="account_2", holder_address="wallet_1", amount="1"),
+            "3": Token(token="3", token_account="account_3", holder_address="wallet_1", amount="1"),
         }
-        fetch_mock.return_value = input_dict
-
-        result = nft_snapshot.populate_account_details_async(input_dict)
-        fetch_mock.assert_has_calls(
-            (
-                mock.call(
-                    sh.create_solana_client,
-                    input_dict,
-                    "name",
-                    sh.get_account_info_from_solana_async,
-                ),
-                mock.call(
-                    hh.create_http_client, input_dict, "image", nft_snapshot.get_arweave_metadata
-                ),
+        # Token 1 has moved on to a new wallet; token 2 has moved to a new token account; token 3 can't be fetched
+        holders = {"account_1": ("wallet_2", "1"), "account_2": ("wallet_1", "0")}
+
+        async def fetch_holders(client, all_tokens, owner_accounts, chunk, limiter):
+            for account in chunk:
+                if account == "account_3":
+                    raise ValueError("timed out")
+                for mint in owner_accounts[account]:
+                    all_tokens[mint].holder_address, all_tokens[mint].amount = holders[account]
+
+        async def fetch_token_account(client, token, limiter):
+            token.token_account = f"new_account_{token.token}"
+            holders[token.token_account] = ("wallet_3", "1")
+
+        mocker.patch.object(
+            nft_snapshot.sh, "holder_chunks", side_effect=lambda a: [[k] for k in a]
+        )
+        mocker.patch.object(nft_snapshot.sh, "get_holder_chunk_from_solana_async", fetch_holders)
+        mocker.patch.object(
+            nft_snapshot.sh, "get_token_account_from_solana_async", fetch_token_account
+        )
+
+        async with nft_snapshot.FairScheduler(concurrency=2) as scheduler:
+            session = nft_snapshot.SnapshotSession(
+                token_file,
+                name="test",
+                clients={"solana": None},
+                limiters={"solana": None},
+                scheduler=scheduler,
+            )
+            session.all_tokens = input_dict
+            save_mock = mocker.patch.object(session.cache, "save")
+            await nft_snapshot.refresh_holders_async(session)
+        assert input_dict["1"].holder_address == "wallet_2"
+        assert input_dict["2"].token_account == "new_account_2"
+        assert input_dict["2"].holder_address == "wallet_3"
+        # Token 3 keeps its cached holder
+        assert input_dict["3"].holder_address == "wallet_1"
+        assert input_dict["3"].amount == "1"
+        assert "holders" not in input_dict["3"].fetched_at
+        # The cleared tokens weren't saved part way through
+        save_mock.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_daemon_cycle_async(self, mocker):
+        input_dict = {
+            "1": Token(
+                token="1",
+                token_account="account_1",
+                holder_address="wallet_1",
+                name="One",
+                id="1",
+                image="image_1",
             )
+        }
+        session = mock.Mock(all_tokens=input_dict, populated={"holders"})
+        session.populate = mock.AsyncMock()
+        state = DaemonState()
+        state.mark("holders", 3600)
+        job = nft_snapshot.CollectionJob(
+            "test",
+            "tokens.txt",
+            reports=("holder_counts", "snapshot"),
+            intervals={"holders": 60, "metadata": None},
+        )
+        collection = nft_snapshot.DaemonCollection(job, session, state)
+        holders_mock = mocker.patch.object(nft_snapshot, "refresh_holders_async")
+        stages_mock = mocker.patch.object(nft_snapshot, "refresh_stages_async")
+        snapshot_mock = mocker.patch.object(nft_snapshot, "daemon_snapshot")
+
+        due = await nft_snapshot.daemon_cycle_async(collection, 3630)
+        # Holders were refreshed recently, so only the first snapshot is due
+        assert due == ["snapshot"]
+        holders_mock.assert_not_called()
+        snapshot_mock.assert_called_once_with(collection, 3630)
+        session.cache.save.assert_not_called()
+        # Whatever failed last cycle is retried
+        assert session.populated == set()
+        session.populate.assert_awaited_with("holder_counts", "snapshot")
+
+        due = await nft_snapshot.daemon_cycle_async(collection, 3660)
+        assert due == ["holders"]
+        holders_mock.assert_called_once_with(session)
+        stages_mock.assert_not_called()
+        session.cache.save.assert_called_once_with(input_dict)
+        assert state.last_run == {"holders": 3660, "snapshot": 3630}
+        session.cache.save_extra.assert_called_with("daemon", state)
+
+    def test_daemon_snapshot(self, mocker, tmp_path):
+        mocker.patch.object(nft_snapshot, "load_history").return_value = HolderHistory()
+        input_dict = {"1": Token(token="1", id="1", holder_address="wallet_1", amount="1")}
+        session = mock.Mock(all_tokens=input_dict, report_tokens=input_dict)
+        session.cache.load_extra.return_value = None
+        job = nft_snapshot.CollectionJob(
+            "test",
+            "tokens.txt",
+            reports=("snapshot",),
+            outfile_name=str(tmp_path / "test.csv"),
+            diff=True,
+        )
+        state = DaemonState()
+        collection = nft_snapshot.DaemonCollection(job, session, state)
+        mocker.patch.object(
+            nft_snapshot, "timestamped_name", side_effect=lambda name, now: f"{name}.{now}"
         )
-        assert cache_mock.call_count == 2
-        assert result == input_dict
+
+        first = nft_snapshot.daemon_snapshot(collection, 0)
+        assert first == str(tmp_path / "test.csv.0")
+        assert state.last_snapshot == first
+
+        input_dict["1"].holder_address = "wallet_2"
+        write_mock = mocker.patch.object(nft_snapshot, "write_changes")
+        second = nft_snapshot.daemon_snapshot(collection, 60)
+        changes = list(write_mock.call_args[0][0])
+        assert write_mock.call_args[0][1] == "test_diff.csv.60"
+        assert [(change["change"], change["old"], change["new"]) for change in changes] == [
+            ("transfer", "wallet_1", "wallet_2")
+        ]
+        assert state.last_snapshot == second
 
     @pytest.mark.asyncio
-    async def test_fetch_token_data_from_network_async(self, mocker):
-        input_token = Token(token="test_token", token_account="")
-        input_dict = {"test_token": input_token}
+    async def test_run_daemon_async(self, mocker, monkeypatch, tmp_path):
+        monkeypatch.setattr(cache, "CACHE_DIR", str(tmp_path))
+        job = nft_snapshot.CollectionJob("test", "tokens.txt", reports=("holder_counts",))
+        collection = nft_snapshot.DaemonCollection(job, mock.Mock(), DaemonState())
+        load_mock = mocker.patch.object(nft_snapshot, "load_daemon_collection")
+        load_mock.return_value = collection
+        mocker.patch.object(nft_snapshot.sh, "create_solana_client", mock.MagicMock())
+        mocker.patch.object(nft_snapshot.hh, "create_http_client", mock.MagicMock())
+        cycle_mock = mocker.patch.object(nft_snapshot, "daemon_cycle_async")
+        cycle_mock.side_effect = [ValueError("RPC down"), []]
+        mocker.patch.object(nft_snapshot, "daemon_sleep").return_value = 0
+
+        result = await nft_snapshot.run_daemon_async([job], cycles=2)
+        assert result == [collection]
+        session = load_mock.call_args[0][1]
+        assert (session.name, session.cache.key) == ("test", "tokens")
+        # A failed cycle doesn't stop the daemon
+        assert cycle_mock.call_count == 2
+
+    def test_serve_collections(self, mocker, monkeypatch, tmp_path):
+        monkeypatch.setattr(cache, "CACHE_DIR", str(tmp_path))
+        run_mock = mocker.patch.object(nft_snapshot, "run_server")
+        job = nft_snapshot.CollectionJob("mf", "mf.txt", rarity_models=("trait_count",))
+
+        nft_snapshot.serve_collections([job], "0.0.0.0", 8000)
+        service, host, port = run_mock.call_args[0]
+        assert (host, port) == ("0.0.0.0", 8000)
+        assert service.caches["mf"].path == tmp_path / "mf_cache.p"
+        assert service.rarity_models == {"mf": ("trait_count",)}
 
-        test_fn = mocker.AsyncMock()
-        result = await nft_snapshot.fetch_token_data_from_network_async(
-            hh.create_http_client, input_dict, "token_account", test_fn
+    def test_cli(self, mocker, monkeypatch, tmp_path):
+        monkeypatch.setattr(cache, "CACHE_DIR", str(tmp_path / "cache"))
+        logging_mock = mocker.patch.object(nft_snapshot, "configure_logging")
+        main_mock = mocker.patch.object(nft_snapshot, "main")
+        batch_mock = mocker.patch.object(nft_snapshot, "run_batch")
+
+        nft_snapshot.cli(["-o", "--top", "5", "tokens.txt"])
+        logging_mock.assert_called_once_with()
+        args = main_mock.call_args[0]
+        assert args[2] is True
+        assert args[0].token_file_name == "tokens.txt"
+        assert args[20] == 5
+        for top in ("0", "-1"):
+            with pytest.raises(SystemExit):
+                nft_snapshot.cli(["-o", "--top", top, "tokens.txt"])
+
+        nft_snapshot.cli(["-o", "tokens.txt", "--workers", "4", "--deadline", "30"])
+        session = main_mock.call_args[0][0]
+        assert (session.workers, session.deadline_seconds) == (4, 30)
+
+        nft_snapshot.cli(["-t", "--collection", "mint_1", "--collection", "mint_2", "tokens.txt"])
+        session = main_mock.call_args[0][0]
+        assert (session.collections, session.creators, session.editions) == (
+            ["mint_1", "mint_2"],
+            (),
+            None,
         )
-        assert result == input_dict
+        with pytest.raises(SystemExit):
+            # Nothing to look the tokens up by
+            nft_snapshot.cli(["-t", "tokens.txt"])
+
+        nft_snapshot.cli(["--batch", "collections.json"])
+        batch_mock.assert_called_once_with("collections.json", "text", None)
+        with pytest.raises(SystemExit):
+            nft_snapshot.cli(["--daemon"])
+
+        shard_mock = mocker.patch.object(nft_snapshot, "run_shard")
+        for argv in (["--shard", "1/4", "tokens.txt"], ["-t", "--shard", "1/4", "tokens.txt"]):
+            # Shards need the token file to have been written first
+            with pytest.raises(SystemExit):
+                nft_snapshot.cli(argv)
+        token_file = tmp_path / "tokens.txt"
+        token_file.write_text("1")
+        nft_snapshot.cli(["-o", "--shard", "1/4", str(token_file)])
+        shard_mock.assert_called_once_with(
+            str(token_file), (1, 4), None, False, ["holder_counts"], None
+        )
+
+    def test_load_cache(self):
+        token_cache = mock.Mock()
+        token_cache.load.return_value = {"1": Token(token="1")}
+
+        assert nft_snapshot.load_cache(token_cache, False) == (token_cache.load.return_value, {})
+        token_cache.save.assert_not_called()
+        assert nft_snapshot.load_cache(token_cache, True) == ({}, {})
+        token_cache.save.assert_called_once_with({})
+        assert nft_snapshot.load_cache(token_cache, True, keep_stale=True) == (
+            {},
+            token_cache.load.return_value,
+        )
+
+    def test_load_cache_merge_shards(self, mocker):
+        token_cache = mock.Mock(key="tokens")
+        token_cache.load.return_value = {}
+        merge_mock = mocker.patch.object(nft_snapshot, "merge_shard_caches")
+
+        all_tokens, _ = nft_snapshot.load_cache(token_cache, False, merge_shards=4)
+        merge_mock.assert_called_once_with(all_tokens, "tokens", 4)
+        token_cache.save.assert_called_once_with(all_tokens)
+
+    def test_parse_shard(self):
+        assert nft_snapshot.parse_shard("1/4") == (1, 4)
+        for shard in ("4/4", "-1/4", "0/0", "one/4"):
+            with pytest.raises(ArgumentTypeError):
+                nft_snapshot.parse_shard(shard)
+
+    def test_parse_rarity_models(self):
+        result = nft_snapshot.parse_rarity_models("rarity_score, trait_count")
+        assert result == ["rarity_score", "trait_count"]
+
+    def test_parse_rarity_models_unknown_raises(self):
+        with pytest.raises(ArgumentTypeError):
+            nft_snapshot.parse_rarity_models("rarity_score,vibes")
 
     @pytest.mark.asyncio
     async def test_get_arweave_metadata(self, mocker):
@@ -228,6 +650,178 @@ class TestNftSnapshot:
         assert input_token.image == ""
         assert input_token.traits == {}
 
+    def test_update_rarity_state(self):
+        tc_mock = mock.Mock()
+        tc_mock.load_extra.return_value = None
+        input_dict = {"token_1": Token(token="token_1", traits={"hair": "white"})}
+
+        result = nft_snapshot.update_rarity_state(input_dict, tc_mock)
+        tc_mock.load_extra.assert_called_once_with("rarity")
+        tc_mock.save_extra.assert_called_once_with("rarity", result)
+        assert result.rank("token_1") == 1
+
+    def test_update_rarity_state_unchanged(self):
+        input_dict = {"token_1": Token(token="token_1", traits={"hair": "white"})}
+        rarity_state = nft_snapshot.RarityState()
+        rarity_state.sync(input_dict)
+        tc_mock = mock.Mock()
+        tc_mock.load_extra.return_value = rarity_state
+
+        result = nft_snapshot.update_rarity_state(input_dict, tc_mock)
+        assert result == rarity_state
+        tc_mock.save_extra.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_main_rank_range(self, mocker, session_args):
+        token_file, clients = session_args
+        index_mock = mocker.patch.object(nft_snapshot, "update_rarity_index")
+        range_mock = mocker.patch.object(nft_snapshot.output, "write_rank_range")
+        session = nft_snapshot.SnapshotSession(token_file, clients=clients)
+        populate_mock = mocker.patch.object(session, "populate")
+
+        await nft_snapshot.main(session, False, False, False, False, False, rank_range=(1, 10))
+        populate_mock.assert_awaited_once_with("rank_range")
+        range_mock.assert_called_once_with(mock.ANY, index_mock.return_value, 1, 10)
+
+    def test_write_snapshot_report_tokens(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(cache, "CACHE_DIR", str(tmp_path))
+        token_cache = cache.TokenCache()
+        token_cache.initialize("test")
+        input_dict = {
+            mint: Token(token=mint, holder_address=f"wallet_{mint}", traits={"hair": hair})
+            for mint, hair in (("1", "white"), ("2", "white"), ("3", "red"))
+        }
+        report_tokens = {mint: input_dict[mint] for mint in ("1", "2")}
+        outfile = tmp_path / "snapshot.csv"
+        nft_snapshot.write_snapshot(
+            input_dict, str(outfile), (), "test", token_cache, report_tokens
+        )
+
+        # Only the reported tokens are written and ranked against each other...
+        rows = outfile.read_text().splitlines()[1:]
+        assert [row.split(",")[3] for row in rows] == ["1", "2"]
+        assert [row.split(",")[7] for row in rows] == ["1", "2"]
+        # ...but the saved history and rarity state cover every token
+        history = token_cache.load_extra("history")
+        assert history.history("3") == [(mock.ANY, "wallet_3")]
+        assert len(token_cache.load_extra("rarity")) == 3
+
+    def test_report_indexes(self):
+        input_dict = {
+            mint: Token(token=mint, holder_address="wallet_1", traits={"hair": hair})
+            for mint, hair in (("1", "white"), ("2", "white"), ("3", "red"))
+        }
+        token_cache = mock.Mock()
+        token_cache.load_extra.return_value = None
+        report_tokens = {mint: input_dict[mint] for mint in ("1", "2")}
+
+        report_index = nft_snapshot.report_wallet_index(input_dict, report_tokens, token_cache)
+        assert report_index.top() == [("wallet_1", 2)]
+        saved_index = token_cache.save_extra.call_args[0][1]
+        assert saved_index.top() == [("wallet_1", 3)]
+
+        rarity_index = nft_snapshot.report_rarity_index(input_dict, report_tokens, token_cache)
+        assert len(rarity_index) == 2
+        token_cache.save_extra.assert_called_with("rarity", mock.ANY)
+        assert len(token_cache.save_extra.call_args[0][1]) == 3
+
+    def test_update_rarity_index(self):
+        tc_mock = mock.Mock()
+        tc_mock.saved_at.return_value = 100.0
+        tc_mock.load_extra.return_value = None
+        input_dict = {"token_1": Token(token="token_1", traits={"hair": "white"})}
+
+        result = nft_snapshot.update_rarity_index(input_dict, tc_mock, ["rarity_score"])
+        tc_mock.save_extra.assert_called_with("rarity_index", result)
+        assert result.lookup("token_1")["models"]["rarity_score"]["rank"] == 1
+        assert result.cached_at == 100.0
+
+    def test_update_rarity_index_up_to_date(self):
+        input_dict = {"token_1": Token(token="token_1", traits={"hair": "white"})}
+        rarity_state = nft_snapshot.RarityState()
+        rarity_state.sync(input_dict)
+        rarity_index = nft_snapshot.build_rarity_index(rarity_state, input_dict, cached_at=100.0)
+        tc_mock = mock.Mock()
+        tc_mock.saved_at.return_value = 100.0
+        tc_mock.load_extra.side_effect = [rarity_index]
+
+        # Built from the cache as it is now, so the tokens don't need looking at again
+        sync_mock = mock.Mock()
+        with mock.patch.object(nft_snapshot.RarityState, "sync", sync_mock):
+            result = nft_snapshot.update_rarity_index(input_dict, tc_mock)
+        assert result == rarity_index
+        sync_mock.assert_not_called()
+        tc_mock.save_extra.assert_not_called()
+
+        # The cache has been saved since, with the same data
+        tc_mock.saved_at.return_value = 200.0
+        tc_mock.load_extra.side_effect = [rarity_index, rarity_state]
+        result = nft_snapshot.update_rarity_index(input_dict, tc_mock)
+        assert result == rarity_index
+        assert result.cached_at == 200.0
+        tc_mock.save_extra.assert_called_once_with("rarity_index", rarity_index)
+
+        # Without a cache file there's nothing to go by but the data itself
+        rarity_index.cached_at = None
+        tc_mock.saved_at.return_value = None
+        tc_mock.load_extra.side_effect = [rarity_index, rarity_state]
+        assert nft_snapshot.update_rarity_index(input_dict, tc_mock) == rarity_index
+        tc_mock.save_extra.assert_called_once()
+
+    def test_update_rarity_index_out_of_date(self):
+        input_dict = {"token_1": Token(token="token_1", name="#1", traits={"hair": "white"})}
+        rarity_state = nft_snapshot.RarityState()
+        rarity_state.sync(input_dict)
+        rarity_index = nft_snapshot.build_rarity_index(rarity_state, input_dict, cached_at=100.0)
+        tc_mock = mock.Mock()
+        tc_mock.saved_at.return_value = 200.0
+
+        # A recreated state is at the same version, but isn't the state the index was built from
+        recreated_state = nft_snapshot.RarityState()
+        recreated_state.sync(input_dict)
+        assert recreated_state.version == rarity_state.version
+        tc_mock.load_extra.side_effect = [rarity_index, recreated_state]
+        assert nft_snapshot.update_rarity_index(input_dict, tc_mock) is not rarity_index
+
+        # Renaming a token doesn't change the state, but does change what the index holds
+        input_dict["token_1"].name = "Renamed #1"
+        tc_mock.load_extra.side_effect = [rarity_index, rarity_state]
+        result = nft_snapshot.update_rarity_index(input_dict, tc_mock)
+        assert result.lookup("token_1")["name"] == "Renamed #1"
+        assert tc_mock.save_extra.call_count == 2
+
+        # As does asking for a model the index doesn't have, even with the cache unchanged
+        tc_mock.saved_at.return_value = 100.0
+        tc_mock.load_extra.side_effect = [rarity_index, rarity_state]
+        result = nft_snapshot.update_rarity_index(input_dict, tc_mock, ["rarity_score"])
+        assert result.models == ["rarity_score"]
+
+    def test_parse_rank_range(self):
+        assert nft_snapshot.parse_rank_range("1:10") == (1, 10)
+
+    def test_parse_positive_int(self):
+        assert nft_snapshot.parse_positive_int("10") == 10
+        for value in ("0", "-3", "ten"):
+            with pytest.raises(ArgumentTypeError):
+                nft_snapshot.parse_positive_int(value)
+
+    def test_parse_rank_range_invalid_raises(self):
+        with pytest.raises(ArgumentTypeError):
+            nft_snapshot.parse_rank_range("10:1")
+
+    def test_trait_query_holders(self, mocker):
+        output_mock = mocker.patch.object(nft_snapshot.output, "format_trait_query")
+        output_mock.return_value = "result_string"
+        input_dict = {
+            "token_1": Token(token="token_1", holder_address="w1", traits={"hair": "white"}),
+            "token_2": Token(token="token_2", holder_address="w2", traits={"hair": "black"}),
+            "token_3": Token(token="token_3", holder_address="w1", traits={"hair": "white"}),
+        }
+
+        result = nft_snapshot.trait_query_holders(input_dict, "hair=white")
+        assert result == "result_string"
+        output_mock.assert_called_once_with("hair=white", {"w1": ["token_1", "token_3"]})
+
     def test_holder_counts(self, mocker):
         output_mock = mocker.patch.object(nft_snapshot, "output")
         output_mock.format_biggest_holders.return_value = "result_string"
@@ -241,9 +835,152 @@ class TestNftSnapshot:
 
         result = nft_snapshot.holder_counts(input_dict)
         assert result == "result_string"
-        output_mock.format_biggest_holders.assert_called_once_with(
-            5, {"wallet_1": 2, "wallet_2": 1, "": 2}
+        output_mock.format_biggest_holders.assert_called_once_with(5, mock.ANY, None)
+        wallet_index = output_mock.format_biggest_holders.call_args[0][1]
+        assert wallet_index.top() == [("", 2), ("wallet_1", 2), ("wallet_2", 1)]
+
+    def test_holder_counts_from_wallet_index(self, mocker):
+        output_mock = mocker.patch.object(nft_snapshot, "output")
+        output_mock.format_biggest_holders.return_value = "result_string"
+        input_dict = {
+            "token_1": Token(token="token_1", holder_address="wallet_1"),
+            "token_2": Token(token="token_2", holder_address="wallet_2"),
+            "token_3": Token(token="token_3", holder_address="wallet_1"),
+        }
+        wallet_index = nft_snapshot.WalletIndex()
+        wallet_index.sync(input_dict)
+
+        result = nft_snapshot.holder_counts(input_dict, wallet_index)
+        assert result == "result_string"
+        output_mock.format_biggest_holders.assert_called_once_with(3, wallet_index, None)
+
+    def test_holder_counts_stats(self):
+        input_dict = {
+            "token_1": Token(token="token_1", holder_address="wallet_1"),
+            "token_2": Token(token="token_2", holder_address="wallet_2"),
+            "token_3": Token(token="token_3", holder_address="wallet_1"),
+            "token_4": Token(token="token_4", holder_address=""),
+        }
+        result = json.loads(nft_snapshot.holder_counts(input_dict, holder_stats="json"))
+        assert result["holders"] == 2
+        assert result["tokens_held"] == 3
+        assert result["concentration"]["top_1"] == pytest.approx(2 / 3)
+
+        result = nft_snapshot.holder_counts(input_dict, holder_stats="text")
+        assert "Total Holder Wallets: 2\n" in result
+        assert "Top 1: 66.67%\n" in result
+
+    def test_holder_counts_streamed(self, capsys):
+        input_dict = {
+            "token_1": Token(token="token_1", holder_address="wallet_1"),
+            "token_2": Token(token="token_2", holder_address="wallet_2"),
+            "token_3": Token(token="token_3", holder_address="wallet_1"),
+        }
+        renderer = nft_snapshot.make_renderer("json", sys.stdout)
+        assert nft_snapshot.holder_counts(input_dict, renderer=renderer, top=1) is None
+        result = json.loads(capsys.readouterr().out)
+        assert result["holders"] == 2
+        assert result["biggest_holders"] == [
+            {"holder": "wallet_1", "count": 2, "marketplace": None}
+        ]
+
+    def test_update_wallet_index(self):
+        tc_mock = mock.Mock()
+        tc_mock.load_extra.return_value = None
+        input_dict = {"token_1": Token(token="token_1", holder_address="wallet_1")}
+
+        result = nft_snapshot.update_wallet_index(input_dict, tc_mock)
+        tc_mock.load_extra.assert_called_once_with("wallets")
+        tc_mock.save_extra.assert_called_once_with("wallets", result)
+        assert result.tokens_for("wallet_1") == ["token_1"]
+
+    @pytest.mark.asyncio
+    async def test_main_wallet(self, mocker, session_args):
+        token_file, clients = session_args
+        format_mock = mocker.patch.object(nft_snapshot.output, "write_wallet_holdings")
+        session = nft_snapshot.SnapshotSession(token_file, clients=clients)
+        session.cache.save({"1": Token(token="1", holder_address="wallet_1")})
+        populate_mock = mocker.patch.object(session, "populate")
+
+        await nft_snapshot.main(session, False, False, False, False, False, wallet="wallet_1")
+        populate_mock.assert_awaited_once_with("wallet")
+        format_mock.assert_called_once_with(mock.ANY, "wallet_1", ["1"], session.all_tokens)
+
+    @pytest.mark.asyncio
+    async def test_main_json_lines(self, mocker, session_args, capsys):
+        token_file, clients = session_args
+        session = nft_snapshot.SnapshotSession(token_file, clients=clients)
+        session.cache.save(
+            {
+                mint: Token(
+                    token=mint, name=f"#{mint}", holder_address="wallet_1", traits={"hair": "red"}
+                )
+                for mint in ("1", "2", "3")
+            }
+        )
+        mocker.patch.object(session, "populate")
+
+        await nft_snapshot.main(
+            session,
+            False,
+            True,
+            False,
+            False,
+            False,
+            trait_query="hair=red",
+            wallet="wallet_1",
+            holding_time="wallet_1",
+            report_format="json",
+        )
+        # Every report is a JSON object on a line of its own
+        lines = capsys.readouterr().out.splitlines()
+        reports = [json.loads(line) for line in lines]
+        assert [report["report"] for report in reports] == [
+            "holder_counts",
+            "trait_query",
+            "wallet",
+            "holding_time",
+        ]
+        assert reports[0]["biggest_holders"][0]["count"] == 3
+        assert reports[2]["tokens"][0] == {"token": "1", "name": "#1"}
+
+    @pytest.mark.asyncio
+    async def test_main_diff(self, mocker, session_args):
+        token_file, clients = session_args
+        session = nft_snapshot.SnapshotSession(token_file, clients=clients)
+        diff_mock = mocker.patch.object(session, "diff")
+
+        await nft_snapshot.main(
+            session,
+            False,
+            False,
+            False,
+            False,
+            False,
+            diff=["old.csv", "new.csv"],
+            diff_format="json",
         )
+        diff_mock.assert_awaited_once_with("old.csv", "-", "json", "new.csv")
+
+    def test_history_report(self):
+        history = HolderHistory()
+        history.record({"1": Token(token="1", holder_address="wallet_1")}, 1000)
+        history.record({"1": Token(token="1", holder_address="wallet_2")}, 2000)
+        input_dict = {"1": Token(token="1", name="Token #1")}
+
+        at = datetime.datetime.fromtimestamp(1500, datetime.timezone.utc)
+        result = nft_snapshot.history_report(input_dict, history, "1", at, "wallet_2")
+        assert "1970-01-01T00:16:40+00:00: wallet_1\n" in result
+        assert "1970-01-01T00:33:20+00:00: wallet_2\n" in result
+        assert "Holder at 1970-01-01T00:25:00+00:00: wallet_1\n" in result
+        assert "Token #1: 0:00:00\n" in result
+
+    def test_parse_history_time(self):
+        assert nft_snapshot.parse_history_time("2022-05-01") == datetime.datetime(
+            2022, 5, 1, tzinfo=datetime.timezone.utc
+        )
+        with pytest.raises(ArgumentTypeError):
+            nft_snapshot.parse_history_time("yesterday")
 
     def test_attribute_distribution(self, mocker):
         output_mock = mocker.patch.object(nft_snapshot, "output")
@@ -258,5 +995,98 @@ class TestNftSnapshot:
         result = nft_snapshot.attribute_distribution(input_dict)
         assert result == "result_string"
         output_mock.format_trait_frequency.assert_called_once_with(
-            2, {"hair": {"white": 2}, "eyes": {"blue": 1, "": 1}}
+            2, {"hair": {"white": 2}, "eyes": {"blue": 1, "": 1}}, None
+        )
+
+
+class TestSnapshotSession:
+    @pytest.mark.asyncio
+    async def test_holder_counts(self, session_args, fake_fetches):
+        token_file, clients = session_args
+        async with nft_snapshot.SnapshotSession(token_file, clients=clients) as session:
+            assert await session.discover() == ["1", "2", "3"]
+            assert await session.holder_counts() == [("wallet_1", 2), ("wallet_2", 1)]
+            assert await session.wallet("wallet_2") == ["3"]
+            assert session.populated == {"token_accounts", "holders", "accounts"}
+
+        # The fetched data was cached, in the session's own cache
+        async with nft_snapshot.SnapshotSession(token_file, clients=clients) as session:
+            assert session.all_tokens["3"].holder_address == "wallet_2"
+
+    @pytest.mark.asyncio
+    async def test_discover_from_sources(self, mocker, session_args):
+        token_file, clients = session_args
+        sources_mock = mocker.patch.object(nft_snapshot.sh, "get_token_list_from_sources")
+        sources_mock.return_value = ["4", "5"]
+
+        async with nft_snapshot.SnapshotSession(token_file, clients=clients) as session:
+            with pytest.raises(ValueError):
+                await session.discover(refresh=True)
+        session = nft_snapshot.SnapshotSession(
+            token_file, "cmid", cmv2=True, clients=clients, creators=["creator_1"]
         )
+        async with session:
+            assert await session.discover(refresh=True) == ["4", "5"]
+            assert set(session.all_tokens) == {"4", "5"}
+        sources_mock.assert_called_with([("cmv2", "cmid"), ("creator", "creator_1")], None)
+        assert nft_snapshot.read_token_list(token_file) == ["4", "5"]
+
+    @pytest.mark.asyncio
+    async def test_diff(self, mocker, session_args):
+        token_file, clients = session_args
+        state_mock = mocker.patch.object(nft_snapshot, "update_rarity_state")
+        read_mock = mocker.patch.object(nft_snapshot, "read_snapshot")
+        current_mock = mocker.patch.object(nft_snapshot, "token_snapshot")
+        diff_mock = mocker.patch.object(nft_snapshot, "diff_snapshots")
+        write_mock = mocker.patch.object(nft_snapshot, "write_changes")
+        write_mock.return_value = 3
+        session = nft_snapshot.SnapshotSession(token_file, clients=clients)
+        populate_mock = mocker.patch.object(session, "populate")
+
+        assert await session.diff("old.csv") == 3
+        populate_mock.assert_awaited_once_with("diff")
+        read_mock.assert_called_once_with("old.csv")
+        state_mock.assert_called_once_with(session.all_tokens, session.cache)
+        current_mock.assert_called_once_with(
+            session.all_tokens, rarity_state=state_mock.return_value
+        )
+        diff_mock.assert_called_once_with(read_mock.return_value, current_mock.return_value)
+        write_mock.assert_called_once_with(diff_mock.return_value, "-", "csv")
+
+    @pytest.mark.asyncio
+    async def test_token_rarity(self, mocker, session_args, fake_fetches):
+        token_file, clients = session_args
+        traits = {"1": {"hair": "white"}, "2": {"hair": "white"}, "3": {"hair": "red"}}
+
+        async def fetch_metadata(client, token, limiter):
+            token.image = f"{token.token}.png"
+            token.traits = traits[token.token]
+
+        mocker.patch.object(nft_snapshot, "get_arweave_metadata", fetch_metadata)
+
+        async with nft_snapshot.SnapshotSession(token_file, clients=clients) as session:
+            await session.discover()
+            result = await session.token_rarity("3")
+            assert (result["rank"], result["name"]) == (1, "#3")
+            assert await session.trait_query("hair=white") == {"wallet_1": ["1", "2"]}
+            assert session.name == "tokens"
+
+    @pytest.mark.asyncio
+    async def test_run_shard_async(self, mocker, session_args, fake_fetches):
+        token_file, clients = session_args
+        session_class = nft_snapshot.SnapshotSession
+        mocker.patch.object(
+            nft_snapshot,
+            "SnapshotSession",
+            lambda *args, **kwargs: session_class(*args, clients=clients, **kwargs),
+        )
+        assert await nft_snapshot.run_shard_async(token_file, (1, 2), reports=["wallet"]) == 0
+        with pytest.raises(ValueError):
+            await nft_snapshot.run_shard_async(f"{token_file}.missing", (1, 2), "cmid")
+
+        session = session_class(token_file, shard=(1, 2), clients=clients)
+        assert session.cache.key.endswith("tokens_shard1of2")
+        async with session:
+            shard = nft_snapshot.shard_tokens(["1", "2", "3"], 1, 2)
+            assert set(session.all_tokens) == set(shard)
+            assert all(token.holder_address for token in session.all_tokens.values())
@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+
+from util.offload import CpuPool
+
+
+def square(items):
+    return [item * item for item in items]
+
+
+def fail(items):
+    raise ValueError("bad batch")
+
+
+class TestCpuPool:
+    @pytest.mark.asyncio
+    async def test_inline(self):
+        with CpuPool() as pool:
+            assert pool.executor is None
+            assert await pool.apply(square, 3) == 9
+            assert pool.map(square, [1, 2, 3]) == [1, 4, 9]
+
+    @pytest.mark.asyncio
+    async def test_apply_batches(self, mocker):
+        with CpuPool(2, batch_size=2, linger=0.01) as pool:
+            flush_spy = mocker.spy(pool, "_flush")
+            results = await asyncio.gather(*(pool.apply(square, item) for item in range(5)))
+            assert results == [0, 1, 4, 9, 16]
+            # Two full batches are sent straight away, and the last item once it has waited long enough
+            assert flush_spy.call_count == 3
+            assert pool.pending == {} and pool.timers == {}
+
+    @pytest.mark.asyncio
+    async def test_apply_error(self):
+        with CpuPool(1, linger=0) as pool:
+            with pytest.raises(ValueError):
+                await pool.apply(fail, 1)
+
+    def test_map(self):
+        with CpuPool(2, batch_size=3) as pool:
+            assert pool.map(square, list(range(10))) == square(range(10))
+
+    def test_new_event_loop(self):
+        # A pool can be used by one asyncio.run() after another (as the populate functions do)
+        async def run(pool):
+            return await asyncio.gather(pool.apply(square, 2), pool.apply(square, 3))
+
+        with CpuPool(1) as pool:
+            assert asyncio.run(run(pool)) == [4, 9]
+            assert asyncio.run(run(pool)) == [4, 9]
@@ -1,5 +1,24 @@
+import csv
+import gzip
+import json
+
+import pytest
+
 from util import output
+from util.render import render_string
+from util.distribution import holder_distribution
+from util.history import HolderHistory
+from util.rarity_state import RarityState
 from util.token import Token
+from util.wallet_index import WalletIndex
+
+
+def make_wallet_index(counts: dict) -> WalletIndex:
+    wallet_index = WalletIndex()
+    for holder, count in counts.items():
+        for i in range(count):
+            wallet_index.set_holder(f"{holder}_token_{i}", holder)
+    return wallet_index
 
 
 class TestOutput:
@@ -22,13 +41,58 @@ GUfCR9mK6azb9vcpsxgXyj7XRPAKJd4KMHTTVvtncGgp: 50 (MagicEden)
 F4ghBzHFNgJxV4wEQDchU5i7n4XWWMBSaq7CuswGiVsr: 4 (DigitalEyes)
 holder_2: 3
 4pUQS4Jo2dsfWzt3VgHXy3H6RYnEDd11oWPiaM2rdAPw: 2 (AlphaArt)
-holder_1: 1
 3D49QorJyNaL4rcpiynbuS3pRH4Y7EXEM6v6ZGaqfFGK: 1 (Solanart)
+holder_1: 1
 """
 
-        result = output.format_biggest_holders(300, input_dict)
+        result = output.format_biggest_holders(300, make_wallet_index(input_dict))
         assert result == expected
 
+    def test_format_biggest_holders_top(self):
+        input_dict = {
+            "holder_1": 1,
+            "holder_2": 3,
+            "GUfCR9mK6azb9vcpsxgXyj7XRPAKJd4KMHTTVvtncGgp": 50,
+        }
+        result = output.format_biggest_holders(300, make_wallet_index(input_dict), top=2)
+        assert result.endswith(
+            "----------\nGUfCR9mK6azb9vcpsxgXyj7XRPAKJd4KMHTTVvtncGgp: 50 (MagicEden)\nholder_2: 3\n"
+        )
+        assert "Total Holder Wallets: 3\n" in result
+
+    def test_format_biggest_holders_json(self):
+        input_dict = {"holder_1": 1, "GUfCR9mK6azb9vcpsxgXyj7XRPAKJd4KMHTTVvtncGgp": 50}
+        result = json.loads(
+            output.format_biggest_holders(300, make_wallet_index(input_dict), render_format="json")
+        )
+        assert result == {
+            "report": "holder_counts",
+            "tokens": 300,
+            "holders": 2,
+            "biggest_holders": [
+                {
+                    "holder": "GUfCR9mK6azb9vcpsxgXyj7XRPAKJd4KMHTTVvtncGgp",
+                    "count": 50,
+                    "marketplace": "MagicEden",
+                },
+                {"holder": "holder_1", "count": 1, "marketplace": None},
+            ],
+        }
+
+    def test_format_holder_distribution(self):
+        distribution = holder_distribution(
+            4,
+            {"holder_1": 3, "GUfCR9mK6azb9vcpsxgXyj7XRPAKJd4KMHTTVvtncGgp": 1},
+            output.MARKETPLACE_WALLETS,
+        )
+        result = output.format_holder_distribution(distribution)
+        assert "Total tokens: 4\nTotal Holder Wallets: 2\n" in result
+        assert "Gini coefficient: 0.2500\n" in result
+        assert "Top 1: 75.00%\nTop 10: 100.00%\n" in result
+        assert "1: 1 wallets, 1 tokens\n" in result
+        assert "3-5: 1 wallets, 3 tokens\n" in result
+        assert "MagicEden: 1\nListed share: 25.00%\n" in result
+
     def test_format_trait_frequency(self):
         input_dict = {
             "Eyes": {
@@ -58,6 +122,15 @@ holder_2: 6 (6/7, 0.857143)
         result = output.format_trait_frequency(7, input_dict)
         assert result == expected
 
+    def test_format_trait_frequency_markdown_top(self):
+        input_dict = {"Eyes": {"blue": 2, "green": 1, "red": 4}}
+        expected = (
+            "- 7 tokens with metadata\n\n## Attributes\n\n\n### Eyes\n\n"
+            "- green: 1 (1/7, 0.142857)\n- blue: 2 (2/7, 0.285714)\n"
+        )
+        result = output.format_trait_frequency(7, input_dict, top=2, render_format="markdown")
+        assert result == expected
+
     def test_sort_dict_by_values(self):
         input_dict = {
             "a": 2,
@@ -92,7 +165,7 @@ holder_2: 6 (6/7, 0.857143)
         result = output.sort_dict_by_values(input_dict, reverse=True)
         assert result == expected
 
-    def test_holder_snapshot(self, mocker):
+    def test_holder_snapshot(self, tmp_path):
         input_dict = {
             "token_addr_1": Token(
                 token="token_addr_1",
@@ -104,35 +177,126 @@ holder_2: 6 (6/7, 0.857143)
                 traits={"Trait1": "Value1"},
             )
         }
-        headers = [
-            "Number",
-            "TokenName",
-            "Token",
-            "HolderAddress",
-            "TotalHeld",
-            "Image",
-            "Rank",
-            "Rarity",
-            "Trait1",
-        ]
-        expected = [
-            [
-                "1",
-                "Token #1",
-                "token_addr_1",
-                "owner_1",
-                1,
-                "https://www.iana.org/_img/2022/iana-logo-header.svg",
-                1,
-                "100.00000000000000000000%",
-                "Value1",
-            ]
-        ]
-        test_outfile_name = "outfile.csv"
-        pd_mock = mocker.patch("pandas.DataFrame")
-        output.holder_snapshot(input_dict, test_outfile_name)
-        pd_mock.assert_called_once_with(expected, columns=headers)
-        pd_mock.return_value.to_csv.assert_called_once_with(test_outfile_name)
+        expected = (
+            ",Number,TokenName,Token,HolderAddress,TotalHeld,Image,Rank,Rarity,Trait1\n"
+            "0,1,Token #1,token_addr_1,owner_1,1,https://www.iana.org/_img/2022/iana-logo-header.svg,"
+            "1,100.00000000000000000000%,Value1\n"
+        )
+        test_outfile = tmp_path / "outfile.csv"
+        output.holder_snapshot(input_dict, str(test_outfile))
+        assert test_outfile.read_text() == expected
+
+    def test_holder_snapshot_with_models(self, tmp_path):
+        input_dict = {
+            "token_addr_1": Token(token="token_addr_1", id="1", traits={"Trait1": "Value1"}),
+            "token_addr_2": Token(token="token_addr_2", id="2", traits={"Trait1": "Value2"}),
+            "token_addr_3": Token(token="token_addr_3", id="3"),
+        }
+        test_outfile = tmp_path / "outfile.csv"
+        output.holder_snapshot(input_dict, str(test_outfile), ["rarity_score"])
+        rows = list(csv.reader(test_outfile.open()))
+        assert rows[0][-3:] == ["RarityScore", "RarityScoreRank", "Trait1"]
+        assert rows[1][-3:] == ["2.0", "1", "Value1"]
+        assert rows[2][-3:] == ["2.0", "2", "Value2"]
+        assert rows[3][-4:] == ["", "", "", ""]
+
+    def test_holder_snapshot_gzip(self, tmp_path):
+        input_dict = {"token_addr_1": Token(token="token_addr_1", traits={"Trait1": "Value1"})}
+        test_outfile = tmp_path / "outfile.csv.gz"
+        output.holder_snapshot(input_dict, str(test_outfile))
+        with gzip.open(test_outfile, "rt") as outfile:
+            assert outfile.readline() == (
+                ",Number,TokenName,Token,HolderAddress,TotalHeld,Image,Rank,Rarity,Trait1\n"
+            )
+
+    def test_holder_snapshot_stdout(self, capsys):
+        input_dict = {"token_addr_1": Token(token="token_addr_1", traits={"Trait1": "Value1"})}
+        output.holder_snapshot(input_dict, "-")
+        assert capsys.readouterr().out.splitlines()[1].endswith("Value1")
+
+    def test_holder_snapshot_parquet(self, tmp_path):
+        parquet = pytest.importorskip("pyarrow.parquet")
+        input_dict = {
+            f"token_addr_{i}": Token(
+                token=f"token_addr_{i}",
+                id=str(i),
+                amount="1",
+                traits={"Trait1": f"Value{i % 2}"} if i < 4 else {},
+            )
+            for i in range(5)
+        }
+        test_outfile = tmp_path / "outfile.parquet"
+        output.holder_snapshot(
+            input_dict, str(test_outfile), metadata={"collection": "test_cm", "slot": 7}
+        )
+        table = parquet.read_table(test_outfile)
+        assert table.column("Trait1").type.value_type == "string"
+        assert table.column("Trait1").to_pylist() == ["Value0", "Value1", "Value0", "Value1", None]
+        assert table.column("TotalHeld").to_pylist() == [1] * 5
+        assert table.column("Rank").to_pylist() == [1, 2, 3, 4, None]
+        assert table.column("Rarity").to_pylist()[:4] == [50.0] * 4
+        metadata = table.schema.metadata
+        assert json.loads(metadata[b"collection"]) == "test_cm"
+        assert json.loads(metadata[b"slot"]) == 7
+
+    def test_holder_snapshot_flags_data_status(self, tmp_path):
+        input_dict = {
+            "token_addr_1": Token(token="token_addr_1", id="1", traits={"Trait1": "Value1"}),
+            "token_addr_2": Token(token="token_addr_2", id="2"),
+        }
+        input_dict["token_addr_2"].data_status = "missing"
+        test_outfile = tmp_path / "outfile.csv"
+        output.holder_snapshot(input_dict, str(test_outfile))
+        rows = list(csv.reader(test_outfile.open()))
+        assert rows[0][-2:] == ["DataStatus", "Trait1"]
+        assert rows[1][-2:] == ["", "Value1"]
+        assert rows[2][-2:] == ["missing", ""]
+
+    def test_holder_snapshot_rarity_state_columns(self, tmp_path):
+        rarity_state = RarityState()
+        rarity_state.sync({"token_addr_1": Token(token="token_addr_1", traits={"Hat": "Cap"})})
+        input_dict = {
+            "token_addr_1": Token(token="token_addr_1", traits={"Eyes": "Blue"}),
+            "token_addr_2": Token(token="token_addr_2", traits={"Eyes": "Red", "Fur": "Gold"}),
+        }
+        rarity_state.sync(input_dict)
+
+        # Columns follow the current tokens' trait types, not every type the state has seen
+        test_outfile = tmp_path / "outfile.csv"
+        output.holder_snapshot(input_dict, str(test_outfile), rarity_state=rarity_state)
+        rows = list(csv.reader(test_outfile.open()))
+        assert rows[0][-3:] == ["Rarity", "Eyes", "Fur"]
+        assert [row[-2:] for row in rows[1:]] == [["Blue", ""], ["Red", "Gold"]]
+
+    def test_holder_snapshot_records_history(self, tmp_path):
+        input_dict = {"token_addr_1": Token(token="token_addr_1", holder_address="owner_1")}
+        history = HolderHistory()
+        metadata = {"timestamp": "2022-05-01T00:00:00+00:00", "slot": 5}
+        output.holder_snapshot(
+            input_dict, str(tmp_path / "outfile.csv"), metadata=metadata, history=history
+        )
+        assert history.snapshots == [(1651363200, 5)]
+        assert history.history("token_addr_1") == [(1651363200, "owner_1")]
+
+        # A snapshot that couldn't be written isn't recorded
+        with pytest.raises(OSError):
+            output.holder_snapshot(
+                input_dict,
+                str(tmp_path / "missing" / "outfile.csv"),
+                metadata=metadata,
+                history=history,
+            )
+        assert history.snapshots == [(1651363200, 5)]
+
+    def test_snapshot_metadata(self):
+        input_dict = {"token_1": Token(token="token_1"), "token_2": Token(token="token_2")}
+        input_dict["token_1"].holder_slot = 10
+        input_dict["token_2"].holder_slot = 12
+        metadata = output.snapshot_metadata(input_dict, "test_cm")
+        assert metadata["collection"] == "test_cm"
+        assert metadata["slot"] == 12
+        assert metadata["tokens"] == 2
+        assert metadata["timestamp"]
 
     def test_get_trait_map(self):
         input_dict = {
@@ -164,3 +328,106 @@ jacket:  (2/3, 0.666667)
 """
         result = output.format_token_rarity("token_2", input_dict)
         assert result == expected
+
+    def test_format_token_rarity_with_models(self):
+        input_dict = {
+            "token_1": Token(token="token_1", traits={"hair": "white", "eyes": "blue"}),
+            "token_2": Token(token="token_2", traits={"hair": "white", "eyes": ""}),
+            "token_3": Token(token="token_3", traits={"jacket": "yes"}),
+        }
+        expected = """
+Token token_2
+----------
+Rank: 3
+Rarity: 0.29629629629629627985
+RarityScore: 4.500000 (rank 3)
+
+Traits
+-----
+hair: white (2/3, 0.666667)
+eyes:  (2/3, 0.666667)
+jacket:  (2/3, 0.666667)
+"""
+        result = output.format_token_rarity("token_2", input_dict, ["rarity_score"])
+        assert result == expected
+
+    def test_format_token_rarity_json(self):
+        input_dict = {
+            "token_1": Token(token="token_1", traits={"hair": "white", "eyes": "blue"}),
+            "token_2": Token(token="token_2", traits={"hair": "white", "eyes": ""}),
+        }
+        result = json.loads(
+            output.format_token_rarity("token_2", input_dict, ["trait_count"], render_format="json")
+        )
+        assert result["token"] == "token_2"
+        assert result["rank"] == 2
+        assert result["models"] == {"trait_count": {"score": 0.5, "rank": 2}}
+        assert result["traits"][0] == {
+            "trait_type": "hair",
+            "value": "white",
+            "count": 2,
+            "frequency": 1.0,
+        }
+
+    def test_format_trait_query(self):
+        input_dict = {
+            "holder_1": ["token_1"],
+            "GUfCR9mK6azb9vcpsxgXyj7XRPAKJd4KMHTTVvtncGgp": ["token_2", "token_3"],
+            "": ["token_4"],
+        }
+        expected = """
+Tokens matching Eyes=Laser: 4
+Holder Wallets: 3
+
+Holders:
+----------
+GUfCR9mK6azb9vcpsxgXyj7XRPAKJd4KMHTTVvtncGgp: 2 (MagicEden) [token_2, token_3]
+UNKNOWN_ADDRESS: 1 [token_4]
+holder_1: 1 [token_1]
+"""
+        result = output.format_trait_query("Eyes=Laser", input_dict)
+        assert result == expected
+
+    def test_format_wallet_holdings(self):
+        input_dict = {
+            "token_1": Token(token="token_1", name="Token #1"),
+            "token_2": Token(token="token_2", name="Token #2"),
+        }
+        expected = """
+Wallet GUfCR9mK6azb9vcpsxgXyj7XRPAKJd4KMHTTVvtncGgp (MagicEden)
+----------
+Tokens held: 2
+Token #1: token_1
+Token #2: token_2
+"""
+        result = output.format_wallet_holdings(
+            "GUfCR9mK6azb9vcpsxgXyj7XRPAKJd4KMHTTVvtncGgp", ["token_1", "token_2"], input_dict
+        )
+        assert result == expected
+
+    def test_write_data_status(self):
+        input_dict = {
+            "token_1": Token(token="token_1", name="Token #1"),
+            "token_2": Token(token="token_2"),
+            "token_3": Token(token="token_3"),
+        }
+        input_dict["token_1"].data_status = "stale"
+        input_dict["token_2"].data_status = "missing"
+        expected = """
+Data status
+----------
+Stale: 1
+Missing: 1
+
+Stale or missing tokens:
+----------
+Token #1: stale
+token_2: missing
+"""
+        assert render_string(output.write_data_status, input_dict) == expected
+
+    def test_write_data_age(self):
+        result = render_string(output.write_data_age, "holder_counts", 0, now=60)
+        assert result == "\nholder_counts data as of 1970-01-01T00:00:00+00:00 (0:01:00 old)\n"
+        result = render_string(output.write_data_age, "rarity", None, render_format="json")
+        assert json.loads(result) == {"report": "rarity", "data_as_of": None}
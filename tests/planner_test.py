@@ -0,0 +1,79 @@
+from util import planner
+from util.token import Token
+
+
+class TestPlanner:
+    def test_fields_for(self):
+        assert planner.fields_for(["holder_counts", "rarity"]) == {
+            "holder_address",
+            "name",
+            "traits",
+        }
+        assert planner.fields_for([]) == set()
+
+    def test_plan_fetches_from_empty_cache(self):
+        input_dict = {str(i): Token(token=str(i)) for i in range(250)}
+        plan = planner.plan_fetches(input_dict, planner.REPORT_FIELDS["snapshot"])
+        assert plan.stages == [
+            planner.PlannedStage("token_accounts", 250, 250),
+            planner.PlannedStage("holders", 250, 3),
+            planner.PlannedStage("accounts", 250, 250),
+            planner.PlannedStage("metadata", 250, 250),
+        ]
+        assert plan.requests == 753
+
+    def test_plan_fetches_only_needed_stages(self):
+        input_dict = {
+            "1": Token(token="1", token_account="a", holder_address="wallet_1"),
+            "2": Token(token="2", token_account="a"),
+            "3": Token(token="3", token_account="b"),
+            "4": Token(token="4", token_account=""),
+        }
+        plan = planner.plan_fetches(input_dict, planner.REPORT_FIELDS["holder_counts"])
+        # Token accounts are all cached, and tokens 2 and 3 share one batched request
+        assert plan.stages == [planner.PlannedStage("holders", 3, 1)]
+
+    def test_plan_fetches_rarity_skips_holders(self):
+        input_dict = {
+            "1": Token(token="1", name="One", data_uri="https://example.com/1.json"),
+            "2": Token(token="2", name="Two", data_uri=""),
+            "3": Token(token="3"),
+        }
+        plan = planner.plan_fetches(input_dict, planner.REPORT_FIELDS["rarity"])
+        assert plan.stages == [
+            planner.PlannedStage("accounts", 1, 1),
+            planner.PlannedStage("metadata", 3, 2),
+        ]
+
+    def test_plan_fetches_editions(self):
+        input_dict = {str(i): Token(token=str(i)) for i in range(150)}
+        input_dict["0"].edition = ""
+        plan = planner.plan_fetches(input_dict, planner.fields_for(["holder_counts", "editions"]))
+        assert plan.stages == [
+            planner.PlannedStage("token_accounts", 150, 150),
+            planner.PlannedStage("holders", 150, 2),
+            planner.PlannedStage("editions", 149, 2),
+        ]
+
+    def test_plan_fetches_skip(self):
+        input_dict = {"1": Token(token="1")}
+        plan = planner.plan_fetches(input_dict, {"traits"}, skip={"accounts"})
+        assert [stage.name for stage in plan.stages] == ["metadata"]
+
+    def test_plan_fetches_everything_cached(self):
+        input_dict = {"1": Token(token="1", holder_address="wallet_1")}
+        plan = planner.plan_fetches(input_dict, {"holder_address"})
+        assert plan.stages == []
+        assert "Nothing to fetch" in planner.format_plan(plan, 1)
+
+    def test_format_plan(self):
+        input_dict = {"1": Token(token="1")}
+        plan = planner.plan_fetches(input_dict, {"name"})
+        expected = """
+Fetch plan for 1 tokens
+----------
+Fields needed: name
+accounts: 1 tokens, 1 requests (getAccountInfo for the metadata account, one per token)
+Total requests: 1
+"""
+        assert planner.format_plan(plan, 1) == expected
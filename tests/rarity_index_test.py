@@ -0,0 +1,53 @@
+from util import output
+from util.rarity_index import build_rarity_index
+from util.rarity_state import RarityState
+from util.token import Token
+
+
+def make_index(models=()):
+    input_dict = {
+        "token_1": Token(token="token_1", name="#1", traits={"hair": "white", "eyes": "blue"}),
+        "token_2": Token(token="token_2", name="#2", traits={"hair": "white", "eyes": ""}),
+        "token_3": Token(token="token_3", name="#3", traits={"jacket": "yes"}),
+    }
+    rarity_state = RarityState()
+    rarity_state.sync(input_dict)
+    return build_rarity_index(rarity_state, input_dict, models), input_dict
+
+
+class TestRarityIndex:
+    def test_lookup(self):
+        rarity_index, _ = make_index(["rarity_score"])
+        result = rarity_index.lookup("token_2")
+        assert result["rank"] == 3
+        assert result["rarity"] == 0.2962962962962963
+        assert result["percentile"] == 100.0
+        assert result["models"] == {"rarity_score": {"score": 4.5, "rank": 3}}
+        assert result["traits"][0] == {
+            "trait_type": "hair",
+            "value": "white",
+            "count": 2,
+            "frequency": 2 / 3,
+        }
+
+    def test_rank_range(self):
+        rarity_index, _ = make_index()
+        assert [t["token"] for t in rarity_index.rank_range(2, 5)] == ["token_1", "token_2"]
+        assert [t["token"] for t in rarity_index.top(1)] == ["token_3"]
+        assert [t["token"] for t in rarity_index.top_percent(50)] == ["token_3", "token_1"]
+
+    def test_format_token_rarity_matches_from_scratch(self):
+        rarity_index, input_dict = make_index(["trait_count"])
+        expected = output.format_token_rarity("token_1", input_dict, ["trait_count"])
+        result = output.format_token_rarity("token_1", input_dict, ["trait_count"], rarity_index)
+        assert result == expected
+
+    def test_format_rank_range(self):
+        rarity_index, _ = make_index()
+        expected = """
+Ranks 1-2 of 3
+----------
+1: #3 token_3 (0.07407407407407406996)
+2: #1 token_1 (0.14814814814814813992)
+"""
+        assert output.format_rank_range(rarity_index, 1, 2) == expected
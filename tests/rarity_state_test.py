@@ -0,0 +1,90 @@
+import pickle
+
+from util import output
+from util.rarity_state import RarityState
+from util.token import Token
+
+
+def make_tokens():
+    return {
+        "token_1": Token(token="token_1", traits={"hair": "white", "eyes": "blue"}),
+        "token_2": Token(token="token_2", traits={"hair": "white", "eyes": ""}),
+        "token_3": Token(token="token_3", traits={"jacket": "yes"}),
+    }
+
+
+class TestRarityState:
+    def test_sync_matches_full_recompute(self):
+        input_dict = make_tokens()
+        rarity_state = RarityState()
+        assert rarity_state.sync(input_dict) == {"token_1", "token_2", "token_3"}
+        assert [rarity_state.rank(t) for t in input_dict] == [2, 3, 1]
+        assert rarity_state.rarity("token_2") == 0.2962962962962963
+
+        expected = make_tokens()
+        output.rank_collection(expected)
+        rarity_state.apply(input_dict)
+        for t in input_dict:
+            assert input_dict[t].rank == expected[t].rank
+            assert input_dict[t].rarity == expected[t].rarity
+
+    def test_sync_unchanged(self):
+        input_dict = make_tokens()
+        rarity_state = RarityState()
+        rarity_state.sync(input_dict)
+        assert rarity_state.sync(input_dict) == set()
+
+    def test_sync_only_rescores_affected_tokens(self, mocker):
+        input_dict = make_tokens()
+        input_dict["token_4"] = Token(token="token_4", traits={"hair": "black"})
+        rarity_state = RarityState()
+        rarity_state.sync(input_dict)
+
+        rescore_spy = mocker.spy(rarity_state, "_rescore")
+        input_dict["token_4"].traits = {"hair": "white"}
+        assert rarity_state.sync(input_dict) == {"token_4"}
+        rescored = {call.args[0] for call in rescore_spy.call_args_list}
+        assert rescored == {"token_1", "token_2", "token_4"}
+
+        expected = dict(make_tokens(), token_4=Token(token="token_4", traits={"hair": "white"}))
+        output.rank_collection(expected)
+        for t in input_dict:
+            assert rarity_state.rank(t) == expected[t].rank
+
+    def test_sync_removed_token(self):
+        input_dict = make_tokens()
+        rarity_state = RarityState()
+        rarity_state.sync(input_dict)
+
+        del input_dict["token_3"]
+        assert rarity_state.sync(input_dict) == {"token_3"}
+        assert len(rarity_state) == 2
+        assert rarity_state.code_counts[2] == [2, 0]
+
+    def test_sync_ties_follow_token_order(self):
+        input_dict = {
+            "token_2": Token(token="token_2", traits={"hair": "white"}),
+            "token_3": Token(token="token_3", traits={"hair": "black"}),
+        }
+        rarity_state = RarityState()
+        rarity_state.sync(input_dict)
+        assert [rarity_state.rank(t) for t in input_dict] == [1, 2]
+
+        # A token added ahead of the others in the token list wins the ties, as when ranking from scratch
+        input_dict = {"token_1": Token(token="token_1", traits={"hair": "red"}), **input_dict}
+        assert rarity_state.sync(input_dict) == {"token_1", "token_2", "token_3"}
+        expected = {
+            mint: Token(token=mint, traits=token.traits) for mint, token in input_dict.items()
+        }
+        output.rank_collection(expected)
+        assert [rarity_state.rank(t) for t in input_dict] == [expected[t].rank for t in expected]
+        assert [rarity_state.rank(t) for t in input_dict] == [1, 2, 3]
+
+    def test_generation(self):
+        rarity_state = RarityState()
+        assert RarityState().generation != rarity_state.generation
+        assert pickle.loads(pickle.dumps(rarity_state)).generation == rarity_state.generation
+
+        # States saved before generations existed get one when loaded
+        del rarity_state.generation
+        assert pickle.loads(pickle.dumps(rarity_state)).generation
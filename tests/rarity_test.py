@@ -0,0 +1,41 @@
+import numpy
+
+from util import rarity
+from util.token import Token
+from util.traits import encode_tokens
+
+
+class TestRarity:
+    def test_code_matrix(self):
+        input_dict = {
+            "token_1": Token(token="token_1", traits={"hair": "white", "eyes": "blue"}),
+            "token_2": Token(token="token_2", traits={}),
+            "token_3": Token(token="token_3", traits={"jacket": "yes"}),
+        }
+        encode_tokens({"hair": 0, "eyes": 1, "jacket": 2}, input_dict)
+        tokens, matrix = rarity.code_matrix(input_dict)
+        assert tokens == [input_dict["token_1"], input_dict["token_3"]]
+        assert matrix.tolist() == [[1, 1, 0], [0, 0, 1]]
+
+    def test_count_codes(self):
+        matrix = numpy.array([[1, 1, 0], [1, 0, 0], [0, 0, 1]])
+        result = rarity.count_codes(matrix, [2, 2, 2])
+        assert [counts.tolist() for counts in result] == [[1, 2], [2, 1], [2, 1]]
+
+    def test_score_models(self):
+        matrix = numpy.array([[1, 1, 0], [1, 0, 0], [0, 0, 1]])
+        probabilities = rarity.code_probabilities(rarity.count_codes(matrix, [2, 2, 2]), 3)
+        token_probabilities = rarity.gather(matrix, probabilities)
+        result = rarity.score_models(
+            matrix, token_probabilities, ["statistical", "rarity_score", "trait_count"]
+        )
+        assert numpy.allclose(result["statistical"][0], numpy.log([4 / 27, 8 / 27, 2 / 27]))
+        assert result["statistical"][1].tolist() == [2, 3, 1]
+        assert numpy.allclose(result["rarity_score"][0], [6.0, 4.5, 7.5])
+        assert result["rarity_score"][1].tolist() == [2, 3, 1]
+        assert numpy.allclose(result["trait_count"][0], [1 / 3, 2 / 3, 2 / 3])
+        assert result["trait_count"][1].tolist() == [1, 2, 3]
+
+    def test_ranks_from_scores_breaks_ties_by_order(self):
+        result = rarity.ranks_from_scores(numpy.array([-1.0, -3.0, -1.0, -2.0]))
+        assert result.tolist() == [3, 1, 4, 2]
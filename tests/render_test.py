@@ -0,0 +1,84 @@
+import io
+import json
+
+import pytest
+
+from util import render
+
+
+def write_report(renderer):
+    renderer.begin("Report")
+    renderer.field("total", 3, "Total: 3")
+    renderer.field("hidden", "x", None)
+    renderer.begin_group("details", "Details:", render.UNDERLINE)
+    renderer.begin_list("items", "Items", underline=None)
+    renderer.item({"name": "a", "count": 2}, "a: 2")
+    renderer.item({"name": "b", "count": 1}, "b: 1")
+    renderer.end_list()
+    renderer.begin_list("empty", "Empty", underline=None)
+    renderer.end_list()
+    renderer.end_group()
+    renderer.end()
+
+
+class TestRender:
+    def test_text(self):
+        expected = (
+            "\nReport\n----------\nTotal: 3\n\nDetails:\n----------\n\nItems\na: 2\nb: 1\n\nEmpty\n"
+        )
+        assert render.render_string(write_report) == expected
+
+    def test_markdown(self):
+        expected = (
+            "# Report\n\n- Total: 3\n\n## Details\n\n\n### Items\n\n- a: 2\n- b: 1\n\n### Empty\n\n"
+        )
+        assert render.render_string(write_report, render_format="markdown") == expected
+
+    def test_json(self):
+        result = render.render_string(write_report, render_format="json")
+        assert json.loads(result) == {
+            "total": 3,
+            "hidden": "x",
+            "details": {
+                "items": [{"name": "a", "count": 2}, {"name": "b", "count": 1}],
+                "empty": [],
+            },
+        }
+
+    def test_json_streams(self):
+        stream = io.StringIO()
+        renderer = render.make_renderer("json", stream)
+        renderer.begin()
+        renderer.begin_list("items", "Items")
+        renderer.item({"name": "a"}, "a")
+        assert stream.getvalue() == '{"items": [{"name": "a"}'
+
+    def test_json_lines(self):
+        stream = io.StringIO()
+        renderer = render.make_renderer("json", stream)
+        for report in ("first", "second"):
+            renderer.begin("Report", report)
+            renderer.field("total", 3, "Total: 3")
+            renderer.end()
+        lines = stream.getvalue().splitlines()
+        assert [json.loads(line) for line in lines] == [
+            {"report": "first", "total": 3},
+            {"report": "second", "total": 3},
+        ]
+
+    def test_make_renderer_unknown_format(self):
+        with pytest.raises(ValueError):
+            render.make_renderer("xml", io.StringIO())
+
+    def test_top_items(self):
+        input_dict = {"a": 2, "b": 4, "c": 1, "d": 3, "e": 4}
+        assert render.top_items(input_dict) == [("c", 1), ("a", 2), ("d", 3), ("b", 4), ("e", 4)]
+        assert render.top_items(input_dict, reverse=True) == [
+            ("e", 4),
+            ("b", 4),
+            ("d", 3),
+            ("a", 2),
+            ("c", 1),
+        ]
+        assert render.top_items(input_dict, 2) == [("c", 1), ("a", 2)]
+        assert render.top_items(input_dict, 2, reverse=True) == [("e", 4), ("b", 4)]
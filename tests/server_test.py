@@ -0,0 +1,171 @@
+import os
+import pickle
+
+import pytest
+from aiohttp.test_utils import TestClient
+from aiohttp.test_utils import TestServer
+
+from util import cache
+from util import server
+from util.cache import TokenCache
+from util.server import CollectionIndexes
+from util.server import make_app
+from util.server import QueryService
+from util.token import Token
+
+
+def make_tokens():
+    return {
+        "token_1": Token(
+            token="token_1",
+            name="#1",
+            holder_address="wallet_1",
+            traits={"hair": "white", "eyes": "blue"},
+        ),
+        "token_2": Token(
+            token="token_2", name="#2", holder_address="wallet_2", traits={"hair": "white"}
+        ),
+        "token_3": Token(
+            token="token_3", name="#3", holder_address="wallet_1", traits={"jacket": "yes"}
+        ),
+    }
+
+
+@pytest.fixture
+def token_cache(monkeypatch, tmp_path):
+    monkeypatch.setattr(cache, "CACHE_DIR", str(tmp_path))
+    token_cache = TokenCache()
+    token_cache.initialize("test")
+    token_cache.save(make_tokens())
+    return token_cache
+
+
+def make_client(token_cache):
+    service = QueryService({"test": token_cache})
+    service.load()
+    return TestClient(TestServer(make_app(service, reload_interval=None)))
+
+
+class TestCollectionIndexes:
+    def test_lookups(self):
+        indexes = CollectionIndexes("test", make_tokens(), ["trait_count"])
+        assert indexes.token_rarity("token_3")["rank"] == 1
+        assert indexes.token_rarity("token_3")["models"]["trait_count"]["rank"] == 2
+        assert indexes.token_rarity("token_4") is None
+        assert indexes.wallet_holdings("wallet_1") == {
+            "holder": "wallet_1",
+            "marketplace": None,
+            "count": 2,
+            "tokens": [{"token": "token_1", "name": "#1"}, {"token": "token_3", "name": "#3"}],
+        }
+        assert indexes.holder_counts[0] == {"holder": "wallet_1", "count": 2, "marketplace": None}
+
+
+class TestQueryService:
+    @pytest.mark.asyncio
+    async def test_reload_changed(self, token_cache):
+        service = QueryService({"test": token_cache})
+        service.load()
+        assert await service.reload_changed() == []
+
+        all_tokens = make_tokens()
+        all_tokens["token_2"].holder_address = "wallet_1"
+        token_cache.save(all_tokens)
+        os.utime(token_cache.path, (0, service.collections["test"].cached_at + 1))
+        assert await service.reload_changed() == ["test"]
+        assert service.collections["test"].wallet_holdings("wallet_1")["count"] == 3
+
+    @pytest.mark.asyncio
+    async def test_reload_changed_failure(self, mocker, token_cache):
+        service = QueryService({"test": token_cache})
+        service.load()
+        old = service.collections["test"]
+        os.utime(token_cache.path, (0, old.cached_at + 1))
+        mocker.patch.object(server, "CollectionIndexes", side_effect=RuntimeError("bad cache"))
+        assert await service.reload_changed() == []
+        assert service.collections["test"] is old
+
+    @pytest.mark.asyncio
+    async def test_reload_changed_unreadable_cache(self, token_cache):
+        service = QueryService({"test": token_cache})
+        service.load()
+        old = service.collections["test"]
+
+        # A cache caught part way through being written, or written out empty, doesn't replace the data being served
+        for contents in (token_cache.path.read_bytes()[:20], pickle.dumps({})):
+            token_cache.path.write_bytes(contents)
+            os.utime(token_cache.path, (0, old.cached_at + 1))
+            assert await service.reload_changed() == []
+            assert service.collections["test"] is old
+            response = service.collections["test"].wallet_holdings("wallet_1")
+            assert response["count"] == 2
+
+    def test_load_missing_cache(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(cache, "CACHE_DIR", str(tmp_path))
+        token_cache = TokenCache()
+        token_cache.initialize("missing")
+        service = QueryService({"missing": token_cache})
+        service.load()
+        assert service.collections == {}
+
+
+class TestEndpoints:
+    @pytest.mark.asyncio
+    async def test_collections(self, token_cache):
+        async with make_client(token_cache) as client:
+            response = await client.get("/collections")
+            assert response.status == 200
+            result = await response.json()
+            assert [(c["name"], c["tokens"]) for c in result] == [("test", 3)]
+
+    @pytest.mark.asyncio
+    async def test_token_rarity(self, token_cache):
+        async with make_client(token_cache) as client:
+            response = await client.get("/collections/test/tokens/token_1/rarity")
+            assert response.status == 200
+            result = await response.json()
+            assert result["token"] == "token_1"
+            assert result["rank"] == 2
+
+            response = await client.get("/collections/test/tokens/token_4/rarity")
+            assert response.status == 404
+            assert (await response.json())["error"] == "No rarity data for token token_4"
+
+    @pytest.mark.asyncio
+    async def test_unknown_collection(self, token_cache):
+        async with make_client(token_cache) as client:
+            response = await client.get("/collections/other/holders")
+            assert response.status == 404
+
+    @pytest.mark.asyncio
+    async def test_wallet_holdings(self, token_cache):
+        async with make_client(token_cache) as client:
+            response = await client.get("/collections/test/wallets/wallet_2")
+            result = await response.json()
+            assert result["count"] == 1
+            assert result["tokens"] == [{"token": "token_2", "name": "#2"}]
+
+    @pytest.mark.asyncio
+    async def test_holder_counts(self, token_cache):
+        async with make_client(token_cache) as client:
+            result = await (await client.get("/collections/test/holders")).json()
+            assert result["tokens"] == 3
+            assert result["holders"] == 2
+            assert [h["holder"] for h in result["biggest_holders"]] == ["wallet_1", "wallet_2"]
+
+            result = await (await client.get("/collections/test/holders?top=1")).json()
+            assert len(result["biggest_holders"]) == 1
+            for top in ("many", "0", "-1"):
+                response = await client.get(f"/collections/test/holders?top={top}")
+                assert response.status == 400
+                assert (await response.json())["error"] == f"Invalid top {top}"
+
+    @pytest.mark.asyncio
+    async def test_trait_distribution(self, token_cache):
+        async with make_client(token_cache) as client:
+            result = await (await client.get("/collections/test/traits")).json()
+            assert result["tokens_with_metadata"] == 3
+            assert result["attributes"]["hair"] == [
+                {"value": "", "count": 1, "frequency": 1 / 3},
+                {"value": "white", "count": 2, "frequency": 2 / 3},
+            ]
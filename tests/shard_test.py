@@ -0,0 +1,57 @@
+from util import cache
+from util.cache import TokenCache
+from util.shard import merge_shard_caches
+from util.shard import merge_tokens
+from util.shard import shard_cache_key
+from util.shard import shard_of
+from util.shard import shard_tokens
+from util.token import Token
+
+
+class TestShard:
+    def test_shard_of(self):
+        token_list = [f"token_{i}" for i in range(100)]
+        shards = [shard_tokens(token_list, index, 4) for index in range(4)]
+        # Every token is in exactly one shard, and the split doesn't depend on the order of the token list
+        assert sorted(mint for shard in shards for mint in shard) == sorted(token_list)
+        assert all(shard for shard in shards)
+        assert shard_tokens(list(reversed(token_list)), 1, 4) == list(reversed(shards[1]))
+        assert shard_of("token_1", 4) == shard_of("token_1", 4)
+        assert shard_of("token_1", 1) == 0
+
+    def test_shard_cache_key(self):
+        assert shard_cache_key("tokenlist_mf", 2, 8) == "tokenlist_mf_shard2of8"
+
+    def test_merge_tokens(self):
+        all_tokens = {
+            "1": Token(token="1", holder_address="wallet_1", amount="1", name="#1"),
+            "2": Token(token="2", holder_address="wallet_1", amount="1"),
+        }
+        all_tokens["1"].fetched_at = {"holders": 200, "accounts": 100}
+        all_tokens["2"].fetched_at = {"holders": 200}
+        shard = {
+            "1": Token(token="1", holder_address="wallet_2", amount="1", name="#1 new"),
+            "2": Token(token="2", holder_address="wallet_3", amount="1"),
+            "3": Token(token="3", holder_address="wallet_3", amount="1"),
+        }
+        shard["1"].fetched_at = {"holders": 100, "accounts": 300}
+        shard["2"].fetched_at = {"holders": 300}
+
+        assert merge_tokens(all_tokens, shard) == 3
+        # Older holder data doesn't replace newer, but newer account data does
+        assert all_tokens["1"].holder_address == "wallet_1"
+        assert all_tokens["1"].name == "#1 new"
+        assert all_tokens["1"].fetched_at == {"holders": 200, "accounts": 300}
+        assert all_tokens["2"].holder_address == "wallet_3"
+        assert all_tokens["3"] is shard["3"]
+
+    def test_merge_shard_caches(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(cache, "CACHE_DIR", str(tmp_path))
+        for index in (0, 2):
+            shard_cache = TokenCache()
+            shard_cache.initialize(shard_cache_key("test", index, 3))
+            shard_cache.save({str(index): Token(token=str(index), holder_address="wallet_1")})
+
+        all_tokens = {}
+        assert merge_shard_caches(all_tokens, "test", 3) == 2
+        assert set(all_tokens) == {"0", "2"}
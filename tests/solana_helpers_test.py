@@ -5,36 +5,113 @@ import base58
 import pytest
 from solana.rpc.async_api import AsyncClient
 
+from util import cache
 from util import solana_helpers
+from util.offload import CpuPool
 from util.token import Token
 
 
 class TestSolanaHelpers:
-    def test_get_token_list_from_candymachine_id(self, mocker):
-        client_mock = mocker.patch("solana.rpc.api.Client")
-        client_mock.return_value.get_program_accounts.return_value = {
-            "result": [{"account": {"data": [base64.b64encode(b"0" * 33 + b"123456789")]}}]
-        }
+    @pytest.fixture
+    def gpa_client(self, mocker, monkeypatch, tmp_path):
+        """A Solana client whose getProgramAccounts finds a mint in the first partition, and one in the last"""
+        monkeypatch.setattr(cache, "CACHE_DIR", str(tmp_path))
+        client_mock = mocker.MagicMock(AsyncClient)
+
+        async def get_program_accounts(program, encoding, data_size, memcmp_opts):
+            prefix = base58.b58decode(memcmp_opts[-1].bytes)
+            if prefix not in (b"\x00", b"\xff"):
+                return {"result": []}
+            data = base64.b64encode(b"0" * 33 + prefix + b"123456789")
+            return {"result": [{"account": {"data": [data]}}]}
+
+        client_mock.get_program_accounts.side_effect = get_program_accounts
+        client_mock.__aenter__.return_value = client_mock
+        mocker.patch.object(solana_helpers, "create_solana_client").return_value = client_mock
+        return client_mock
+
+    def test_get_token_list_from_candymachine_id(self, gpa_client):
         test_cm_id = "4wTTi885HkQ6awqRGQkHAdXXzE46DyqLNXtfo1uz5ub3"  # Mindfolk
-        expected = [base58.b58encode("123456789").decode()]
+        expected = [
+            base58.b58encode(b"\x00123456789").decode(),
+            base58.b58encode(b"\xff123456789").decode(),
+        ]
 
         result = solana_helpers.get_token_list_from_candymachine_id(test_cm_id)
-        client_mock.assert_called_once_with("https://rpc.theindex.io", timeout=30)
-        client_mock.return_value.get_program_accounts.assert_called_once()
+        assert gpa_client.get_program_accounts.call_count == solana_helpers.DISCOVERY_PARTITIONS
+        memcmp_opts = gpa_client.get_program_accounts.call_args.kwargs["memcmp_opts"]
+        assert memcmp_opts[0].bytes == test_cm_id
+        assert memcmp_opts[1].offset == solana_helpers.MINT_OFFSET
         assert result == expected
 
-    def test_get_token_list_from_candymachine_id_v2(self, mocker):
-        client_mock = mocker.patch("solana.rpc.api.Client")
-        client_mock.return_value.get_program_accounts.return_value = {
-            "result": [{"account": {"data": [base64.b64encode(b"0" * 33 + b"123456789")]}}]
-        }
+    def test_get_token_list_from_candymachine_id_v2(self, gpa_client):
         test_cm_id = "HHGsTSzwPpYMYDGgUqssgAsMZMsYbshgrhMge8Ypgsjx"  # DTP CMv2
-        expected = [base58.b58encode("123456789").decode()]
 
         result = solana_helpers.get_token_list_from_candymachine_id(test_cm_id, use_v2=True)
-        client_mock.assert_called_once_with("https://rpc.theindex.io", timeout=30)
-        client_mock.return_value.get_program_accounts.assert_called_once()
-        assert result == expected
+        memcmp_opts = gpa_client.get_program_accounts.call_args.kwargs["memcmp_opts"]
+        # Filtered on the Candy Machine's PDA rather than its ID
+        assert memcmp_opts[0].bytes != test_cm_id
+        assert len(result) == 2
+
+    def test_get_token_list_from_sources(self, gpa_client):
+        test_cm_id = "4wTTi885HkQ6awqRGQkHAdXXzE46DyqLNXtfo1uz5ub3"  # Mindfolk
+        sources = [("cmid", test_cm_id), ("creator", test_cm_id)]
+
+        result = solana_helpers.get_token_list_from_sources(sources)
+        assert gpa_client.get_program_accounts.call_count == 2 * solana_helpers.DISCOVERY_PARTITIONS
+        # Both sources find the same mints, which are only listed once
+        assert len(result) == 2
+
+    def test_creator_searches(self):
+        test_creator = "4wTTi885HkQ6awqRGQkHAdXXzE46DyqLNXtfo1uz5ub3"
+        [(checkpoint, memcmp_opts)] = solana_helpers.creator_searches(test_creator)
+        assert checkpoint.key == f"creator_{test_creator}"
+        assert [(opts.offset, opts.bytes) for opts in memcmp_opts] == [
+            (solana_helpers.CREATOR_ARRAY_START, test_creator),
+            (solana_helpers.CREATOR_ARRAY_START + 32, "2"),  # verified
+        ]
+
+    def test_collection_searches(self):
+        test_collection = "4wTTi885HkQ6awqRGQkHAdXXzE46DyqLNXtfo1uz5ub3"
+        searches = solana_helpers.collection_searches(test_collection)
+        # A search for each number of creators, and each combination of edition nonce and token standard lengths
+        assert len(searches) == solana_helpers.MAX_CREATOR_LIMIT * 3
+        assert len({checkpoint.key for checkpoint, _ in searches}) == len(searches)
+        creators_opts, collection_opts = searches[0][1]
+        assert base58.b58decode(creators_opts.bytes) == b"\x01\x00\x00\x00"
+        # One creator, no edition nonce or token standard
+        assert collection_opts.offset == 326 + 34 + 2 + 1 + 1
+        assert base58.b58decode(collection_opts.bytes) == b"\x01\x01" + base58.b58decode(
+            test_collection
+        )
+
+    @pytest.mark.asyncio
+    async def test_discover_mints_async_resumes(self, gpa_client, mocker):
+        checkpoint = cache.DiscoveryCheckpoint("test")
+        checkpoint.save(b"\x00", ["already_found", "duplicate"])
+        checkpoint.save(b"\x01", ["duplicate"])
+        retry = solana_helpers.get_partition_from_solana_async.retry
+        mocker.patch.object(retry, "sleep", mocker.AsyncMock())
+        fetch_partition = gpa_client.get_program_accounts.side_effect
+
+        async def flaky_partition(program, encoding, data_size, memcmp_opts):
+            if base58.b58decode(memcmp_opts[-1].bytes) == b"\x02":
+                raise ValueError("cut off")
+            return await fetch_partition(program, encoding, data_size, memcmp_opts)
+
+        gpa_client.get_program_accounts.side_effect = flaky_partition
+        with pytest.raises(RuntimeError):
+            await solana_helpers.discover_mints_async([(checkpoint, [])])
+        # The partitions that were already fetched weren't fetched again, and the ones that were are kept
+        assert gpa_client.get_program_accounts.call_count == 254 + 2
+        assert len(checkpoint.load()) == 255
+
+        gpa_client.get_program_accounts.reset_mock()
+        gpa_client.get_program_accounts.side_effect = fetch_partition
+        result = await solana_helpers.discover_mints_async([(checkpoint, [])])
+        assert gpa_client.get_program_accounts.call_count == 1
+        assert result == ["already_found", "duplicate", base58.b58encode(b"\xff123456789").decode()]
+        assert checkpoint.load() == {}
 
     def test_create_solana_client(self):
         result = solana_helpers.create_solana_client()
@@ -121,6 +198,59 @@ class TestSolanaHelpers:
         assert input_token.amount == 0
         assert input_token.holder_address == ""
 
+    def test_group_by_token_account(self):
+        input_dict = {
+            "token_1": Token(token="token_1", token_account="account_1"),
+            "token_2": Token(token="token_2", token_account="account_1"),
+            "token_3": Token(token="token_3", token_account=""),
+            "token_4": Token(token="token_4", token_account="account_4", holder_address="owner"),
+        }
+        result = solana_helpers.group_by_token_account(input_dict)
+        assert result == {"account_1": ["token_1", "token_2"]}
+        assert input_dict["token_3"].holder_address == ""
+        assert solana_helpers.holder_chunks({str(i): [] for i in range(5)}, size=2) == [
+            ["0", "1"],
+            ["2", "3"],
+            ["4"],
+        ]
+
+    @pytest.mark.asyncio
+    async def test_get_holder_chunk_from_solana_async(self, mocker):
+        client_mock = mocker.MagicMock(AsyncClient)
+        client_mock.get_multiple_accounts.return_value = {
+            "result": {
+                "context": {"slot": 5},
+                "value": [
+                    {
+                        "data": {
+                            "parsed": {"info": {"owner": "test1", "tokenAmount": {"amount": 1}}}
+                        }
+                    },
+                    None,
+                ],
+            }
+        }
+        input_dict = {
+            "token_1": Token(token="token_1", token_account="account_1"),
+            "token_2": Token(token="token_2", token_account="account_2"),
+        }
+        owner_accounts = solana_helpers.group_by_token_account(input_dict)
+
+        result = await solana_helpers.get_holder_chunk_from_solana_async(
+            client_mock,
+            input_dict,
+            owner_accounts,
+            ["account_1", "account_2"],
+            aiolimiter.AsyncLimiter(1, 1),
+        )
+        client_mock.get_multiple_accounts.assert_called_once_with(
+            ["account_1", "account_2"], encoding="jsonParsed"
+        )
+        assert result == input_dict
+        assert input_dict["token_1"].holder_address == "test1"
+        assert input_dict["token_1"].holder_slot == 5
+        assert input_dict["token_2"].holder_address == ""
+
     @pytest.mark.asyncio
     async def test_get_account_info_from_solana_async(self, mocker):
         client_mock = mocker.MagicMock(AsyncClient)
@@ -146,3 +276,72 @@ class TestSolanaHelpers:
         assert input_token.name == "String #2"
         assert input_token.id == "2"
         assert input_token.data_uri == "https://www.google.com"
+
+    @pytest.mark.asyncio
+    async def test_get_account_info_from_solana_async_with_no_data(self, mocker):
+        client_mock = mocker.MagicMock(AsyncClient)
+        client_mock.get_account_info.return_value = {
+            "result": {"value": {"data": [base64.b64encode(b"123456789")]}}
+        }
+        metadata_mock = mocker.patch.object(solana_helpers, "metadata")
+        metadata_mock.get_metadata_account.return_value = "string1"
+        metadata_mock.unpack_metadata_account.return_value = {}
+        input_token = Token(token="7z1YPxYiKK3c8ZgC4eEaA3dZDCb88LK34Nk4yGBeZnao")
+
+        with CpuPool() as pool:
+            result = await solana_helpers.get_account_info_from_solana_async(
+                client_mock, input_token, aiolimiter.AsyncLimiter(1000, 1), pool
+            )
+        assert result == input_token
+        assert input_token.name is None
+
+    def test_decode_mints(self):
+        mints = [f"{i}23456789" for i in range(1, 6)]
+        encoded = [base64.b64encode(b"0" * 33 + mint.encode()) for mint in mints]
+        expected = [base58.b58encode(mint).decode() for mint in mints]
+
+        assert solana_helpers.decode_mints(encoded) == expected
+        # Split into batches across worker processes, and put back together in order
+        with CpuPool(2, batch_size=2) as pool:
+            assert pool.map(solana_helpers.decode_mints, encoded) == expected
+
+    def test_metadata_accounts(self):
+        test_token = "7z1YPxYiKK3c8ZgC4eEaA3dZDCb88LK34Nk4yGBeZnao"  # Mindfolk Founders #176
+        with CpuPool(1) as pool:
+            result = pool.map(solana_helpers.metadata_accounts, [test_token])
+        assert result == solana_helpers.metadata_accounts([test_token])
+        assert isinstance(result[0], str)
+
+    @pytest.mark.asyncio
+    async def test_get_edition_chunk_from_solana_async(self, mocker):
+        input_dict = {mint: Token(token=mint) for mint in ("1", "2", "3", "4")}
+        input_dict["4"].edition = "master"
+        mocker.patch.object(
+            solana_helpers, "edition_accounts", side_effect=lambda mints: [f"e_{m}" for m in mints]
+        )
+        client_mock = mocker.MagicMock(AsyncClient)
+        client_mock.get_multiple_accounts.return_value = {
+            "result": {
+                "value": [
+                    {"data": [base64.b64encode(b"\x06" + b"0" * 281)]},
+                    {"data": [base64.b64encode(b"\x01" + b"0" * 40)]},
+                    None,
+                ]
+            }
+        }
+
+        [chunk] = solana_helpers.edition_chunks(input_dict)
+        assert chunk == ["1", "2", "3"]
+        await solana_helpers.get_edition_chunk_from_solana_async(
+            client_mock, input_dict, chunk, aiolimiter.AsyncLimiter(1000, 1)
+        )
+        client_mock.get_multiple_accounts.assert_called_once_with(
+            ["e_1", "e_2", "e_3"], encoding="base64"
+        )
+        assert [token.edition for token in input_dict.values()] == ["master", "print", "", "master"]
+        assert solana_helpers.edition_chunks(input_dict) == []
+
+    def test_edition_accounts(self):
+        test_token = "7z1YPxYiKK3c8ZgC4eEaA3dZDCb88LK34Nk4yGBeZnao"  # Mindfolk Founders #176
+        [edition_account] = solana_helpers.edition_accounts([test_token])
+        assert edition_account != solana_helpers.metadata_accounts([test_token])[0]
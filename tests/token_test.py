@@ -1,4 +1,5 @@
 from util import token
+from util.traits import encode_tokens
 
 
 class TestToken:
@@ -16,6 +17,23 @@ class TestToken:
         result = token.get_attribute_counts(trait_map, input_dict)
         assert result == expected
 
+    def test_count_trait_codes(self):
+        input_dict = {
+            "token_1": token.Token(token="token_1", traits={"hair": "white", "eyes": "blue"}),
+            "token_2": token.Token(token="token_2", traits={"hair": "white", "eyes": ""}),
+            "token_3": token.Token(token="token_3", traits={"jacket": "yes"}),
+            "token_4": token.Token(token="token_4", traits={}),
+        }
+        vocabulary = encode_tokens({"hair": 0, "eyes": 1, "jacket": 2}, input_dict)
+        result = token.count_trait_codes(vocabulary, input_dict)
+        assert result[0] == 3
+        assert [counts.tolist() for counts in result[1]] == [[1, 2], [2, 1], [2, 1]]
+        assert token.code_counts_to_dict(vocabulary, result[1]) == {
+            "hair": {"white": 2, "": 1},
+            "eyes": {"blue": 1, "": 2},
+            "jacket": {"": 2, "yes": 1},
+        }
+
     def test_get_attribute_rarities(self):
         attr_counts = {
             "hair": {"white": 2, "": 1},
@@ -49,3 +67,14 @@ class TestToken:
         assert input_dict["token_2"].rank == 3
         assert input_dict["token_3"].rarity == 0.07407407407407407
         assert input_dict["token_3"].rank == 1
+
+    def test_filter_editions(self):
+        input_dict = {mint: token.Token(token=mint) for mint in ("1", "2", "3", "4")}
+        input_dict["1"].edition = "master"
+        input_dict["2"].edition = "print"
+        input_dict["3"].edition = ""
+
+        assert token.filter_editions(input_dict, None) is input_dict
+        # Token 4's edition isn't known, so it's kept
+        assert set(token.filter_editions(input_dict, ["master", "none"])) == {"1", "3", "4"}
+        assert set(token.filter_editions(input_dict, ["print"])) == {"2", "4"}
@@ -0,0 +1,59 @@
+import pytest
+
+from util import trait_index
+from util.token import Token
+
+
+def make_index():
+    input_dict = {
+        "token_1": Token(token="token_1", traits={"Background": "Gold", "Eyes": "Laser"}),
+        "token_2": Token(token="token_2", traits={"Background": "Gold", "Eyes": "Sleepy"}),
+        "token_3": Token(token="token_3", traits={"Background": "Blue Sky", "Level": 5}),
+        "token_4": Token(token="token_4", traits={}),
+    }
+    return trait_index.TraitIndex(input_dict, {"Background": 0, "Eyes": 1, "Level": 2})
+
+
+class TestTraitIndex:
+    def test_query_and(self):
+        result = make_index().query("Background=Gold AND Eyes=Laser")
+        assert result == ["token_1"]
+
+    def test_query_or_with_spaces_and_numbers(self):
+        result = make_index().query("Background = Blue Sky OR Level=5 OR Eyes=Laser")
+        assert result == ["token_1", "token_3"]
+
+    def test_query_not_and_parentheses(self):
+        result = make_index().query("NOT (Background=Gold AND NOT Eyes=Sleepy)")
+        assert result == ["token_2", "token_3", "token_4"]
+
+    def test_query_missing_trait(self):
+        result = make_index().query("Eyes= AND Background=Blue Sky")
+        assert result == ["token_3"]
+
+    def test_query_no_traits(self):
+        # A token without traits matches every empty value, consistently with NOT on a real value
+        index = make_index()
+        assert index.query("Eyes=") == ["token_3", "token_4"]
+        assert index.query("NOT Eyes=Laser AND NOT Eyes=Sleepy") == ["token_3", "token_4"]
+        assert index.query("Background= OR Level=") == ["token_1", "token_2", "token_4"]
+
+    def test_query_unknown_value(self):
+        assert make_index().query("Eyes=Closed") == []
+
+    def test_query_unknown_trait_type_raises(self):
+        with pytest.raises(ValueError):
+            make_index().query("Hat=Cap")
+
+    def test_query_invalid_raises(self):
+        with pytest.raises(ValueError):
+            make_index().query("(Background=Gold AND")
+
+    def test_holders_for(self):
+        input_dict = {
+            "token_1": Token(token="token_1", holder_address="wallet_1"),
+            "token_2": Token(token="token_2", holder_address="wallet_2"),
+            "token_3": Token(token="token_3", holder_address="wallet_1"),
+        }
+        result = trait_index.holders_for(input_dict, ["token_1", "token_2", "token_3"])
+        assert result == {"wallet_1": ["token_1", "token_3"], "wallet_2": ["token_2"]}
@@ -0,0 +1,35 @@
+from util import traits
+from util.token import Token
+
+
+class TestTraits:
+    def test_encode(self):
+        vocabulary = traits.TraitVocabulary({"hair": 0, "eyes": 1})
+        assert vocabulary.encode({"hair": "white", "eyes": "blue"}) == (1, 1)
+        assert vocabulary.encode({"eyes": "green"}) == (0, 2)
+        assert vocabulary.encode({"hair": "white", "eyes": ""}) == (1, traits.NONE_CODE)
+        assert vocabulary.values == [["", "white"], ["", "blue", "green"]]
+
+    def test_decode(self):
+        vocabulary = traits.TraitVocabulary({"hair": 0, "eyes": 1})
+        codes = vocabulary.encode({"eyes": "blue"})
+        assert vocabulary.decode(codes) == ["", "blue"]
+
+    def test_encode_new_trait_type(self):
+        vocabulary = traits.TraitVocabulary({"hair": 0})
+        assert vocabulary.encode({"jacket": "yes"}) == (0, 1)
+        assert vocabulary.trait_map == {"hair": 0, "jacket": 1}
+
+    def test_encode_tokens(self):
+        input_dict = {
+            "token_1": Token(token="token_1", traits={"hair": "white", "eyes": "blue"}),
+            "token_2": Token(token="token_2", traits={"hair": "white", "eyes": ""}),
+            "token_3": Token(token="token_3", traits={"jacket": "yes"}),
+            "token_4": Token(token="token_4", traits={}),
+        }
+        vocabulary = traits.encode_tokens({"hair": 0, "eyes": 1, "jacket": 2}, input_dict)
+        assert len(vocabulary) == 3
+        assert input_dict["token_1"].trait_codes == (1, 1, 0)
+        assert input_dict["token_2"].trait_codes == (1, 0, 0)
+        assert input_dict["token_3"].trait_codes == (0, 0, 1)
+        assert input_dict["token_4"].trait_codes is None
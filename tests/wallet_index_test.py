@@ -0,0 +1,56 @@
+from util.deadline import MISSING
+from util.deadline import STALE
+from util.token import Token
+from util.wallet_index import WalletIndex
+
+
+def make_tokens():
+    return {
+        "token_1": Token(token="token_1", holder_address="wallet_1"),
+        "token_2": Token(token="token_2", holder_address="wallet_2"),
+        "token_3": Token(token="token_3", holder_address="wallet_1"),
+        "token_4": Token(token="token_4", holder_address=None),
+    }
+
+
+class TestWalletIndex:
+    def test_sync(self):
+        wallet_index = WalletIndex()
+        assert wallet_index.sync(make_tokens()) == {"token_1", "token_2", "token_3"}
+        assert wallet_index.tokens_for("wallet_1") == ["token_1", "token_3"]
+        assert wallet_index.count("wallet_2") == 1
+        assert wallet_index.counts() == {"wallet_1": 2, "wallet_2": 1}
+        assert wallet_index.top() == [("wallet_1", 2), ("wallet_2", 1)]
+
+    def test_sync_transfer(self):
+        input_dict = make_tokens()
+        wallet_index = WalletIndex()
+        wallet_index.sync(input_dict)
+
+        input_dict["token_1"].holder_address = "wallet_2"
+        input_dict["token_4"].holder_address = "wallet_2"
+        assert wallet_index.sync(input_dict) == {"token_1", "token_4"}
+        assert wallet_index.tokens_for("wallet_1") == ["token_3"]
+        assert wallet_index.top(1) == [("wallet_2", 3)]
+
+    def test_sync_removed_token(self):
+        input_dict = make_tokens()
+        wallet_index = WalletIndex()
+        wallet_index.sync(input_dict)
+
+        del input_dict["token_2"]
+        assert wallet_index.sync(input_dict) == {"token_2"}
+        assert wallet_index.count("wallet_2") == 0
+        assert len(wallet_index) == 1
+
+    def test_sync_skips_flagged_tokens(self):
+        input_dict = make_tokens()
+        wallet_index = WalletIndex()
+        wallet_index.sync(input_dict)
+
+        input_dict["token_1"].holder_address = None
+        input_dict["token_1"].data_status = MISSING
+        input_dict["token_3"].holder_address = "wallet_2"
+        input_dict["token_3"].data_status = STALE
+        assert wallet_index.sync(input_dict) == set()
+        assert wallet_index.tokens_for("wallet_1") == ["token_1", "token_3"]
@@ -0,0 +1,194 @@
+import asyncio
+import collections
+import json
+import logging
+from pathlib import Path
+from typing import Callable
+from typing import NamedTuple
+
+from util.daemon import DEFAULT_INTERVALS
+
+logger = logging.getLogger("nft_snapshot.util.batch")
+
+BATCH_REPORTS = ("holder_counts", "attributes", "snapshot")
+
+# Requests per second allowed to each provider (Solana RPC, metadata hosts), shared by every collection in a batch
+DEFAULT_REQUESTS_PER_SECOND = 100
+# Requests in flight at once across the whole batch
+DEFAULT_CONCURRENCY = 50
+
+
+class CollectionJob(NamedTuple):
+    """A collection to process in a batch, and which reports to produce for it"""
+
+    name: str
+    token_file: str
+    candymachine_id: str = None
+    cmv2: bool = False
+    reports: tuple = ()
+    outfile_name: str = None
+    rarity_models: tuple = ()
+    top: int = None
+    # With --daemon, how often to run each of daemon.DEFAULT_INTERVALS' tasks, where not the default
+    intervals: dict = None
+    # With --daemon, whether to write the changes since the last snapshot with each snapshot
+    diff: bool = False
+
+    @property
+    def cache_key(self) -> str:
+        return self.token_file.split(".")[0]
+
+
+def load_manifest(manifest_name: str) -> (list, dict):
+    """Read a batch manifest: a JSON object with a "collections" list, each entry giving a collection's token_file
+    and/or cmid (and cmv2), the reports to produce (any of BATCH_REPORTS), and optionally a name, snapshot_file,
+    rarity_models and top, plus intervals and diff for --daemon. The object can also set requests_per_second and
+    concurrency for the whole batch.
+
+    :param manifest_name: Name of the manifest file
+    :return: list of CollectionJobs; dict of batch settings
+    """
+    with open(manifest_name) as manifest_file:
+        manifest = json.load(manifest_file)
+
+    jobs = []
+    for entry in manifest.get("collections", []):
+        cmid = entry.get("cmid")
+        if not entry.get("token_file") and not cmid:
+            raise ValueError("Each collection in a batch manifest needs a token_file or cmid")
+        name = entry.get("name") or cmid or Path(entry["token_file"]).stem
+        unknown = set(entry.get("reports", [])) - set(BATCH_REPORTS)
+        if unknown:
+            raise ValueError(f"Unknown reports for {name}: {', '.join(sorted(unknown))}")
+        unknown = set(entry.get("intervals", {})) - set(DEFAULT_INTERVALS)
+        if unknown:
+            raise ValueError(f"Unknown intervals for {name}: {', '.join(sorted(unknown))}")
+        top = entry.get("top")
+        if top is not None and (not isinstance(top, int) or top < 1):
+            raise ValueError(f"The top for {name} needs to be a whole number of at least 1")
+        jobs.append(
+            CollectionJob(
+                name=name,
+                token_file=entry.get("token_file") or f"tokenlist_{name}.txt",
+                candymachine_id=cmid,
+                cmv2=entry.get("cmv2", False),
+                reports=tuple(entry.get("reports", [])),
+                outfile_name=entry.get("snapshot_file") or f"{name}_snapshot.csv",
+                rarity_models=tuple(entry.get("rarity_models", [])),
+                top=top,
+                intervals=entry.get("intervals"),
+                diff=entry.get("diff", False),
+            )
+        )
+    if len({job.cache_key for job in jobs}) != len(jobs):
+        raise ValueError("Collections in a batch manifest need different token files")
+
+    settings = {
+        "requests_per_second": manifest.get("requests_per_second", DEFAULT_REQUESTS_PER_SECOND),
+        "concurrency": manifest.get("concurrency", DEFAULT_CONCURRENCY),
+    }
+    return jobs, settings
+
+
+class FairScheduler:
+    """Runs requests for several collections at once, with a cap on how many are in flight. Collections with work
+    waiting take turns, one request each, so a big collection can't hold up the small ones behind it.
+    """
+
+    def __init__(self, concurrency: int = DEFAULT_CONCURRENCY):
+        """
+        :param concurrency: How many requests to have in flight at once
+        """
+        self.concurrency = concurrency
+        # Work waiting per collection, and the collections with work waiting in the order they get their turns
+        self.queues = collections.defaultdict(collections.deque)
+        self.turns = collections.deque()
+        self.ready = asyncio.Event()
+        self.workers = []
+
+    async def __aenter__(self) -> "FairScheduler":
+        self.workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+
+    async def run(self, name: str, work: list, timeout: float = None) -> list:
+        """Queue up a collection's requests and wait for them all to finish
+
+        :param name: The collection's name
+        :param work: list of functions taking no arguments that return the awaitable for each request
+        :param timeout: Seconds to wait for them, if any. Requests that haven't finished by then are cancelled,
+            whether they're still queued or in flight.
+        :return: list of the results, in the same order as work (with the exception in place of any that failed, and
+            asyncio.TimeoutError in place of any the timeout cut short)
+        """
+        loop = asyncio.get_running_loop()
+        queue = self.queues[name]
+        if work and not queue:
+            self.turns.append(name)
+        futures = []
+        for fn in work:
+            future = loop.create_future()
+            queue.append((fn, future))
+            futures.append(future)
+        self.ready.set()
+        if not futures:
+            return []
+        try:
+            await asyncio.wait(futures, timeout=timeout)
+        finally:
+            for future in futures:
+                future.cancel()
+        return [_outcome(future) for future in futures]
+
+    def _next(self) -> tuple:
+        if not self.turns:
+            return None
+        name = self.turns.popleft()
+        queue = self.queues[name]
+        item = queue.popleft()
+        if queue:
+            self.turns.append(name)
+        return item
+
+    async def _worker(self) -> None:
+        while True:
+            item = self._next()
+            if item is None:
+                self.ready.clear()
+                await self.ready.wait()
+                continue
+            fn, future = item
+            await _resolve(fn, future)
+
+
+async def _resolve(fn: Callable, future: asyncio.Future) -> None:
+    if future.done():
+        # Cancelled by a run that timed out before the request got its turn
+        return
+    task = asyncio.ensure_future(fn())
+    # A run that times out cancels its requests in flight too
+    future.add_done_callback(lambda _: task.cancel())
+    try:
+        await asyncio.wait([task])
+    except asyncio.CancelledError:
+        # The scheduler is shutting down
+        task.cancel()
+        raise
+    if future.done():
+        return
+    if task.cancelled():
+        future.cancel()
+    elif task.exception() is not None:
+        future.set_exception(task.exception())
+    else:
+        future.set_result(task.result())
+
+
+def _outcome(future: asyncio.Future):
+    if future.cancelled():
+        return asyncio.TimeoutError()
+    return future.exception() or future.result()
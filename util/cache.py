@@ -1,6 +1,8 @@
 import asyncio
 import logging
+import os
 import pickle
+import shutil
 from pathlib import Path
 
 logger = logging.getLogger("nft_snapshot.util.cache")
@@ -29,12 +31,14 @@ def read_token_list(token_file_name) -> list[str]:
 
 
 class TokenCache:
+    key: str
     filename: str
     path: Path
     _initialized: bool = False
 
     def initialize(self, cache_file_key):
         self._initialized = True
+        self.key = cache_file_key
         self.filename = "{}_cache.p".format(cache_file_key)
 
         # Make sure the cache directory and file exist
@@ -52,20 +56,29 @@ class TokenCache:
 
         :return: dict filled with token data fetched from the cache
         """
-        if not self._initialized:
-            raise RuntimeError("Trying to use cache before initializing it")
-
         try:
-            with self.path.open("rb") as file:
-                all_tokens = pickle.load(file)
-                logger.debug("Loaded cache data from %s", self.filename)
-                return all_tokens
+            return self.read()
         except Exception as e:
             logger.debug("Unable to load cache file %s: %s", self.filename, e)
             return {}
 
+    def read(self) -> dict:
+        """Load the previously-fetched data from the cache, like load(), but raising if it can't be read rather than
+        starting afresh (e.g. for the query service, which should keep serving what it has)
+
+        :return: dict filled with token data fetched from the cache
+        """
+        if not self._initialized:
+            raise RuntimeError("Trying to use cache before initializing it")
+
+        with self.path.open("rb") as file:
+            all_tokens = pickle.load(file)
+            logger.debug("Loaded cache data from %s", self.filename)
+            return all_tokens
+
     def save(self, all_tokens: dict) -> None:
-        """Save the passed-in dictionary data to the cache, overwriting current contents.
+        """Save the passed-in dictionary data to the cache, overwriting current contents. Written to a temporary file
+        first and then moved into place, so anything reading the cache meanwhile sees the old data whole.
 
         :param all_tokens: The full set of token data to write to the cache
         """
@@ -73,11 +86,127 @@ class TokenCache:
             raise RuntimeError("Trying to use cache before initializing it")
 
         try:
-            with self.path.open("wb") as file:
-                pickle.dump(all_tokens, file)
-                logger.debug("Wrote cache data to %s", self.path)
+            dump_atomic(all_tokens, self.path)
+            logger.debug("Wrote cache data to %s", self.path)
         except Exception as e:
             logger.warning("Unable to write cache file %s: %s", self.filename, e)
 
+    def saved_at(self) -> float:
+        """Get when the cache was last written to
+
+        :return: The cache file's modification time as a Unix timestamp, or None if there's no cache file yet
+        """
+        if not self._initialized:
+            raise RuntimeError("Trying to use cache before initializing it")
+
+        try:
+            return self.path.stat().st_mtime
+        except OSError:
+            return None
+
+    def extra_path(self, name: str) -> Path:
+        """Get the path of a file kept alongside the cache for derived data (indexes, rarity state, etc.)
+
+        :param name: Short name of the derived data
+        :return: Path of the file
+        """
+        if not self._initialized:
+            raise RuntimeError("Trying to use cache before initializing it")
+        return self.path.with_name(self.path.name.replace("_cache.p", f"_{name}.p"))
 
-token_cache = TokenCache()
+    def load_extra(self, name: str):
+        """Load derived data previously saved alongside the cache.
+
+        :param name: Short name of the derived data
+        :return: The loaded object, or None if there isn't one
+        """
+        path = self.extra_path(name)
+        try:
+            with path.open("rb") as file:
+                extra = pickle.load(file)
+                logger.debug("Loaded %s data from %s", name, path)
+                return extra
+        except Exception as e:
+            logger.debug("Unable to load %s data from %s: %s", name, path, e)
+            return None
+
+    def save_extra(self, name: str, extra) -> None:
+        """Save derived data alongside the cache, overwriting current contents.
+
+        :param name: Short name of the derived data
+        :param extra: The object to save
+        """
+        path = self.extra_path(name)
+        try:
+            dump_atomic(extra, path)
+            logger.debug("Wrote %s data to %s", name, path)
+        except Exception as e:
+            logger.warning("Unable to write %s data to %s: %s", name, path, e)
+
+
+def dump_atomic(data, path: Path) -> None:
+    """Pickle data to a file by writing a temporary file alongside it and moving that into place, so readers never
+    see a partly-written file
+
+    :param data: The object to pickle
+    :param path: Path of the file to write
+    """
+    # Named for the process, so two processes writing the same file don't share a temporary file
+    temp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        with temp_path.open("wb") as file:
+            pickle.dump(data, file)
+        temp_path.replace(path)
+    finally:
+        temp_path.unlink(missing_ok=True)
+
+
+class DiscoveryCheckpoint:
+    """The partitions of a token discovery (see solana_helpers.discover_mints_async()) that have been fetched so
+    far, one file per partition, so a discovery that is interrupted or has partitions fail picks up where it left
+    off rather than starting again from zero
+    """
+
+    def __init__(self, key: str):
+        """
+        :param key: Identifies the discovery (e.g. by the address it filters on)
+        """
+        self.key = key
+        self.path = Path(CACHE_DIR) / f"{key}_discovery"
+
+    def load(self) -> dict:
+        """Load the partitions fetched so far
+
+        :return: dict of partition prefix (bytes) to the list of token IDs found in it
+        """
+        partitions = {}
+        for path in sorted(self.path.glob("*.p")):
+            try:
+                with path.open("rb") as file:
+                    partitions[bytes.fromhex(path.stem)] = pickle.load(file)
+            except Exception as e:
+                logger.debug("Unable to load discovery checkpoint %s: %s", path, e)
+        return partitions
+
+    def save(self, prefix: bytes, mints: list) -> None:
+        """Save a fetched partition. Written to a temporary file first, so an interrupted write doesn't leave a
+        partial partition behind to be taken as done.
+
+        :param prefix: The partition's prefix
+        :param mints: list of token IDs found in it
+        """
+        self.path.mkdir(parents=True, exist_ok=True)
+        path = self.path / f"{prefix.hex()}.p"
+        temp_path = path.with_suffix(".tmp")
+        try:
+            with temp_path.open("wb") as file:
+                pickle.dump(mints, file)
+            temp_path.replace(path)
+        except Exception as e:
+            logger.warning("Unable to write discovery checkpoint %s: %s", path, e)
+
+    def clear(self) -> None:
+        """Remove the checkpoints, once the discovery is complete (so the next one fetches everything afresh). A
+        checkpoint that can't be removed is left behind rather than failing the discovery that just succeeded.
+        """
+        shutil.rmtree(self.path, ignore_errors=True)
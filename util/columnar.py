@@ -0,0 +1,156 @@
+import itertools
+import json
+import logging
+
+from util.rarity import RARITY_MODELS
+from util.traits import NONE_CODE
+from util.traits import TraitVocabulary
+
+logger = logging.getLogger("nft_snapshot.util.columnar")
+
+COLUMNAR_EXTENSIONS = (".parquet", ".arrow", ".feather")
+
+# Rows per Parquet row group / Arrow record batch, which bounds how much is held in memory at once
+ROW_GROUP_SIZE = 10000
+
+
+def is_columnar(outfile_name: str) -> bool:
+    """Whether a snapshot file name asks for columnar (Parquet or Arrow) output
+
+    :param outfile_name: The snapshot file name
+    :return: True if the snapshot should be written by write_columnar_snapshot()
+    """
+    return outfile_name.endswith(COLUMNAR_EXTENSIONS)
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("Writing Parquet/Arrow snapshots requires the pyarrow package")
+    return pyarrow
+
+
+def snapshot_schema(
+    vocabulary: TraitVocabulary,
+    rarity_models: list = (),
+    metadata: dict = None,
+    data_status: bool = False,
+):
+    """Get the Arrow schema for a snapshot. Trait columns are dictionary-encoded, and the snapshot metadata is
+    stored (as JSON strings) in the schema metadata.
+
+    :param vocabulary: The TraitVocabulary the tokens' trait_codes refer to
+    :param rarity_models: Names of extra rarity models to add score and rank columns for
+    :param metadata: dict of snapshot metadata (collection, slot, timestamp, etc.)
+    :param data_status: Whether to add the DataStatus column flagging tokens with stale or missing data
+    :return: pyarrow.Schema
+    """
+    pa = _import_pyarrow()
+    fields = [
+        pa.field("Number", pa.string()),
+        pa.field("TokenName", pa.string()),
+        pa.field("Token", pa.string()),
+        pa.field("HolderAddress", pa.string()),
+        pa.field("TotalHeld", pa.int64()),
+        pa.field("Image", pa.string()),
+        pa.field("Rank", pa.int64()),
+        pa.field("Rarity", pa.float64()),
+    ]
+    for model in rarity_models:
+        label = RARITY_MODELS[model].label
+        fields += [pa.field(label, pa.float64()), pa.field(f"{label}Rank", pa.int64())]
+    if data_status:
+        fields.append(pa.field("DataStatus", pa.string()))
+    for trait_type in vocabulary.trait_map:
+        fields.append(pa.field(str(trait_type), pa.dictionary(pa.int32(), pa.string())))
+    return pa.schema(
+        fields,
+        metadata={key: json.dumps(value) for key, value in (metadata or {}).items()},
+    )
+
+
+def _record_batch(
+    pa,
+    schema,
+    tokens: list,
+    vocabulary: TraitVocabulary,
+    rarity_models: list,
+    data_status: bool = False,
+):
+    columns = [
+        [token.id for token in tokens],
+        [token.name for token in tokens],
+        [token.token for token in tokens],
+        [token.holder_address if token.holder_address else "UNKNOWN_ADDRESS" for token in tokens],
+        [int(token.amount) if token.amount is not None else None for token in tokens],
+        [token.image for token in tokens],
+        [token.rank for token in tokens],
+        [token.rarity * 100 if token.rarity is not None else None for token in tokens],
+    ]
+    for model in rarity_models:
+        columns.append([token.model_scores.get(model) for token in tokens])
+        columns.append([token.model_ranks.get(model) for token in tokens])
+    if data_status:
+        columns.append([token.data_status or "" for token in tokens])
+    arrays = [pa.array(column, type=field.type) for column, field in zip(columns, schema)]
+
+    # Trait columns use the collection-wide vocabulary as the dictionary and the trait codes as the indices, so
+    # every batch shares one dictionary per column. Tokens without the trait are null.
+    for column, values in enumerate(vocabulary.values):
+        codes = [
+            token.trait_codes[column]
+            if token.trait_codes is not None and token.trait_codes[column] != NONE_CODE
+            else None
+            for token in tokens
+        ]
+        arrays.append(
+            pa.DictionaryArray.from_arrays(
+                pa.array(codes, type=pa.int32()),
+                pa.array([str(value) for value in values], type=pa.string()),
+            )
+        )
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def write_columnar_snapshot(
+    outfile_name: str,
+    all_tokens: dict,
+    vocabulary: TraitVocabulary,
+    rarity_models: list = (),
+    metadata: dict = None,
+    row_group_size: int = ROW_GROUP_SIZE,
+    data_status: bool = False,
+) -> None:
+    """Write a snapshot as Parquet (.parquet) or an Arrow IPC file (.arrow/.feather), with proper column types.
+    Rows are written a row group at a time so memory use stays bounded.
+
+    :param outfile_name: The name of the file to write
+    :param all_tokens: A dict of all the token data in the collection, already ranked by rank_collection()
+    :param vocabulary: The TraitVocabulary the tokens' trait_codes refer to
+    :param rarity_models: Names of extra rarity models to add score and rank columns for
+    :param metadata: dict of snapshot metadata (collection, slot, timestamp, etc.) for the file metadata
+    :param row_group_size: Number of rows per row group / record batch
+    :param data_status: Whether to add the DataStatus column flagging tokens with stale or missing data
+    """
+    pa = _import_pyarrow()
+    schema = snapshot_schema(vocabulary, rarity_models, metadata, data_status)
+    if outfile_name.endswith(".parquet"):
+        writer = pa.parquet.ParquetWriter(outfile_name, schema)
+        write_batch = writer.write_batch
+    else:
+        writer = pa.ipc.new_file(outfile_name, schema)
+        write_batch = writer.write_batch
+
+    with writer:
+        tokens = iter(all_tokens.values())
+        while True:
+            batch_tokens = list(itertools.islice(tokens, row_group_size))
+            if not batch_tokens:
+                break
+            write_batch(
+                _record_batch(pa, schema, batch_tokens, vocabulary, rarity_models, data_status)
+            )
+    logger.debug("Wrote columnar snapshot to %s", outfile_name)
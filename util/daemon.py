@@ -0,0 +1,97 @@
+import datetime
+import logging
+from pathlib import Path
+from typing import NamedTuple
+
+logger = logging.getLogger("nft_snapshot.util.daemon")
+
+# What the daemon does for each collection, and how often (in seconds) by default
+DEFAULT_INTERVALS = {
+    "holders": 15 * 60,
+    "metadata": 24 * 60 * 60,
+    "snapshot": 60 * 60,
+}
+
+# Longest the daemon sleeps between checking what is due, so it notices new work (and shutdown) promptly
+MAX_SLEEP = 60
+
+
+class DaemonCollection(NamedTuple):
+    """A collection the daemon is keeping up to date: its batch job, the SnapshotSession holding its cache and
+    in-memory token data, and its state
+    """
+
+    job: object
+    session: object
+    state: "DaemonState"
+
+
+class DaemonState:
+    """What the daemon has done for a collection and when, persisted alongside the collection's cache so a restarted
+    daemon carries on where it left off rather than redoing everything
+    """
+
+    def __init__(self):
+        # Task name to the Unix time it last ran
+        self.last_run = {}
+        # The last snapshot written, to diff the next one against
+        self.last_snapshot = None
+
+    def __setstate__(self, state):
+        # State pickled by older versions may be missing newer attributes, so start from the defaults
+        self.__init__()
+        self.__dict__.update(state)
+
+    def due(self, intervals: dict, now: float) -> list:
+        """Get the tasks that are due to run
+
+        :param intervals: dict of task name to how often it runs, in seconds (tasks set to None never run)
+        :param now: The current Unix time
+        :return: list of task names, in the order of intervals
+        """
+        return [
+            task
+            for task, interval in intervals.items()
+            if interval is not None and now >= self.last_run.get(task, 0) + interval
+        ]
+
+    def next_due(self, intervals: dict) -> float:
+        """Get when the next task is due
+
+        :param intervals: dict of task name to how often it runs, in seconds (tasks set to None never run)
+        :return: Unix time the next task is due (0 if one has never run), or None if there are no tasks
+        """
+        times = [
+            self.last_run.get(task, 0) + interval
+            for task, interval in intervals.items()
+            if interval is not None
+        ]
+        return min(times) if times else None
+
+    def mark(self, task: str, now: float) -> None:
+        """Record that a task has run
+
+        :param task: The task name
+        :param now: The Unix time it ran
+        """
+        self.last_run[task] = now
+
+
+def timestamped_name(file_name: str, when: float) -> str:
+    """Get the name to write a scheduled snapshot or diff to, so each run gets its own file. A "{timestamp}"
+    placeholder in the file name is filled in; otherwise the timestamp goes before the extension.
+
+    :param file_name: The configured file name (e.g. "mf_snapshot.csv" or "snapshots/mf_{timestamp}.parquet")
+    :param when: The Unix time of the run
+    :return: The file name to write to
+    """
+    timestamp = datetime.datetime.fromtimestamp(int(when), datetime.timezone.utc).strftime(
+        "%Y%m%dT%H%M%SZ"
+    )
+    if "{timestamp}" in file_name:
+        return file_name.replace("{timestamp}", timestamp)
+    path = Path(file_name)
+    # Keep compound extensions like .csv.gz together
+    suffixes = "".join(path.suffixes)
+    stem = path.name[: len(path.name) - len(suffixes)] if suffixes else path.name
+    return str(path.with_name(f"{stem}_{timestamp}{suffixes}"))
@@ -0,0 +1,87 @@
+import logging
+import time
+
+from util.planner import FIELD_STAGES
+from util.planner import STAGES
+
+logger = logging.getLogger("nft_snapshot.util.deadline")
+
+STALE = "stale"
+MISSING = "missing"
+
+
+class Deadline:
+    """A time budget for a whole run, shared out across the fetch stages as they come up"""
+
+    def __init__(self, seconds: float, stale_tokens: dict = None, clock=time.monotonic):
+        """
+        :param seconds: How long the run has, from now
+        :param stale_tokens: Older token data to fall back on for tokens that couldn't be fetched in time, by token ID
+        :param clock: Function returning the current time in seconds (for testing)
+        """
+        self.clock = clock
+        self.end = clock() + seconds
+        self.stale_tokens = stale_tokens or {}
+
+    def remaining(self) -> float:
+        """Get how much of the budget is left
+
+        :return: Seconds left (never negative)
+        """
+        return max(self.end - self.clock(), 0.0)
+
+    def expired(self) -> bool:
+        """Whether the budget has run out
+
+        :return: True if there is no time left
+        """
+        return self.remaining() <= 0
+
+    def stage_budget(self, stages_left: int) -> float:
+        """Get the time to give the next fetch stage: an even share of what is left between it and the stages
+        after it, so one slow stage can't starve the rest
+
+        :param stages_left: How many stages are still to run, including this one
+        :return: Seconds the stage may take
+        """
+        return self.remaining() / max(stages_left, 1)
+
+
+def fill_from_stale(all_tokens: dict, fields: set, stale_tokens: dict = None) -> (int, int):
+    """After fetching has been cut short, fill in any of the given fields that are still missing from older cached
+    data for the same token, and flag every token that had gaps by setting its data_status to STALE (filled from
+    older data) or MISSING (no older data to use)
+
+    :param all_tokens: A dict of all the token data being operated upon
+    :param fields: The Token fields the reports need
+    :param stale_tokens: Older token data to fall back on (e.g. the cache from before --bust-cache), by token ID
+    :return: (number of tokens filled from stale data, number of tokens still missing data)
+    """
+    stale_tokens = stale_tokens or {}
+    stages = [STAGES[name] for name in sorted({FIELD_STAGES[field] for field in fields})]
+    stale_count = missing_count = 0
+    for mint, token in all_tokens.items():
+        gaps = [stage for stage in stages if getattr(token, stage.key) is None]
+        if not gaps:
+            continue
+        stale_token = stale_tokens.get(mint)
+        status = STALE
+        for stage in gaps:
+            if stale_token is None or getattr(stale_token, stage.key, None) is None:
+                status = MISSING
+                continue
+            for field in stage.fields:
+                setattr(token, field, getattr(stale_token, field, None))
+        if token.data_status != MISSING:
+            token.data_status = status
+        if status == STALE:
+            stale_count += 1
+        else:
+            missing_count += 1
+    if stale_count or missing_count:
+        logger.warning(
+            "Out of time: %d tokens filled from stale data, %d missing data",
+            stale_count,
+            missing_count,
+        )
+    return stale_count, missing_count
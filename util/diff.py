@@ -0,0 +1,182 @@
+import csv
+import gzip
+import io
+import json
+import logging
+
+from util.columnar import is_columnar
+from util.output import DATA_STATUS_COLUMN
+from util.output import model_columns
+from util.output import open_snapshot_file
+from util.output import rank_collection
+from util.output import snapshot_columns
+from util.output import snapshot_rows
+from util.rarity import RARITY_MODELS
+from util.rarity_state import RarityState
+
+logger = logging.getLogger("nft_snapshot.util.diff")
+
+DIFF_FORMATS = ("csv", "json")
+
+DIFF_COLUMNS = ["change", "token", "name", "field", "old", "new"]
+
+# Snapshot columns that describe the token rather than who holds it or how it ranks. Any column not listed in one of
+# these is a trait.
+METADATA_COLUMNS = ["Number", "TokenName", "Image"]
+OWNERSHIP_COLUMNS = ["Token", "HolderAddress", "TotalHeld"]
+# Rank, rarity and data status columns are worked out afresh for every snapshot, so changes to them aren't reported
+DERIVED_COLUMNS = {"Rank", "Rarity", DATA_STATUS_COLUMN, *model_columns(RARITY_MODELS)}
+
+
+def read_snapshot(snapshot_name: str):
+    """Read a snapshot written by output.holder_snapshot(), one row at a time. CSV snapshots may be gzip- or
+    zstd-compressed (.gz or .zst); Parquet and Arrow snapshots are read a record batch at a time and need pyarrow.
+
+    :param snapshot_name: The snapshot file name
+    :return: generator of row dicts mapping column name to value (as a str, "" if empty)
+    """
+    if is_columnar(snapshot_name):
+        yield from _read_columnar_snapshot(snapshot_name)
+        return
+    with _open_csv_snapshot(snapshot_name) as infile:
+        for row in csv.DictReader(infile):
+            # Drop the leading unnamed row number column
+            row.pop("", None)
+            yield row
+
+
+def _open_csv_snapshot(snapshot_name: str):
+    if snapshot_name.endswith(".gz"):
+        return gzip.open(snapshot_name, "rt", newline="", encoding="utf-8")
+    if snapshot_name.endswith(".zst"):
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError("Reading .zst snapshots requires the zstandard package")
+        reader = zstandard.ZstdDecompressor().stream_reader(open(snapshot_name, "rb"), closefd=True)
+        return io.TextIOWrapper(reader, newline="", encoding="utf-8")
+    return open(snapshot_name, newline="", encoding="utf-8")
+
+
+def _read_columnar_snapshot(snapshot_name: str):
+    try:
+        import pyarrow.dataset
+    except ImportError:
+        raise RuntimeError("Reading Parquet/Arrow snapshots requires the pyarrow package")
+    file_format = "parquet" if snapshot_name.endswith(".parquet") else "ipc"
+    for batch in pyarrow.dataset.dataset(snapshot_name, format=file_format).to_batches():
+        for row in batch.to_pylist():
+            yield {column: _normalize(value) for column, value in row.items()}
+
+
+def _normalize(value) -> str:
+    return "" if value is None else str(value)
+
+
+def token_snapshot(all_tokens: dict, rarity_models: list = (), rarity_state: RarityState = None):
+    """Produce snapshot rows for the tokens currently in the cache, as read_snapshot() would read them back from a
+    CSV snapshot
+
+    :param all_tokens: A dict of all the token data in the collection
+    :param rarity_models: Names of extra rarity models to include
+    :param rarity_state: RarityState already synced with all_tokens, used instead of re-ranking from scratch
+    :return: generator of row dicts mapping column name to value (as a str, "" if empty)
+    """
+    vocabulary = rank_collection(all_tokens, rarity_models, rarity_state)
+    columns = snapshot_columns(vocabulary, rarity_models)
+    for row in snapshot_rows(all_tokens, vocabulary, rarity_models):
+        yield {column: _normalize(value) for column, value in zip(columns, row)}
+
+
+def diff_snapshots(old_rows, new_rows):
+    """Compare two snapshots, joining them on the token ID. The old snapshot is read once into a hash table keyed by
+    token (holding only the columns that are compared), then the new snapshot is streamed past it, so each input is
+    only read once and the changes come out in the new snapshot's order, with burned tokens last.
+
+    :param old_rows: iterable of row dicts for the older snapshot (e.g. from read_snapshot())
+    :param new_rows: iterable of row dicts for the newer snapshot
+    :return: generator of change dicts with the keys in DIFF_COLUMNS. change is one of "new", "burned", "transfer",
+        "ownership" (the held amount changed), "metadata" or "trait"
+    """
+    old_tokens = {}
+    for row in old_rows:
+        old_tokens[row["Token"]] = {
+            column: value for column, value in row.items() if column not in DERIVED_COLUMNS
+        }
+
+    for row in new_rows:
+        mint = row["Token"]
+        old = old_tokens.pop(mint, None)
+        if old is None:
+            yield _change("new", row, "", "", row.get("HolderAddress", ""))
+        else:
+            yield from _row_changes(old, row)
+
+    for old in old_tokens.values():
+        yield _change("burned", old, "", old.get("HolderAddress", ""), "")
+
+
+def _row_changes(old: dict, new: dict):
+    if old.get("HolderAddress") != new.get("HolderAddress"):
+        yield _change(
+            "transfer", new, "HolderAddress", old.get("HolderAddress"), new["HolderAddress"]
+        )
+    if old.get("TotalHeld") != new.get("TotalHeld"):
+        yield _change("ownership", new, "TotalHeld", old.get("TotalHeld"), new.get("TotalHeld"))
+    for column in METADATA_COLUMNS:
+        if old.get(column) != new.get(column):
+            yield _change("metadata", new, column, old.get(column), new.get(column))
+    for column in _trait_columns(old, new):
+        if old.get(column, "") != new.get(column, ""):
+            yield _change("trait", new, column, old.get(column, ""), new.get(column, ""))
+
+
+def _trait_columns(old: dict, new: dict) -> list:
+    columns = list(old) + [column for column in new if column not in old]
+    return [
+        column
+        for column in columns
+        if column not in DERIVED_COLUMNS
+        and column not in METADATA_COLUMNS
+        and column not in OWNERSHIP_COLUMNS
+    ]
+
+
+def _change(change: str, row: dict, field: str, old: str, new: str) -> dict:
+    return {
+        "change": change,
+        "token": row["Token"],
+        "name": row.get("TokenName", ""),
+        "field": field,
+        "old": old,
+        "new": new,
+    }
+
+
+def write_changes(changes, outfile_name: str = "-", diff_format: str = "csv") -> int:
+    """Write out a change feed as it is produced
+
+    :param changes: iterable of change dicts from diff_snapshots()
+    :param outfile_name: The file to write to ("-" for stdout, and .gz/.zst compresses)
+    :param diff_format: "csv" for a CSV file with the DIFF_COLUMNS, or "json" for a JSON array of change objects
+    :return: The number of changes written
+    """
+    if diff_format not in DIFF_FORMATS:
+        raise ValueError(f"Unknown diff format {diff_format}")
+    count = 0
+    with open_snapshot_file(outfile_name) as outfile:
+        if diff_format == "csv":
+            writer = csv.DictWriter(outfile, DIFF_COLUMNS, lineterminator="\n")
+            writer.writeheader()
+            for change in changes:
+                writer.writerow(change)
+                count += 1
+        else:
+            outfile.write("[")
+            for change in changes:
+                outfile.write(",\n" if count else "\n")
+                outfile.write(json.dumps(change))
+                count += 1
+            outfile.write("\n]\n")
+    logger.debug("Wrote %d changes to %s", count, outfile_name)
+    return count
@@ -0,0 +1,92 @@
+import logging
+
+import numpy
+
+logger = logging.getLogger("nft_snapshot.util.distribution")
+
+# Lower bounds of the tokens-per-wallet histogram buckets; each bucket runs up to the next bound
+HISTOGRAM_BOUNDS = [1, 2, 3, 6, 11, 26, 51, 101]
+
+CONCENTRATION_TOP = [1, 10, 100]
+
+
+def holder_distribution(tokens_total: int, counts: dict, marketplace_wallets: dict = None) -> dict:
+    """Summarize how a collection's tokens are spread across holder wallets. Everything is computed with numpy over
+    the array of per-wallet counts, sorted once.
+
+    :param tokens_total: The total number of tokens in the collection
+    :param counts: A dict containing the counts of tokens held in each wallet (wallet_id: count). Tokens without a
+        known holder (an empty or None wallet) are left out of the holder stats.
+    :param marketplace_wallets: dict of marketplace escrow wallet to marketplace name, to work out how much of the
+        collection is listed
+    :return: dict of the holder stats: holders, tokens_held, unique_holder_ratio, gini, mean, median, max,
+        concentration (share of the held tokens in the top N wallets), histogram (bucket label, wallets, tokens)
+        and marketplaces (tokens listed per marketplace, and the listed share of the collection)
+    """
+    marketplace_wallets = marketplace_wallets or {}
+    held = {holder: count for holder, count in counts.items() if holder}
+    values = numpy.sort(numpy.fromiter(held.values(), dtype=numpy.int64, count=len(held)))
+    holders = len(values)
+    tokens_held = int(values.sum())
+
+    # Descending cumulative sums give the share held by the top N wallets directly
+    cumulative = numpy.cumsum(values[::-1])
+    concentration = {
+        f"top_{n}": float(cumulative[min(n, holders) - 1] / tokens_held) if holders else 0.0
+        for n in CONCENTRATION_TOP
+    }
+
+    bucket = numpy.searchsorted(HISTOGRAM_BOUNDS, values, side="right") - 1
+    wallets_per_bucket = numpy.bincount(bucket, minlength=len(HISTOGRAM_BOUNDS))
+    tokens_per_bucket = numpy.bincount(bucket, weights=values, minlength=len(HISTOGRAM_BOUNDS))
+    histogram = [
+        {"bucket": label, "wallets": int(wallets), "tokens": int(tokens)}
+        for label, wallets, tokens in zip(_bucket_labels(), wallets_per_bucket, tokens_per_bucket)
+    ]
+
+    listed = {
+        name: int(held[wallet]) for wallet, name in marketplace_wallets.items() if wallet in held
+    }
+    return {
+        "tokens": tokens_total,
+        "holders": holders,
+        "tokens_held": tokens_held,
+        "unique_holder_ratio": holders / tokens_total if tokens_total else 0.0,
+        "gini": gini(values),
+        "mean": float(values.mean()) if holders else 0.0,
+        "median": float(numpy.median(values)) if holders else 0.0,
+        "max": int(values[-1]) if holders else 0,
+        "concentration": concentration,
+        "histogram": histogram,
+        "marketplaces": {
+            "listed": listed,
+            "listed_share": sum(listed.values()) / tokens_total if tokens_total else 0.0,
+        },
+    }
+
+
+def gini(values: numpy.ndarray) -> float:
+    """Get the Gini coefficient of a set of holdings: 0 if every wallet holds the same amount, approaching 1 as a
+    single wallet holds everything
+
+    :param values: numpy array of tokens per wallet, sorted ascending
+    :return: The Gini coefficient
+    """
+    n = len(values)
+    total = values.sum()
+    if not n or not total:
+        return 0.0
+    weighted = numpy.dot(numpy.arange(1, n + 1), values)
+    return float(2.0 * weighted / (n * total) - (n + 1.0) / n)
+
+
+def _bucket_labels() -> list:
+    labels = []
+    for low, high in zip(HISTOGRAM_BOUNDS, HISTOGRAM_BOUNDS[1:] + [None]):
+        if high is None:
+            labels.append(f"{low}+")
+        elif high - low == 1:
+            labels.append(str(low))
+        else:
+            labels.append(f"{low}-{high - 1}")
+    return labels
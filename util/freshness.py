@@ -0,0 +1,141 @@
+import asyncio
+import copy
+import datetime
+import logging
+import time
+from typing import Callable
+
+from util.planner import FIELD_STAGES
+from util.planner import STAGES
+
+logger = logging.getLogger("nft_snapshot.util.freshness")
+
+REVALIDATE_MODES = ("cache", "rerender", "snapshot")
+
+
+def stamp_fetched(tokens: list, stage_name: str, timestamp: float = None) -> None:
+    """Record when a fetch stage filled in the given tokens' data. Tokens the stage didn't manage to fill in are left
+    alone.
+
+    :param tokens: The Tokens the stage was run for
+    :param stage_name: The stage (a key of planner.STAGES)
+    :param timestamp: When the data was fetched (now if None)
+    """
+    timestamp = timestamp if timestamp is not None else time.time()
+    key = STAGES[stage_name].key
+    for token in tokens:
+        if getattr(token, key) is not None:
+            token.fetched_at[stage_name] = timestamp
+
+
+def data_as_of(all_tokens: dict, fields: set, default: float = None) -> float:
+    """Get when the oldest of the given fields' data was fetched, across all the tokens that have it
+
+    :param all_tokens: A dict of all the token data being operated upon
+    :param fields: The Token fields to check
+    :param default: When to take data fetched before fetch times were recorded to be from (e.g. the cache file's
+        modification time)
+    :return: The oldest fetch time as a Unix timestamp, or None if it's unknown
+    """
+    stage_names = {FIELD_STAGES[field] for field in fields}
+    times = [
+        token.fetched_at.get(name, default)
+        for token in all_tokens.values()
+        for name in stage_names
+        if getattr(token, STAGES[name].key) is not None
+    ]
+    times = [fetched for fetched in times if fetched is not None]
+    return min(times) if times else None
+
+
+def format_data_age(as_of: float, now: float = None) -> str:
+    """Format how old some data is, for annotating reports served from the cache
+
+    :param as_of: When the data was fetched, as a Unix timestamp (None if unknown)
+    :param now: The current time (now if None)
+    :return: str like "2022-05-01T00:00:00+00:00 (2:00:00 old)"
+    """
+    if as_of is None:
+        return "unknown"
+    now = now if now is not None else time.time()
+    fetched = datetime.datetime.fromtimestamp(int(as_of), datetime.timezone.utc)
+    age = datetime.timedelta(seconds=int(max(now - as_of, 0)))
+    return f"{fetched.isoformat()} ({age} old)"
+
+
+class Revalidation:
+    """Refetches a set of fields for every token in the background, while the cached data carries on being used.
+    The refresh works on a copy of the tokens with those fields cleared, so the fetch stages fetch them all again,
+    and the fresh data is only merged back in once it's done. Tokens the refresh couldn't fetch keep their cached
+    data.
+    """
+
+    def __init__(self, all_tokens: dict, fields: set, fetch_stages: Callable):
+        """
+        :param all_tokens: A dict of all the token data being operated upon
+        :param fields: The Token fields to refresh
+        :param fetch_stages: Coroutine function taking (stage_names, all_tokens) that runs the given fetch stages for
+            the tokens without their data, stamping them with stamp_fetched() (e.g. SnapshotSession.fetch_stages).
+            It mustn't save anything to the cache: it runs on a copy of the tokens that is only partly filled in
+            until it's done, so the caller saves once wait() has merged the fresh data back in.
+        """
+        self.all_tokens = all_tokens
+        self.fields = fields
+        # A stage's inputs are refreshed along with it, e.g. token accounts with holders, since a transfer can move
+        # the token to a new token account
+        stage_names = {FIELD_STAGES[field] for field in fields}
+        stage_names |= {STAGES[name].depends_on for name in stage_names} - {None}
+        self.stage_names = [name for name in STAGES if name in stage_names]
+        self.fetch_stages = fetch_stages
+        self.fresh_tokens = {mint: self._cleared(token) for mint, token in all_tokens.items()}
+        self.error = None
+        self.task = None
+
+    def _cleared(self, token):
+        fresh = copy.copy(token)
+        fresh.fetched_at = dict(token.fetched_at)
+        for name in self.stage_names:
+            for field in STAGES[name].fields:
+                setattr(fresh, field, None)
+        if "metadata" in self.stage_names:
+            # Metadata fetching only sets traits for tokens that have some
+            fresh.traits = {}
+        return fresh
+
+    async def _run(self) -> None:
+        try:
+            await self.fetch_stages(self.stage_names, self.fresh_tokens)
+        except Exception as e:
+            logger.warning("Unable to refresh cached data: %s", e)
+            self.error = e
+
+    def start(self) -> "Revalidation":
+        """Start refreshing in the background, as a task on the running event loop
+
+        :return: self
+        """
+        logger.info("Refreshing %s in the background...", ", ".join(self.stage_names))
+        self.task = asyncio.create_task(self._run())
+        return self
+
+    async def wait(self) -> int:
+        """Wait for the refresh to finish, then merge the fresh data into all_tokens (ready for the caller to save)
+
+        :return: The number of tokens that were refreshed
+        """
+        await self.task
+        refreshed = 0
+        for mint, fresh in self.fresh_tokens.items():
+            token = self.all_tokens[mint]
+            updated = False
+            for name, stage in STAGES.items():
+                if name in fresh.fetched_at and fresh.fetched_at.get(name) != token.fetched_at.get(
+                    name
+                ):
+                    for field in stage.fields:
+                        setattr(token, field, getattr(fresh, field))
+                    token.fetched_at[name] = fresh.fetched_at[name]
+                    updated = True
+            refreshed += updated
+        logger.info("Refreshed %d of %d tokens", refreshed, len(self.all_tokens))
+        return refreshed
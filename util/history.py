@@ -0,0 +1,137 @@
+import bisect
+import logging
+from array import array
+
+logger = logging.getLogger("nft_snapshot.util.history")
+
+# Wallet ID used when a token has no known holder (e.g. it was burned or its holder couldn't be fetched)
+NO_HOLDER = -1
+
+
+class HolderHistory:
+    """Time series of who held each token, built up from a run of snapshots. Only changes are stored: each token has a
+    pair of arrays holding the times its holder changed and the (interned) wallet it changed to, so a snapshot that
+    changes nothing costs nothing. Finding who held a token at a point in time is a bisect on that token's times.
+
+    Alongside the changes, each wallet's current holdings are indexed with the time it acquired each token, which
+    answers holding duration queries without replaying the history.
+    """
+
+    def __init__(self):
+        self.wallets = []
+        self.wallet_ids = {}
+        self.times = {}
+        self.changes = {}
+        self.held_since = {}
+        self.snapshots = []
+
+    def __len__(self) -> int:
+        return len(self.snapshots)
+
+    def _wallet_id(self, holder_address) -> int:
+        if not holder_address:
+            return NO_HOLDER
+        wallet_id = self.wallet_ids.get(holder_address)
+        if wallet_id is None:
+            wallet_id = self.wallet_ids[holder_address] = len(self.wallets)
+            self.wallets.append(holder_address)
+        return wallet_id
+
+    def _wallet(self, wallet_id: int):
+        return self.wallets[wallet_id] if wallet_id != NO_HOLDER else None
+
+    def record(self, all_tokens: dict, timestamp: float, slot: int = None) -> int:
+        """Record a snapshot of the collection's holders, storing only the tokens whose holder changed since the last
+        snapshot. Tokens that were in earlier snapshots but are missing from this one are recorded as having no
+        holder. Tokens flagged with a data_status (holder data that was stale or missing when a deadline ran out)
+        keep their last recorded holder, so a partial snapshot doesn't show up as ownership changes.
+
+        :param all_tokens: A dict of all the token data in the collection
+        :param timestamp: When the snapshot was taken, as a Unix timestamp
+        :param slot: The slot the holder data was fetched at, if known
+        :return: The number of holder changes recorded
+        """
+        timestamp = int(timestamp)
+        if self.snapshots and timestamp < self.snapshots[-1][0]:
+            raise ValueError("Snapshots must be recorded in time order")
+
+        changed = 0
+        for mint, token in all_tokens.items():
+            if token.data_status:
+                continue
+            changed += self._set_holder(mint, self._wallet_id(token.holder_address), timestamp)
+        for mint in self.times.keys() - all_tokens.keys():
+            changed += self._set_holder(mint, NO_HOLDER, timestamp)
+        self.snapshots.append((timestamp, slot))
+        logger.debug("Recorded snapshot at %d with %d holder changes", timestamp, changed)
+        return changed
+
+    def _set_holder(self, mint: str, wallet_id: int, timestamp: int) -> int:
+        changes = self.changes.get(mint)
+        if changes is None:
+            if wallet_id == NO_HOLDER:
+                return 0
+            self.times[mint] = array("q")
+            changes = self.changes[mint] = array("l")
+        elif changes[-1] == wallet_id:
+            return 0
+        else:
+            self.held_since.get(changes[-1], {}).pop(mint, None)
+
+        self.times[mint].append(timestamp)
+        changes.append(wallet_id)
+        if wallet_id != NO_HOLDER:
+            self.held_since.setdefault(wallet_id, {})[mint] = timestamp
+        return 1
+
+    def holder_at(self, mint: str, timestamp: float):
+        """Get who held a token at a point in time
+
+        :param mint: The token ID
+        :param timestamp: The point in time, as a Unix timestamp
+        :return: The holder's address, or None if the token had no known holder then
+        """
+        times = self.times.get(mint)
+        if times is None:
+            return None
+        i = bisect.bisect_right(times, timestamp)
+        return self._wallet(self.changes[mint][i - 1]) if i else None
+
+    def holders_at(self, timestamp: float) -> dict:
+        """Reconstruct who held every token at a point in time
+
+        :param timestamp: The point in time, as a Unix timestamp
+        :return: dict mapping token ID to holder address, for the tokens that had a known holder then
+        """
+        holders = {}
+        for mint in self.times:
+            holder_address = self.holder_at(mint, timestamp)
+            if holder_address is not None:
+                holders[mint] = holder_address
+        return holders
+
+    def history(self, mint: str) -> list:
+        """Get every recorded holder change for a token
+
+        :param mint: The token ID
+        :return: list of (timestamp, holder address or None) tuples, oldest first
+        """
+        return [
+            (timestamp, self._wallet(wallet_id))
+            for timestamp, wallet_id in zip(self.times.get(mint, ()), self.changes.get(mint, ()))
+        ]
+
+    def holding_durations(self, holder_address: str, timestamp: float = None) -> dict:
+        """Get how long a wallet has held each of the tokens it currently holds
+
+        :param holder_address: The wallet's address
+        :param timestamp: The time to measure up to, as a Unix timestamp (defaults to the latest snapshot)
+        :return: dict mapping token ID to the number of seconds held, longest held first
+        """
+        if timestamp is None:
+            timestamp = self.snapshots[-1][0] if self.snapshots else 0
+        held_since = self.held_since.get(self.wallet_ids.get(holder_address), {})
+        return {
+            mint: int(timestamp) - since
+            for mint, since in sorted(held_since.items(), key=lambda item: item[1])
+        }
@@ -0,0 +1,111 @@
+import asyncio
+import functools
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable
+
+logger = logging.getLogger("nft_snapshot.util.offload")
+
+# Items per batch sent to a worker process: big enough that the cost of sending the batch over is small next to the
+# work, small enough to keep every worker busy
+DEFAULT_BATCH_SIZE = 100
+# Seconds to wait for a batch to fill up before sending it off anyway
+DEFAULT_LINGER = 0.005
+
+
+class CpuPool:
+    """Runs CPU-bound steps (PDA derivation, account decoding, etc.) in worker processes, so the event loop is left to
+    handle the network I/O. Coroutines hand over one item at a time with apply(), and the items are gathered into
+    batches per function, so each trip to a worker process carries a batch's worth of work.
+
+    Without workers (the default) everything runs inline, exactly as if there were no pool.
+    """
+
+    def __init__(
+        self,
+        workers: int = None,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        linger: float = DEFAULT_LINGER,
+    ):
+        """
+        :param workers: How many worker processes to run (none, and everything runs inline, if 0 or None)
+        :param batch_size: Items per batch sent to a worker
+        :param linger: Seconds to wait for a batch to fill up before sending it anyway
+        """
+        self.workers = workers
+        self.batch_size = batch_size
+        self.linger = linger
+        self.executor = None
+        self.loop = None
+        self.pending = {}
+        self.timers = {}
+
+    def __enter__(self) -> "CpuPool":
+        if self.workers:
+            self.executor = ProcessPoolExecutor(self.workers)
+            logger.debug("Started %d worker processes", self.workers)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    async def apply(self, fn: Callable, item):
+        """Run a batch function on a single item, batched up with other items for the same function
+
+        :param fn: Module-level function taking a list of items and returning a list of results in the same order
+        :param item: The item
+        :return: fn's result for the item
+        """
+        if self.executor is None:
+            return fn([item])[0]
+        loop = asyncio.get_running_loop()
+        if loop is not self.loop:
+            # Anything left over was for an event loop that's gone (e.g. a previous asyncio.run())
+            self.loop, self.pending, self.timers = loop, {}, {}
+        future = loop.create_future()
+        pending = self.pending.setdefault(fn, [])
+        pending.append((item, future))
+        if len(pending) >= self.batch_size:
+            self._flush(fn)
+        elif fn not in self.timers:
+            self.timers[fn] = loop.call_later(self.linger, self._flush, fn)
+        return await future
+
+    def map(self, fn: Callable, items: list) -> list:
+        """Run a batch function over a list of items, split into batches across the workers, and wait for it
+
+        :param fn: Module-level function taking a list of items and returning a list of results in the same order
+        :param items: The items
+        :return: list of fn's results, in the same order as items
+        """
+        if self.executor is None:
+            return fn(items)
+        batches = [items[i : i + self.batch_size] for i in range(0, len(items), self.batch_size)]
+        return [result for results in self.executor.map(fn, batches) for result in results]
+
+    def _flush(self, fn: Callable) -> None:
+        timer = self.timers.pop(fn, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self.pending.pop(fn, [])
+        if not batch:
+            return
+        done = self.loop.run_in_executor(self.executor, fn, [item for item, _ in batch])
+        done.add_done_callback(functools.partial(_resolve_batch, batch))
+
+
+def _resolve_batch(batch: list, done: asyncio.Future) -> None:
+    error = None if done.cancelled() else done.exception()
+    results = None if done.cancelled() or error is not None else done.result()
+    for i, (_, future) in enumerate(batch):
+        if future.done():
+            # The coroutine waiting for it was cancelled
+            continue
+        if done.cancelled():
+            future.cancel()
+        elif error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(results[i])
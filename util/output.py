@@ -1,9 +1,30 @@
-import pandas
+import contextlib
+import csv
+import datetime
+import gzip
+import io
+import sys
 
-from util.token import get_attribute_counts
-from util.token import get_attribute_rarities
-from util.token import set_token_rarities_and_ranks
+from util.columnar import is_columnar
+from util.columnar import write_columnar_snapshot
+from util.deadline import MISSING
+from util.deadline import STALE
+from util.freshness import format_data_age
+from util.history import HolderHistory
+from util.rarity import RARITY_MODELS
+from util.rarity_index import RarityIndex
+from util.rarity_state import RarityState
+from util.render import render_string
+from util.render import Renderer
+from util.render import top_items
+from util.render import UNDERLINE
+from util.token import count_trait_codes
+from util.token import get_code_rarities
+from util.token import set_token_rarities_and_ranks_from_codes
 from util.token import Token
+from util.traits import encode_tokens
+from util.traits import TraitVocabulary
+from util.wallet_index import WalletIndex
 
 
 # List of marketplaces, from https://github.com/theskeletoncrew/air-support/blob/main/1_record_holders/src/main.ts
@@ -15,46 +36,177 @@ MARKETPLACE_WALLETS = {
 }
 
 
-def format_biggest_holders(tokens_total: int, counts: dict) -> str:
+def format_biggest_holders(
+    tokens_total: int, wallet_index: WalletIndex, top: int = None, render_format: str = "text"
+) -> str:
     """Format all the NFT holder wallets, sorted with the largest holders at the top
 
     :param tokens_total: The total number of tokens in the collection
-    :param counts: A dict containing the counts of tokens held in each wallet (wallet_id: count)
+    :param wallet_index: Up-to-date WalletIndex of the collection's holders
+    :param top: Only include this many of the largest holders, if given
+    :param render_format: One of render.RENDER_FORMATS
     :return: A str containing the formatted output
     """
-    result_str = "\n"
-    result_str += "Total tokens: {}\n".format(tokens_total)
-    result_str += "Total Holder Wallets: {}\n".format(len(counts))
+    return render_string(
+        write_biggest_holders, tokens_total, wallet_index, top, render_format=render_format
+    )
+
+
+def write_biggest_holders(
+    renderer: Renderer, tokens_total: int, wallet_index: WalletIndex, top: int = None
+) -> None:
+    """Write all the NFT holder wallets to a renderer, sorted with the largest holders at the top. The holders are
+    read off the front of the index, which keeps them in order, so only the top ones are ever looked at.
+
+    :param renderer: The Renderer to write to
+    :param tokens_total: The total number of tokens in the collection
+    :param wallet_index: Up-to-date WalletIndex of the collection's holders
+    :param top: Only include this many of the largest holders, if given
+    """
+    renderer.begin(report="holder_counts")
+    renderer.field("tokens", tokens_total, "Total tokens: {}".format(tokens_total))
+    holders_total = len(wallet_index)
+    renderer.field("holders", holders_total, "Total Holder Wallets: {}".format(holders_total))
 
     # format holder list in descending order
-    counts = sort_dict_by_values(counts, reverse=True)
-    result_str += "\nBiggest holders:\n----------\n"
-    for holder, count in counts.items():
-        marketplace_suffix = (
-            " (" + MARKETPLACE_WALLETS[holder] + ")" if holder in MARKETPLACE_WALLETS else ""
+    renderer.begin_list("biggest_holders", "Biggest holders:")
+    for holder, count in wallet_index.top(top):
+        marketplace = MARKETPLACE_WALLETS.get(holder)
+        marketplace_suffix = " (" + marketplace + ")" if marketplace else ""
+        renderer.item(
+            {"holder": holder, "count": count, "marketplace": marketplace},
+            "{}: {}{}".format(holder, count, marketplace_suffix),
+        )
+    renderer.end_list()
+    renderer.end()
+
+
+def format_holder_distribution(distribution: dict, render_format: str = "text") -> str:
+    """Format the holder distribution stats for a collection
+
+    :param distribution: dict produced by distribution.holder_distribution()
+    :param render_format: One of render.RENDER_FORMATS
+    :return: A str containing the formatted output
+    """
+    return render_string(write_holder_distribution, distribution, render_format=render_format)
+
+
+def write_holder_distribution(renderer: Renderer, distribution: dict) -> None:
+    """Write the holder distribution stats for a collection to a renderer
+
+    :param renderer: The Renderer to write to
+    :param distribution: dict produced by distribution.holder_distribution()
+    """
+    renderer.begin(report="holder_stats")
+    renderer.field("tokens", distribution["tokens"], f"Total tokens: {distribution['tokens']}")
+    renderer.field(
+        "holders", distribution["holders"], f"Total Holder Wallets: {distribution['holders']}"
+    )
+    renderer.field("tokens_held", distribution["tokens_held"], None)
+    renderer.field(
+        "unique_holder_ratio",
+        distribution["unique_holder_ratio"],
+        "Unique holder ratio: {:.4f}".format(distribution["unique_holder_ratio"]),
+    )
+    renderer.field(
+        "gini", distribution["gini"], "Gini coefficient: {:.4f}".format(distribution["gini"])
+    )
+    renderer.field(
+        "mean",
+        distribution["mean"],
+        "Tokens per wallet: mean {:.2f}, median {:g}, max {}".format(
+            distribution["mean"], distribution["median"], distribution["max"]
+        ),
+    )
+    renderer.field("median", distribution["median"], None)
+    renderer.field("max", distribution["max"], None)
+
+    renderer.begin_group("concentration", "Concentration:", UNDERLINE)
+    for top, share in distribution["concentration"].items():
+        renderer.field(top, share, "{}: {:.2%}".format(top.replace("_", " ").capitalize(), share))
+    renderer.end_group()
+
+    renderer.begin_list("histogram", "Tokens per wallet:")
+    for bucket in distribution["histogram"]:
+        renderer.item(
+            bucket,
+            "{}: {} wallets, {} tokens".format(
+                bucket["bucket"], bucket["wallets"], bucket["tokens"]
+            ),
         )
-        result_str += "{}: {}{}\n".format(holder, count, marketplace_suffix)
-    return result_str
+    renderer.end_list()
+
+    marketplaces = distribution["marketplaces"]
+    renderer.begin_group("marketplaces", "Listed on marketplaces:", UNDERLINE)
+    renderer.begin_group("listed")
+    for marketplace, count in marketplaces["listed"].items():
+        renderer.field(marketplace, count, f"{marketplace}: {count}")
+    renderer.end_group()
+    renderer.field(
+        "listed_share",
+        marketplaces["listed_share"],
+        "Listed share: {:.2%}".format(marketplaces["listed_share"]),
+    )
+    renderer.end_group()
+    renderer.end()
 
 
-def format_trait_frequency(tokens_with_metadata_total: int, attribute_counts: dict) -> str:
+def format_trait_frequency(
+    tokens_with_metadata_total: int,
+    attribute_counts: dict,
+    top: int = None,
+    render_format: str = "text",
+) -> str:
     """Format a list of all the NFT traits in the collection and their statistical frequencies.
 
     :param tokens_with_metadata_total: The total number of tokens in the collection with trait data
     :param attribute_counts: A dict containing all the traits present in the collection, their possible values, and the
         number of occurrences of those values
+    :param top: Only include this many of the rarest values of each trait, if given
+    :param render_format: One of render.RENDER_FORMATS
     :return: A str containing the formatted output
     """
-    result_str = f"\n{tokens_with_metadata_total} tokens with metadata\n"
-    result_str += "\nAttributes:\n----------\n"
+    return render_string(
+        write_trait_frequency,
+        tokens_with_metadata_total,
+        attribute_counts,
+        top,
+        render_format=render_format,
+    )
+
+
+def write_trait_frequency(
+    renderer: Renderer, tokens_with_metadata_total: int, attribute_counts: dict, top: int = None
+) -> None:
+    """Write a list of all the NFT traits in the collection and their statistical frequencies to a renderer, rarest
+    values first
+
+    :param renderer: The Renderer to write to
+    :param tokens_with_metadata_total: The total number of tokens in the collection with trait data
+    :param attribute_counts: A dict containing all the traits present in the collection, their possible values, and the
+        number of occurrences of those values
+    :param top: Only include this many of the rarest values of each trait, if given
+    """
+    renderer.begin(report="attributes")
+    renderer.field(
+        "tokens_with_metadata",
+        tokens_with_metadata_total,
+        f"{tokens_with_metadata_total} tokens with metadata",
+    )
+    renderer.begin_group("attributes", "Attributes:", UNDERLINE)
     for trait_type, values in attribute_counts.items():
-        result_str += f"\n{trait_type}\n"
-        for value, count in sort_dict_by_values(values).items():
-            frequency_str = " ({}/{}, {:.6f})".format(
-                count, tokens_with_metadata_total, count * 1.0 / tokens_with_metadata_total
+        renderer.begin_list(trait_type, trait_type, underline=None)
+        for value, count in top_items(values, top):
+            frequency = count * 1.0 / tokens_with_metadata_total
+            renderer.item(
+                {"value": value, "count": count, "frequency": frequency},
+                "{}: {} ({}/{}, {:.6f})".format(
+                    value, count, count, tokens_with_metadata_total, frequency
+                ),
             )
-            result_str += f"{value}: {count}{frequency_str}\n"
-    return result_str
+        renderer.end_list()
+    renderer.end_group()
+    renderer.end()
 
 
 def sort_dict_by_values(dictionary: dict, reverse: bool = False) -> dict:
@@ -68,26 +220,153 @@ def sort_dict_by_values(dictionary: dict, reverse: bool = False) -> dict:
     return dict([(k, v) for (v, k) in flipped_sorted_dict])
 
 
-def holder_snapshot(all_tokens: dict, outfile_name: str) -> None:
-    """Output a CSV file containing data about each token in the collection.
+def rank_collection(
+    all_tokens: dict, rarity_models: list = (), rarity_state: RarityState = None
+) -> TraitVocabulary:
+    """Set the rarity and rank of every token in the collection, from the incremental rarity state if there is one
+    or from scratch otherwise.
+
+    :param all_tokens: A dict of all the token data in the collection
+    :param rarity_models: Names of extra rarity models to compute
+    :param rarity_state: RarityState already synced with all_tokens, if available
+    :return: The TraitVocabulary the tokens' trait_codes refer to
+    """
+    if rarity_state is not None:
+        rarity_state.apply(all_tokens, rarity_models)
+        # The state's vocabulary holds every trait type it has ever seen, in the order it saw them: lay the tokens'
+        # codes out by the current trait types instead, the same as ranking from scratch does
+        return encode_tokens(get_trait_map(all_tokens), all_tokens)
+
+    vocabulary = encode_tokens(get_trait_map(all_tokens), all_tokens)
+    tokens_with_attributes_total, code_counts = count_trait_codes(vocabulary, all_tokens)
+    code_rarities = get_code_rarities(tokens_with_attributes_total, code_counts)
+    set_token_rarities_and_ranks_from_codes(code_rarities, all_tokens, rarity_models)
+    return vocabulary
+
+
+SNAPSHOT_COLUMNS = [
+    "Number",
+    "TokenName",
+    "Token",
+    "HolderAddress",
+    "TotalHeld",
+    "Image",
+    "Rank",
+    "Rarity",
+]
+
+# Only added when some tokens' data is stale or missing because a run ran out of time (see util.deadline)
+DATA_STATUS_COLUMN = "DataStatus"
+
+
+def holder_snapshot(
+    all_tokens: dict,
+    outfile_name: str,
+    rarity_models: list = (),
+    rarity_state: RarityState = None,
+    metadata: dict = None,
+    history: HolderHistory = None,
+    history_tokens: dict = None,
+) -> None:
+    """Output a CSV file containing data about each token in the collection. Rows are written out as they are
+    produced rather than being collected up first. Output is gzip- or zstd-compressed if the file name ends in
+    .gz or .zst, and goes to stdout if the file name is "-". If the file name ends in .parquet, .arrow or .feather
+    the snapshot is written as Parquet or Arrow instead, with the metadata stored in the file.
 
     :param all_tokens: A dict of all the token data in the collection
     :param outfile_name: The name of the file to output the CSV to
+    :param rarity_models: Names of extra rarity models to add score and rank columns for
+    :param rarity_state: RarityState already synced with all_tokens, used instead of re-ranking from scratch
+    :param metadata: dict of snapshot metadata (see snapshot_metadata()), stored in Parquet/Arrow output and used to
+        timestamp the snapshot in the holder history
+    :param history: HolderHistory to record the snapshot's holders in, if desired
+    :param history_tokens: The tokens to record in the history, if not all_tokens (e.g. the whole collection, when
+        the snapshot only covers some of it)
     """
-    token_csv_data = []
+    vocabulary = rank_collection(all_tokens, rarity_models, rarity_state)
+    data_status = any(token.data_status for token in all_tokens.values())
+    if is_columnar(outfile_name):
+        write_columnar_snapshot(
+            outfile_name, all_tokens, vocabulary, rarity_models, metadata, data_status=data_status
+        )
+    else:
+        with open_snapshot_file(outfile_name) as outfile:
+            writer = csv.writer(outfile, lineterminator="\n")
+            # The leading unnamed row number column matches what the snapshot has always had
+            writer.writerow([""] + snapshot_columns(vocabulary, rarity_models, data_status))
+            rows = snapshot_rows(all_tokens, vocabulary, rarity_models, data_status)
+            for i, row in enumerate(rows):
+                writer.writerow([i] + row)
 
-    trait_map = get_trait_map(all_tokens)
-    tokens_with_attributes_total, attribute_counts = get_attribute_counts(trait_map, all_tokens)
-    attribute_rarities = get_attribute_rarities(tokens_with_attributes_total, attribute_counts)
+    # Only once the snapshot has been written out, so a failed write doesn't leave a snapshot in the history that
+    # was never saved
+    if history is not None:
+        metadata = metadata or {}
+        timestamp = (
+            datetime.datetime.fromisoformat(metadata["timestamp"])
+            if metadata.get("timestamp")
+            else datetime.datetime.now(datetime.timezone.utc)
+        )
+        history_tokens = history_tokens if history_tokens is not None else all_tokens
+        history.record(history_tokens, timestamp.timestamp(), metadata.get("slot"))
+
+
+def snapshot_metadata(all_tokens: dict, collection: str) -> dict:
+    """Get the metadata describing a snapshot: which collection it is of, the latest slot the holder data was
+    fetched at, and when it was taken
 
-    set_token_rarities_and_ranks(trait_map, attribute_rarities, all_tokens)
+    :param all_tokens: A dict of all the token data in the collection
+    :param collection: Name of the collection (e.g. the Candy Machine ID or token file name)
+    :return: dict of snapshot metadata
+    """
+    slots = [token.holder_slot for token in all_tokens.values() if token.holder_slot is not None]
+    return {
+        "collection": collection,
+        "slot": max(slots) if slots else None,
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "tokens": len(all_tokens),
+    }
 
+
+def snapshot_columns(
+    vocabulary: TraitVocabulary, rarity_models: list = (), data_status: bool = False
+) -> list:
+    """Get the column names for a snapshot
+
+    :param vocabulary: The TraitVocabulary the tokens' trait_codes refer to
+    :param rarity_models: Names of extra rarity models to add score and rank columns for
+    :param data_status: Whether to add the DataStatus column flagging tokens with stale or missing data
+    :return: list of column names
+    """
+    status_columns = [DATA_STATUS_COLUMN] if data_status else []
+    return (
+        SNAPSHOT_COLUMNS
+        + model_columns(rarity_models)
+        + status_columns
+        + list(vocabulary.trait_map.keys())
+    )
+
+
+def snapshot_rows(
+    all_tokens: dict,
+    vocabulary: TraitVocabulary,
+    rarity_models: list = (),
+    data_status: bool = False,
+):
+    """Generate the snapshot row for each token, in the same order as snapshot_columns()
+
+    :param all_tokens: A dict of all the token data in the collection, already ranked by rank_collection()
+    :param vocabulary: The TraitVocabulary the tokens' trait_codes refer to
+    :param rarity_models: Names of extra rarity models to add score and rank columns for
+    :param data_status: Whether to add the DataStatus column flagging tokens with stale or missing data
+    :return: generator of row lists
+    """
+    empty_traits = [None] * len(vocabulary)
     for token in all_tokens.values():
-        # Create a list big enough for all the collection's traits, then fill in the ones this NFT has
-        token_traits = [None] * len(trait_map)
-        for trait_name, trait_value in token.traits.items():
-            token_traits[trait_map[trait_name]] = trait_value
-        token_csv_data.append(
+        token_traits = (
+            vocabulary.decode(token.trait_codes) if token.trait_codes is not None else empty_traits
+        )
+        yield (
             [
                 token.id,
                 token.name,
@@ -96,26 +375,56 @@ def holder_snapshot(all_tokens: dict, outfile_name: str) -> None:
                 token.amount,
                 token.image,
                 token.rank,
-                "{:.20f}%".format(token.rarity * 100),
+                "{:.20f}%".format(token.rarity * 100) if token.rarity is not None else None,
             ]
+            + [
+                value
+                for model in rarity_models
+                for value in (token.model_scores.get(model), token.model_ranks.get(model))
+            ]
+            + ([token.data_status or ""] if data_status else [])
             + token_traits
         )
 
-    dataset = pandas.DataFrame(
-        token_csv_data,
-        columns=[
-            "Number",
-            "TokenName",
-            "Token",
-            "HolderAddress",
-            "TotalHeld",
-            "Image",
-            "Rank",
-            "Rarity",
-        ]
-        + list(trait_map.keys()),
-    )
-    dataset.to_csv(outfile_name)
+
+@contextlib.contextmanager
+def open_snapshot_file(outfile_name: str):
+    """Open a snapshot file for writing text, compressing it based on the file extension (.gz or .zst), or use
+    stdout if the file name is "-"
+
+    :param outfile_name: The name of the file to write to
+    :return: context manager yielding a text file object
+    """
+    if outfile_name == "-":
+        yield sys.stdout
+    elif outfile_name.endswith(".gz"):
+        with gzip.open(outfile_name, "wt", newline="", encoding="utf-8") as outfile:
+            yield outfile
+    elif outfile_name.endswith(".zst"):
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError("Writing .zst snapshots requires the zstandard package")
+        with open(outfile_name, "wb") as raw_file:
+            compressor = zstandard.ZstdCompressor().stream_writer(raw_file, closefd=False)
+            with io.TextIOWrapper(compressor, newline="", encoding="utf-8") as outfile:
+                yield outfile
+    else:
+        with open(outfile_name, "w", newline="", encoding="utf-8") as outfile:
+            yield outfile
+
+
+def model_columns(rarity_models: list) -> list:
+    """Get the snapshot column names for the given extra rarity models (a score and a rank column for each)
+
+    :param rarity_models: Names of rarity models (keys of RARITY_MODELS)
+    :return: list of column names
+    """
+    columns = []
+    for model in rarity_models:
+        label = RARITY_MODELS[model].label
+        columns += [label, f"{label}Rank"]
+    return columns
 
 
 def get_trait_map(all_tokens: dict) -> dict:
@@ -134,32 +443,371 @@ def get_trait_map(all_tokens: dict) -> dict:
     return trait_map
 
 
-def format_token_rarity(token_id: str, all_tokens: dict[str, Token]) -> str:
+def format_token_rarity(
+    token_id: str,
+    all_tokens: dict[str, Token],
+    rarity_models: list = (),
+    rarity_index: RarityIndex = None,
+    render_format: str = "text",
+) -> str:
     """Format the statistical rarity of a token overall, and for each trait
 
     :param token_id: The token to analyse statistical rarity for
     :param all_tokens: A dict of all the token data in the collection
+    :param rarity_models: Names of extra rarity models to show the token's score and rank for
+    :param rarity_index: Up-to-date RarityIndex (including rarity_models) to look the token up in, if available
+    :param render_format: One of render.RENDER_FORMATS
     :return: Nicely-formatted str containing the requested rarity info
     """
+    return render_string(
+        write_token_rarity,
+        token_id,
+        all_tokens,
+        rarity_models,
+        rarity_index,
+        render_format=render_format,
+    )
+
+
+def write_token_rarity(
+    renderer: Renderer,
+    token_id: str,
+    all_tokens: dict[str, Token],
+    rarity_models: list = (),
+    rarity_index: RarityIndex = None,
+) -> None:
+    """Write the statistical rarity of a token overall, and for each trait, to a renderer
+
+    :param renderer: The Renderer to write to
+    :param token_id: The token to analyse statistical rarity for
+    :param all_tokens: A dict of all the token data in the collection
+    :param rarity_models: Names of extra rarity models to show the token's score and rank for
+    :param rarity_index: Up-to-date RarityIndex (including rarity_models) to look the token up in, if available
+    """
+    if rarity_index is not None:
+        token_rarity = rarity_index.lookup(token_id)
+        total = len(rarity_index)
+    else:
+        token_rarity = get_token_rarity(token_id, all_tokens, rarity_models)
+        total = token_rarity["total"]
+
+    renderer.begin(f"Token {token_id}", "rarity")
+    renderer.field("token", token_id, None)
+    renderer.field("rank", token_rarity["rank"], f"Rank: {token_rarity['rank']}")
+    renderer.field("rarity", token_rarity["rarity"], f"Rarity: {token_rarity['rarity']:.20f}")
+    renderer.begin_group("models")
+    for model in rarity_models:
+        model_rarity = token_rarity["models"][model]
+        renderer.field(
+            model,
+            model_rarity,
+            "{label}: {score:.6f} (rank {rank})".format(
+                label=RARITY_MODELS[model].label, **model_rarity
+            ),
+        )
+    renderer.end_group()
+
+    renderer.begin_list("traits", "Traits", "-----")
+    for trait in token_rarity["traits"]:
+        renderer.item(
+            trait,
+            "{name}: {value} ({count}/{total}, {pct:.6f})".format(
+                name=trait["trait_type"],
+                value=trait["value"],
+                count=trait["count"],
+                total=total,
+                pct=trait["frequency"],
+            ),
+        )
+    renderer.end_list()
+    renderer.end()
+
+
+def get_token_rarity(token_id: str, all_tokens: dict[str, Token], rarity_models: list = ()) -> dict:
+    """Work out a token's rarity info from scratch, in the same shape as RarityIndex.lookup()
+
+    :param token_id: The token to analyse statistical rarity for
+    :param all_tokens: A dict of all the token data in the collection
+    :param rarity_models: Names of extra rarity models to include
+    :return: dict of the token's rarity info
+    """
     token = all_tokens[token_id]
 
-    trait_map = get_trait_map(all_tokens)
-    tokens_with_attributes_total, attribute_counts = get_attribute_counts(trait_map, all_tokens)
-    attribute_rarities = get_attribute_rarities(tokens_with_attributes_total, attribute_counts)
-
-    if not token.rarity or not token.rank:
-        set_token_rarities_and_ranks(trait_map, attribute_rarities, all_tokens)
-
-    output = f"\nToken {token_id}\n----------\n"
-    output += f"Rank: {token.rank}\nRarity: {token.rarity:.20f}\n\n"
-    output += "Traits\n-----\n"
-    for trait_name in trait_map:
-        value = token.traits[trait_name] if trait_name in token.traits else ""
-        output += "{name}: {value} ({count}/{total}, {pct:.6f})\n".format(
-            name=trait_name,
-            value=value,
-            count=attribute_counts[trait_name][value],
-            total=tokens_with_attributes_total,
-            pct=attribute_rarities[trait_name][value],
+    vocabulary = encode_tokens(get_trait_map(all_tokens), all_tokens)
+    tokens_with_attributes_total, code_counts = count_trait_codes(vocabulary, all_tokens)
+    if not token.rarity or not token.rank or any(m not in token.model_ranks for m in rarity_models):
+        code_rarities = get_code_rarities(tokens_with_attributes_total, code_counts)
+        set_token_rarities_and_ranks_from_codes(code_rarities, all_tokens, rarity_models)
+
+    return {
+        "token": token_id,
+        "name": token.name,
+        "rank": token.rank,
+        "rarity": token.rarity,
+        "total": tokens_with_attributes_total,
+        "models": {
+            model: {"score": token.model_scores[model], "rank": token.model_ranks[model]}
+            for model in rarity_models
+        },
+        "traits": [
+            {
+                "trait_type": trait_type,
+                "value": vocabulary.values[column][code],
+                "count": int(code_counts[column][code]),
+                "frequency": code_counts[column][code] * 1.0 / tokens_with_attributes_total,
+            }
+            for column, (trait_type, code) in enumerate(
+                zip(vocabulary.trait_map, token.trait_codes)
+            )
+        ],
+    }
+
+
+def format_rank_range(
+    rarity_index: RarityIndex, start: int, end: int, render_format: str = "text"
+) -> str:
+    """Format the tokens ranked from start to end (inclusive)
+
+    :param rarity_index: Up-to-date RarityIndex for the collection
+    :param start: The first rank to include (1 is rarest)
+    :param end: The last rank to include
+    :param render_format: One of render.RENDER_FORMATS
+    :return: Nicely-formatted str containing the tokens in the range
+    """
+    return render_string(write_rank_range, rarity_index, start, end, render_format=render_format)
+
+
+def write_rank_range(renderer: Renderer, rarity_index: RarityIndex, start: int, end: int) -> None:
+    """Write the tokens ranked from start to end (inclusive) to a renderer
+
+    :param renderer: The Renderer to write to
+    :param rarity_index: Up-to-date RarityIndex for the collection
+    :param start: The first rank to include (1 is rarest)
+    :param end: The last rank to include
+    """
+    renderer.begin(f"Ranks {start}-{end} of {len(rarity_index)}", "rank_range")
+    renderer.field("start", start, None)
+    renderer.field("end", end, None)
+    renderer.field("total", len(rarity_index), None)
+    renderer.begin_list("tokens", None)
+    for token_rarity in rarity_index.rank_range(start, end):
+        renderer.item(token_rarity, "{rank}: {name} {token} ({rarity:.20f})".format(**token_rarity))
+    renderer.end_list()
+    renderer.end()
+
+
+def format_trait_query(expression: str, holders: dict, render_format: str = "text") -> str:
+    """Format the holders of the tokens matching a trait query, with the largest holders at the top
+
+    :param expression: The trait query that was run
+    :param holders: dict mapping holder address to the list of matching tokens it holds
+    :param render_format: One of render.RENDER_FORMATS
+    :return: A str containing the formatted output
+    """
+    return render_string(write_trait_query, expression, holders, render_format=render_format)
+
+
+def write_trait_query(renderer: Renderer, expression: str, holders: dict) -> None:
+    """Write the holders of the tokens matching a trait query to a renderer, with the largest holders at the top
+
+    :param renderer: The Renderer to write to
+    :param expression: The trait query that was run
+    :param holders: dict mapping holder address to the list of matching tokens it holds
+    """
+    tokens_total = sum(len(mints) for mints in holders.values())
+    renderer.begin(report="trait_query")
+    renderer.field("query", expression, None)
+    renderer.field("tokens", tokens_total, f"Tokens matching {expression}: {tokens_total}")
+    renderer.field("holders", len(holders), f"Holder Wallets: {len(holders)}")
+    renderer.begin_list("matching_holders", "Holders:")
+    for holder, mints in sorted(holders.items(), key=lambda item: (-len(item[1]), item[0] or "")):
+        holder = holder if holder else "UNKNOWN_ADDRESS"
+        marketplace = MARKETPLACE_WALLETS.get(holder)
+        marketplace_suffix = " (" + marketplace + ")" if marketplace else ""
+        renderer.item(
+            {"holder": holder, "count": len(mints), "marketplace": marketplace, "tokens": mints},
+            "{}: {}{} [{}]".format(holder, len(mints), marketplace_suffix, ", ".join(mints)),
+        )
+    renderer.end_list()
+    renderer.end()
+
+
+def format_wallet_holdings(
+    holder_address: str, mints: list, all_tokens: dict, render_format: str = "text"
+) -> str:
+    """Format the list of tokens held by a wallet
+
+    :param holder_address: The wallet's address
+    :param mints: The token IDs the wallet holds
+    :param all_tokens: A dict of all the token data in the collection
+    :param render_format: One of render.RENDER_FORMATS
+    :return: A str containing the formatted output
+    """
+    return render_string(
+        write_wallet_holdings, holder_address, mints, all_tokens, render_format=render_format
+    )
+
+
+def write_wallet_holdings(
+    renderer: Renderer, holder_address: str, mints: list, all_tokens: dict
+) -> None:
+    """Write the list of tokens held by a wallet to a renderer
+
+    :param renderer: The Renderer to write to
+    :param holder_address: The wallet's address
+    :param mints: The token IDs the wallet holds
+    :param all_tokens: A dict of all the token data in the collection
+    """
+    marketplace = MARKETPLACE_WALLETS.get(holder_address)
+    marketplace_suffix = " (" + marketplace + ")" if marketplace else ""
+    renderer.begin(f"Wallet {holder_address}{marketplace_suffix}", "wallet")
+    renderer.field("wallet", holder_address, None)
+    renderer.field("marketplace", marketplace, None)
+    renderer.field("tokens_held", len(mints), f"Tokens held: {len(mints)}")
+    renderer.begin_list("tokens", None)
+    for mint in mints:
+        name = all_tokens[mint].name
+        renderer.item({"token": mint, "name": name}, f"{name}: {mint}")
+    renderer.end_list()
+    renderer.end()
+
+
+def format_holder_history(
+    mint: str,
+    changes: list,
+    at: datetime.datetime = None,
+    holder_at: str = None,
+    render_format: str = "text",
+) -> str:
+    """Format the holder history of a token, optionally with who held it at a point in time
+
+    :param mint: The token ID
+    :param changes: list of (timestamp, holder address or None) tuples from HolderHistory.history()
+    :param at: The point in time to show the holder at, if desired
+    :param holder_at: Who held the token at that time (None if nobody did)
+    :param render_format: One of render.RENDER_FORMATS
+    :return: A str containing the formatted output
+    """
+    return render_string(
+        write_holder_history, mint, changes, at, holder_at, render_format=render_format
+    )
+
+
+def write_holder_history(
+    renderer: Renderer,
+    mint: str,
+    changes: list,
+    at: datetime.datetime = None,
+    holder_at: str = None,
+) -> None:
+    """Write the holder history of a token to a renderer, optionally with who held it at a point in time
+
+    :param renderer: The Renderer to write to
+    :param mint: The token ID
+    :param changes: list of (timestamp, holder address or None) tuples from HolderHistory.history()
+    :param at: The point in time to show the holder at, if desired
+    :param holder_at: Who held the token at that time (None if nobody did)
+    """
+    renderer.begin(f"Holder history for {mint}", "holder_history")
+    renderer.field("token", mint, None)
+    renderer.begin_list("history", None)
+    for timestamp, holder_address in changes:
+        time_str = _format_timestamp(timestamp)
+        renderer.item(
+            {"time": time_str, "holder": holder_address},
+            f"{time_str}: {holder_address or 'NO_HOLDER'}",
+        )
+    renderer.end_list()
+    if at is not None:
+        renderer.begin_group("holder_at")
+        renderer.field("time", at.isoformat(), None)
+        renderer.field(
+            "holder", holder_at, f"Holder at {at.isoformat()}: {holder_at or 'NO_HOLDER'}"
+        )
+        renderer.end_group()
+    renderer.end()
+
+
+def format_holding_durations(
+    holder_address: str, durations: dict, all_tokens: dict, render_format: str = "text"
+) -> str:
+    """Format how long a wallet has held each of its tokens
+
+    :param holder_address: The wallet's address
+    :param durations: dict mapping token ID to seconds held, from HolderHistory.holding_durations()
+    :param all_tokens: A dict of all the token data in the collection
+    :param render_format: One of render.RENDER_FORMATS
+    :return: A str containing the formatted output
+    """
+    return render_string(
+        write_holding_durations, holder_address, durations, all_tokens, render_format=render_format
+    )
+
+
+def write_holding_durations(
+    renderer: Renderer, holder_address: str, durations: dict, all_tokens: dict
+) -> None:
+    """Write how long a wallet has held each of its tokens to a renderer
+
+    :param renderer: The Renderer to write to
+    :param holder_address: The wallet's address
+    :param durations: dict mapping token ID to seconds held, from HolderHistory.holding_durations()
+    :param all_tokens: A dict of all the token data in the collection
+    """
+    renderer.begin(f"Holding time for {holder_address}", "holding_time")
+    renderer.field("wallet", holder_address, None)
+    renderer.begin_list("tokens", None)
+    for mint, seconds in durations.items():
+        name = all_tokens[mint].name if mint in all_tokens else None
+        renderer.item(
+            {"token": mint, "name": name, "seconds": seconds},
+            f"{name or mint}: {datetime.timedelta(seconds=seconds)}",
         )
-    return output
+    renderer.end_list()
+    renderer.end()
+
+
+def write_data_status(renderer: Renderer, all_tokens: dict) -> None:
+    """Write out which tokens' data is stale or missing because the run ran out of time before it could all be
+    fetched, so the reports above can be read with that in mind. Nothing is written if all the data is fresh.
+
+    :param renderer: The Renderer to write to
+    :param all_tokens: A dict of all the token data in the collection
+    """
+    flagged = [token for token in all_tokens.values() if token.data_status]
+    if not flagged:
+        return
+    statuses = [token.data_status for token in flagged]
+    renderer.begin("Data status", "data_status")
+    renderer.field("stale", statuses.count(STALE), f"Stale: {statuses.count(STALE)}")
+    renderer.field("missing", statuses.count(MISSING), f"Missing: {statuses.count(MISSING)}")
+    renderer.begin_list("tokens", "Stale or missing tokens:")
+    for token in flagged:
+        renderer.item(
+            {"token": token.token, "name": token.name, "status": token.data_status},
+            f"{token.name or token.token}: {token.data_status}",
+        )
+    renderer.end_list()
+    renderer.end()
+
+
+def write_data_age(renderer: Renderer, report: str, as_of: float, now: float = None) -> None:
+    """Write out how old the data a report was produced from is, for reports served from the cache
+
+    :param renderer: The Renderer to write to
+    :param report: Name of the report (e.g. "holder_counts")
+    :param as_of: When the report's oldest data was fetched, as a Unix timestamp (None if unknown)
+    :param now: The current time (now if None)
+    """
+    renderer.begin()
+    renderer.field("report", report, None)
+    renderer.field(
+        "data_as_of",
+        _format_timestamp(as_of) if as_of is not None else None,
+        f"{report} data as of {format_data_age(as_of, now)}",
+    )
+    renderer.end()
+
+
+def _format_timestamp(timestamp: float) -> str:
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).isoformat()
@@ -0,0 +1,165 @@
+import logging
+import math
+from typing import NamedTuple
+
+logger = logging.getLogger("nft_snapshot.util.planner")
+
+# Solana getMultipleAccounts takes up to 100 accounts per request
+HOLDER_BATCH_SIZE = 100
+EDITION_BATCH_SIZE = 100
+
+
+class Stage(NamedTuple):
+    """A fetch stage: the Token fields it fills in, the field it checks to decide whether a token still needs
+    fetching, which stage has to run first, and a description for --explain
+    """
+
+    fields: tuple
+    key: str
+    depends_on: str
+    description: str
+
+
+# In the order they run
+STAGES = {
+    "token_accounts": Stage(
+        ("token_account",),
+        "token_account",
+        None,
+        "getTokenLargestAccounts, one per token",
+    ),
+    "holders": Stage(
+        ("holder_address", "amount", "holder_slot"),
+        "holder_address",
+        "token_accounts",
+        f"getMultipleAccounts, {HOLDER_BATCH_SIZE} token accounts per request",
+    ),
+    "accounts": Stage(
+        ("name", "id", "data_uri"),
+        "name",
+        None,
+        "getAccountInfo for the metadata account, one per token",
+    ),
+    "metadata": Stage(
+        ("image", "traits"),
+        "image",
+        "accounts",
+        "off-chain metadata JSON (Arweave etc.), one per token with a URI",
+    ),
+    "editions": Stage(
+        ("edition",),
+        "edition",
+        None,
+        f"getMultipleAccounts, {EDITION_BATCH_SIZE} edition accounts per request",
+    ),
+}
+
+FIELD_STAGES = {field: name for name, stage in STAGES.items() for field in stage.fields}
+
+# The Token fields each report reads
+REPORT_FIELDS = {
+    "holder_counts": {"holder_address"},
+    "attributes": {"traits"},
+    "snapshot": {"id", "name", "holder_address", "amount", "image", "traits"},
+    "rarity": {"name", "traits"},
+    "rank_range": {"name", "traits"},
+    "trait_query": {"holder_address", "traits"},
+    "wallet": {"name", "holder_address"},
+    "diff": {"id", "name", "holder_address", "amount", "image", "traits"},
+    # Filtering the other reports by edition kind (--editions)
+    "editions": {"edition"},
+}
+
+
+class PlannedStage(NamedTuple):
+    """A stage in a FetchPlan, with how many tokens it will fetch for and how many requests that takes"""
+
+    name: str
+    tokens: int
+    requests: int
+
+
+class FetchPlan(NamedTuple):
+    """The fetch stages to run, in order, to get the fields a set of reports needs"""
+
+    fields: frozenset
+    stages: list
+
+    @property
+    def requests(self) -> int:
+        return sum(stage.requests for stage in self.stages)
+
+
+def fields_for(reports: list) -> set:
+    """Get the Token fields needed by a set of reports
+
+    :param reports: Names of reports (keys of REPORT_FIELDS)
+    :return: set of field names
+    """
+    fields = set()
+    for report in reports:
+        fields |= REPORT_FIELDS[report]
+    return fields
+
+
+def plan_fetches(all_tokens: dict, fields: set, skip: set = frozenset()) -> FetchPlan:
+    """Work out which fetch stages need to run to fill in the given fields, based on what is already in the cache.
+    A stage is only planned if some token is still missing its data, plus any stage it depends on that still has
+    tokens to fetch.
+
+    :param all_tokens: A dict of all the token data being operated upon
+    :param fields: The Token fields needed
+    :param skip: Names of stages that have already run and shouldn't be run again
+    :return: The FetchPlan
+    """
+    missing = {
+        name: [token for token in all_tokens.values() if getattr(token, stage.key) is None]
+        for name, stage in STAGES.items()
+        if name not in skip
+    }
+    needed = {FIELD_STAGES[field] for field in fields}
+    for name in list(needed):
+        depends_on = STAGES[name].depends_on
+        if missing.get(name) and depends_on:
+            needed.add(depends_on)
+
+    stages = [
+        PlannedStage(name, len(missing[name]), _request_count(name, missing))
+        for name in STAGES
+        if name in needed and missing.get(name)
+    ]
+    return FetchPlan(frozenset(fields), stages)
+
+
+def _request_count(name: str, missing: dict) -> int:
+    tokens = missing[name]
+    if name == "holders":
+        # Tokens share a request per unique token account; tokens whose account isn't known yet count as one each
+        accounts = {token.token_account for token in tokens if token.token_account}
+        unknown = sum(1 for token in tokens if token.token_account is None)
+        return math.ceil((len(accounts) + unknown) / HOLDER_BATCH_SIZE)
+    if name == "editions":
+        return math.ceil(len(tokens) / EDITION_BATCH_SIZE)
+    if name == "metadata":
+        # No request is made for tokens without a metadata URI; ones not fetched yet might have one
+        return sum(1 for token in tokens if token.data_uri or token.name is None)
+    return len(tokens)
+
+
+def format_plan(plan: FetchPlan, tokens_total: int) -> str:
+    """Format a FetchPlan for --explain
+
+    :param plan: The FetchPlan
+    :param tokens_total: The total number of tokens in the collection
+    :return: A str containing the formatted output
+    """
+    result_str = f"\nFetch plan for {tokens_total} tokens\n----------\n"
+    result_str += "Fields needed: {}\n".format(", ".join(sorted(plan.fields)) or "none")
+    if not plan.stages:
+        return result_str + "Nothing to fetch, everything needed is cached\n"
+    for stage in plan.stages:
+        result_str += "{}: {} tokens, {} requests ({})\n".format(
+            stage.name, stage.tokens, stage.requests, STAGES[stage.name].description
+        )
+    result_str += f"Total requests: {plan.requests}\n"
+    return result_str
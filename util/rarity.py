@@ -0,0 +1,129 @@
+import itertools
+import logging
+from typing import Callable
+from typing import NamedTuple
+
+import numpy
+
+from util.traits import NONE_CODE
+
+logger = logging.getLogger("nft_snapshot.util.rarity")
+
+
+def code_matrix(all_tokens: dict) -> (list, numpy.ndarray):
+    """Stack the trait_codes of every token that has traits into a single (tokens x trait types) matrix
+
+    :param all_tokens: The preassembled data dict for all tokens, already run through encode_tokens()
+    :return: list: the tokens in row order; ndarray: the matrix of trait codes
+    """
+    tokens = [token for token in all_tokens.values() if token.trait_codes is not None]
+    width = len(tokens[0].trait_codes) if tokens else 0
+    matrix = numpy.fromiter(
+        itertools.chain.from_iterable(token.trait_codes for token in tokens),
+        dtype=numpy.int32,
+        count=len(tokens) * width,
+    )
+    return tokens, matrix.reshape(len(tokens), width)
+
+
+def count_codes(matrix: numpy.ndarray, vocabulary_sizes: list) -> list:
+    """Count the occurrences of each code in each column of the code matrix
+
+    :param matrix: The matrix produced by code_matrix()
+    :param vocabulary_sizes: The number of codes in each column's vocabulary
+    :return: list of per-column ndarrays of counts, indexed by code
+    """
+    return [
+        numpy.bincount(matrix[:, column], minlength=size)
+        for column, size in enumerate(vocabulary_sizes)
+    ]
+
+
+def code_probabilities(code_counts: list, total: int) -> list:
+    """Turn per-column code counts into per-column code probabilities
+
+    :param code_counts: The per-column counts produced by count_codes()
+    :param total: The number of tokens the counts were taken over
+    :return: list of per-column ndarrays of probabilities, indexed by code
+    """
+    return [counts / total for counts in code_counts]
+
+
+def gather(matrix: numpy.ndarray, per_code: list) -> numpy.ndarray:
+    """Look up a per-code value for every cell of the code matrix in one shot
+
+    :param matrix: The matrix produced by code_matrix()
+    :param per_code: list of per-column ndarrays indexed by code
+    :return: ndarray the same shape as matrix holding the looked-up values
+    """
+    if not per_code:
+        return numpy.zeros(matrix.shape)
+    offsets = numpy.cumsum([0] + [len(values) for values in per_code[:-1]])
+    return numpy.concatenate(per_code)[matrix + offsets]
+
+
+def ranks_from_scores(scores: numpy.ndarray) -> numpy.ndarray:
+    """Rank scores ascending with a single stable argsort, so ties are broken by row order
+
+    :param scores: ndarray of scores where lower is rarer
+    :return: ndarray of 1-based ranks per row
+    """
+    ranks = numpy.empty(len(scores), dtype=numpy.int64)
+    ranks[numpy.argsort(scores, kind="stable")] = numpy.arange(1, len(scores) + 1)
+    return ranks
+
+
+def _statistical(matrix: numpy.ndarray, probabilities: numpy.ndarray) -> numpy.ndarray:
+    return numpy.log(probabilities).sum(axis=1)
+
+
+def _trait_count(matrix: numpy.ndarray, probabilities: numpy.ndarray) -> numpy.ndarray:
+    trait_counts = (matrix != NONE_CODE).sum(axis=1)
+    return numpy.bincount(trait_counts)[trait_counts] / len(matrix)
+
+
+def _harmonic_mean(matrix: numpy.ndarray, probabilities: numpy.ndarray) -> numpy.ndarray:
+    return probabilities.shape[1] / (1.0 / probabilities).sum(axis=1)
+
+
+def _information_content(matrix: numpy.ndarray, probabilities: numpy.ndarray) -> numpy.ndarray:
+    return -numpy.log2(probabilities).sum(axis=1)
+
+
+def _rarity_score(matrix: numpy.ndarray, probabilities: numpy.ndarray) -> numpy.ndarray:
+    return (1.0 / probabilities).sum(axis=1)
+
+
+class RarityModel(NamedTuple):
+    label: str
+    score_fn: Callable
+    lower_is_rarer: bool
+
+
+# Each model takes the code matrix and the matching matrix of trait probabilities (both tokens x trait types)
+RARITY_MODELS = {
+    "statistical": RarityModel("Statistical", _statistical, True),
+    "trait_count": RarityModel("TraitCount", _trait_count, True),
+    "harmonic_mean": RarityModel("HarmonicMean", _harmonic_mean, True),
+    "information_content": RarityModel("InformationContent", _information_content, False),
+    "rarity_score": RarityModel("RarityScore", _rarity_score, False),
+}
+
+
+def score_models(matrix: numpy.ndarray, token_probabilities: numpy.ndarray, models: list) -> dict:
+    """Score and rank every row of the code matrix under each of the given rarity models, all sharing the one
+    lookup of trait probabilities. The statistical model is the sum of log-probabilities, which (unlike the
+    product of probabilities) doesn't underflow for collections with lots of traits.
+
+    :param matrix: The matrix produced by code_matrix()
+    :param token_probabilities: The per-token trait probabilities, from gather() over code_probabilities()
+    :param models: The names of the models (keys of RARITY_MODELS) to compute
+    :return: dict mapping model name to a tuple of (ndarray of scores, ndarray of ranks)
+    """
+    results = {}
+    for name in models:
+        model = RARITY_MODELS[name]
+        scores = model.score_fn(matrix, token_probabilities)
+        ranks = ranks_from_scores(scores if model.lower_is_rarer else -scores)
+        results[name] = (scores, ranks)
+    return results
@@ -0,0 +1,185 @@
+import hashlib
+import logging
+import math
+
+import numpy
+
+from util.rarity_state import RarityState
+from util.traits import TraitVocabulary
+
+logger = logging.getLogger("nft_snapshot.util.rarity_index")
+
+
+class RarityIndex:
+    """Precomputed, read-only rarity data for a collection, built once per data refresh so single-token lookups and
+    top-k/percentile/rank range queries can be answered without touching the rest of the collection. Everything is
+    stored in rank order, so a token's rank is just its position.
+    """
+
+    def __init__(
+        self,
+        tokens: list,
+        vocabulary: TraitVocabulary,
+        code_counts: list,
+        models: list = (),
+        fingerprint: str = None,
+        cached_at: float = None,
+    ):
+        """Build the index from tokens that already have their rarity, rank and trait_codes set
+
+        :param tokens: Token objects in rank order
+        :param vocabulary: The TraitVocabulary the tokens' trait_codes refer to
+        :param code_counts: Per-column counts of each trait code
+        :param models: Names of the extra rarity models set on the tokens
+        :param fingerprint: rarity_fingerprint() of the data the index was built from, to tell when it is out of date
+        :param cached_at: When the cache the data came from was saved (see TokenCache.saved_at()), so an index of an
+            unchanged cache can be used without fingerprinting the data again
+        """
+        self.fingerprint = fingerprint
+        self.cached_at = cached_at
+        self.models = list(models)
+        self.trait_types = list(vocabulary.trait_map)
+        self.values = [list(values) for values in vocabulary.values]
+        self.code_counts = [[int(count) for count in counts] for counts in code_counts]
+        self.total = len(tokens)
+
+        self.mints = [token.token for token in tokens]
+        self.names = [token.name for token in tokens]
+        self.positions = {mint: i for i, mint in enumerate(self.mints)}
+        self.rarities = numpy.array([token.rarity for token in tokens], dtype=float)
+        self.log_rarities = numpy.array([token.log_rarity for token in tokens], dtype=float)
+        self.codes = numpy.array([token.trait_codes for token in tokens], dtype=numpy.int32)
+        self.model_scores = {
+            model: numpy.array([token.model_scores[model] for token in tokens]) for model in models
+        }
+        self.model_ranks = {
+            model: numpy.array([token.model_ranks[model] for token in tokens]) for model in models
+        }
+
+    def __contains__(self, mint: str) -> bool:
+        return mint in self.positions
+
+    def __len__(self) -> int:
+        return self.total
+
+    def rank(self, mint: str) -> int:
+        """Get a token's statistical rarity rank (1 is rarest)
+
+        :param mint: The token ID
+        :return: The token's rank
+        """
+        return self.positions[mint] + 1
+
+    def percentile(self, mint: str) -> float:
+        """Get the percentage of the collection that is at least as rare as the given token
+
+        :param mint: The token ID
+        :return: The token's percentile (e.g. 1.0 means it is in the rarest 1%)
+        """
+        return self.rank(mint) * 100.0 / self.total
+
+    def summary(self, position: int) -> dict:
+        """Get the headline rarity info for the token at a position in the index
+
+        :param position: The 0-based position (rank - 1) of the token
+        :return: dict of the token's ID, name, rank and rarity
+        """
+        return {
+            "token": self.mints[position],
+            "name": self.names[position],
+            "rank": position + 1,
+            "rarity": float(self.rarities[position]),
+        }
+
+    def lookup(self, mint: str) -> dict:
+        """Get full rarity info for a single token: rank, scores and the frequency of each of its traits
+
+        :param mint: The token ID
+        :return: dict of the token's rarity info
+        """
+        position = self.positions[mint]
+        result = self.summary(position)
+        result["log_rarity"] = float(self.log_rarities[position])
+        result["percentile"] = self.percentile(mint)
+        result["models"] = {
+            model: {
+                "score": float(self.model_scores[model][position]),
+                "rank": int(self.model_ranks[model][position]),
+            }
+            for model in self.models
+        }
+        result["traits"] = [
+            {
+                "trait_type": trait_type,
+                "value": self.values[column][code],
+                "count": self.code_counts[column][code],
+                "frequency": self.code_counts[column][code] * 1.0 / self.total,
+            }
+            for column, (trait_type, code) in enumerate(zip(self.trait_types, self.codes[position]))
+        ]
+        return result
+
+    def rank_range(self, start: int, end: int) -> list:
+        """Get the tokens ranked from start to end (inclusive)
+
+        :param start: The first rank to include (1 is rarest)
+        :param end: The last rank to include
+        :return: list of token summary dicts, in rank order
+        """
+        return [
+            self.summary(position) for position in range(max(start, 1) - 1, min(end, self.total))
+        ]
+
+    def top(self, k: int) -> list:
+        """Get the k rarest tokens
+
+        :param k: How many tokens to return
+        :return: list of token summary dicts, in rank order
+        """
+        return self.rank_range(1, k)
+
+    def top_percent(self, percent: float) -> list:
+        """Get the tokens in the rarest given percentage of the collection
+
+        :param percent: The percentage of the collection to return (e.g. 1.0 for the rarest 1%)
+        :return: list of token summary dicts, in rank order
+        """
+        return self.top(math.ceil(self.total * percent / 100.0))
+
+
+def rarity_fingerprint(rarity_state: RarityState, all_tokens: dict) -> str:
+    """Fingerprint the data a RarityIndex is built from: which RarityState it came from and that state's version
+    (which changes whenever any ranks do), and the token names the index keeps
+
+    :param rarity_state: RarityState already synced with all_tokens
+    :param all_tokens: The preassembled data dict for all tokens
+    :return: str hex digest
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{rarity_state.generation}:{rarity_state.version}".encode())
+    for _, _, mint in rarity_state.ranked:
+        digest.update(f"\0{mint}\0{all_tokens[mint].name}".encode())
+    return digest.hexdigest()
+
+
+def build_rarity_index(
+    rarity_state: RarityState, all_tokens: dict, models: list = (), cached_at: float = None
+) -> RarityIndex:
+    """Build a RarityIndex from an up-to-date RarityState
+
+    :param rarity_state: RarityState already synced with all_tokens
+    :param all_tokens: The preassembled data dict for all tokens
+    :param models: Names of extra rarity models to include in the index
+    :param cached_at: When the cache all_tokens came from was saved, if it came from one
+    :return: The new RarityIndex
+    """
+    rarity_state.apply(all_tokens, models)
+    tokens = [all_tokens[mint] for _, _, mint in rarity_state.ranked]
+    return RarityIndex(
+        tokens,
+        rarity_state.vocabulary,
+        rarity_state.code_counts,
+        models,
+        rarity_fingerprint(rarity_state, all_tokens),
+        cached_at,
+    )
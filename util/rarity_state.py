@@ -0,0 +1,213 @@
+import logging
+import math
+import uuid
+
+import numpy
+from sortedcontainers import SortedList
+
+from util import rarity
+from util.traits import NONE_CODE
+from util.traits import TraitVocabulary
+
+logger = logging.getLogger("nft_snapshot.util.rarity_state")
+
+
+class RarityState:
+    """Persistent statistical rarity state for a collection, kept up to date incrementally as trait data comes in
+    (e.g. in waves during a reveal) rather than being recomputed from scratch on every run.
+
+    Each token's ranking key is the sum of the logs of its trait value counts. That differs from its log rarity
+    only by a term shared by every token (trait types * log(total tokens)), so a change to one trait value's count
+    only moves the tokens that have that value. Ranks are kept in a SortedList, which acts as an order-statistic
+    structure: rank lookups and updates are O(log n) with no full sort. Ties go to the token that comes first in the
+    token list, as they do when ranking from scratch.
+    """
+
+    def __init__(self):
+        # Tells this state apart from any other, e.g. one recreated after the saved state was lost, whose version
+        # numbers start again from scratch
+        self.generation = uuid.uuid4().hex
+        self.vocabulary = TraitVocabulary({})
+        self.traits = {}
+        self.token_codes = {}
+        self.code_counts = []
+        self.members = []
+        self.keys = {}
+        self.sequence = {}
+        self.ranked = SortedList()
+        self.version = 0
+
+    def __len__(self) -> int:
+        return len(self.token_codes)
+
+    def __setstate__(self, state):
+        # States pickled by older versions have no generation, so give them one of their own
+        self.__dict__.update(state)
+        self.__dict__.setdefault("generation", uuid.uuid4().hex)
+
+    def sync(self, all_tokens: dict) -> set:
+        """Bring the state up to date with the traits currently in all_tokens, rescoring only the tokens affected
+        by whatever was added, changed or removed since the last sync
+
+        :param all_tokens: The preassembled data dict for all tokens
+        :return: set of the token IDs whose traits (or position in the token list) changed
+        """
+        positions = {mint: i for i, mint in enumerate(all_tokens)}
+        changed = {}
+        for mint, token in all_tokens.items():
+            traits = token.traits or None
+            if self.traits.get(mint) != traits:
+                changed[mint] = traits
+        for mint in self.traits.keys() - all_tokens.keys():
+            changed[mint] = None
+        # Tokens whose place in the token list has shifted need re-ranking among any they tie with
+        moved = {
+            mint
+            for mint in self.keys.keys() - changed.keys()
+            if self.sequence[mint] != positions[mint]
+        }
+        if not changed and not moved:
+            return set()
+        self.version += 1
+        for mint in moved:
+            self._unrank(mint)
+            self.sequence[mint] = positions[mint]
+
+        # When most of the collection changed (e.g. the first sync), skip tracking what moved and rebuild the ranks
+        width = len(self.vocabulary)
+        rebuild = len(changed) * 2 > len(self.token_codes)
+        count_deltas = None if rebuild else {}
+        for mint, traits in changed.items():
+            if mint in self.token_codes:
+                self._remove(mint, count_deltas)
+            if traits is not None:
+                self.traits[mint] = dict(traits)
+                self._add(mint, self.vocabulary.encode(traits), positions[mint], count_deltas)
+
+        if rebuild or len(self.vocabulary) > width:
+            # A new trait type changes the "none" count for every token, so everything needs rescoring
+            self.keys = {mint: self._key(codes) for mint, codes in self.token_codes.items()}
+            self.ranked = SortedList(
+                (key, self.sequence[mint], mint) for mint, key in self.keys.items()
+            )
+            affected = self.keys
+        else:
+            # Only counts that actually moved change anyone's score (a token swapping one value for another
+            # removes and re-adds the same "none" codes, for instance)
+            affected = {mint for mint in changed if mint in self.token_codes} | moved
+            for (column, code), delta in count_deltas.items():
+                if delta:
+                    affected.update(self.members[column].get(code, ()))
+            for mint in affected:
+                self._rescore(mint)
+
+        logger.debug("Rarity state: %d tokens changed, %d rescored", len(changed), len(affected))
+        return set(changed) | moved
+
+    def _add(self, mint: str, codes: tuple, position: int, count_deltas: dict = None) -> None:
+        self._grow()
+        self.token_codes[mint] = codes
+        self.sequence[mint] = position
+        for column, code in enumerate(codes):
+            counts = self.code_counts[column]
+            if code >= len(counts):
+                counts.extend([0] * (code + 1 - len(counts)))
+            counts[code] += 1
+            members = self.members[column].get(code)
+            if members is None:
+                members = self.members[column][code] = set()
+            members.add(mint)
+            if count_deltas is not None:
+                count_deltas[column, code] = count_deltas.get((column, code), 0) + 1
+
+    def _remove(self, mint: str, count_deltas: dict = None) -> None:
+        self._unrank(mint)
+        del self.traits[mint]
+        del self.sequence[mint]
+        for column, code in enumerate(self.token_codes.pop(mint)):
+            self.code_counts[column][code] -= 1
+            self.members[column][code].discard(mint)
+            if count_deltas is not None:
+                count_deltas[column, code] = count_deltas.get((column, code), 0) - 1
+
+    def _grow(self) -> None:
+        """Add columns for any trait types the vocabulary has picked up, marking every existing token as not
+        having them
+        """
+        for _ in range(len(self.code_counts), len(self.vocabulary)):
+            self.code_counts.append([len(self.token_codes)])
+            self.members.append({NONE_CODE: set(self.token_codes)})
+            for mint, codes in self.token_codes.items():
+                self.token_codes[mint] = codes + (NONE_CODE,)
+
+    def _unrank(self, mint: str) -> None:
+        key = self.keys.pop(mint, None)
+        if key is not None:
+            self.ranked.remove((key, self.sequence[mint], mint))
+
+    def _key(self, codes: tuple) -> float:
+        return sum(math.log(self.code_counts[column][code]) for column, code in enumerate(codes))
+
+    def _rescore(self, mint: str) -> None:
+        self._unrank(mint)
+        key = self._key(self.token_codes[mint])
+        self.keys[mint] = key
+        self.ranked.add((key, self.sequence[mint], mint))
+
+    def rank(self, mint: str) -> int:
+        """Get a token's statistical rarity rank (1 is rarest)
+
+        :param mint: The token ID
+        :return: The token's rank
+        """
+        return self.ranked.index((self.keys[mint], self.sequence[mint], mint)) + 1
+
+    def rarity(self, mint: str) -> float:
+        """Get a token's statistical rarity (the product of the frequencies of its trait values)
+
+        :param mint: The token ID
+        :return: The token's rarity
+        """
+        token_rarity = 1
+        for column, code in enumerate(self.token_codes[mint]):
+            token_rarity *= self.code_counts[column][code] * 1.0 / len(self)
+        return token_rarity
+
+    def log_rarity(self, mint: str) -> float:
+        """Get a token's statistical rarity in log space
+
+        :param mint: The token ID
+        :return: The token's log rarity
+        """
+        return self.keys[mint] - len(self.vocabulary) * math.log(len(self))
+
+    def apply(self, all_tokens: dict, models: list = ()) -> None:
+        """Set trait_codes, rarity and rank on every token from the state, walking the ranks in order rather than
+        sorting. Any extra rarity models are computed in one vectorized pass over the state's counts.
+
+        :param all_tokens: The preassembled data dict for all tokens, already passed to sync()
+        :param models: Names of extra rarity models (keys of rarity.RARITY_MODELS) to compute
+        """
+        for token in all_tokens.values():
+            token.trait_codes = None
+        if not self.ranked:
+            return
+
+        mints = [mint for _, _, mint in self.ranked]
+        matrix = numpy.array([self.token_codes[mint] for mint in mints], dtype=numpy.int32)
+        counts = [numpy.asarray(counts) for counts in self.code_counts]
+        token_probabilities = rarity.gather(matrix, rarity.code_probabilities(counts, len(self)))
+        rarities = token_probabilities.prod(axis=1)
+        model_results = rarity.score_models(matrix, token_probabilities, models)
+
+        log_total = len(self.vocabulary) * math.log(len(self))
+        for i, mint in enumerate(mints):
+            token = all_tokens[mint]
+            token.trait_codes = self.token_codes[mint]
+            token.rarity = float(rarities[i])
+            token.log_rarity = self.keys[mint] - log_total
+            token.rank = i + 1
+            token.model_scores = {
+                name: float(scores[i]) for name, (scores, _) in model_results.items()
+            }
+            token.model_ranks = {name: int(r[i]) for name, (_, r) in model_results.items()}
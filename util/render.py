@@ -0,0 +1,248 @@
+import heapq
+import io
+import json
+import logging
+
+logger = logging.getLogger("nft_snapshot.util.render")
+
+RENDER_FORMATS = ("text", "json", "markdown")
+
+UNDERLINE = "----------"
+
+
+class Renderer:
+    """Writes a report to a stream piece by piece as it is produced, so nothing is built up in memory and the first
+    lines show up straight away. A report is a set of fields (single values), lists of items, and groups that nest
+    fields and lists. Each call carries both the structured data (for JSON) and the line of text to show for it (for
+    text and Markdown), so a report is written once and can be rendered in any of the RENDER_FORMATS.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def begin(self, title: str = None, report: str = None) -> None:
+        """Start the report
+
+        :param title: Heading for the report, if it has one
+        :param report: Name of the report in structured output, if it has one (e.g. "holder_counts")
+        """
+
+    def end(self) -> None:
+        """Finish the report"""
+
+    def field(self, key: str, value, text: str) -> None:
+        """Write a single value
+
+        :param key: Name of the value in structured output
+        :param value: The value (anything JSON-serializable)
+        :param text: The line to show for it in text output (None if it only goes in structured output, e.g. because
+            it is already in a heading)
+        """
+
+    def begin_list(self, key: str, title: str, underline: str = UNDERLINE) -> None:
+        """Start a list of items
+
+        :param key: Name of the list in structured output
+        :param title: Heading for the list (None for no heading)
+        :param underline: What to underline the heading with in text output (None for no underline)
+        """
+
+    def item(self, record: dict, text: str) -> None:
+        """Write an item in the current list
+
+        :param record: The item's data (anything JSON-serializable)
+        :param text: The line to show for it in text output
+        """
+
+    def end_list(self) -> None:
+        """Finish the current list"""
+
+    def begin_group(self, key: str, title: str = None, underline: str = None) -> None:
+        """Start a named group of fields and lists
+
+        :param key: Name of the group in structured output
+        :param title: Heading for the group, if it has one
+        :param underline: What to underline the heading with in text output (None for no underline)
+        """
+
+    def end_group(self) -> None:
+        """Finish the current group"""
+
+
+class TextRenderer(Renderer):
+    """Plain text, the format the reports have always been printed in"""
+
+    def begin(self, title: str = None, report: str = None) -> None:
+        self.stream.write("\n")
+        if title is not None:
+            self.stream.write(f"{title}\n{UNDERLINE}\n")
+
+    def field(self, key: str, value, text: str) -> None:
+        if text is not None:
+            self.stream.write(f"{text}\n")
+
+    def begin_list(self, key: str, title: str, underline: str = UNDERLINE) -> None:
+        if title is not None:
+            self._heading(title, underline)
+
+    def item(self, record: dict, text: str) -> None:
+        self.stream.write(f"{text}\n")
+
+    def begin_group(self, key: str, title: str = None, underline: str = None) -> None:
+        if title is not None:
+            self._heading(title, underline)
+
+    def _heading(self, title: str, underline: str = None) -> None:
+        self.stream.write(f"\n{title}\n")
+        if underline is not None:
+            self.stream.write(f"{underline}\n")
+
+
+class MarkdownRenderer(Renderer):
+    """Markdown, with the report and list headings as headers and everything else as bullet points"""
+
+    def __init__(self, stream):
+        super().__init__(stream)
+        # Heading level of each open list or group (None for untitled groups)
+        self.levels = []
+
+    def begin(self, title: str = None, report: str = None) -> None:
+        if title is not None:
+            self.stream.write(f"# {title}\n\n")
+
+    def field(self, key: str, value, text: str) -> None:
+        if text is not None:
+            self.stream.write(f"- {text}\n")
+
+    def begin_list(self, key: str, title: str, underline: str = UNDERLINE) -> None:
+        self.begin_group(key, title, underline)
+
+    def item(self, record: dict, text: str) -> None:
+        self.stream.write(f"- {text}\n")
+
+    def end_list(self) -> None:
+        self.levels.pop()
+
+    def begin_group(self, key: str, title: str = None, underline: str = None) -> None:
+        if title is None:
+            self.levels.append(None)
+        else:
+            self._heading(title)
+
+    def end_group(self) -> None:
+        self.levels.pop()
+
+    def _heading(self, title: str) -> None:
+        level = next((level for level in reversed(self.levels) if level is not None), 1) + 1
+        self.stream.write("\n{} {}\n\n".format("#" * level, title.rstrip(":")))
+        self.levels.append(level)
+
+
+class JsonRenderer(Renderer):
+    """JSON Lines: each report is a single JSON object on a line of its own, written out as it goes, so a run that
+    prints several reports gives a stream of objects that can be read one line at a time. Reports with a name carry
+    it as their "report" key. Fields, lists and groups become keys of the object they are in; list items are array
+    elements.
+    """
+
+    def __init__(self, stream):
+        super().__init__(stream)
+        # How many entries have been written so far in each open object/array, to know where commas go
+        self.counts = []
+
+    def _open(self, key: str, bracket: str) -> None:
+        self._separate()
+        if key is not None:
+            self.stream.write(f"{json.dumps(key)}: ")
+        self.stream.write(bracket)
+        self.counts.append(0)
+
+    def _close(self, bracket: str) -> None:
+        self.counts.pop()
+        self.stream.write(bracket)
+
+    def _separate(self) -> None:
+        if not self.counts:
+            return
+        if self.counts[-1]:
+            self.stream.write(", ")
+        self.counts[-1] += 1
+
+    def begin(self, title: str = None, report: str = None) -> None:
+        self._open(None, "{")
+        if report is not None:
+            self.field("report", report, None)
+
+    def end(self) -> None:
+        self._close("}")
+        self.stream.write("\n")
+
+    def field(self, key: str, value, text: str) -> None:
+        self._separate()
+        self.stream.write(f"{json.dumps(key)}: {json.dumps(value)}")
+
+    def begin_list(self, key: str, title: str, underline: str = UNDERLINE) -> None:
+        self._open(key, "[")
+
+    def item(self, record: dict, text: str) -> None:
+        self._separate()
+        self.stream.write(json.dumps(record))
+
+    def end_list(self) -> None:
+        self._close("]")
+
+    def begin_group(self, key: str, title: str = None, underline: str = None) -> None:
+        self._open(key, "{")
+
+    def end_group(self) -> None:
+        self._close("}")
+
+
+RENDERERS = {
+    "text": TextRenderer,
+    "json": JsonRenderer,
+    "markdown": MarkdownRenderer,
+}
+
+
+def make_renderer(render_format: str, stream) -> Renderer:
+    """Get a renderer for the given format
+
+    :param render_format: One of RENDER_FORMATS
+    :param stream: The text stream to write to
+    :return: The Renderer
+    """
+    if render_format not in RENDERERS:
+        raise ValueError(f"Unknown report format {render_format}")
+    return RENDERERS[render_format](stream)
+
+
+def render_string(write_report, *args, render_format: str = "text", **kwargs) -> str:
+    """Render a report to a string rather than a stream
+
+    :param write_report: Function that writes the report, taking a Renderer followed by args and kwargs
+    :param render_format: One of RENDER_FORMATS
+    :return: The rendered report
+    """
+    buffer = io.StringIO()
+    write_report(make_renderer(render_format, buffer), *args, **kwargs)
+    return buffer.getvalue()
+
+
+def top_items(dictionary: dict, n: int = None, reverse: bool = False) -> list:
+    """Get a dict's items sorted by value (then key), like output.sort_dict_by_values(), but when only the first n are
+    wanted pick them with a heap rather than sorting everything
+
+    :param dictionary: dict to sort
+    :param n: How many items to return (all of them if None)
+    :param reverse: Whether to sort descending
+    :return: list of (key, value) tuples
+    """
+    if n is None:
+        return sorted(dictionary.items(), key=_value_then_key, reverse=reverse)
+    select = heapq.nlargest if reverse else heapq.nsmallest
+    return select(n, dictionary.items(), key=_value_then_key)
+
+
+def _value_then_key(item: tuple) -> tuple:
+    return item[1], item[0]
@@ -0,0 +1,287 @@
+import asyncio
+import json
+import logging
+
+from aiohttp import web
+
+from util.cache import TokenCache
+from util.output import get_trait_map
+from util.output import MARKETPLACE_WALLETS
+from util.rarity_index import build_rarity_index
+from util.rarity_state import RarityState
+from util.token import get_attribute_counts
+from util.wallet_index import WalletIndex
+
+logger = logging.getLogger("nft_snapshot.util.server")
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8080
+# How often (in seconds) to check whether a collection's cache has been written to since it was loaded
+RELOAD_INTERVAL = 5
+
+
+class CollectionIndexes:
+    """Everything the query service answers a collection's requests from, built once from its cache so each request
+    is a dict lookup or a slice. The collection-wide responses (holder counts, trait distribution) are rendered to
+    JSON up front, since they only change when the data does.
+    """
+
+    def __init__(
+        self, name: str, all_tokens: dict, rarity_models: list = (), cached_at: float = None
+    ):
+        """
+        :param name: The collection's name
+        :param all_tokens: A dict of all the collection's token data
+        :param rarity_models: Names of extra rarity models to include in rarity lookups
+        :param cached_at: Modification time of the cache the data was loaded from, to tell when to reload
+        """
+        self.name = name
+        self.cached_at = cached_at
+        self.total = len(all_tokens)
+        self.names = {mint: token.name for mint, token in all_tokens.items()}
+
+        rarity_state = RarityState()
+        rarity_state.sync(all_tokens)
+        self.rarity_index = build_rarity_index(rarity_state, all_tokens, rarity_models)
+        self.wallet_index = WalletIndex()
+        self.wallet_index.sync(all_tokens)
+
+        self.holder_counts = [
+            {"holder": holder, "count": count, "marketplace": MARKETPLACE_WALLETS.get(holder)}
+            for holder, count in self.wallet_index.top()
+        ]
+        self.holder_counts_json = json.dumps(
+            {
+                "tokens": self.total,
+                "holders": len(self.wallet_index),
+                "biggest_holders": self.holder_counts,
+            }
+        )
+        with_traits, attribute_counts = get_attribute_counts(get_trait_map(all_tokens), all_tokens)
+        self.traits_json = json.dumps(
+            {
+                "tokens_with_metadata": with_traits,
+                "attributes": {
+                    trait_type: [
+                        {"value": value, "count": count, "frequency": count * 1.0 / with_traits}
+                        for value, count in sorted(values.items(), key=lambda item: item[1])
+                    ]
+                    for trait_type, values in attribute_counts.items()
+                },
+            },
+            default=str,
+        )
+
+    def token_rarity(self, mint: str) -> dict:
+        """Get a token's rarity info (see RarityIndex.lookup())
+
+        :param mint: The token ID
+        :return: dict of the token's rarity info, or None if it isn't in the collection (or has no traits)
+        """
+        return self.rarity_index.lookup(mint) if mint in self.rarity_index else None
+
+    def wallet_holdings(self, holder_address: str) -> dict:
+        """Get the tokens a wallet holds in the collection
+
+        :param holder_address: The wallet's address
+        :return: dict of the wallet, its marketplace (if it is one) and the tokens it holds
+        """
+        mints = self.wallet_index.tokens_for(holder_address)
+        return {
+            "holder": holder_address,
+            "marketplace": MARKETPLACE_WALLETS.get(holder_address),
+            "count": len(mints),
+            "tokens": [{"token": mint, "name": self.names.get(mint)} for mint in mints],
+        }
+
+
+def load_collection_indexes(
+    name: str, cache: TokenCache, rarity_models: list = ()
+) -> CollectionIndexes:
+    """Load a collection's cached token data and build the indexes to serve it from
+
+    :param name: The collection's name
+    :param cache: The collection's (initialized) TokenCache
+    :param rarity_models: Names of extra rarity models to include in rarity lookups
+    :return: The CollectionIndexes
+    :raises ValueError: If the cache is empty
+    """
+    # Read the modification time first, so a write that lands while loading is picked up by the next check
+    cached_at = cache.saved_at()
+    # Unlike cache.load(), a cache that can't be read raises rather than looking like an empty collection
+    all_tokens = cache.read()
+    if not all_tokens:
+        raise ValueError(f"The cache for {name} is empty")
+    indexes = CollectionIndexes(name, all_tokens, rarity_models, cached_at)
+    logger.info("Loaded %d tokens for %s", indexes.total, name)
+    return indexes
+
+
+class QueryService:
+    """Holds the indexes for each collection being served, and swaps in fresh ones whenever a collection's cache is
+    written to (e.g. by a --daemon or a regular run). Indexes are rebuilt off the event loop and replaced whole, so
+    requests keep being answered from the old ones in the meantime.
+    """
+
+    def __init__(self, caches: dict, rarity_models: dict = None):
+        """
+        :param caches: dict of collection name to its (initialized) TokenCache
+        :param rarity_models: dict of collection name to the extra rarity models to include for it
+        """
+        self.caches = caches
+        self.rarity_models = rarity_models or {}
+        self.collections = {}
+
+    def load(self) -> None:
+        """Load every collection's indexes. Collections whose cache can't be loaded yet are left out until it can."""
+        for name, cache in self.caches.items():
+            try:
+                self.collections[name] = load_collection_indexes(
+                    name, cache, self.rarity_models.get(name, ())
+                )
+            except Exception as e:
+                logger.warning("Unable to load %s, not serving it yet: %s", name, e)
+
+    async def reload_changed(self) -> list:
+        """Rebuild the indexes of any collection whose cache has been written to since it was loaded
+
+        :return: list of the names of the collections that were reloaded
+        """
+        reloaded = []
+        for name, cache in self.caches.items():
+            current = self.collections.get(name)
+            saved_at = cache.saved_at()
+            if saved_at is None or (current is not None and saved_at == current.cached_at):
+                continue
+            try:
+                self.collections[name] = await asyncio.to_thread(
+                    load_collection_indexes, name, cache, self.rarity_models.get(name, ())
+                )
+            except Exception as e:
+                logger.warning("Unable to reload %s, still serving the old data: %s", name, e)
+                continue
+            reloaded.append(name)
+        return reloaded
+
+    async def watch(self, interval: float = RELOAD_INTERVAL) -> None:
+        """Keep reloading collections as their caches change, until cancelled
+
+        :param interval: Seconds between checks
+        """
+        while True:
+            await asyncio.sleep(interval)
+            await self.reload_changed()
+
+
+def make_app(service: QueryService, reload_interval: float = RELOAD_INTERVAL) -> web.Application:
+    """Make the web app serving a QueryService's collections. Endpoints (all GET, all JSON):
+
+    - /collections: the collections being served
+    - /collections/{name}/tokens/{mint}/rarity: a token's rarity rank, scores and trait frequencies
+    - /collections/{name}/wallets/{address}: the tokens a wallet holds
+    - /collections/{name}/holders?top=N: holder counts, biggest holders first
+    - /collections/{name}/traits: the trait distribution, rarest values first
+
+    :param service: The QueryService, already loaded
+    :param reload_interval: Seconds between checks for changed caches (no hot reloading if None)
+    :return: The aiohttp Application
+    """
+    app = web.Application()
+    app["service"] = service
+    app.router.add_get("/collections", list_collections)
+    app.router.add_get("/collections/{name}/tokens/{mint}/rarity", token_rarity)
+    app.router.add_get("/collections/{name}/wallets/{address}", wallet_holdings)
+    app.router.add_get("/collections/{name}/holders", holder_counts)
+    app.router.add_get("/collections/{name}/traits", trait_distribution)
+
+    if reload_interval is not None:
+
+        async def start_watching(app):
+            app["watcher"] = asyncio.create_task(service.watch(reload_interval))
+
+        async def stop_watching(app):
+            app["watcher"].cancel()
+
+        app.on_startup.append(start_watching)
+        app.on_cleanup.append(stop_watching)
+    return app
+
+
+def run_server(
+    service: QueryService,
+    host: str = DEFAULT_HOST,
+    port: int = DEFAULT_PORT,
+    reload_interval: float = RELOAD_INTERVAL,
+) -> None:
+    """Load a QueryService's collections and serve them until interrupted
+
+    :param service: The QueryService
+    :param host: Interface to listen on
+    :param port: Port to listen on
+    :param reload_interval: Seconds between checks for changed caches
+    """
+    service.load()
+    web.run_app(make_app(service, reload_interval), host=host, port=port, print=logger.info)
+
+
+def _collection(request: web.Request) -> CollectionIndexes:
+    name = request.match_info["name"]
+    indexes = request.app["service"].collections.get(name)
+    if indexes is None:
+        raise _not_found(f"Unknown collection {name}")
+    return indexes
+
+
+def _not_found(message: str) -> web.HTTPNotFound:
+    return web.HTTPNotFound(text=json.dumps({"error": message}), content_type="application/json")
+
+
+async def list_collections(request: web.Request) -> web.Response:
+    collections = request.app["service"].collections.values()
+    return web.json_response(
+        [
+            {"name": indexes.name, "tokens": indexes.total, "cached_at": indexes.cached_at}
+            for indexes in collections
+        ]
+    )
+
+
+async def token_rarity(request: web.Request) -> web.Response:
+    indexes = _collection(request)
+    mint = request.match_info["mint"]
+    result = indexes.token_rarity(mint)
+    if result is None:
+        raise _not_found(f"No rarity data for token {mint}")
+    return web.json_response(result)
+
+
+async def wallet_holdings(request: web.Request) -> web.Response:
+    indexes = _collection(request)
+    return web.json_response(indexes.wallet_holdings(request.match_info["address"]))
+
+
+async def holder_counts(request: web.Request) -> web.Response:
+    indexes = _collection(request)
+    top = request.query.get("top")
+    if top is None:
+        return web.Response(text=indexes.holder_counts_json, content_type="application/json")
+    try:
+        top = int(top)
+        if top < 1:
+            raise ValueError(top)
+    except ValueError:
+        raise web.HTTPBadRequest(
+            text=json.dumps({"error": f"Invalid top {top}"}), content_type="application/json"
+        )
+    return web.json_response(
+        {
+            "tokens": indexes.total,
+            "holders": len(indexes.wallet_index),
+            "biggest_holders": indexes.holder_counts[:top],
+        }
+    )
+
+
+async def trait_distribution(request: web.Request) -> web.Response:
+    indexes = _collection(request)
+    return web.Response(text=indexes.traits_json, content_type="application/json")
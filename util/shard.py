@@ -0,0 +1,94 @@
+import hashlib
+import logging
+
+from util.cache import TokenCache
+from util.planner import STAGES
+
+logger = logging.getLogger("nft_snapshot.util.shard")
+
+
+def shard_of(mint: str, shards: int) -> int:
+    """Get the shard a token belongs to. Based on a hash of the token ID rather than its position in the token list
+    or Python's hash(), so every process on every machine agrees, whatever order they read the tokens in.
+
+    :param mint: The token ID
+    :param shards: How many shards the collection is split into
+    :return: The 0-based shard index
+    """
+    digest = hashlib.sha256(mint.encode()).digest()
+    return int.from_bytes(digest[:8], "big") % shards
+
+
+def shard_tokens(token_list: list, index: int, shards: int) -> list:
+    """Get the tokens in one shard of a token list
+
+    :param token_list: list of token IDs
+    :param index: The 0-based shard index
+    :param shards: How many shards the collection is split into
+    :return: list of the shard's token IDs, in token list order
+    """
+    return [mint for mint in token_list if shard_of(mint, shards) == index]
+
+
+def shard_cache_key(cache_key: str, index: int, shards: int) -> str:
+    """Get the cache key for one shard of a collection, so each shard worker has a cache file of its own
+
+    :param cache_key: The collection's cache key
+    :param index: The 0-based shard index
+    :param shards: How many shards the collection is split into
+    :return: The shard's cache key
+    """
+    return f"{cache_key}_shard{index}of{shards}"
+
+
+def merge_tokens(all_tokens: dict, shard_tokens: dict) -> int:
+    """Merge a shard's token data into the collection's, one fetch stage at a time. A stage's data from the shard
+    is taken if the collection doesn't have it, or has an older fetch of it.
+
+    :param all_tokens: The collection's token data, which is updated in place
+    :param shard_tokens: The shard's token data
+    :return: The number of tokens that took data from the shard
+    """
+    merged = 0
+    for mint, token in shard_tokens.items():
+        existing = all_tokens.get(mint)
+        if existing is None:
+            all_tokens[mint] = token
+            merged += 1
+            continue
+        updated = False
+        for name, stage in STAGES.items():
+            if getattr(token, stage.key) is None:
+                continue
+            if getattr(existing, stage.key) is None or token.fetched_at.get(
+                name, 0
+            ) >= existing.fetched_at.get(name, 0):
+                for field in stage.fields:
+                    setattr(existing, field, getattr(token, field))
+                if name in token.fetched_at:
+                    existing.fetched_at[name] = token.fetched_at[name]
+                updated = True
+        merged += updated
+    return merged
+
+
+def merge_shard_caches(all_tokens: dict, cache_key: str, shards: int) -> int:
+    """Merge every shard's cache into the collection's token data. Shards without a cache yet are skipped (their
+    tokens are then fetched as usual).
+
+    :param all_tokens: The collection's token data, which is updated in place
+    :param cache_key: The collection's cache key
+    :param shards: How many shards the collection was split into
+    :return: The number of tokens that took data from a shard
+    """
+    merged = 0
+    for index in range(shards):
+        shard_cache = TokenCache()
+        shard_cache.initialize(shard_cache_key(cache_key, index, shards))
+        shard_data = shard_cache.load()
+        if not shard_data:
+            logger.warning("No cached data for shard %d of %d", index, shards)
+            continue
+        merged += merge_tokens(all_tokens, shard_data)
+    logger.info("Merged %d tokens from %d shards", merged, shards)
+    return merged
@@ -1,5 +1,6 @@
+import asyncio
 import base64
-import itertools
+import functools
 import logging
 import time
 
@@ -16,11 +17,10 @@ from tenacity import wait_random_exponential
 from tqdm import tqdm
 
 from util import metadata
+from util.cache import DiscoveryCheckpoint
+from util.offload import CpuPool
 from util.token import Token
 
-# from solana.rpc.types import DataSliceOpts
-
-
 logger = logging.getLogger("nft_snapshot.util.solana_helpers")
 
 SOLANA_RPC_ENDPOINT = "https://ssc-dao.genesysgo.net/"
@@ -29,76 +29,275 @@ SOLANA_RPC_ENDPOINT = "https://ssc-dao.genesysgo.net/"
 # Also much faster for requests it supports, so generally use this one
 GPA_RPC_ENDPOINT = "https://rpc.theindex.io"
 
-
-@retry(
-    stop=stop_after_attempt(3),
-    after=after_log(logger, logging.DEBUG),
-    wait=wait_random_exponential(min=1, max=10),
+# Bunch of constants to get us looking in the right place within metadata accounts...
+MAX_NAME_LENGTH = 32
+MAX_URI_LENGTH = 200
+MAX_SYMBOL_LENGTH = 10
+MAX_CREATOR_LEN = 32 + 1 + 1
+MAX_CREATOR_LIMIT = 5
+MAX_DATA_SIZE = (
+    4
+    + MAX_NAME_LENGTH
+    + 4
+    + MAX_SYMBOL_LENGTH
+    + 4
+    + MAX_URI_LENGTH
+    + 2
+    + 1
+    + 4
+    + MAX_CREATOR_LIMIT * MAX_CREATOR_LEN
+)
+MAX_METADATA_LEN = 1 + 32 + 32 + MAX_DATA_SIZE + 1 + 1 + 9 + 172
+# After the key and update authority
+MINT_OFFSET = 1 + 32
+CREATOR_ARRAY_START = (
+    1 + 32 + 32 + 4 + MAX_NAME_LENGTH + 4 + MAX_URI_LENGTH + 4 + MAX_SYMBOL_LENGTH + 2 + 1 + 4
 )
-def get_token_list_from_candymachine_id(cm_id: str, use_v2: bool = False) -> list:
+
+TOKEN_METADATA_PROGRAM = PublicKey("metaqbxxUerdq28cj1RbAWkYQm3ybzjb6a8bt518x1s")
+CANDY_MACHINE_V2_PROGRAM = PublicKey("cndy3Z4yapfJBmL3ShUp5exZKqR3z33thTzeNMm2gRZ")
+
+# Token Metadata program account keys (the first byte of the account) of the edition account kinds
+EDITION_KINDS = {1: "print", 2: "master", 6: "master"}
+
+# Discovery is split into a partition (a getProgramAccounts call) per possible first byte of the mint
+DISCOVERY_PARTITIONS = 256
+DISCOVERY_CONCURRENCY = 8
+
+
+def get_token_list_from_candymachine_id(
+    cm_id: str, use_v2: bool = False, pool: CpuPool = None
+) -> list:
     """Fetch the list of tokens minted from the given Candy Machine ID
     Adapted from https://github.com/solana-dev-adv/solana-cookbook/tree/master/code/nfts/nfts-mint-addresses
 
     :param cm_id: The Candy Machine ID to fetch tokens for
     :param use_v2: Whether the Candy Machine uses the v2 codebase or not (changes fetching methodology)
+    :param pool: CpuPool to decode the token IDs in, if any
     :return: A list of the token IDs
     """
+    return get_token_list_from_sources([("cmv2" if use_v2 else "cmid", cm_id)], pool)
+
+
+def get_token_list_from_sources(sources: list, pool: CpuPool = None) -> list:
+    """Fetch the list of tokens from one or more discovery sources at once, e.g. all the Candy Machines a collection
+    was minted from, or its verified collection plus a Candy Machine that minted some of it before it had one
+
+    :param sources: list of (kind, address) pairs, kind being one of DISCOVERY_SOURCES
+    :param pool: CpuPool to decode the token IDs in, if any
+    :return: A list of the token IDs, without duplicates
+    """
     start_time = time.time()
 
-    logger.info(f"Fetching tokens from CM {cm_id} (v2? {use_v2})")
-
-    client = api.Client(GPA_RPC_ENDPOINT, timeout=30)
-
-    # Bunch of constants to get us looking in the right place...
-    MAX_NAME_LENGTH = 32
-    MAX_URI_LENGTH = 200
-    MAX_SYMBOL_LENGTH = 10
-    MAX_CREATOR_LEN = 32 + 1 + 1
-    MAX_CREATOR_LIMIT = 5
-    MAX_DATA_SIZE = (
-        4
-        + MAX_NAME_LENGTH
-        + 4
-        + MAX_SYMBOL_LENGTH
-        + 4
-        + MAX_URI_LENGTH
-        + 2
-        + 1
-        + 4
-        + MAX_CREATOR_LIMIT * MAX_CREATOR_LEN
-    )
-    MAX_METADATA_LEN = 1 + 32 + 32 + MAX_DATA_SIZE + 1 + 1 + 9 + 172
-    CREATOR_ARRAY_START = (
-        1 + 32 + 32 + 4 + MAX_NAME_LENGTH + 4 + MAX_URI_LENGTH + 4 + MAX_SYMBOL_LENGTH + 2 + 1 + 4
-    )
+    searches = []
+    for kind, address in sources:
+        logger.info(f"Fetching tokens by {kind} {address}")
+        searches.extend(DISCOVERY_SOURCES[kind](address))
+    token_list = asyncio.run(discover_mints_async(searches, pool=pool))
+    logging.info("--- %s seconds ---", (time.time() - start_time))
+    return token_list
 
-    TOKEN_METADATA_PROGRAM = PublicKey("metaqbxxUerdq28cj1RbAWkYQm3ybzjb6a8bt518x1s")
-    CANDY_MACHINE_V2_PROGRAM = PublicKey("cndy3Z4yapfJBmL3ShUp5exZKqR3z33thTzeNMm2gRZ")
 
+def candymachine_searches(cm_id: str, use_v2: bool = False) -> list:
+    """Get the searches for the tokens minted from a Candy Machine, which is their first creator (v1), or whose
+    PDA is (v2)
+
+    :param cm_id: The Candy Machine ID
+    :param use_v2: Whether the Candy Machine uses the v2 codebase or not
+    :return: list of (DiscoveryCheckpoint, memcmp_opts) searches
+    """
     cm_pk = PublicKey(cm_id)
     if use_v2:
         cm_pk = cm_pk.find_program_address(
             [b"candy_machine", bytes(cm_pk)], CANDY_MACHINE_V2_PROGRAM
         )[0]
 
-    # Set some options for exactly where to look within the data, and then fetch it
+    # Set some options for exactly where to look within the data
     memcmp_opts = [MemcmpOpts(offset=CREATOR_ARRAY_START, bytes=str(cm_pk))]
+    return [(DiscoveryCheckpoint(f"cm_{cm_pk}"), memcmp_opts)]
+
+
+def creator_searches(creator: str) -> list:
+    """Get the searches for the tokens whose first creator is the given address, and has verified it (so tokens
+    that just claim to be by it aren't picked up)
+
+    :param creator: The creator's address
+    :return: list of (DiscoveryCheckpoint, memcmp_opts) searches
+    """
+    memcmp_opts = [
+        MemcmpOpts(offset=CREATOR_ARRAY_START, bytes=str(PublicKey(creator))),
+        MemcmpOpts(offset=CREATOR_ARRAY_START + 32, bytes=base58.b58encode(b"\x01").decode()),
+    ]
+    return [(DiscoveryCheckpoint(f"creator_{creator}"), memcmp_opts)]
+
+
+def collection_searches(collection_mint: str) -> list:
+    """Get the searches for the tokens in the given verified collection. The collection comes after the creators
+    and two optional fields (edition nonce and token standard) so where it is depends on how many creators there
+    are and which fields are set; there's a search for each possible position.
+
+    :param collection_mint: The collection's mint address
+    :return: list of (DiscoveryCheckpoint, memcmp_opts) searches
+    """
+    # Set and verified, then the collection's mint
+    collection = base58.b58encode(b"\x01\x01" + bytes(PublicKey(collection_mint))).decode()
+    searches = []
+    for creators in range(1, MAX_CREATOR_LIMIT + 1):
+        creators_end = CREATOR_ARRAY_START + creators * MAX_CREATOR_LEN
+        # Primary sale happened and is mutable, then 1 or 2 bytes each for the edition nonce and token standard
+        for optional_fields_length in (2, 3, 4):
+            offset = creators_end + 2 + optional_fields_length
+            memcmp_opts = [
+                MemcmpOpts(
+                    offset=CREATOR_ARRAY_START - 4,
+                    bytes=base58.b58encode(creators.to_bytes(4, "little")).decode(),
+                ),
+                MemcmpOpts(offset=offset, bytes=collection),
+            ]
+            checkpoint = DiscoveryCheckpoint(f"collection_{collection_mint}_{offset}")
+            searches.append((checkpoint, memcmp_opts))
+    return searches
+
+
+DISCOVERY_SOURCES = {
+    "cmid": candymachine_searches,
+    "cmv2": functools.partial(candymachine_searches, use_v2=True),
+    "collection": collection_searches,
+    "creator": creator_searches,
+}
+
+
+def partition_prefixes() -> list:
+    """Get the prefixes discovery is partitioned by: every possible first byte of a mint address
+
+    :return: list of the prefixes (bytes)
+    """
+    return [bytes([i]) for i in range(DISCOVERY_PARTITIONS)]
+
+
+async def discover_mints_async(
+    searches: list,
+    concurrency: int = DISCOVERY_CONCURRENCY,
+    pool: CpuPool = None,
+) -> list:
+    """Find the mints of every metadata account matching any of the given searches. Rather than one
+    getProgramAccounts call per search, which big collections can time out or be cut off by the provider on, the
+    accounts are split into partitions by the first byte of their mint, and the partitions of all the searches
+    fetched concurrently. Each partition is checkpointed once fetched, so if any fail, running again only fetches
+    those.
+
+    :param searches: list of (DiscoveryCheckpoint, memcmp_opts) pairs: the filters picking out some accounts to
+        find, and where to keep the partitions fetched for them
+    :param concurrency: How many partitions to fetch at once
+    :param pool: CpuPool to decode the token IDs in, if any
+    :return: list of the token IDs, without duplicates
+    """
+    pool = pool if pool is not None else CpuPool()
+    partitions = [checkpoint.load() for checkpoint, _ in searches]
+    remaining = [
+        (i, prefix)
+        for i in range(len(searches))
+        for prefix in partition_prefixes()
+        if prefix not in partitions[i]
+    ]
+    if any(partitions):
+        logger.info("Resuming discovery with %d partitions left", len(remaining))
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(client, i, prefix):
+        checkpoint, memcmp_opts = searches[i]
+        async with semaphore:
+            encoded = await get_partition_from_solana_async(client, memcmp_opts, prefix)
+        mints = await asyncio.to_thread(pool.map, decode_mints, encoded)
+        checkpoint.save(prefix, mints)
+        partitions[i][prefix] = mints
+
+    async with create_solana_client() as client:
+        results = await asyncio.gather(
+            *(fetch(client, i, prefix) for i, prefix in remaining), return_exceptions=True
+        )
+    failures = [result for result in results if isinstance(result, Exception)]
+    if failures:
+        raise RuntimeError(
+            f"{len(failures)} of {len(remaining)} discovery partitions failed (first error: {failures[0]}); "
+            "run again to fetch just those"
+        )
+    for checkpoint, _ in searches:
+        checkpoint.clear()
+    # A mint turns up more than once if it matches several searches (e.g. its Candy Machine and its collection)
+    return list(
+        dict.fromkeys(
+            mint
+            for searched in partitions
+            for prefix in partition_prefixes()
+            for mint in searched[prefix]
+        )
+    )
+
+
+@retry(
+    stop=stop_after_attempt(3),
+    after=after_log(logger, logging.DEBUG),
+    wait=wait_random_exponential(min=1, max=10),
+)
+async def get_partition_from_solana_async(
+    client: async_api.AsyncClient, memcmp_opts: list, prefix: bytes
+) -> list:
+    """Fetch one partition of the metadata accounts matching the given filters: those whose mint starts with prefix
+
+    :param client: The Solana client used to make requests
+    :param memcmp_opts: list of MemcmpOpts picking out the accounts to find
+    :param prefix: The partition's prefix
+    :return: list of the matching accounts' base64-encoded data
+    """
+    partition_opts = MemcmpOpts(offset=MINT_OFFSET, bytes=base58.b58encode(prefix).decode())
     # NOTE: data_slice doesn't seem to do anything anymore, which seems...bad? Anyway, I just
-    #     filter in the output below so we're all good.
-    # data_slice_opts = DataSliceOpts(offset=33, length=32)
-    metadata_accounts = client.get_program_accounts(
+    #     filter in the output so we're all good.
+    response = await client.get_program_accounts(
         TOKEN_METADATA_PROGRAM,
         encoding="base64",
-        # data_slice=data_slice_opts,
         data_size=MAX_METADATA_LEN,
-        memcmp_opts=memcmp_opts,
+        memcmp_opts=[*memcmp_opts, partition_opts],
     )
-    logging.info("--- %s seconds ---", (time.time() - start_time))
+    return [v["account"]["data"][0] for v in response["result"]]
 
-    return [
-        str(base58.b58encode(base64.b64decode(v["account"]["data"][0])[33:65]), "UTF-8")
-        for v in metadata_accounts["result"]
-    ]
+
+def decode_mints(encoded: list) -> list:
+    """Get the token IDs from a batch of base64-encoded metadata accounts (for running in a CpuPool)
+
+    :param encoded: list of base64-encoded metadata account data
+    :return: list of token IDs, in the same order
+    """
+    return [str(base58.b58encode(base64.b64decode(data)[33:65]), "UTF-8") for data in encoded]
+
+
+def metadata_accounts(mints: list) -> list:
+    """Derive the metadata account addresses for a batch of token IDs (for running in a CpuPool)
+
+    :param mints: list of token IDs
+    :return: list of metadata account addresses, in the same order
+    """
+    return [str(metadata.get_metadata_account(mint)) for mint in mints]
+
+
+def decode_metadata_accounts(encoded: list) -> list:
+    """Decode a batch of base64-encoded metadata accounts, keeping just the fields we use (for running in a
+    CpuPool, so only those are sent back)
+
+    :param encoded: list of base64-encoded metadata account data
+    :return: list of dicts of the name and uri (None for accounts without data), in the same order
+    """
+    decoded = []
+    for data in encoded:
+        unpacked_data = metadata.unpack_metadata_account(base64.b64decode(data))
+        account_data = unpacked_data.get("data")
+        decoded.append(
+            {"name": account_data.get("name"), "uri": account_data.get("uri")}
+            if account_data is not None
+            else None
+        )
+    return decoded
 
 
 def create_solana_client() -> async_api.AsyncClient:
@@ -134,12 +333,64 @@ async def get_token_account_from_solana_async(
     return token
 
 
-def get_holder_account_info_from_solana(all_tokens: dict) -> dict:
-    """Fetch info about the token account for all tokens in a batched fashion
+def get_holder_account_info_from_solana(all_tokens: dict, timeout: float = None) -> dict:
+    """Fetch info about the token account for all tokens in a batched fashion. If a timeout is given, no more
+    batches are requested once it has passed, leaving the rest of the tokens unpopulated.
 
     :param all_tokens: A dict of all the token data being operated upon
+    :param timeout: Seconds to stop fetching after, if any
     :return: The all_tokens dict populated for each token
     """
+    stop_time = time.monotonic() + timeout if timeout is not None else None
+    owner_accounts = group_by_token_account(all_tokens)
+
+    client = api.Client(SOLANA_RPC_ENDPOINT, timeout=30)
+    chunks = holder_chunks(owner_accounts)
+    for done, chunk in enumerate(tqdm(chunks, total=len(chunks))):
+        if stop_time is not None and time.monotonic() >= stop_time:
+            logger.warning(
+                "Out of time with %d of %d batches unfetched", len(chunks) - done, len(chunks)
+            )
+            break
+        result = client.get_multiple_accounts(chunk, encoding="jsonParsed")
+        set_holders(all_tokens, owner_accounts, chunk, result)
+    return all_tokens
+
+
+@retry(
+    stop=stop_after_attempt(3),
+    after=after_log(logger, logging.DEBUG),
+    wait=wait_random_exponential(min=1, max=10),
+)
+async def get_holder_chunk_from_solana_async(
+    client: async_api.AsyncClient,
+    all_tokens: dict,
+    owner_accounts: dict,
+    chunk: list,
+    limiter: AsyncLimiter,
+) -> dict:
+    """Fetch the holders for a batch of token accounts, from holder_chunks()
+
+    :param client: The Solana client used to make requests
+    :param all_tokens: A dict of all the token data being operated upon
+    :param owner_accounts: dict of token account to the token IDs it holds, from group_by_token_account()
+    :param chunk: The token accounts to fetch
+    :param limiter: An AsyncLimiter used to prevent hitting request limits, and generally be a good citizen.
+    :return: The all_tokens dict populated for the tokens in the batch
+    """
+    async with limiter:
+        result = await client.get_multiple_accounts(chunk, encoding="jsonParsed")
+    set_holders(all_tokens, owner_accounts, chunk, result)
+    return all_tokens
+
+
+def group_by_token_account(all_tokens: dict) -> dict:
+    """Group the tokens still needing their holder fetched by token account, so each account is only fetched once.
+    Tokens known not to have a token account get an empty holder straight away.
+
+    :param all_tokens: A dict of all the token data being operated upon
+    :return: dict of token account to the list of token IDs it holds
+    """
     owner_accounts = {}
     for token in all_tokens.values():
         if token.holder_address is not None:
@@ -151,34 +402,48 @@ def get_holder_account_info_from_solana(all_tokens: dict) -> dict:
         if not owner_accounts.get(token.token_account):
             owner_accounts[token.token_account] = []
         owner_accounts[token.token_account].append(token.token)
+    return owner_accounts
 
-    # Chunk into sets of 100
-    client = api.Client(SOLANA_RPC_ENDPOINT, timeout=30)
-    chunks = list(itertools.zip_longest(*[iter(owner_accounts.keys())] * 100))
-    for chunk in tqdm(chunks, total=len(chunks)):
-        chunk = list(chunk)
-        while chunk and chunk[-1] is None:
-            chunk.pop()
-        result = client.get_multiple_accounts(chunk, encoding="jsonParsed")
-        for i, owner_account in enumerate(chunk):
-            tokens = owner_accounts[owner_account]
-            for token in tokens:
-                if not result["result"]["value"][i]:
+
+def holder_chunks(owner_accounts: dict, size: int = 100) -> list:
+    """Split the token accounts to fetch into batches for getMultipleAccounts
+
+    :param owner_accounts: dict of token account to the token IDs it holds, from group_by_token_account()
+    :param size: Number of accounts per batch (getMultipleAccounts takes up to 100)
+    :return: list of lists of token accounts
+    """
+    accounts = list(owner_accounts.keys())
+    return [accounts[i : i + size] for i in range(0, len(accounts), size)]
+
+
+def set_holders(all_tokens: dict, owner_accounts: dict, chunk: list, result: dict) -> None:
+    """Set the holders of the tokens in a batch from the getMultipleAccounts response for it
+
+    :param all_tokens: A dict of all the token data being operated upon
+    :param owner_accounts: dict of token account to the token IDs it holds, from group_by_token_account()
+    :param chunk: The token accounts that were fetched
+    :param result: The getMultipleAccounts response
+    """
+    slot = result["result"].get("context", {}).get("slot")
+    for i, owner_account in enumerate(chunk):
+        tokens = owner_accounts[owner_account]
+        for token in tokens:
+            all_tokens[token].holder_slot = slot
+            if not result["result"]["value"][i]:
+                all_tokens[token].holder_address = ""
+                all_tokens[token].amount = 0
+            else:
+                token_holders = result["result"]["value"][i]["data"]["parsed"]
+
+                # Why is this empty sometimes? Because tokens get nuked, so there is no "holder" to fetch
+                if token_holders.get("info") and token_holders["info"].get("owner"):
+                    all_tokens[token].holder_address = token_holders["info"]["owner"]
+                    all_tokens[token].amount = (
+                        token_holders["info"].get("tokenAmount").get("amount")
+                    )
+                else:
                     all_tokens[token].holder_address = ""
                     all_tokens[token].amount = 0
-                else:
-                    token_holders = result["result"]["value"][i]["data"]["parsed"]
-
-                    # Why is this empty sometimes? Because tokens get nuked, so there is no "holder" to fetch
-                    if token_holders.get("info") and token_holders["info"].get("owner"):
-                        all_tokens[token].holder_address = token_holders["info"]["owner"]
-                        all_tokens[token].amount = (
-                            token_holders["info"].get("tokenAmount").get("amount")
-                        )
-                    else:
-                        all_tokens[token].holder_address = ""
-                        all_tokens[token].amount = 0
-    return all_tokens
 
 
 @retry(
@@ -187,23 +452,88 @@ def get_holder_account_info_from_solana(all_tokens: dict) -> dict:
     wait=wait_random_exponential(min=1, max=10),
 )
 async def get_account_info_from_solana_async(
-    client: async_api.AsyncClient, token: Token, limiter: AsyncLimiter
+    client: async_api.AsyncClient, token: Token, limiter: AsyncLimiter, pool: CpuPool = None
 ) -> Token:
     """Fetch info about a token's metadata account from the Solana network
 
     :param client: The Solana client used to make requests
     :param token: The Token object for which data is being requested
     :param limiter: An AsyncLimiter used to prevent hitting request limits, and generally be a good citizen.
+    :param pool: CpuPool to derive the account address and decode the account in, if any
     :return: The data dict with the "account" key populated with response data
     """
+    pool = pool if pool is not None else CpuPool()
+    metadata_account = await pool.apply(metadata_accounts, token.token)
     async with limiter:
-        metadata_account = metadata.get_metadata_account(token.token)
         data = await client.get_account_info(metadata_account)
-        decoded_data = base64.b64decode(data["result"]["value"]["data"][0])
-        unpacked_data = metadata.unpack_metadata_account(decoded_data)
-
-        if unpacked_data.get("data") is not None:
-            token.name = unpacked_data["data"].get("name")
-            token.id = token.name[token.name.find("#") + 1 : :]
-            token.data_uri = unpacked_data["data"].get("uri")
-        return token
+    account_data = await pool.apply(decode_metadata_accounts, data["result"]["value"]["data"][0])
+
+    if account_data is not None:
+        token.name = account_data["name"]
+        token.id = token.name[token.name.find("#") + 1 : :]
+        token.data_uri = account_data["uri"]
+    return token
+
+
+@retry(
+    stop=stop_after_attempt(3),
+    after=after_log(logger, logging.DEBUG),
+    wait=wait_random_exponential(min=1, max=10),
+)
+async def get_edition_chunk_from_solana_async(
+    client: async_api.AsyncClient,
+    all_tokens: dict,
+    chunk: list,
+    limiter: AsyncLimiter,
+    pool: CpuPool = None,
+) -> dict:
+    """Fetch the edition accounts for a batch of tokens, from edition_chunks()
+
+    :param client: The Solana client used to make requests
+    :param all_tokens: A dict of all the token data being operated upon
+    :param chunk: The token IDs to fetch
+    :param limiter: An AsyncLimiter used to prevent hitting request limits, and generally be a good citizen.
+    :param pool: CpuPool to derive the edition account addresses in, if any
+    :return: The all_tokens dict populated for the tokens in the batch
+    """
+    pool = pool if pool is not None else CpuPool()
+    accounts = await asyncio.gather(*(pool.apply(edition_accounts, mint) for mint in chunk))
+    async with limiter:
+        result = await client.get_multiple_accounts(accounts, encoding="base64")
+    set_editions(all_tokens, chunk, result)
+    return all_tokens
+
+
+def edition_chunks(all_tokens: dict, size: int = 100) -> list:
+    """Split the tokens still needing their edition fetched into batches for getMultipleAccounts
+
+    :param all_tokens: A dict of all the token data being operated upon
+    :param size: Number of tokens per batch (getMultipleAccounts takes up to 100)
+    :return: list of lists of token IDs
+    """
+    mints = [token.token for token in all_tokens.values() if token.edition is None]
+    return [mints[i : i + size] for i in range(0, len(mints), size)]
+
+
+def edition_accounts(mints: list) -> list:
+    """Derive the edition account addresses for a batch of token IDs (for running in a CpuPool)
+
+    :param mints: list of token IDs
+    :return: list of edition account addresses, in the same order
+    """
+    return [str(metadata.get_edition(mint)) for mint in mints]
+
+
+def set_editions(all_tokens: dict, chunk: list, result: dict) -> None:
+    """Set the edition kind of the tokens in a batch from the getMultipleAccounts response for it
+
+    :param all_tokens: A dict of all the token data being operated upon
+    :param chunk: The token IDs whose edition accounts were fetched
+    :param result: The getMultipleAccounts response
+    """
+    for mint, account in zip(chunk, result["result"]["value"]):
+        if not account:
+            all_tokens[mint].edition = ""
+            continue
+        key = base64.b64decode(account["data"][0])[:1]
+        all_tokens[mint].edition = EDITION_KINDS.get(key[0], "") if key else ""
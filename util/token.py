@@ -1,7 +1,16 @@
 import logging
 
+import numpy
+
+from util import rarity
+from util.traits import encode_tokens
+from util.traits import TraitVocabulary
+
 logger = logging.getLogger("nft_snapshot.util.token")
 
+# --editions names for the Token.edition values
+EDITION_FILTERS = {"master": "master", "print": "print", "none": ""}
+
 
 class Token:
     def __init__(
@@ -27,8 +36,98 @@ class Token:
         self.traits = traits if traits is not None else {}
         self.data_uri = data_uri
 
+        self.trait_codes = None
         self.rarity = None
+        self.log_rarity = None
         self.rank = None
+        self.holder_slot = None
+        # "master" or "print" edition, or "" if the token has no edition account (see solana_helpers.EDITION_KINDS)
+        self.edition = None
+        self.model_scores = {}
+        self.model_ranks = {}
+        # Set when a run ran out of time before this token's data could be fetched (see util.deadline)
+        self.data_status = None
+        # When each fetch stage last filled in this token's data, as Unix timestamps (see util.freshness)
+        self.fetched_at = {}
+
+    def __setstate__(self, state):
+        # Tokens pickled by older versions may be missing newer attributes, so start from the defaults
+        self.__init__(state["token"])
+        self.__dict__.update(state)
+
+
+def filter_editions(all_tokens: dict[str, Token], editions: list) -> dict[str, Token]:
+    """Get just the tokens of the given edition kinds, e.g. to leave print editions out of holder counts and rarity.
+    Tokens whose edition hasn't been fetched can't be told apart, so are kept.
+
+    :param all_tokens: The preassembled data dict for all tokens
+    :param editions: Edition kinds to keep (keys of EDITION_FILTERS), or None/empty to keep every token
+    :return: dict of the kept tokens (all_tokens itself if there's nothing to filter)
+    """
+    if not editions:
+        return all_tokens
+    kinds = {EDITION_FILTERS[edition] for edition in editions}
+    unknown = sum(1 for token in all_tokens.values() if token.edition is None)
+    if unknown:
+        logger.warning("Keeping %d tokens whose edition isn't known", unknown)
+    return {
+        mint: token
+        for mint, token in all_tokens.items()
+        if token.edition is None or token.edition in kinds
+    }
+
+
+def count_trait_codes(vocabulary: TraitVocabulary, all_tokens: dict[str, Token]) -> (int, list):
+    """Count the occurrences of every trait code in the collection, using the tokens' trait_codes
+
+    :param vocabulary: The TraitVocabulary produced by encode_tokens()
+    :param all_tokens: The preassembled data dict for all tokens
+    :return: int: count of tokens with attributes; list: per-column arrays of counts indexed by code
+    """
+    for token in all_tokens.values():
+        if token.trait_codes is None:
+            logging.info("Token %s has no attributes", token.token)
+
+    tokens, matrix = rarity.code_matrix(all_tokens)
+    sizes = [len(values) for values in vocabulary.values]
+    return len(tokens), rarity.count_codes(matrix, sizes)
+
+
+def get_code_rarities(tokens_with_attributes_total: int, code_counts: list) -> list:
+    """Get the relative rarities of all trait codes in the collection
+
+    :param tokens_with_attributes_total: Total number of tokens in the collection with traits set
+    :param code_counts: The per-column code counts produced by count_trait_codes()
+    :return: list of per-column arrays of rarities indexed by code
+    """
+    return rarity.code_probabilities(code_counts, tokens_with_attributes_total)
+
+
+def set_token_rarities_and_ranks_from_codes(
+    code_rarities: list, all_tokens: dict[str, Token], models: list = ()
+):
+    """Set the tokens' overall rarity and rank within the collection, using the tokens' trait_codes. Ranks
+    come from the log-space score, with ties broken by the order of all_tokens. Any extra rarity models asked
+    for are computed in the same pass and stored in each token's model_scores and model_ranks.
+
+    :param code_rarities: The per-column code rarities produced by get_code_rarities()
+    :param all_tokens: The preassembled data dict for all tokens
+    :param models: Names of extra rarity models (keys of rarity.RARITY_MODELS) to compute
+    """
+    tokens, matrix = rarity.code_matrix(all_tokens)
+    code_rarities = [numpy.asarray(rarities, dtype=float) for rarities in code_rarities]
+    token_probabilities = rarity.gather(matrix, code_rarities)
+    rarities = token_probabilities.prod(axis=1)
+    results = rarity.score_models(matrix, token_probabilities, ["statistical", *models])
+
+    log_rarities, ranks = results["statistical"]
+    model_results = {name: results[name] for name in models}
+    for i, t in enumerate(tokens):
+        t.rarity = float(rarities[i])
+        t.log_rarity = float(log_rarities[i])
+        t.rank = int(ranks[i])
+        t.model_scores = {name: float(scores[i]) for name, (scores, _) in model_results.items()}
+        t.model_ranks = {name: int(r[i]) for name, (_, r) in model_results.items()}
 
 
 def get_attribute_counts(trait_map: dict, all_tokens: dict[str, Token]) -> (int, dict):
@@ -38,23 +137,26 @@ def get_attribute_counts(trait_map: dict, all_tokens: dict[str, Token]) -> (int,
     :param all_tokens: The preassembled data dict for all tokens
     :return: int: count of tokens with attributes; dict: counts of all values for all attributes
     """
-    tokens_with_attributes_total = 0
-    attribute_counts = {}
+    vocabulary = encode_tokens(trait_map, all_tokens)
+    tokens_with_attributes_total, code_counts = count_trait_codes(vocabulary, all_tokens)
+    return tokens_with_attributes_total, code_counts_to_dict(vocabulary, code_counts)
 
-    for token in all_tokens.values():
-        if token.traits:
-            tokens_with_attributes_total += 1
-            for trait_type in trait_map:
-                value = token.traits[trait_type] if trait_type in token.traits else ""
-                if not attribute_counts.get(trait_type):
-                    attribute_counts[trait_type] = {}
-                if not attribute_counts[trait_type].get(value):
-                    attribute_counts[trait_type][value] = 0
-                attribute_counts[trait_type][value] += 1
-        else:
-            logging.info("Token %s has no attributes", token.token)
 
-    return tokens_with_attributes_total, attribute_counts
+def code_counts_to_dict(vocabulary: TraitVocabulary, code_counts: list) -> dict:
+    """Convert per-column code counts into the nested dict of trait type -> value -> count used for output
+
+    :param vocabulary: The TraitVocabulary the counts were produced with
+    :param code_counts: The per-column code counts produced by count_trait_codes()
+    :return: dict: counts of all values for all attributes (values that never occur are left out)
+    """
+    attribute_counts = {}
+    for trait_type, column in vocabulary.trait_map.items():
+        attribute_counts[trait_type] = {
+            vocabulary.values[column][code]: int(count)
+            for code, count in enumerate(code_counts[column])
+            if count
+        }
+    return attribute_counts
 
 
 def get_attribute_rarities(tokens_with_attributes_total: int, attribute_counts: dict) -> dict:
@@ -86,21 +188,9 @@ def set_token_rarities_and_ranks(
     :param attribute_rarities: dict produced by get_attribute_rarities()
     :param all_tokens: The preassembled data dict for all tokens
     """
-    rarity_ranks = {}
-    for t in all_tokens.values():
-        if t.traits:
-            token_rarity = 1
-            for trait in trait_map:
-                value = t.traits[trait] if trait in t.traits else ""
-                token_rarity *= attribute_rarities[trait][value]
-            t.rarity = token_rarity
-            if rarity_ranks.get(token_rarity) is None:
-                rarity_ranks[token_rarity] = []
-            rarity_ranks[token_rarity].append(t)
-
-    rarity_ranks = {k: rarity_ranks[k] for k in sorted(rarity_ranks)}
-    rank = 1
-    for rarity, rank_list in rarity_ranks.items():
-        for t in rank_list:
-            t.rank = rank
-            rank += 1
+    vocabulary = encode_tokens(trait_map, all_tokens)
+    code_rarities = [
+        [attribute_rarities[trait_type].get(value, 0.0) for value in vocabulary.values[column]]
+        for trait_type, column in vocabulary.trait_map.items()
+    ]
+    set_token_rarities_and_ranks_from_codes(code_rarities, all_tokens)
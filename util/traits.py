@@ -0,0 +1,107 @@
+import logging
+
+logger = logging.getLogger("nft_snapshot.util.traits")
+
+# Every trait column reserves code 0 for tokens that don't have the trait at all. Tokens that have the
+# trait set to "" share the code, since the rest of the tooling has always counted the two the same way.
+NONE_CODE = 0
+NONE_VALUE = ""
+
+
+class TraitVocabulary:
+    """Interned vocabulary of every trait type and value seen in a collection. Trait types map to columns
+    (in the same order as output.get_trait_map()) and each value within a column maps to a small int code, so
+    a token's traits can be stored as a fixed-width tuple of codes instead of a dict of strings.
+    """
+
+    def __init__(self, trait_map: dict):
+        self.trait_map = {}
+        self.values = []
+        self._codes = []
+        for trait_type in sorted(trait_map, key=trait_map.get):
+            self.add_trait_type(trait_type)
+
+    def __len__(self) -> int:
+        return len(self.trait_map)
+
+    def add_trait_type(self, trait_type) -> int:
+        """Add a trait type to the vocabulary (if it isn't already present)
+
+        :param trait_type: The trait type to add
+        :return: The column index of the trait type
+        """
+        if trait_type not in self.trait_map:
+            self.trait_map[trait_type] = len(self.trait_map)
+            self.values.append([NONE_VALUE])
+            self._codes.append({NONE_VALUE: NONE_CODE})
+        return self.trait_map[trait_type]
+
+    def code(self, column: int, value) -> int:
+        """Get the code for a trait value in the given column, interning it if it hasn't been seen before
+
+        :param column: The column index of the trait type
+        :param value: The trait value
+        :return: The int code for the value
+        """
+        codes = self._codes[column]
+        code = codes.get(value)
+        if code is None:
+            code = len(self.values[column])
+            codes[value] = code
+            self.values[column].append(value)
+        return code
+
+    def lookup(self, column: int, value):
+        """Get the code for a trait value in the given column without interning it
+
+        :param column: The column index of the trait type
+        :param value: The trait value
+        :return: The int code for the value, or None if it has never been seen
+        """
+        return self._codes[column].get(value)
+
+    def encode(self, traits: dict) -> tuple:
+        """Encode a token's traits dict as a tuple of codes, one per trait type in the vocabulary
+
+        :param traits: dict of trait type to trait value
+        :return: tuple of int codes aligned with trait_map, with NONE_CODE for missing traits
+        """
+        trait_map = self.trait_map
+        value_codes = self._codes
+        codes = [NONE_CODE] * len(trait_map)
+        for trait_type, value in traits.items():
+            column = trait_map.get(trait_type)
+            if column is None:
+                column = self.add_trait_type(trait_type)
+                codes.append(NONE_CODE)
+            code = value_codes[column].get(value)
+            codes[column] = code if code is not None else self.code(column, value)
+        return tuple(codes)
+
+    def decode(self, codes: tuple) -> list:
+        """Turn a tuple of codes back into the trait values they stand for
+
+        :param codes: tuple of codes produced by encode()
+        :return: list of trait values aligned with trait_map
+        """
+        return [self.values[column][code] for column, code in enumerate(codes)]
+
+
+def encode_tokens(trait_map: dict, all_tokens: dict) -> TraitVocabulary:
+    """Build the trait vocabulary for a collection and set each token's trait_codes from it. Tokens with no
+    traits at all get trait_codes of None, so they can be left out of rarity calculations.
+
+    :param trait_map: dict produced by output.get_trait_map()
+    :param all_tokens: The preassembled data dict for all tokens
+    :return: The TraitVocabulary used to encode the tokens
+    """
+    vocabulary = TraitVocabulary(trait_map)
+    for token in all_tokens.values():
+        token.trait_codes = vocabulary.encode(token.traits) if token.traits else None
+
+    # A token could have introduced a trait type missing from the map, so pad everything to the final width
+    width = len(vocabulary)
+    for token in all_tokens.values():
+        if token.trait_codes is not None and len(token.trait_codes) < width:
+            token.trait_codes += (NONE_CODE,) * (width - len(token.trait_codes))
+    return vocabulary
@@ -0,0 +1,95 @@
+import logging
+
+from sortedcontainers import SortedList
+
+logger = logging.getLogger("nft_snapshot.util.wallet_index")
+
+
+class WalletIndex:
+    """Persistent reverse index from holder address to the tokens it holds. Wallets are also kept in a SortedList
+    ordered by how many tokens they hold, so the biggest holders can be read off the front without sorting.
+    """
+
+    def __init__(self):
+        self.holders = {}
+        self.holdings = {}
+        self.ranked = SortedList()
+
+    def __len__(self) -> int:
+        return len(self.holdings)
+
+    def sync(self, all_tokens: dict) -> set:
+        """Bring the index up to date with the holder addresses currently in all_tokens. Tokens flagged with a
+        data_status keep the holder they had in the index, as their holder address isn't current.
+
+        :param all_tokens: The preassembled data dict for all tokens
+        :return: set of the token IDs whose holder changed
+        """
+        changed = set()
+        for mint, token in all_tokens.items():
+            if token.data_status:
+                continue
+            if self.holders.get(mint) != token.holder_address:
+                self.set_holder(mint, token.holder_address)
+                changed.add(mint)
+        for mint in self.holders.keys() - all_tokens.keys():
+            self.set_holder(mint, None)
+            changed.add(mint)
+        return changed
+
+    def set_holder(self, mint: str, holder_address) -> None:
+        """Record a token's (new) holder, moving it out of its previous holder's holdings
+
+        :param mint: The token ID
+        :param holder_address: The holder's address, or None if the token's holder isn't known (anymore)
+        """
+        previous = self.holders.pop(mint, None)
+        if previous is not None:
+            self._move(previous, mint, add=False)
+        if holder_address is not None:
+            self.holders[mint] = holder_address
+            self._move(holder_address, mint, add=True)
+
+    def _move(self, holder_address: str, mint: str, add: bool) -> None:
+        holding = self.holdings.setdefault(holder_address, {})
+        if holding:
+            self.ranked.remove((-len(holding), holder_address))
+        if add:
+            holding[mint] = None
+        else:
+            del holding[mint]
+        if holding:
+            self.ranked.add((-len(holding), holder_address))
+        else:
+            del self.holdings[holder_address]
+
+    def tokens_for(self, holder_address: str) -> list:
+        """Get the tokens held by a wallet
+
+        :param holder_address: The wallet's address
+        :return: list of token IDs
+        """
+        return list(self.holdings.get(holder_address, ()))
+
+    def count(self, holder_address: str) -> int:
+        """Get the number of tokens held by a wallet
+
+        :param holder_address: The wallet's address
+        :return: The number of tokens held
+        """
+        return len(self.holdings.get(holder_address, ()))
+
+    def counts(self) -> dict:
+        """Get the number of tokens held by every wallet
+
+        :return: dict mapping holder address to the number of tokens it holds
+        """
+        return {holder_address: len(holding) for holder_address, holding in self.holdings.items()}
+
+    def top(self, n: int = None) -> list:
+        """Get the biggest holders, largest first
+
+        :param n: How many holders to return (all of them if None)
+        :return: list of (holder address, count) tuples
+        """
+        return [(holder_address, -count) for count, holder_address in self.ranked[:n]]